@@ -62,10 +62,15 @@ async def initialize_topics(message: Message):
         await message.answer("Произошла ошибка при обработке команды. Проверьте логи бота.")
 
 
+import asyncio
+
 from aiogram import Router, types
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
 
+from config import ADMIN_USER_IDS
+from utils.intent_model import build_ab_report, run_intent_training
+
 # Инициализируем маршрутизатор
 router = Router()
 
@@ -81,4 +86,67 @@ async def home_command_handler(message: types.Message, state: FSMContext):
     # Отправляем приветственное сообщение
     await message.answer(
         "Состояние сброшено"
-    )
\ No newline at end of file
+    )
+
+def is_admin(message: types.Message) -> bool:
+    """ Служебные команды доступны только пользователям из ADMIN_USER_IDS. """
+    return message.from_user is not None and message.from_user.id in ADMIN_USER_IDS
+
+
+def format_share(value: float | None) -> str:
+    return "—" if value is None else f"{value:.1%}"
+
+
+@router.message(Command("train_intents"))
+async def train_intents_command_handler(message: types.Message):
+    """
+    Обработчик команды /train_intents.
+    Обучает локальную модель классификации сообщений на сохранённых ответах LLM.
+    """
+    if not is_admin(message):
+        return
+
+    await message.answer("⏳ Обучаю модель классификации сообщений...")
+    try:
+        # Обучение занимает CPU на секунды — не в цикле событий
+        report = await asyncio.to_thread(run_intent_training)
+    except (ValueError, ImportError) as e:
+        await message.answer(f"Модель не обучена: {e}")
+        return
+    except Exception as e:
+        logger.error(f"❌ Ошибка обучения модели классификации: {e}", exc_info=True)
+        await message.answer("Ошибка при обучении модели. Проверьте логи бота.")
+        return
+
+    holdout = report.get("holdout") or {}
+    await message.answer(
+        f"✅ Модель версии {report['version']} обучена на {report['train_samples']} сообщениях "
+        f"({report['classes']} классов).\n"
+        f"Отложенная выборка ({holdout.get('samples', 0)}): точность {format_share(holdout.get('accuracy'))}, "
+        f"отвечает сама в {format_share(holdout.get('coverage'))} случаев с точностью "
+        f"{format_share(holdout.get('confident_accuracy'))}."
+    )
+
+
+@router.message(Command("intent_report"))
+async def intent_report_command_handler(message: types.Message):
+    """
+    Обработчик команды /intent_report.
+    Сравнивает ответы текущей локальной модели с разметкой LLM на реальных сообщениях.
+    """
+    if not is_admin(message):
+        return
+
+    report = await asyncio.to_thread(build_ab_report)
+    if not report["version"]:
+        await message.answer("Локальная модель классификации ещё не обучена: /train_intents")
+        return
+
+    await message.answer(
+        f"📊 Модель версии {report['version']}: классифицировано {report['classified']} сообщений, "
+        f"сама ответила на {format_share(report['coverage'])}.\n"
+        f"Уверенные ответы (A/B-проверка LLM): {report['confident']['compared']}, "
+        f"совпадение с LLM {format_share(report['confident']['accuracy'])}.\n"
+        f"Переданные LLM: {report['fallback']['compared']}, "
+        f"совпадение с LLM {format_share(report['fallback']['accuracy'])}."
+    )
@@ -1,70 +1,165 @@
-import asyncio
+import time
+from functools import lru_cache
+from types import SimpleNamespace
 
-from aiogram import Router
-from langchain.agents import Tool
-from langchain.chains import LLMChain
-from langchain_openai import ChatOpenAI
 from promts.template_promt import template_generation_prompt, context_analysis_prompt, invite_prompt, \
     template_edit_prompt
-from config import OPENAI_API_KEY
-import json
+from config import OPENAI_API_KEY, OPENAI_BASE_URL
+from utils.llm_router import TASK_EDIT, TASK_EXTRACT, TASK_GENERATE, get_route
 import logging
 
 
 logger = logging.getLogger(__name__)
 
-# Настройка LLM
-llm = ChatOpenAI(openai_api_key=OPENAI_API_KEY, temperature=0.7)
-
-# Настройка инструментов
-invite_chain = LLMChain(llm=llm, prompt=invite_prompt)
-invite_tool = Tool(
-    name="InviteTool",
-    func=lambda: invite_chain.invoke({}),
-    description="Просит пользователя ввести пожелания для шаблона."
-)
-
-context_analysis_chain = LLMChain(llm=llm, prompt=context_analysis_prompt)
-context_analysis_tool = Tool(
-    name="ContextAnalysis",
-    func=context_analysis_chain.run,
-    description="Анализирует ввод."
-)
-
-template_generation_chain = LLMChain(llm=llm, prompt=template_generation_prompt)
-template_generation_tool = Tool(
-    name="TemplateGenerator",
-    func=template_generation_chain.run,
-    description="Генерирует текст письма с учетом компании и контентного плана."
-)
-
-template_edit_chain = LLMChain(llm=llm, prompt=template_edit_prompt)
-template_edit_tool = Tool(
-    name="TemplateEditor",
-    func=template_edit_chain.run,
-    description="Редактирует текст шаблона на основе комментариев пользователя."
-)
-
-async def async_template_edit_tool(input_data: dict):
+# Промпты цепочек агента шаблонов и классы задач, по которым выбираются модели (utils/llm_router.py)
+TEMPLATE_CHAINS = {
+    "invite": (invite_prompt, TASK_GENERATE),
+    "context_analysis": (context_analysis_prompt, TASK_EXTRACT),
+    "template_generation": (template_generation_prompt, TASK_GENERATE),
+    "template_edit": (template_edit_prompt, TASK_EDIT),
+}
+# Сколько вариантов шаблона генерируется одновременно (остальные ждут в abatch)
+TEMPLATE_VARIANTS_CONCURRENCY = 4
+
+
+def build_guarded_model(model: str, operation: str, timeout: float):
+    """
+    Модель ChatOpenAI как шаг LCEL-цепочки с теми же ограничениями и учётом, что и остальные вызовы LLM:
+    адаптивный лимит и предохранитель модели, метрики и потребление компании. Шаг потоковый,
+    поэтому одна цепочка поддерживает ainvoke, abatch и astream.
+
+    :param model: Модель.
+    :param operation: Операция для метрик.
+    :param timeout: Таймаут запроса (секунды).
+    :return: Runnable: PromptValue -> AIMessageChunk.
+    """
+    from langchain_core.runnables import RunnableGenerator
+    from langchain_openai import ChatOpenAI
+
+    from utils.llm_guard import get_llm_guard
+    from utils.metrics import LLM_TIME_TO_FIRST_TOKEN, observe_llm_call
+    from utils.usage import record_usage
+
+    llm = ChatOpenAI(
+        model=model, openai_api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, temperature=0.7, timeout=timeout,
+        stream_usage=True,
+    )
+
+    async def generate(prompts):
+        async for prompt in prompts:
+            start = time.perf_counter()
+            usage, first_chunk = None, True
+            async with get_llm_guard(model).async_slot():
+                with observe_llm_call(model, operation):
+                    async for chunk in llm.astream(prompt):
+                        if chunk.usage_metadata:
+                            usage = chunk.usage_metadata
+                        if first_chunk and chunk.content:
+                            LLM_TIME_TO_FIRST_TOKEN.labels(model, operation).observe(time.perf_counter() - start)
+                            first_chunk = False
+                        yield chunk
+            record_usage(model, operation, usage and SimpleNamespace(
+                prompt_tokens=usage["input_tokens"], completion_tokens=usage["output_tokens"]
+            ))
+
+    return RunnableGenerator(generate, name=f"{model}:{operation}")
+
+
+@lru_cache(maxsize=None)
+def get_template_chains() -> dict:
+    """
+    Создаёт асинхронные LCEL-цепочки агента шаблонов при первом обращении (langchain не импортируется
+    при старте бота): промпт | модель маршрута с запасными | строка.
+
+    :return: Словарь цепочек: invite, context_analysis, template_generation, template_edit.
+    """
+    import openai
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+
+    from utils.llm_guard import LLMUnavailableError
+
+    # Те же ошибки, что и is_fallback_error: переход на запасную модель только до первого фрагмента ответа
+    fallback_errors = (
+        openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.NotFoundError,
+        openai.InternalServerError, LLMUnavailableError,
+    )
+
+    chains = {}
+    for name, (prompt, task) in TEMPLATE_CHAINS.items():
+        models, timeout = get_route(task)
+        primary, *fallbacks = [build_guarded_model(model, name, timeout) for model in models]
+        llm = primary.with_fallbacks(fallbacks, exceptions_to_handle=fallback_errors) if fallbacks else primary
+        chains[name] = ChatPromptTemplate.from_template(prompt) | llm | StrOutputParser()
+    return chains
+
+
+@lru_cache(maxsize=None)
+def get_template_tools() -> list:
+    """ Инструменты агента шаблонов (создаются при первом обращении), асинхронные. """
+    from langchain_core.tools import Tool
+
+    chains = get_template_chains()
+    return [
+        Tool(
+            name="InviteTool",
+            func=None,
+            coroutine=lambda *_: chains["invite"].ainvoke({}),
+            description="Просит пользователя ввести пожелания для шаблона."
+        ),
+        Tool(
+            name="ContextAnalysis",
+            func=None,
+            coroutine=lambda input_text: chains["context_analysis"].ainvoke({"input": input_text}),
+            description="Анализирует ввод."
+        ),
+        Tool(
+            name="TemplateGenerator",
+            func=None,
+            coroutine=chains["template_generation"].ainvoke,
+            description="Генерирует текст письма с учетом компании и контентного плана."
+        ),
+        Tool(
+            name="TemplateEditor",
+            func=None,
+            coroutine=chains["template_edit"].ainvoke,
+            description="Редактирует текст шаблона на основе комментариев пользователя."
+        ),
+    ]
+
+async def async_template_edit_tool(input_data: dict) -> str:
     """
     Асинхронно вызывает модель для редактирования шаблона.
     """
-    return await asyncio.to_thread(template_edit_chain.run, input_data)
+    return await get_template_chains()["template_edit"].ainvoke(input_data)
 
-async def async_invite_tool():
-    response = await asyncio.to_thread(invite_chain.invoke, {})
+async def async_invite_tool() -> str:
+    return await get_template_chains()["invite"].ainvoke({})
 
-    # Проверяем, является ли ответ строкой или словарем
-    if isinstance(response, dict):
-        # Если это словарь, пробуем извлечь текст (обычно он в "text" или "content")
-        response_text = response.get("text") or response.get("content") or str(response)
-    else:
-        response_text = str(response)  # Преобразуем в строку, если что-то пошло не так
+async def async_context_analysis_tool(input_text: str) -> str:
+    return await get_template_chains()["context_analysis"].ainvoke({"input": input_text})
 
-    return response_text
+async def async_template_generation_tool(input_data: dict) -> str:
+    return await get_template_chains()["template_generation"].ainvoke(input_data)
 
-async def async_context_analysis_tool(input_text: str):
-    return await asyncio.to_thread(context_analysis_chain.run, {"input": input_text})
+async def async_template_variants_tool(inputs: list[dict]) -> list[str]:
+    """
+    Генерирует несколько вариантов шаблона одним пакетом (по одному на входные данные).
+
+    :param inputs: Входные данные промпта генерации для каждого варианта.
+    :return: Тексты вариантов в том же порядке.
+    """
+    return await get_template_chains()["template_generation"].abatch(
+        inputs, config={"max_concurrency": TEMPLATE_VARIANTS_CONCURRENCY}
+    )
 
-async def async_template_generation_tool(input_data: dict):
-    return await asyncio.to_thread(template_generation_chain.run, input_data)
+async def stream_template_chain(name: str, input_data: dict):
+    """
+    Потоковый вызов цепочки агента: отдаёт текст частями по мере генерации (например, для stream_to_message).
+
+    :param name: Цепочка: invite, context_analysis, template_generation, template_edit.
+    :param input_data: Входные данные промпта.
+    :return: Асинхронный генератор фрагментов текста.
+    """
+    async for chunk in get_template_chains()[name].astream(input_data):
+        yield chunk
@@ -0,0 +1,227 @@
+"""
+Бенчмарки загрузки баз, сегментации и генерации черновиков (pytest-benchmark).
+
+Запуск из корня репозитория:
+    python -m pytest benchmarks --benchmark-autosave --benchmark-storage=file://benchmarks/results
+Сравнение с последним сохранённым прогоном (падает при замедлении среднего больше чем на 10%):
+    python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:10% \
+        --benchmark-storage=file://benchmarks/results
+
+Переменные окружения:
+    BENCH_SIZES — размеры синтетических баз через запятую (по умолчанию 10000; например 10000,100000,1000000).
+    BENCH_DATABASE_URL — одноразовая PostgreSQL для бенчмарков БД. Если не задана, поднимается временный
+        локальный сервер через pgserver (если пакет установлен), иначе бенчмарки БД пропускаются.
+    BENCH_DRAFT_LEADS — число лидов в бенчмарке генерации черновиков (по умолчанию 100).
+    BENCH_LLM_LATENCY — задержка заглушки модели, секунды (по умолчанию 0.05).
+"""
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+BENCH_SIZES = [int(size) for size in os.getenv("BENCH_SIZES", "10000").split(",") if size.strip()]
+BENCH_DRAFT_LEADS = int(os.getenv("BENCH_DRAFT_LEADS", "100"))
+BENCH_LLM_LATENCY = float(os.getenv("BENCH_LLM_LATENCY", "0.05"))
+
+# Доли «грязных» строк в синтетической базе: повторы email, ячейки с несколькими адресами, пустые строки
+DUPLICATE_RATIO = 0.05
+MULTI_EMAIL_RATIO = 0.01
+EMPTY_ROW_RATIO = 0.02
+
+REGIONS = ["Москва", "г. москва", "Санкт-Петербург", "Новосибирская обл.", "Казань", "Екатеринбург"]
+ACTIVITIES = ["Оптовая торговля", "Строительство", "Производство мебели", "Разработка ПО", "Логистика"]
+POSITIONS = ["Генеральный директор", "Директор", "Управляющий", ""]
+
+
+def _start_throwaway_postgres() -> tuple[str | None, str | None]:
+    """ Поднимает временный PostgreSQL (pgserver) и возвращает (URL, каталог данных). """
+    try:
+        import pgserver
+    except ImportError:
+        return None, None
+    pgdata = tempfile.mkdtemp(prefix="bench_pg_")
+    server = pgserver.get_server(pgdata, cleanup_mode="stop")
+    return server.get_uri().replace("postgresql://", "postgresql+psycopg2://", 1), pgdata
+
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+_BENCH_PGDATA = None
+if not BENCH_DATABASE_URL:
+    BENCH_DATABASE_URL, _BENCH_PGDATA = _start_throwaway_postgres()
+
+# Движок приложения создаётся при импорте db.db, поэтому URL подменяется до импорта модулей проекта
+os.environ["DATABASE_URL"] = BENCH_DATABASE_URL or "sqlite://"
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+def pytest_generate_tests(metafunc):
+    if "lead_count" in metafunc.fixturenames:
+        metafunc.parametrize("lead_count", BENCH_SIZES, scope="module", ids=lambda size: f"{size}_rows")
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if _BENCH_PGDATA:
+        shutil.rmtree(_BENCH_PGDATA, ignore_errors=True)
+
+
+def make_leads(count: int, seed: int = 42) -> pd.DataFrame:
+    """
+    Генерирует синтетическую базу лидов в формате загружаемого файла (с повторами email,
+    ячейками с несколькими адресами и пустыми строками).
+
+    :param count: Количество строк.
+    :param seed: Зерно генератора (прогоны воспроизводимы).
+    :return: DataFrame с колонками email-сегмента.
+    """
+    rng = np.random.default_rng(seed)
+    index = np.arange(count)
+
+    emails = pd.Series([f"info{i}@company{i % 5000}.ru" for i in index])
+    duplicates = rng.random(count) < DUPLICATE_RATIO
+    # Повтор — тот же адрес другой строки, записанный в другом регистре и с пробелами
+    emails[duplicates] = " " + emails[rng.integers(0, count, duplicates.sum())].str.upper().values
+    multi = rng.random(count) < MULTI_EMAIL_RATIO
+    emails[multi] = emails[multi] + ", sales@" + emails[multi].str.split("@").str[1]
+
+    df = pd.DataFrame({
+        "name": [f"ООО Компания {i}" for i in index],
+        "region": rng.choice(REGIONS, count),
+        "msp_registry": rng.choice(["Микропредприятие", "Малое предприятие", ""], count),
+        "director_name": rng.choice(["Иванов Иван", "Петрова Анна", "", "Сидоров Олег"], count),
+        "director_position": rng.choice(POSITIONS, count),
+        "phone_number": [f"+7 900 {i % 1000:03d}-{i % 100:02d}-{i % 97:02d}" for i in index],
+        "email": emails,
+        "website": [f"https://company{i}.ru" for i in index],
+        "primary_activity": rng.choice(ACTIVITIES, count),
+        "revenue": rng.integers(1, 500_000, count).astype(str),
+        "employee_count": rng.integers(1, 5000, count).astype(str),
+        "branch_count": rng.integers(0, 50, count).astype(str),
+    })
+    df.loc[rng.random(count) < EMPTY_ROW_RATIO] = np.nan
+    return df
+
+
+@pytest.fixture(scope="module")
+def leads_df(lead_count) -> pd.DataFrame:
+    return make_leads(lead_count)
+
+
+@pytest.fixture
+def draft_leads_df() -> pd.DataFrame:
+    """ Лиды волны для бенчмарка генерации черновиков (как из сегмента кампании: без пустых строк, с id). """
+    leads = make_leads(BENCH_DRAFT_LEADS).dropna(how="all").reset_index(drop=True)
+    leads["id"] = leads.index + 1
+    return leads
+
+
+@pytest.fixture
+def stub_llm(monkeypatch):
+    """ Подменяет модель синхронной заглушкой с задержкой BENCH_LLM_LATENCY, выгрузку в Google Таблицу — пустышкой. """
+    import json
+    import time
+    from types import SimpleNamespace
+
+    from handlers.draft_handlers import draft_handler
+    from utils import structured_output
+
+    def route_chat_completion(task: str, operation: str, messages: list[dict], **kwargs):
+        # Блокирует поток на время ответа, как синхронный клиент OpenAI
+        time.sleep(BENCH_LLM_LATENCY)
+        content = json.dumps({"subject": "Предложение о сотрудничестве", "text": messages[-1]["content"][:200]},
+                             ensure_ascii=False)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    monkeypatch.setattr(structured_output, "route_chat_completion", route_chat_completion)
+    monkeypatch.setattr(draft_handler, "append_drafts_to_sheet", lambda *args, **kwargs: None)
+
+
+@pytest.fixture(scope="session")
+def bench_engine():
+    if not BENCH_DATABASE_URL:
+        pytest.skip("Нет PostgreSQL для бенчмарков: задайте BENCH_DATABASE_URL или установите pgserver")
+
+    from db.db import engine, init_db
+    from db.migration_manager import apply_migrations
+
+    # Схема создаётся так же, как при запуске бота: миграции, затем недостающие таблицы моделей
+    os.chdir(REPO_ROOT)
+    apply_migrations()
+    init_db()
+    return engine
+
+
+@pytest.fixture
+def bench_db(bench_engine):
+    from db.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+        SessionLocal.remove()
+
+
+@pytest.fixture
+def bench_company(bench_db):
+    """ Фабрика компании с кампанией, контент-планом, волной и шаблоном. """
+    return lambda suffix: create_bench_company(bench_db, suffix)
+
+
+def create_bench_company(db, suffix: str) -> dict:
+    """
+    Создаёт компанию с кампанией, контент-планом, волной и шаблоном для бенчмарков.
+
+    :param db: Сессия базы данных.
+    :param suffix: Суффикс названий компании и кампании.
+    :return: Словарь с ID созданных записей.
+    """
+    import uuid
+    from datetime import datetime
+
+    from db.models import Campaigns, ChatThread, Company, ContentPlan, Templates, Waves
+
+    chat_id = uuid.uuid4().int % 10 ** 9
+    company = Company(chat_id=str(chat_id), telegram_id=str(chat_id), name=f"Бенчмарк {suffix}",
+                      google_sheet_url="bench-sheet", google_sheet_name="Черновики")
+    db.add(company)
+    db.flush()
+    thread = ChatThread(chat_id=chat_id, thread_id=chat_id, thread_name=f"Кампания {suffix}")
+    db.add(thread)
+    db.flush()
+    campaign = Campaigns(company_id=company.company_id, thread_id=chat_id, campaign_name=f"Кампания {suffix}")
+    db.add(campaign)
+    db.flush()
+    content_plan = ContentPlan(company_id=company.company_id, telegram_id=str(chat_id), wave_count=1,
+                               description="Знакомство с сервисом", campaign_id=campaign.campaign_id)
+    db.add(content_plan)
+    db.flush()
+    wave = Waves(content_plan_id=content_plan.content_plan_id, campaign_id=campaign.campaign_id,
+                 company_id=company.company_id, send_date=datetime.utcnow(), subject="Предложение")
+    db.add(wave)
+    db.flush()
+    db.add(Templates(company_id=company.company_id, campaign_id=campaign.campaign_id, wave_id=wave.wave_id,
+                     subject="Предложение", user_request="Письмо-знакомство",
+                     template_content="Здравствуйте, {director_name}! Предлагаем {company_name} сотрудничество."))
+    db.commit()
+    return {"company_id": company.company_id, "campaign_id": campaign.campaign_id, "wave_id": wave.wave_id}
+
+
+@pytest.fixture
+def email_table_name(bench_engine):
+    """ Имя динамической email-таблицы бенчмарка; таблица удаляется после теста. """
+    import uuid
+
+    from sqlalchemy import text
+
+    table_name = f"bench_{uuid.uuid4().hex[:12]}"
+    yield table_name
+    with bench_engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS "{table_name}" CASCADE'))
@@ -0,0 +1,12 @@
+import asyncio
+
+
+def test_generate_drafts_for_wave(benchmark, bench_db, bench_company, draft_leads_df, stub_llm):
+    from handlers.draft_handlers.draft_handler import generate_drafts_for_wave
+
+    ids = bench_company("drafts")
+
+    saved = benchmark.pedantic(
+        lambda: asyncio.run(generate_drafts_for_wave(bench_db, draft_leads_df, ids["wave_id"])), rounds=1
+    )
+    assert saved == len(draft_leads_df)
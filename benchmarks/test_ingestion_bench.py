@@ -0,0 +1,34 @@
+from db.dynamic_table_manager import create_dynamic_email_table
+from utils.parser_email_table import clean_and_validate_emails, clean_dataframe
+
+
+def test_clean_dataframe(benchmark, leads_df):
+    result = benchmark.pedantic(clean_dataframe, setup=lambda: ((leads_df.copy(),), {}), rounds=3)
+    assert len(result) < len(leads_df)
+
+
+def test_clean_and_validate_emails(benchmark, leads_df):
+    cleaned = clean_dataframe(leads_df.copy())
+    _, email_column, multi_count, _, _ = benchmark.pedantic(
+        clean_and_validate_emails, setup=lambda: ((cleaned.copy(),), {}), rounds=3
+    )
+    assert email_column == "email"
+    assert multi_count > 0
+
+
+def test_save_data_to_db(benchmark, leads_df, bench_engine, bench_db, email_table_name):
+    from db.email_table_db import save_data_to_db
+    from sqlalchemy import text
+
+    records = clean_dataframe(leads_df.copy()).to_dict(orient="records")
+
+    def setup():
+        # Каждый раунд загружает базу в пустую таблицу
+        with bench_engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS "{email_table_name}"'))
+        create_dynamic_email_table(bench_engine, email_table_name)
+        return (records, email_table_name, bench_db), {}
+
+    stats = benchmark.pedantic(save_data_to_db, setup=setup, rounds=3)
+    assert stats["new"] > 0
+    assert stats["duplicates"] > 0
@@ -0,0 +1,46 @@
+import pytest
+
+from db.dynamic_table_manager import create_dynamic_email_table
+from utils.parser_email_table import clean_dataframe
+
+# Типичный сегмент кампании: регион, наличие директора и порог по численности
+SEGMENT_FILTERS = {"region": ["москва", "петербург"], "director_name": True, "employee_count": {">": 100}}
+
+
+@pytest.fixture
+def loaded_campaign(leads_df, bench_engine, bench_db, bench_company, email_table_name):
+    """ Загруженная email-таблица и кампания с фильтрами и материализованным сегментом. """
+    from db.db_segmentation import materialize_campaign_segment
+    from db.email_table_db import create_email_table_record, save_data_to_db
+    from db.models import Campaigns, EmailTable
+
+    ids = bench_company(email_table_name)
+    create_dynamic_email_table(bench_engine, email_table_name)
+    create_email_table_record(bench_db, company_id=ids["company_id"], table_name=email_table_name,
+                              description="Бенчмарк сегментации")
+    assert save_data_to_db(clean_dataframe(leads_df.copy()).to_dict(orient="records"), email_table_name, bench_db)
+
+    email_table = bench_db.query(EmailTable).filter_by(table_name=email_table_name).one()
+    campaign = bench_db.query(Campaigns).filter_by(campaign_id=ids["campaign_id"]).one()
+    campaign.filters = SEGMENT_FILTERS
+    campaign.email_table_id = email_table.email_table_id
+    bench_db.commit()
+    materialize_campaign_segment(bench_db, campaign.campaign_id)
+
+    return {**ids, "email_table_id": email_table.email_table_id}
+
+
+def test_apply_filters_to_email_table(benchmark, bench_db, loaded_campaign):
+    from utils.segment_utils import apply_filters_to_email_table
+
+    df = benchmark.pedantic(
+        apply_filters_to_email_table, args=(bench_db, loaded_campaign["email_table_id"], SEGMENT_FILTERS), rounds=5
+    )
+    assert not df.empty
+
+
+def test_get_filtered_leads_for_wave(benchmark, bench_db, loaded_campaign):
+    from utils.wave_shedulers import get_filtered_leads_for_wave
+
+    df = benchmark.pedantic(get_filtered_leads_for_wave, args=(bench_db, loaded_campaign["wave_id"]), rounds=5)
+    assert not df.empty
@@ -1,3 +1,5 @@
+import asyncio
+
 from aiogram import Router
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.base import StorageKey
@@ -182,7 +184,8 @@ async def handle_message(message: Message, state: FSMContext):
     if current_state is None:
         logger.debug("⚠️ Состояние отсутствует. Запускаем AI-классификацию сообщения.")
         try:
-            classification = classify_message(message.text)  # AI-классификация
+            # AI-классификация в отдельном потоке, чтобы не блокировать обработку других чатов
+            classification = await asyncio.to_thread(classify_message, message.text)
             logger.debug(f"🎯 Результат классификации: {classification}")
             await dispatch_classification(classification, message, state)  # Передаём в диспетчер
         except Exception as e:
@@ -1,19 +1,106 @@
-from openai import OpenAI
-import json
-from config import OPENAI_API_KEY
+import time
+from functools import lru_cache
+
+from config import OPENAI_API_KEY, OPENAI_BASE_URL
 from promts.base_promt import BASE_PROMPT
 #from promts.campaign_promt import CREATE_CAMPAIGN_PROMPT
 from promts.company_promt import PROCESS_COMPANY_INFORMATION_PROMPT
+from promts.output_schemas import CompanyData, MessageClassification
 from states.states import AddCampaignState
+from utils.llm_router import TASK_CLASSIFY, TASK_EXTRACT
+from utils.structured_output import StructuredOutputError, request_structured
 from logger import logger
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    """
+    Возвращает клиент OpenAI. SDK импортируется при первом обращении, а не при старте бота.
+    """
+    from openai import OpenAI
+
+    return OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+
+
+@lru_cache(maxsize=None)
+def get_async_openai_client():
+    """
+    Возвращает асинхронный клиент OpenAI (для потоковой генерации в хендлерах).
+    """
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+
+
+def create_chat_completion(operation: str, model: str, messages: list[dict], cacheable: bool = False, **kwargs):
+    """
+    Запрос к чат-модели OpenAI с учётом метрик: время, ошибки, токены и стоимость.
+
+    :param operation: Операция для меток метрик (classify, draft, map_columns и т.п.).
+    :param model: Модель.
+    :param messages: Сообщения чата.
+    :param cacheable: Ответ можно брать из кэша LLM (только для детерминированных промптов извлечения,
+                      не для генерации текстов).
+    :return: Ответ OpenAI.
+    """
+    from utils.llm_cache import get_cached_completion, save_completion
+    from utils.llm_guard import get_llm_guard
+    from utils.metrics import observe_llm_call
+    from utils.usage import record_usage
+
+    if cacheable:
+        cached = get_cached_completion(operation, model, messages, kwargs)
+        if cached is not None:
+            return cached
+
+    with get_llm_guard(model).slot(operation), observe_llm_call(model, operation):
+        response = get_openai_client().chat.completions.create(model=model, messages=messages, **kwargs)
+    record_usage(model, operation, getattr(response, "usage", None))
+
+    if cacheable:
+        save_completion(operation, model, messages, kwargs, response)
+    return response
+
+
+async def stream_chat_completion(operation: str, model: str, messages: list[dict], **kwargs):
+    """
+    Потоковый запрос к чат-модели OpenAI: отдаёт текст ответа частями по мере генерации.
+    Учитывает те же метрики и ограничения, что и create_chat_completion, плюс время до первого фрагмента.
+
+    :param operation: Операция для меток метрик.
+    :param model: Модель.
+    :param messages: Сообщения чата.
+    :return: Асинхронный генератор фрагментов текста.
+    """
+    from utils.llm_guard import get_llm_guard
+    from utils.metrics import LLM_TIME_TO_FIRST_TOKEN, observe_llm_call
+    from utils.usage import record_usage
+
+    start = time.perf_counter()
+    usage, first_chunk = None, True
+    async with get_llm_guard(model).async_slot():
+        with observe_llm_call(model, operation):
+            stream = await get_async_openai_client().chat.completions.create(
+                model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **kwargs
+            )
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if first_chunk:
+                    LLM_TIME_TO_FIRST_TOKEN.labels(model, operation).observe(time.perf_counter() - start)
+                    first_chunk = False
+                yield chunk.choices[0].delta.content
+    record_usage(model, operation, usage)
+
 
 def classify_message(message_text: str) -> dict:
     """
-    Классифицирует пользовательское сообщение, используя OpenAI.
+    Классифицирует пользовательское сообщение: локальной моделью, если она уверена, иначе через OpenAI.
     """
+    from utils.intent_model import classify_with_local_model
+
     try:
         logger.debug("Starting message classification...")
 
@@ -22,43 +109,29 @@ def classify_message(message_text: str) -> dict:
             logger.warning("Received empty or None message text for classification.")
             return {"action_type": "unknown", "entity_type": "unknown"}
 
-        # Escape curly braces in the message text
-        escaped_text = message_text.replace("{", "{{").replace("}", "}}")
-
-        # Format the prompt with the escaped message text
-        prompt = BASE_PROMPT.format(input_text=escaped_text)
-        #logger.debug(f"Formatted prompt: {prompt}")
-
-        # Call the OpenAI API
-        logger.debug("Calling OpenAI API...")
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}]
-        )
-
-        # Log the full response from the model
-        #logger.debug(f"Full response from OpenAI: {response}")
+        return classify_with_local_model(message_text, classify_message_with_llm)
+    except StructuredOutputError as parse_error:
+        logger.error(f"JSON parsing error: {parse_error}")
+        return {"action_type": "unknown", "entity_type": "unknown"}
+    except Exception as e:
+        logger.error(f"Error during OpenAI API call: {e}", exc_info=True)
+        return {"action_type": "unknown", "entity_type": "unknown"}
 
-        # Extract the content from the response
-        content = response.choices[0].message.content.strip()
-        #logger.debug(f"Model response content: {content}")
 
-        # Clean the content by removing any prefixes like "Ответ:"
-        if content.lower().startswith("ответ:"):
-            content = content.split(":", 1)[1].strip()
+def classify_message_with_llm(message_text: str) -> dict:
+    """
+    Классифицирует сообщение через OpenAI. Ошибки не перехватываются: неудачный ответ — не разметка.
+    """
+    # Escape curly braces in the message text
+    escaped_text = message_text.replace("{", "{{").replace("}", "}}")
 
-        # Attempt to parse the content as JSON
-        try:
-            result = json.loads(content)
-        except json.JSONDecodeError as parse_error:
-            logger.error(f"JSON parsing error: {parse_error}")
-            logger.debug(f"Invalid JSON content: {content}")
-            result = {"action_type": "unknown", "entity_type": "unknown"}
+    # Format the prompt with the escaped message text
+    prompt = BASE_PROMPT.format(input_text=escaped_text)
+    #logger.debug(f"Formatted prompt: {prompt}")
 
-        return result
-    except Exception as e:
-        logger.error(f"Error during OpenAI API call: {e}", exc_info=True)
-        return {"action_type": "unknown", "entity_type": "unknown"}
+    # Call the OpenAI API
+    logger.debug("Calling OpenAI API...")
+    return request_structured(TASK_CLASSIFY, "classify", prompt, MessageClassification).model_dump()
 
 def extract_company_data(company_text: str) -> dict:
     """
@@ -70,16 +143,10 @@ def extract_company_data(company_text: str) -> dict:
         logger.debug(f"Formatted company prompt: {prompt}")
 
         # Вызываем OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}]
-        )
-
-        # Извлекаем и парсим ответ
-        content = response.choices[0].message.content
-        logger.debug(f"Company data response: {content}")
-        return json.loads(content.strip())
-    except json.JSONDecodeError as json_error:
+        company_data = request_structured(TASK_EXTRACT, "extract_company", prompt, CompanyData, cacheable=True)
+        logger.debug(f"Company data response: {company_data}")
+        return company_data.model_dump()
+    except StructuredOutputError as json_error:
         logger.error(f"JSON parsing error: {json_error}", exc_info=True)
         return {"error": "Invalid JSON response from model"}
     except Exception as e:
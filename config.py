@@ -9,6 +9,101 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
 TARGET_CHAT_ID = os.getenv("TARGET_CHAT_ID")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Адрес OpenAI-совместимого API (по умолчанию api.openai.com); для нагрузочных тестов и работы без сети —
+# локальная заглушка: python -m fake_openai.server, OPENAI_BASE_URL=http://127.0.0.1:8800/v1
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+# Маршруты моделей по классам задач (classify, extract, generate, edit) поверх значений по умолчанию
+# из utils/llm_router.py: "extract=gpt-4o-mini|gpt-3.5-turbo,generate=gpt-4"; таймауты: "extract=5,generate=60"
+LLM_ROUTES = os.getenv("LLM_ROUTES", "")
+LLM_TIMEOUTS = os.getenv("LLM_TIMEOUTS", "")
+
+# Кэш ответов LLM для детерминированных промптов извлечения (фильтры, данные компании, колонки, аудитория)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168"))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "100"))
+
+# Пакетная генерация черновиков для волн с датой отправки в будущем: "openai" (Batch API) или "local"
+# (локальная замена с файлами в LLM_BATCH_DIR). Волны меньше LLM_BATCH_MIN_LEADS лидов генерируются в день отправки
+LLM_BATCH_ENABLED = os.getenv("LLM_BATCH_ENABLED", "false").lower() == "true"
+LLM_BATCH_BACKEND = os.getenv("LLM_BATCH_BACKEND", "openai").lower()
+LLM_BATCH_DIR = os.getenv("LLM_BATCH_DIR", "batches")
+LLM_BATCH_HORIZON_DAYS = int(os.getenv("LLM_BATCH_HORIZON_DAYS", "7"))
+LLM_BATCH_MIN_LEADS = int(os.getenv("LLM_BATCH_MIN_LEADS", "100"))
+LLM_BATCH_POLL_INTERVAL = int(os.getenv("LLM_BATCH_POLL_INTERVAL", "600"))
+
+# Месячные лимиты LLM на компанию по умолчанию (0 — без лимита); у отдельных компаний — таблица llm_quotas.
+# Волны, которые не укладываются в лимит, останавливаются до начала генерации, а не посередине
+LLM_COMPANY_MONTHLY_BUDGET_USD = float(os.getenv("LLM_COMPANY_MONTHLY_BUDGET_USD", "0"))
+LLM_COMPANY_MONTHLY_TOKENS = int(os.getenv("LLM_COMPANY_MONTHLY_TOKENS", "0"))
+# Как часто накопленный учёт потребления записывается в БД (секунды)
+LLM_USAGE_FLUSH_INTERVAL = int(os.getenv("LLM_USAGE_FLUSH_INTERVAL", "30"))
+
+# Адаптивный лимит одновременных запросов к каждой модели (AIMD): растёт на быстрых ответах, вдвое падает
+# при 429, таймаутах и задержке выше LLM_LATENCY_TOLERANCE × обычная
+LLM_CONCURRENCY_INITIAL = int(os.getenv("LLM_CONCURRENCY_INITIAL", "8"))
+LLM_CONCURRENCY_MIN = int(os.getenv("LLM_CONCURRENCY_MIN", "1"))
+LLM_CONCURRENCY_MAX = int(os.getenv("LLM_CONCURRENCY_MAX", "32"))
+LLM_LATENCY_TOLERANCE = float(os.getenv("LLM_LATENCY_TOLERANCE", "2.5"))
+# Предохранитель: после LLM_BREAKER_FAILURES ошибок перегрузки подряд модель считается недоступной
+# LLM_BREAKER_COOLDOWN секунд; интерактивные запросы получают отказ сразу, фоновые ждут
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Сколько интерактивный запрос ждёт свободного места, прежде чем получить отказ (секунды)
+LLM_INTERACTIVE_WAIT = float(os.getenv("LLM_INTERACTIVE_WAIT", "5"))
+
+# Локальная модель классификации сообщений (TF-IDF + логистическая регрессия), обучаемая командой /train_intents
+# на классификациях LLM. Отвечает сама при уверенности не ниже INTENT_CONFIDENCE_THRESHOLD; доля INTENT_AB_RATE
+# уверенных ответов всё равно проверяется LLM для отчёта /intent_report
+INTENT_MODEL_ENABLED = os.getenv("INTENT_MODEL_ENABLED", "true").lower() == "true"
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "ml_models/intent_classifier.joblib")
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.85"))
+INTENT_AB_RATE = float(os.getenv("INTENT_AB_RATE", "0.05"))
+INTENT_MIN_SAMPLES = int(os.getenv("INTENT_MIN_SAMPLES", "200"))
+# Telegram ID пользователей, которым доступны служебные команды (через запятую)
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+
+# Генерация черновиков волны: "per_lead" — запрос к модели на каждого лида, "clustered" — лиды группируются
+# по виду деятельности, региону и размеру, на сегмент генерируется DRAFT_CLUSTER_VARIANTS вариантов, данные
+# лида подставляются локально; "auto" — по сегментам для волн от DRAFT_CLUSTER_MIN_LEADS лидов
+DRAFT_GENERATION_MODE = os.getenv("DRAFT_GENERATION_MODE", "per_lead").lower()
+DRAFT_CLUSTER_MIN_LEADS = int(os.getenv("DRAFT_CLUSTER_MIN_LEADS", "1000"))
+DRAFT_CLUSTER_MIN_SIZE = int(os.getenv("DRAFT_CLUSTER_MIN_SIZE", "20"))
+DRAFT_CLUSTER_VARIANTS = int(os.getenv("DRAFT_CLUSTER_VARIANTS", "3"))
+
+# Бюджет сведений о компании в промте генерации шаблона (токены): поля брифа ранжируются по важности для задачи
+# и обрезаются; сокращённые сведения кэшируются до следующего сохранения брифа (save_company_info)
+COMPANY_CONTEXT_MAX_TOKENS = int(os.getenv("COMPANY_CONTEXT_MAX_TOKENS", "1500"))
+
+# Потоковая генерация в Telegram: минимальный интервал между правками сообщения (секунды).
+# Telegram допускает около одной правки в секунду в чате и около 20 в минуту в группе
+TELEGRAM_STREAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_STREAM_EDIT_INTERVAL", "1.5"))
+
+# Логирование: уровень по умолчанию, уровни модулей ("sqlalchemy.engine=WARNING,utils.parser_email_table=DEBUG")
+# и формат вывода: "text" или "json" (одна запись — одна строка, для сборщиков логов)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+# Слушатель ответов на рассылки (IMAP IDLE по всем ящикам из email_connections)
+EMAIL_LISTENER_ENABLED = os.getenv("EMAIL_LISTENER_ENABLED", "false").lower() == "true"
+
+# Режим работы бота: "polling" (один процесс) или "webhook" (aiohttp, несколько процессов за reverse proxy)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Хранилище FSM: "memory" или "postgres" (в режиме вебхука всегда postgres — состояние общее для процессов)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory").lower()
+# Публичный адрес, на который Telegram отправляет апдейты (например, https://bot.example.ru)
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Локальный адрес aiohttp-приложения; все процессы слушают один порт (SO_REUSEPORT)
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "127.0.0.1")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+
+# Эндпоинт /metrics для Prometheus (0 — отключён); процесс-обработчик вебхука N слушает METRICS_PORT + N
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
 
 SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_SERVICE_ACCOUNT_FILE")
 
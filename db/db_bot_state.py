@@ -0,0 +1,133 @@
+from datetime import timedelta
+from io import StringIO
+
+import pandas as pd
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from db.models import FsmFrames, FsmStates, ProcessedUpdates
+
+# Сколько хранить update_id принятых апдейтов (Telegram ретраит вебхук не дольше суток)
+PROCESSED_UPDATES_TTL = timedelta(days=1)
+
+
+def get_fsm_record(db: Session, key: str) -> tuple[str | None, dict | None]:
+    """
+    Возвращает состояние и данные FSM по ключу (DataFrame в данных — ссылки, см. get_fsm_frames).
+
+    :param db: Сессия базы данных.
+    :param key: Ключ хранилища.
+    :return: (state, data) или (None, None), если записи нет.
+    """
+    row = db.execute(select(FsmStates.state, FsmStates.data).where(FsmStates.key == key)).first()
+    return (row.state, row.data) if row else (None, None)
+
+
+def save_fsm_fields(db: Session, key: str, **fields):
+    """
+    Сохраняет поля записи FSM (state и/или data), создавая запись при необходимости.
+
+    :param db: Сессия базы данных.
+    :param key: Ключ хранилища.
+    :param fields: Обновляемые поля.
+    """
+    stmt = pg_insert(FsmStates).values(key=key, **fields)
+    stmt = stmt.on_conflict_do_update(index_elements=[FsmStates.key], set_={**fields, "updated_at": func.now()})
+    db.execute(stmt)
+    db.commit()
+
+
+def get_fsm_frames(db: Session, key: str, frame_ids: set[str]) -> dict[str, pd.DataFrame]:
+    """
+    Загружает таблицы, на которые ссылаются данные FSM.
+
+    :param db: Сессия базы данных.
+    :param key: Ключ хранилища.
+    :param frame_ids: ID таблиц.
+    :return: {frame_id: DataFrame}.
+    """
+    rows = db.execute(
+        select(FsmFrames.frame_id, FsmFrames.payload)
+        .where(FsmFrames.fsm_key == key, FsmFrames.frame_id.in_(frame_ids))
+    )
+    # Без приведения типов и дат: таблица возвращается такой, какой её сохранили
+    return {
+        row.frame_id: pd.read_json(StringIO(row.payload), orient="split", dtype=False, convert_dates=False)
+        for row in rows
+    }
+
+
+def lock_fsm_key(db: Session, key: str):
+    """
+    Берёт транзакционную advisory-блокировку ключа FSM (снимается при commit/rollback): чтение и запись
+    данных одного ключа из разных процессов не перемешиваются.
+
+    :param db: Сессия базы данных.
+    :param key: Ключ хранилища.
+    """
+    db.execute(select(func.pg_advisory_xact_lock(func.hashtext(key))))
+
+
+def save_fsm_data(db: Session, key: str, data: dict | None, frames: dict[str, pd.DataFrame],
+                  frame_ids: set[str] | None = None):
+    """
+    Сохраняет данные FSM вместе с таблицами, на которые они ссылаются. Таблицы, уже сохранённые с тем же
+    frame_id, не перезаписываются; таблицы, на которые данные больше не ссылаются, удаляются.
+
+    :param db: Сессия базы данных.
+    :param key: Ключ хранилища.
+    :param data: Данные FSM в JSON (None — данных нет).
+    :param frames: {frame_id: DataFrame} — таблицы для сохранения.
+    :param frame_ids: ID всех таблиц, на которые ссылаются данные (None — только frames).
+    """
+    lock_fsm_key(db, key)
+    frame_ids = set(frames) if frame_ids is None else frame_ids
+    if frames:
+        stored = set(db.execute(
+            select(FsmFrames.frame_id).where(FsmFrames.fsm_key == key, FsmFrames.frame_id.in_(frames))
+        ).scalars())
+        new_frames = [
+            {"fsm_key": key, "frame_id": frame_id, "payload": frame.to_json(orient="split", force_ascii=False)}
+            for frame_id, frame in frames.items() if frame_id not in stored
+        ]
+        if new_frames:
+            db.execute(pg_insert(FsmFrames).values(new_frames).on_conflict_do_nothing())
+
+    stmt = pg_insert(FsmStates).values(key=key, data=data)
+    db.execute(stmt.on_conflict_do_update(index_elements=[FsmStates.key], set_={"data": data, "updated_at": func.now()}))
+    db.execute(delete(FsmFrames).where(FsmFrames.fsm_key == key, FsmFrames.frame_id.notin_(frame_ids)))
+    db.commit()
+
+
+def register_update(db: Session, update_id: int) -> bool:
+    """
+    Отмечает апдейт как принятый.
+
+    :param db: Сессия базы данных.
+    :param update_id: update_id апдейта Telegram.
+    :return: True, если апдейт пришёл впервые; False — повтор.
+    """
+    result = db.execute(
+        pg_insert(ProcessedUpdates)
+        .values(update_id=update_id)
+        .on_conflict_do_nothing(index_elements=[ProcessedUpdates.update_id])
+        .returning(ProcessedUpdates.update_id)
+    )
+    is_new = result.first() is not None
+    db.commit()
+    return is_new
+
+
+def cleanup_processed_updates(db: Session) -> int:
+    """
+    Удаляет устаревшие update_id.
+
+    :param db: Сессия базы данных.
+    :return: Количество удалённых записей.
+    """
+    result = db.execute(
+        delete(ProcessedUpdates).where(ProcessedUpdates.received_at < func.now() - PROCESSED_UPDATES_TTL)
+    )
+    db.commit()
+    return result.rowcount
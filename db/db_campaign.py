@@ -3,6 +3,7 @@ from datetime import datetime
 from sqlalchemy.sql import text
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from db.db_segmentation import materialize_campaign_segment
 from db.models import Campaigns, ChatThread, Company
 from logger import logger
 
@@ -49,6 +50,7 @@ async def create_campaign_and_thread(bot, db: Session, chat_id: int, campaign_da
         if existing_campaign:
             logger.warning(f"⚠️ Кампания уже существует для темы thread_id={thread_id}. Обновляем данные.")
             existing_campaign.email_table_id = email_table_id
+            existing_campaign.segment_refreshed_at = None  # Сегмент будет пересчитан по новой таблице
             db.commit()
             return existing_campaign
 
@@ -121,13 +123,15 @@ def clean_string(value: str) -> str:
     """Удаляет экранирование Unicode из строки."""
     return value.encode('utf-8').decode('unicode_escape')
 
-def update_campaign_filters(db: Session, campaign_id: int, filters: dict):
+def update_campaign_filters(db: Session, campaign_id: int, filters: dict, materialize: bool = True):
     """
     Обновляет фильтры в существующей кампании.
 
     :param db: Сессия базы данных.
     :param campaign_id: ID кампании.
     :param filters: Фильтры для обновления.
+    :param materialize: Сразу пересчитать сегмент в campaign_leads. Если False, сегмент помечается
+                        устаревшим и должен быть материализован вызывающим кодом (например, в фоне).
     """
     try:
         campaign = db.query(Campaigns).filter_by(campaign_id=campaign_id).first()
@@ -142,10 +146,16 @@ def update_campaign_filters(db: Session, campaign_id: int, filters: dict):
         logger.info(f"📌 Записываем в БД: {filters}, тип: {type(filters)}")
 
         campaign.filters = filters  # Записываем как JSON
+        if not materialize:
+            campaign.segment_refreshed_at = None
         db.commit()
 
         logger.info(f"✅ Успешно записали фильтры: {campaign.filters}")
         logger.info(f"✅ Фильтры успешно добавлены в кампанию ID {campaign_id}")
+
+        # Сохраняем сегмент в campaign_leads, чтобы волны не перефильтровывали email-таблицу
+        if materialize:
+            materialize_campaign_segment(db, campaign_id)
         return True
 
     except Exception as e:
@@ -0,0 +1,87 @@
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from db.models import ColumnMappings
+from logger import logger
+
+# Сколько компаний должны получить от модели один и тот же маппинг, чтобы он стал глобальным
+COLUMN_MAPPING_GLOBAL_MIN_COMPANIES = 3
+
+
+def _find_mapping(db: Session, company_id: int | None, signature: str) -> ColumnMappings | None:
+    query = db.query(ColumnMappings).filter(ColumnMappings.header_signature == signature)
+    if company_id is None:
+        return query.filter(ColumnMappings.company_id.is_(None)).first()
+    return query.filter(ColumnMappings.company_id == company_id).first()
+
+
+def get_cached_column_mapping(db: Session, company_id: int | None, signature: str) -> dict | None:
+    """
+    Ищет сохранённый маппинг колонок: сначала маппинг компании, затем глобальный.
+
+    :param db: Сессия базы данных.
+    :param company_id: ID компании (None — только глобальный кэш).
+    :param signature: Сигнатура заголовков таблицы.
+    :return: {нормализованный заголовок: поле или None} или None, если маппинга нет.
+    """
+    try:
+        cached = None
+        if company_id is not None:
+            cached = _find_mapping(db, company_id, signature)
+        if cached is None:
+            cached = _find_mapping(db, None, signature)
+        if cached is None:
+            return None
+
+        cached.hits += 1
+        db.commit()
+        return dict(cached.mapping)
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка при чтении кэша маппинга колонок: {e}", exc_info=True)
+        return None
+
+
+def save_column_mapping(db: Session, company_id: int | None, signature: str, mapping: dict, shared: bool = False):
+    """
+    Сохраняет маппинг колонок для компании. В глобальный кэш (общий для всех компаний) маппинг попадает,
+    только если он распознан локальными правилами (shared) или такой же маппинг для этих заголовков
+    сохранили не меньше COLUMN_MAPPING_GLOBAL_MIN_COMPANIES компаний: ответ модели для одной компании
+    не должен переопределять маппинг для остальных.
+
+    :param db: Сессия базы данных.
+    :param company_id: ID компании (None — маппинг сохраняется, только если shared).
+    :param signature: Сигнатура заголовков таблицы.
+    :param mapping: {нормализованный заголовок: поле или None}.
+    :param shared: Маппинг получен без модели, только локальными правилами.
+    """
+    try:
+        if company_id is not None:
+            cached = _find_mapping(db, company_id, signature)
+            if cached:
+                cached.mapping = mapping
+            else:
+                db.add(ColumnMappings(company_id=company_id, header_signature=signature, mapping=mapping))
+            db.flush()
+
+        if not shared:
+            agreed = sum(
+                row.mapping == mapping
+                for row in db.query(ColumnMappings).filter(
+                    ColumnMappings.header_signature == signature, ColumnMappings.company_id.isnot(None)
+                )
+            )
+            shared = agreed >= COLUMN_MAPPING_GLOBAL_MIN_COMPANIES
+
+        if shared:
+            cached = _find_mapping(db, None, signature)
+            if cached:
+                cached.mapping = mapping
+            else:
+                db.add(ColumnMappings(company_id=None, header_signature=signature, mapping=mapping))
+        db.commit()
+        logger.info(f"💾 Маппинг колонок сохранён в кэш (компания {company_id}, сигнатура {signature[:12]}, "
+                    f"глобальный: {shared}).")
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка при сохранении маппинга колонок: {e}", exc_info=True)
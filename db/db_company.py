@@ -6,15 +6,14 @@ from config import GOOGLE_SHEETS_POOL
 from db.db import SessionLocal
 from db.models import Company, CompanyInfo, Campaigns
 from logger import logger
+from utils.company_context import invalidate_company_context
 
 
 def get_company_by_chat_id(db: Session, chat_id: str) -> Company:
     """
     Возвращает объект компании по chat_id.
     """
-    result = db.query(Company).filter_by(chat_id=str(chat_id)).first()
-    print(result)
-    return result
+    return db.query(Company).filter_by(chat_id=str(chat_id)).first()
 
 
 def get_company_by_telegram_id(db: Session, telegram_id: str) -> Company:
@@ -73,6 +72,7 @@ def save_company_info(company_id: int, brief_data: dict):
             db.add(new_info)
 
         db.commit()
+        invalidate_company_context(company_id)
     except Exception as e:
         logger.error(f"Ошибка при сохранении данных компании: {e}", exc_info=True)
         db.rollback()
@@ -99,6 +99,7 @@ def delete_additional_info(db: Session, company_id: int):
         # Удаляем содержимое колонки
         company_info.additional_info = None
         db.commit()
+        invalidate_company_context(company_id)
     except Exception as e:
         db.rollback()
         logger.error(f"Ошибка при удалении содержимого additional_info: {e}", exc_info=True)
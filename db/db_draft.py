@@ -0,0 +1,241 @@
+from contextlib import contextmanager
+from datetime import timedelta
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from db.models import Drafts, Waves, Campaigns
+from logger import logger
+
+# Жизненный цикл черновика
+DRAFT_GENERATED = "generated"  # Сгенерирован, ждёт подтверждения
+DRAFT_APPROVED = "approved"  # Подтверждён и стоит в очереди на отправку
+DRAFT_SENDING = "sending"  # Взят в отправку
+DRAFT_SENT = "sent"  # Доставлен на SMTP-сервер
+DRAFT_FAILED = "failed"  # Отправка не удалась окончательно
+
+# Статусы, при которых перегенерация может заменить текст черновика
+REPLACEABLE_STATUSES = (DRAFT_GENERATED, DRAFT_APPROVED)
+
+# Пространство ключей advisory-блокировок PostgreSQL для отправки волн (второй ключ — ID волны)
+WAVE_SENDING_LOCK_SPACE = 31
+
+
+def save_drafts(db: Session, company_id: int, drafts: list[dict]) -> int:
+    """
+    Сохраняет сгенерированные черновики волны. Повторная генерация для лида обновляет черновик,
+    если он ещё не отправлялся.
+
+    :param db: Сессия базы данных.
+    :param company_id: ID компании.
+    :param drafts: Черновики (wave_id, lead_id, email, subject, text).
+    :return: Количество сохранённых черновиков.
+    """
+    rows = [
+        {
+            "wave_id": draft["wave_id"],
+            "company_id": company_id,
+            "lead_id": int(draft["lead_id"]),
+            "email": draft["email"],
+            "subject": draft["subject"],
+            "text": draft["text"],
+            "status": DRAFT_GENERATED,
+        }
+        for draft in drafts
+        if draft.get("email") and draft.get("lead_id") is not None
+    ]
+    if not rows:
+        return 0
+
+    try:
+        stmt = pg_insert(Drafts).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_drafts_wave_lead",
+            set_={
+                "email": stmt.excluded.email,
+                "subject": stmt.excluded.subject,
+                "text": stmt.excluded.text,
+                "status": DRAFT_GENERATED,
+            },
+            where=Drafts.status.in_(REPLACEABLE_STATUSES),
+        )
+        result = db.execute(stmt)
+        db.commit()
+        logger.info(f"💾 Сохранено {result.rowcount} черновиков для волны ID {rows[0]['wave_id']}")
+        return result.rowcount
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка при сохранении черновиков: {e}", exc_info=True)
+        return 0
+
+
+def approve_wave_drafts(db: Session, wave_id: int) -> int:
+    """
+    Подтверждает все сгенерированные черновики волны к отправке.
+
+    :param db: Сессия базы данных.
+    :param wave_id: ID волны.
+    :return: Количество подтверждённых черновиков.
+    """
+    result = db.execute(
+        update(Drafts)
+        .where(Drafts.wave_id == wave_id, Drafts.status == DRAFT_GENERATED)
+        .values(status=DRAFT_APPROVED)
+    )
+    db.commit()
+    logger.info(f"✅ Подтверждено {result.rowcount} черновиков волны ID {wave_id}")
+    return result.rowcount
+
+
+@contextmanager
+def lock_wave_sending(engine, wave_id: int):
+    """
+    Сеансовая advisory-блокировка PostgreSQL на отправку волны: волну отправляет один процесс
+    (воркер вебхука или планировщик). Блокировка держится отдельным соединением и снимается при выходе
+    или при обрыве соединения упавшего процесса — поэтому взявший её может вернуть в очередь
+    черновики, оставшиеся в статусе "sending".
+
+    :param engine: SQLAlchemy engine.
+    :param wave_id: ID волны.
+    :return: Контекстный менеджер, отдающий True, если блокировка получена.
+    """
+    if engine.dialect.name != "postgresql":
+        # Без PostgreSQL (тесты на SQLite) отправку в пределах процесса защищает email_sender
+        yield True
+        return
+
+    with engine.connect() as conn:
+        acquired = conn.execute(select(func.pg_try_advisory_lock(WAVE_SENDING_LOCK_SPACE, wave_id))).scalar()
+        # Блокировка сеансовая: транзакцию можно закрыть, чтобы соединение не висело «idle in transaction»
+        conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(select(func.pg_advisory_unlock(WAVE_SENDING_LOCK_SPACE, wave_id)))
+                conn.commit()
+
+
+def claim_drafts_for_sending(db: Session, wave_id: int) -> list[dict]:
+    """
+    Атомарно переводит подтверждённые черновики волны в статус "sending" и возвращает их.
+    Повторный или параллельный запуск не получит уже взятые в отправку письма.
+
+    :param db: Сессия базы данных.
+    :param wave_id: ID волны.
+    :return: Список черновиков (draft_id, lead_id, email, subject, text, attempts).
+    """
+    result = db.execute(
+        update(Drafts)
+        .where(Drafts.wave_id == wave_id, Drafts.status == DRAFT_APPROVED)
+        .values(status=DRAFT_SENDING)
+        .returning(Drafts.draft_id, Drafts.lead_id, Drafts.email, Drafts.subject, Drafts.text, Drafts.attempts)
+    )
+    drafts = [dict(row._mapping) for row in result]
+    db.commit()
+    return drafts
+
+
+def release_stuck_drafts(db: Session, wave_id: int) -> int:
+    """
+    Возвращает в очередь черновики, оставшиеся в статусе "sending" после аварийной остановки отправки.
+    Вызывается только под lock_wave_sending: иначе вернутся письма, которые отправляет другой процесс.
+
+    :param db: Сессия базы данных.
+    :param wave_id: ID волны.
+    :return: Количество возвращённых черновиков.
+    """
+    result = db.execute(
+        update(Drafts)
+        .where(Drafts.wave_id == wave_id, Drafts.status == DRAFT_SENDING)
+        .values(status=DRAFT_APPROVED)
+    )
+    db.commit()
+    if result.rowcount:
+        logger.warning(f"⚠️ Волна ID {wave_id}: {result.rowcount} черновиков возвращены в очередь отправки.")
+    return result.rowcount
+
+
+def mark_draft_sent(db: Session, draft_id: int, message_id: str, sender: str, attempts: int = 1):
+    """
+    Отмечает черновик как отправленный.
+
+    :param db: Сессия базы данных.
+    :param draft_id: ID черновика.
+    :param message_id: Message-ID отправленного письма.
+    :param sender: Адрес отправителя.
+    :param attempts: Количество попыток, понадобившихся для отправки.
+    """
+    db.execute(
+        update(Drafts)
+        .where(Drafts.draft_id == draft_id)
+        .values(
+            status=DRAFT_SENT, message_id=message_id, sender=sender, sent_at=func.now(),
+            attempts=Drafts.attempts + attempts, last_error=None
+        )
+    )
+    db.commit()
+
+
+def mark_draft_failed(db: Session, draft_id: int, error: str, attempts: int = 1):
+    """
+    Отмечает черновик как окончательно неотправленный.
+
+    :param db: Сессия базы данных.
+    :param draft_id: ID черновика.
+    :param error: Текст последней ошибки.
+    :param attempts: Количество сделанных попыток.
+    """
+    db.execute(
+        update(Drafts)
+        .where(Drafts.draft_id == draft_id)
+        .values(status=DRAFT_FAILED, attempts=Drafts.attempts + attempts, last_error=error)
+    )
+    db.commit()
+
+
+def get_wave_delivery_stats(db: Session, wave_id: int) -> dict:
+    """
+    Возвращает количество черновиков волны по статусам.
+
+    :param db: Сессия базы данных.
+    :param wave_id: ID волны.
+    :return: Словарь {статус: количество}.
+    """
+    rows = (
+        db.query(Drafts.status, func.count())
+        .filter(Drafts.wave_id == wave_id)
+        .group_by(Drafts.status)
+        .all()
+    )
+    return {status: count for status, count in rows}
+
+
+def get_sent_message_ids(db: Session, days: int) -> list:
+    """
+    Возвращает Message-ID писем, отправленных за последние дни, вместе с данными волны.
+
+    :param db: Сессия базы данных.
+    :param days: Глубина периода в днях.
+    :return: Строки (message_id, wave_id, campaign_id, thread_id, subject).
+    """
+    return (
+        db.query(Drafts.message_id, Waves.wave_id, Waves.campaign_id, Campaigns.thread_id, Waves.subject)
+        .join(Waves, Waves.wave_id == Drafts.wave_id)
+        .join(Campaigns, Campaigns.campaign_id == Waves.campaign_id)
+        .filter(Drafts.status == DRAFT_SENT, Drafts.message_id.isnot(None), Drafts.sent_at >= func.now() - timedelta(days=days))
+        .all()
+    )
+
+
+def get_drafted_lead_ids(db: Session, wave_id: int) -> set[int]:
+    """
+    Возвращает ID лидов волны, для которых черновик уже есть (например, из пакетной генерации).
+
+    :param db: Сессия базы данных.
+    :param wave_id: ID волны.
+    :return: Множество lead_id.
+    """
+    return {lead_id for (lead_id,) in db.query(Drafts.lead_id).filter(Drafts.wave_id == wave_id)}
@@ -0,0 +1,103 @@
+from datetime import date, timedelta
+
+from sqlalchemy import exists, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from db.models import DraftBatch, Drafts, Templates, Waves
+from logger import logger
+
+# Жизненный цикл пакетного задания
+BATCH_PENDING = "pending"  # Запись создана, пакет ещё не отправлен провайдеру
+BATCH_SUBMITTED = "submitted"  # Файл загружен, задание создано
+BATCH_IN_PROGRESS = "in_progress"  # Провайдер обрабатывает запросы
+BATCH_COMPLETED = "completed"  # Результаты готовы, ждут загрузки в drafts
+BATCH_INGESTED = "ingested"  # Черновики сохранены
+BATCH_FAILED = "failed"
+BATCH_CANCELLED = "cancelled"
+BATCH_EXPIRED = "expired"  # Не уложилось в окно выполнения; готовая часть результатов загружается
+
+# Задания, которые ещё нужно опрашивать
+ACTIVE_BATCH_STATUSES = (BATCH_SUBMITTED, BATCH_IN_PROGRESS, BATCH_COMPLETED)
+
+
+def create_draft_batch(db: Session, wave_id: int, backend: str, model: str, request_count: int) -> DraftBatch | None:
+    """
+    Сохраняет пакетное задание генерации черновиков до отправки провайдеру (статус pending): волна с записью
+    задания больше не выбирается для пакета, даже если отправка или сохранение её результата не удались.
+
+    :param db: Сессия базы данных.
+    :param wave_id: ID волны.
+    :param backend: Провайдер (openai, local).
+    :param model: Модель.
+    :param request_count: Количество запросов в задании.
+    :return: Запись задания или None при ошибке.
+    """
+    try:
+        batch = DraftBatch(wave_id=wave_id, backend=backend, model=model, request_count=request_count,
+                           status=BATCH_PENDING)
+        db.add(batch)
+        db.commit()
+        db.refresh(batch)
+        return batch
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка при сохранении пакетного задания волны {wave_id}: {e}", exc_info=True)
+        return None
+
+
+def get_active_draft_batches(db: Session) -> list[DraftBatch]:
+    """ Возвращает пакетные задания, которые ещё не завершены или не загружены. """
+    return db.query(DraftBatch).filter(DraftBatch.status.in_(ACTIVE_BATCH_STATUSES)).all()
+
+
+def get_wave_active_batches(db: Session, wave_id: int) -> list[DraftBatch]:
+    """ Возвращает незавершённые пакетные задания волны. """
+    return (
+        db.query(DraftBatch)
+        .filter(DraftBatch.wave_id == wave_id, DraftBatch.status.in_(ACTIVE_BATCH_STATUSES))
+        .all()
+    )
+
+
+def update_draft_batch(db: Session, batch_job_id: int, **values) -> bool:
+    """
+    Обновляет статус и счётчики пакетного задания.
+
+    :param db: Сессия базы данных.
+    :param batch_job_id: ID задания.
+    :param values: Поля для обновления (status, provider_batch_id, saved_count, failed_count, error).
+    :return: True, если запись обновлена.
+    """
+    try:
+        db.query(DraftBatch).filter(DraftBatch.batch_job_id == batch_job_id).update(values)
+        db.commit()
+        return True
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка при обновлении пакетного задания {batch_job_id}: {e}", exc_info=True)
+        return False
+
+
+def get_waves_for_batch(db: Session, today: date, horizon_days: int) -> list[Waves]:
+    """
+    Возвращает волны с датой отправки от завтра до today + horizon_days, у которых есть шаблон,
+    ещё не было пакетного задания и нет черновиков (например, сгенерированных сразу после сохранения шаблона).
+
+    :param db: Сессия базы данных.
+    :param today: Текущая дата (UTC).
+    :param horizon_days: На сколько дней вперёд генерировать черновики пакетом.
+    :return: Список волн.
+    """
+    return (
+        db.query(Waves)
+        .filter(
+            Waves.send_date >= today + timedelta(days=1),
+            Waves.send_date < today + timedelta(days=horizon_days + 1),
+            exists(select(Templates.template_id).where(Templates.wave_id == Waves.wave_id)),
+            ~exists(select(DraftBatch.batch_job_id).where(DraftBatch.wave_id == Waves.wave_id)),
+            ~exists(select(Drafts.draft_id).where(Drafts.wave_id == Waves.wave_id)),
+        )
+        .order_by(Waves.send_date)
+        .all()
+    )
@@ -0,0 +1,52 @@
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from db.models import IntentSample
+from logger import logger
+
+
+def save_intent_sample(db: Session, text: str, labels: dict | None = None, prediction: dict | None = None,
+                       confidence: float | None = None, model_version: str | None = None) -> bool:
+    """
+    Сохраняет классификацию сообщения.
+
+    :param db: Сессия базы данных.
+    :param text: Текст сообщения.
+    :param labels: Ответ LLM {"action_type", "entity_type"} (None — LLM не вызывалась).
+    :param prediction: Ответ локальной модели {"action_type", "entity_type"} (None — модели нет).
+    :param confidence: Уверенность локальной модели.
+    :param model_version: Версия локальной модели.
+    :return: True, если запись прошла.
+    """
+    labels, prediction = labels or {}, prediction or {}
+    try:
+        db.add(IntentSample(
+            text=text,
+            action_type=labels.get("action_type"),
+            entity_type=labels.get("entity_type"),
+            predicted_action=prediction.get("action_type"),
+            predicted_entity=prediction.get("entity_type"),
+            confidence=confidence,
+            model_version=model_version,
+        ))
+        db.commit()
+        return True
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка при сохранении классификации сообщения: {e}", exc_info=True)
+        return False
+
+
+def get_labeled_intent_samples(db: Session) -> list[tuple[str, str, str]]:
+    """ Возвращает размеченные LLM сообщения [(текст, action_type, entity_type)] для обучения. """
+    return (
+        db.query(IntentSample.text, IntentSample.action_type, IntentSample.entity_type)
+        .filter(IntentSample.action_type.isnot(None), IntentSample.entity_type.isnot(None))
+        .order_by(IntentSample.sample_id)
+        .all()
+    )
+
+
+def get_intent_samples_for_version(db: Session, model_version: str) -> list[IntentSample]:
+    """ Возвращает классификации, сделанные локальной моделью указанной версии. """
+    return db.query(IntentSample).filter(IntentSample.model_version == model_version).all()
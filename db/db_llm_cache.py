@@ -0,0 +1,83 @@
+from datetime import timedelta
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from db.models import LlmCache
+from logger import logger
+
+
+def get_cached_llm_response(db: Session, cache_key: str) -> str | None:
+    """
+    Возвращает непросроченный ответ из кэша LLM и отмечает попадание.
+
+    :param db: Сессия базы данных.
+    :param cache_key: Ключ запроса.
+    :return: Текст ответа или None, если записи нет или она устарела.
+    """
+    try:
+        response = db.execute(
+            update(LlmCache)
+            .where(LlmCache.cache_key == cache_key, LlmCache.expires_at > func.now())
+            .values(hits=LlmCache.hits + 1, last_hit_at=func.now())
+            .returning(LlmCache.response)
+        ).scalar()
+        db.commit()
+        return response
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка при чтении кэша LLM: {e}", exc_info=True)
+        return None
+
+
+def save_llm_response(db: Session, cache_key: str, model: str, operation: str, response: str, ttl: timedelta):
+    """
+    Сохраняет ответ модели в кэш (повторное сохранение обновляет ответ и срок жизни).
+
+    :param db: Сессия базы данных.
+    :param cache_key: Ключ запроса.
+    :param model: Модель.
+    :param operation: Операция.
+    :param response: Текст ответа.
+    :param ttl: Срок жизни записи.
+    """
+    values = {
+        "response": response,
+        "size_bytes": len(response.encode("utf-8")),
+        "last_hit_at": func.now(),
+        "expires_at": func.now() + ttl,
+    }
+    try:
+        stmt = pg_insert(LlmCache).values(cache_key=cache_key, model=model, operation=operation, **values)
+        db.execute(stmt.on_conflict_do_update(index_elements=[LlmCache.cache_key], set_=values))
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка при сохранении ответа в кэш LLM: {e}", exc_info=True)
+
+
+def evict_llm_cache(db: Session, max_bytes: int) -> int:
+    """
+    Удаляет просроченные записи и давно не использованные записи сверх допустимого объёма кэша.
+
+    :param db: Сессия базы данных.
+    :param max_bytes: Максимальный суммарный размер ответов в кэше.
+    :return: Количество удалённых записей.
+    """
+    removed = db.execute(delete(LlmCache).where(LlmCache.expires_at <= func.now())).rowcount
+
+    # Нарастающий объём от самых свежих к самым старым: всё, что не помещается в лимит, вытесняется
+    running = (
+        select(
+            LlmCache.cache_key,
+            func.sum(LlmCache.size_bytes).over(order_by=(LlmCache.last_hit_at.desc(), LlmCache.cache_key)).label("total"),
+        )
+        .subquery()
+    )
+    removed += db.execute(
+        delete(LlmCache).where(LlmCache.cache_key.in_(select(running.c.cache_key).where(running.c.total > max_bytes)))
+    ).rowcount
+    db.commit()
+    return removed
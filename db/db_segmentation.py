@@ -0,0 +1,155 @@
+import pandas as pd
+from sqlalchemy import column, delete, func, insert, literal, literal_column, select, table
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from db.models import CampaignLeads, Campaigns, EmailTable
+from logger import logger
+from utils.segment_filters import compile_filters, load_campaign_filters
+
+# Количество id лидов, обрабатываемых за один запрос при инкрементальном обновлении
+SEGMENT_REFRESH_CHUNK_SIZE = 1000
+
+
+def materialize_campaign_segment(db: Session, campaign_id: int) -> int | None:
+    """
+    Полностью пересчитывает сегмент кампании и сохраняет id подходящих лидов в campaign_leads.
+    Выборка выполняется одним INSERT ... SELECT внутри PostgreSQL.
+
+    :param db: Сессия базы данных.
+    :param campaign_id: ID кампании.
+    :return: Количество лидов в сегменте или None при ошибке.
+    """
+    try:
+        campaign = db.query(Campaigns).filter_by(campaign_id=campaign_id).first()
+        if not campaign or not campaign.email_table_id:
+            logger.warning(f"⚠️ Кампания {campaign_id} не найдена или не привязана к email-таблице.")
+            return None
+
+        email_table = db.query(EmailTable).filter_by(email_table_id=campaign.email_table_id).first()
+        if not email_table:
+            logger.warning(f"⚠️ Email-таблица {campaign.email_table_id} для кампании {campaign_id} не найдена.")
+            return None
+
+        compiled = compile_filters(load_campaign_filters(campaign.filters))
+
+        db.execute(delete(CampaignLeads).where(CampaignLeads.campaign_id == campaign_id))
+        result = db.execute(
+            insert(CampaignLeads).from_select(
+                ["campaign_id", "lead_id"],
+                select(literal(campaign_id), column("id"))
+                .select_from(table(email_table.table_name))
+                .where(compiled.where_clause())
+            )
+        )
+        campaign.segment_refreshed_at = func.now()
+        db.commit()
+
+        logger.info(f"✅ Сегмент кампании {campaign_id} материализован: {result.rowcount} лидов.")
+        return result.rowcount
+
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка при материализации сегмента кампании {campaign_id}: {e}", exc_info=True)
+        return None
+
+
+def refresh_segments_for_email_table(db: Session, email_table_id: int, lead_ids: list[int]) -> int:
+    """
+    Инкрементально обновляет материализованные сегменты всех кампаний email-таблицы
+    для добавленных или изменённых лидов (остальные строки таблицы не перечитываются).
+
+    :param db: Сессия базы данных.
+    :param email_table_id: ID email-таблицы.
+    :param lead_ids: id новых или обновлённых строк email-таблицы.
+    :return: Количество обновлённых кампаний.
+    """
+    if not lead_ids:
+        return 0
+
+    try:
+        email_table = db.query(EmailTable).filter_by(email_table_id=email_table_id).first()
+        if not email_table:
+            logger.warning(f"⚠️ Email-таблица {email_table_id} не найдена, сегменты не обновлены.")
+            return 0
+
+        # Обновляем только уже материализованные сегменты: остальные будут посчитаны целиком при запуске волны
+        campaigns = (
+            db.query(Campaigns)
+            .filter(Campaigns.email_table_id == email_table_id, Campaigns.segment_refreshed_at.isnot(None))
+            .all()
+        )
+        if not campaigns:
+            return 0
+
+        leads = table(email_table.table_name, column("id"))
+
+        for campaign in campaigns:
+            compiled = compile_filters(load_campaign_filters(campaign.filters))
+
+            for start in range(0, len(lead_ids), SEGMENT_REFRESH_CHUNK_SIZE):
+                chunk = lead_ids[start:start + SEGMENT_REFRESH_CHUNK_SIZE]
+
+                # Обновлённый лид мог как войти в сегмент, так и выйти из него
+                db.execute(
+                    delete(CampaignLeads).where(
+                        CampaignLeads.campaign_id == campaign.campaign_id,
+                        CampaignLeads.lead_id.in_(chunk)
+                    )
+                )
+                db.execute(
+                    insert(CampaignLeads).from_select(
+                        ["campaign_id", "lead_id"],
+                        select(literal(campaign.campaign_id), leads.c.id)
+                        .where(leads.c.id.in_(chunk), compiled.where_clause())
+                    )
+                )
+
+            campaign.segment_refreshed_at = func.now()
+
+        db.commit()
+        logger.info(
+            f"🔄 Сегменты {len(campaigns)} кампаний обновлены для {len(lead_ids)} лидов "
+            f"таблицы {email_table.table_name}."
+        )
+        return len(campaigns)
+
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка при обновлении сегментов email-таблицы {email_table_id}: {e}", exc_info=True)
+        return 0
+
+
+def get_campaign_lead_ids(db: Session, campaign_id: int) -> list[int]:
+    """
+    Возвращает id лидов из материализованного сегмента кампании.
+
+    :param db: Сессия базы данных.
+    :param campaign_id: ID кампании.
+    :return: Список id лидов.
+    """
+    result = db.execute(
+        select(CampaignLeads.lead_id)
+        .where(CampaignLeads.campaign_id == campaign_id)
+        .order_by(CampaignLeads.lead_id)
+    )
+    return [row[0] for row in result]
+
+
+def read_campaign_segment(db: Session, campaign_id: int, table_name: str) -> pd.DataFrame:
+    """
+    Загружает лидов материализованного сегмента кампании (JOIN email-таблицы с campaign_leads).
+
+    :param db: Сессия базы данных.
+    :param campaign_id: ID кампании.
+    :param table_name: Имя email-таблицы кампании.
+    :return: DataFrame с лидами сегмента.
+    """
+    leads = table(table_name, column("id"))
+    query = (
+        select(literal_column(f"{table_name}.*"))
+        .select_from(leads.join(CampaignLeads.__table__, CampaignLeads.lead_id == leads.c.id))
+        .where(CampaignLeads.campaign_id == campaign_id)
+        .order_by(leads.c.id)
+    )
+    return pd.read_sql(query, db.bind)
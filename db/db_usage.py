@@ -0,0 +1,112 @@
+from datetime import date, datetime
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from db.models import Company, LlmQuota, LlmUsage, Waves
+from logger import logger
+
+USAGE_COUNTERS = ("requests", "prompt_tokens", "completion_tokens", "cost_usd")
+
+
+def add_llm_usage(db: Session, rows: list[dict]) -> bool:
+    """
+    Прибавляет накопленное потребление к дневным агрегатам.
+
+    :param db: Сессия базы данных.
+    :param rows: Строки (usage_date, company_id, campaign_id, wave_id, model, operation и счётчики).
+    :return: True, если запись прошла.
+    """
+    if not rows:
+        return True
+    try:
+        stmt = pg_insert(LlmUsage).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_llm_usage_key",
+            set_={name: getattr(LlmUsage, name) + getattr(stmt.excluded, name) for name in USAGE_COUNTERS},
+        )
+        db.execute(stmt)
+        db.commit()
+        return True
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка при записи учёта LLM: {e}", exc_info=True)
+        return False
+
+
+def get_company_ids_by_chat(db: Session, chat_ids: list[str]) -> dict[str, int]:
+    """ Возвращает {chat_id: company_id} для чатов, привязанных к компаниям. """
+    if not chat_ids:
+        return {}
+    rows = db.query(Company.chat_id, Company.company_id).filter(Company.chat_id.in_(chat_ids)).all()
+    return {chat_id: company_id for chat_id, company_id in rows}
+
+
+def get_company_usage(db: Session, company_id: int, since: date) -> dict:
+    """
+    Возвращает суммарное потребление компании начиная с даты.
+
+    :param db: Сессия базы данных.
+    :param company_id: ID компании.
+    :param since: Начальная дата (включительно).
+    :return: {"requests", "prompt_tokens", "completion_tokens", "cost_usd"}.
+    """
+    row = (
+        db.query(*(func.coalesce(func.sum(getattr(LlmUsage, name)), 0) for name in USAGE_COUNTERS))
+        .filter(LlmUsage.company_id == company_id, LlmUsage.usage_date >= since)
+        .one()
+    )
+    return {name: float(value) if name == "cost_usd" else int(value) for name, value in zip(USAGE_COUNTERS, row)}
+
+
+def get_average_completion_tokens(db: Session, company_id: int, operation: str) -> float | None:
+    """ Средняя длина ответа модели для операции компании (для оценки стоимости волны). """
+    requests, completion_tokens = (
+        db.query(func.sum(LlmUsage.requests), func.sum(LlmUsage.completion_tokens))
+        .filter(LlmUsage.company_id == company_id, LlmUsage.operation == operation)
+        .one()
+    )
+    return float(completion_tokens) / float(requests) if requests else None
+
+
+def get_company_quota(db: Session, company_id: int) -> LlmQuota | None:
+    return db.query(LlmQuota).filter(LlmQuota.company_id == company_id).first()
+
+
+def set_company_quota(db: Session, company_id: int, monthly_budget_usd: float | None,
+                      monthly_token_limit: int | None):
+    """
+    Задаёт месячные лимиты компании.
+
+    :param db: Сессия базы данных.
+    :param company_id: ID компании.
+    :param monthly_budget_usd: Бюджет в USD (None — по умолчанию, 0 — без лимита).
+    :param monthly_token_limit: Лимит токенов (None — по умолчанию, 0 — без лимита).
+    """
+    values = {"monthly_budget_usd": monthly_budget_usd, "monthly_token_limit": monthly_token_limit,
+              "updated_at": func.now()}
+    try:
+        stmt = pg_insert(LlmQuota).values(company_id=company_id, **values)
+        db.execute(stmt.on_conflict_do_update(index_elements=[LlmQuota.company_id], set_=values))
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка при сохранении лимитов LLM компании {company_id}: {e}", exc_info=True)
+
+
+def pause_wave(db: Session, wave_id: int, reason: str):
+    """ Останавливает генерацию волны до появления бюджета. """
+    db.query(Waves).filter(Waves.wave_id == wave_id).update({"paused_at": datetime.utcnow(), "pause_reason": reason})
+    db.commit()
+
+
+def resume_wave(db: Session, wave_id: int):
+    db.query(Waves).filter(Waves.wave_id == wave_id).update({"paused_at": None, "pause_reason": None})
+    db.commit()
+
+
+def get_paused_waves(db: Session, until: date) -> list[Waves]:
+    """ Возвращает остановленные волны с датой отправки не позже указанной. """
+    return db.query(Waves).filter(Waves.paused_at.isnot(None), Waves.send_date < until).all()
@@ -1,4 +1,4 @@
-from sqlalchemy import MetaData, Table, Column, Integer, String, inspect
+from sqlalchemy import MetaData, Table, Column, Integer, String, Index, inspect, text
 from sqlalchemy.exc import ProgrammingError
 import logging
 
@@ -18,9 +18,23 @@ DYNAMIC_EMAIL_TABLE_COLUMNS = [
     ("primary_activity", String),
     ("revenue", String),
     ("employee_count", String),
-    ("branch_count", String)
+    ("branch_count", String),
+    ("email_normalized", String)  # Нормализованный email (lower + trim) для дедупликации
 ]
 
+# Колонка, по которой строится уникальный индекс дедупликации лидов
+EMAIL_DEDUP_COLUMN = "email_normalized"
+
+
+def get_email_dedup_index_name(table_name: str) -> str:
+    """
+    Возвращает имя уникального индекса по нормализованному email для динамической таблицы.
+
+    :param table_name: Имя динамической таблицы.
+    :return: Имя индекса.
+    """
+    return f"ux_{table_name}_{EMAIL_DEDUP_COLUMN}"
+
 
 def create_dynamic_email_table(engine, table_name: str) -> None:
     """
@@ -33,22 +47,24 @@ def create_dynamic_email_table(engine, table_name: str) -> None:
         metadata = MetaData()  # Используем привязанный metadata
         inspector = inspect(engine)
 
-        existing_tables = inspector.get_table_names()
-        logger.debug(f"📋 Существующие таблицы: {existing_tables}")
-
-        if table_name in existing_tables:
+        if inspector.has_table(table_name):
             logger.warning(f"⚠️ Таблица '{table_name}' уже существует. Пропускаем создание.")
             return
 
-        logger.debug(f"📌 Генерируем колонки для таблицы '{table_name}'")
+        logger.debug("📌 Генерируем колонки для таблицы '%s'", table_name)
 
         # Создаём новые объекты `Column()` для каждой таблицы, чтобы избежать конфликта
         dynamic_columns = [Column("id", Integer, primary_key=True, autoincrement=True)] + [
             Column(name, col_type, nullable=True) for name, col_type in DYNAMIC_EMAIL_TABLE_COLUMNS
         ]
 
-        table = Table(table_name, metadata, *dynamic_columns)
-        logger.debug(f"📌 Создаём таблицу '{table_name}' с колонками: {[col.name for col in table.columns]}")
+        table = Table(
+            table_name,
+            metadata,
+            *dynamic_columns,
+            Index(get_email_dedup_index_name(table_name), EMAIL_DEDUP_COLUMN, unique=True)
+        )
+        logger.debug("📌 Создаём таблицу '%s' с колонками: %s", table_name, table.columns.keys())
 
         metadata.create_all(engine, tables=[table])
 
@@ -56,4 +72,64 @@ def create_dynamic_email_table(engine, table_name: str) -> None:
     except ProgrammingError as e:
         logger.error(f"❌ Ошибка при создании таблицы '{table_name}': {e}", exc_info=True)
     except Exception as e:
-        logger.error(f"❌ Непредвиденная ошибка при создании таблицы '{table_name}': {e}", exc_info=True)
\ No newline at end of file
+        logger.error(f"❌ Непредвиденная ошибка при создании таблицы '{table_name}': {e}", exc_info=True)
+
+
+def count_duplicate_emails(conn, table_name: str) -> int:
+    """
+    Считает email, которые записаны в динамической таблице больше одного раза.
+
+    :param conn: Соединение с базой данных.
+    :param table_name: Имя динамической таблицы.
+    :return: Количество повторяющихся email.
+    """
+    return conn.execute(text(
+        f'SELECT count(*) FROM (SELECT 1 FROM "{table_name}" WHERE {EMAIL_DEDUP_COLUMN} IS NOT NULL '
+        f"GROUP BY {EMAIL_DEDUP_COLUMN} HAVING count(*) > 1) duplicates"
+    )).scalar()
+
+
+def ensure_email_dedup_index(engine, table_name: str) -> int | None:
+    """
+    Приводит ранее созданную динамическую таблицу к схеме с дедупликацией:
+    добавляет и заполняет колонку `email_normalized` и создаёт уникальный индекс.
+    Строки не удаляются: на них могут ссылаться черновики и сегменты. Если в таблице уже есть
+    повторяющиеся email, индекс не создаётся, пока их не объединят.
+
+    :param engine: SQLAlchemy engine для подключения к базе данных.
+    :param table_name: Имя динамической таблицы.
+    :return: Количество повторяющихся email (0 — индекс готов, None — ошибка: готовность индекса неизвестна).
+    """
+    index_name = get_email_dedup_index_name(table_name)
+    try:
+        inspector = inspect(engine)
+        columns = {col["name"] for col in inspector.get_columns(table_name)}
+        indexes = {idx["name"] for idx in inspector.get_indexes(table_name)}
+
+        if EMAIL_DEDUP_COLUMN in columns and index_name in indexes:
+            return 0
+
+        logger.info(f"🔧 Добавляем дедупликацию по email в таблицу '{table_name}'")
+
+        with engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE "{table_name}" ADD COLUMN IF NOT EXISTS {EMAIL_DEDUP_COLUMN} VARCHAR'))
+            conn.execute(text(
+                f'UPDATE "{table_name}" '
+                f"SET {EMAIL_DEDUP_COLUMN} = NULLIF(lower(regexp_replace(email, '^\\s+|\\s+$', '', 'g')), '') "
+                f"WHERE {EMAIL_DEDUP_COLUMN} IS NULL AND email IS NOT NULL"
+            ))
+            duplicates = count_duplicate_emails(conn, table_name)
+            if not duplicates:
+                conn.execute(text(
+                    f'CREATE UNIQUE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({EMAIL_DEDUP_COLUMN})'
+                ))
+
+        if duplicates:
+            logger.warning(f"⚠️ В таблице '{table_name}' {duplicates} email записаны несколько раз: "
+                           f"уникальный индекс не создан, загрузки дописывают только новые email.")
+            return duplicates
+        logger.info(f"✅ Уникальный индекс '{index_name}' готов.")
+        return 0
+    except Exception as e:
+        logger.error(f"❌ Ошибка при создании индекса дедупликации для '{table_name}': {e}", exc_info=True)
+        return None
@@ -1,7 +1,10 @@
 import pandas as pd
-from sqlalchemy import Table, MetaData, insert, func
+from sqlalchemy import Table, MetaData, insert, func, literal_column, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.sql import text
 import logging
+from db.db_segmentation import refresh_segments_for_email_table
+from db.dynamic_table_manager import EMAIL_DEDUP_COLUMN
 from db.models import EmailTable, Campaigns
 
 from db.db import engine, SessionLocal
@@ -9,10 +12,18 @@ from sqlalchemy.orm import Session
 
 logger = logging.getLogger(__name__)
 
+# Количество строк в одном INSERT при загрузке базы
+UPLOAD_CHUNK_SIZE = 1000
 
-def process_table_operations(df: pd.DataFrame, file_name: str, chat_id: str, message, table_name) -> bool:
+
+def process_table_operations(df: pd.DataFrame, file_name: str, chat_id: str, message, table_name,
+                             mode: str = "upsert") -> dict | bool:
     """
     Открывает сессию, создаёт таблицу и сохраняет данные в БД.
+
+    :param mode: Режим загрузки (см. save_data_to_db).
+
+    :return: Статистика загрузки (см. save_data_to_db) или False при ошибке.
     """
     db: Session = SessionLocal()
     try:
@@ -40,9 +51,17 @@ def process_table_operations(df: pd.DataFrame, file_name: str, chat_id: str, mes
             return False
 
         # ✅ Сохранение данных в БД (теперь `file_name` передаётся в `df`)
-        if save_data_to_db(df.to_dict(orient="records"), table_name, db):
+        stats = save_data_to_db(df.to_dict(orient="records"), table_name, db, mode)
+        if stats:
+            # Досчитываем сегменты кампаний только по загруженным строкам
+            email_table = db.query(EmailTable).filter(EmailTable.table_name == table_name).first()
+            if email_table is None:
+                # Данные уже сохранены: загрузка не считается неудачной, сегменты досчитаются при следующей
+                logger.error(f"❌ Запись о таблице {table_name} не найдена: сегменты кампаний не обновлены.")
+                return stats
+            refresh_segments_for_email_table(db, email_table.email_table_id, stats["lead_ids"])
             message.reply(f"✅ Данные из {file_name} успешно обработаны и сохранены.")
-            return True
+            return stats
         else:
             message.reply(f"❌ Ошибка при сохранении данных из {file_name}.")
             logger.error(f"Ошибка при сохранении данных в таблицу: {table_name}")
@@ -50,14 +69,69 @@ def process_table_operations(df: pd.DataFrame, file_name: str, chat_id: str, mes
     finally:
         db.close()
 
-def save_data_to_db(data: list, table_name: str, db: Session):
+def normalize_email(value) -> str | None:
+    """
+    Приводит email к каноническому виду для дедупликации (без пробелов по краям, в нижнем регистре).
+
+    :param value: Исходное значение ячейки.
+    :return: Нормализованный email или None, если значение пустое.
+    """
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    normalized = str(value).strip().lower()
+    return normalized or None
+
+
+def deduplicate_records(records: list) -> tuple[list, int]:
+    """
+    Убирает повторы email внутри загружаемого файла за один проход по хеш-таблице.
+    Для повторной записи пустые поля первой записи дополняются её значениями.
+
+    :param records: Список записей (dict) из DataFrame.
+    :return: Кортеж (уникальные записи с заполненным email_normalized, количество дубликатов).
+    """
+    seen = {}
+    unique_records = []
+    duplicates = 0
+
+    for record in records:
+        key = normalize_email(record.get("email"))
+        record = {**record, EMAIL_DEDUP_COLUMN: key}
+
+        if key is None:
+            unique_records.append(record)
+            continue
+
+        existing = seen.get(key)
+        if existing is None:
+            seen[key] = record
+            unique_records.append(record)
+            continue
+
+        duplicates += 1
+        for column, value in record.items():
+            if existing.get(column) in (None, "") and value not in (None, ""):
+                existing[column] = value
+
+    return unique_records, duplicates
+
+
+def save_data_to_db(data: list, table_name: str, db: Session, mode: str = "upsert"):
     """
     Сохраняет данные в динамическую таблицу сегментации email.
 
+    В режиме "upsert" записи с уже существующим email обновляют найденную строку
+    (пустые значения из файла не затирают заполненные), в режиме "append" данные просто дописываются,
+    в режиме "insert_new" дописываются только записи с новыми email (для таблиц без уникального индекса,
+    см. ensure_email_dedup_index).
+
     :param data: Список записей для сохранения.
     :param table_name: Название таблицы для сохранения.
     :param db: Сессия базы данных.
-    :return: True, если данные успешно сохранены, иначе False.
+    :param mode: Режим загрузки: "upsert", "append" или "insert_new".
+    :return: Словарь {"new", "updated", "skipped", "duplicates", "lead_ids"} (lead_ids — id добавленных
+             и обновлённых строк, skipped — записи с уже известными email в режиме "insert_new"),
+             если данные успешно сохранены, иначе False.
     """
     try:
         if not data:
@@ -67,15 +141,62 @@ def save_data_to_db(data: list, table_name: str, db: Session):
         metadata = MetaData()
         table = Table(table_name, metadata, autoload_with=db.bind)
 
-        logger.debug(f"📌 Подготовка данных для вставки в {table_name}: {data[:5]} (показаны первые 5 записей)")
-        logger.debug(f"📌 Выполняется SQL-запрос на вставку {len(data)} записей в {table_name}")
+        records, duplicates = deduplicate_records(data)
+        stats = {"new": 0, "updated": 0, "skipped": 0, "duplicates": duplicates, "lead_ids": []}
+
+        # Многострочный INSERT требует одинакового набора колонок во всех записях
+        present_keys = set().union(*records)
+        column_names = [column.name for column in table.columns if column.name != "id" and column.name in present_keys]
+        records = [{name: record.get(name) for name in column_names} for record in records]
+
+        logger.debug(
+            f"📌 Вставка {len(records)} записей в {table_name} (режим {mode}, дубликатов в файле: {duplicates})"
+        )
+
+        for start in range(0, len(records), UPLOAD_CHUNK_SIZE):
+            chunk = records[start:start + UPLOAD_CHUNK_SIZE]
+
+            if mode == "insert_new":
+                keys = [record[EMAIL_DEDUP_COLUMN] for record in chunk if record.get(EMAIL_DEDUP_COLUMN)]
+                known = set(db.execute(
+                    select(table.c[EMAIL_DEDUP_COLUMN]).where(table.c[EMAIL_DEDUP_COLUMN].in_(keys))
+                ).scalars()) if keys else set()
+                new_records = [record for record in chunk if record.get(EMAIL_DEDUP_COLUMN) not in known]
+                stats["skipped"] += len(chunk) - len(new_records)
+                chunk = new_records
+                if not chunk:
+                    continue
+
+            if mode in ("append", "insert_new"):
+                inserted_ids = db.execute(insert(table).values(chunk).returning(table.c.id)).scalars().all()
+                stats["new"] += len(inserted_ids)
+                stats["lead_ids"].extend(inserted_ids)
+                continue
+
+            stmt = pg_insert(table).values(chunk)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c[EMAIL_DEDUP_COLUMN]],
+                set_={
+                    column.name: func.coalesce(func.nullif(stmt.excluded[column.name], ""), column)
+                    for column in table.columns
+                    if column.name not in ("id", EMAIL_DEDUP_COLUMN)
+                }
+            ).returning(table.c.id, literal_column("(xmax = 0)").label("inserted"))
+
+            for row in db.execute(stmt):
+                stats["lead_ids"].append(row.id)
+                if row.inserted:
+                    stats["new"] += 1
+                else:
+                    stats["updated"] += 1
 
-        stmt = insert(table).values(data)
-        db.execute(stmt)
         db.commit()
 
-        logger.info(f"✅ Данные успешно сохранены в таблицу {table_name}.")
-        return True
+        logger.info(
+            f"✅ Данные сохранены в таблицу {table_name}: новых {stats['new']}, "
+            f"обновлено {stats['updated']}, дубликатов {stats['duplicates']}."
+        )
+        return stats
     except Exception as e:
         logger.error(f"❌ Ошибка при сохранении данных в {table_name}: {e}", exc_info=True)
         db.rollback()
@@ -1,16 +1,14 @@
 import os
 import logging
-from sqlalchemy import create_engine, text, select
+import re
+from sqlalchemy import text, select
 from sqlalchemy.orm import sessionmaker
 
-from config import DATABASE_URL
+from db.db import engine
 from db.models import Migration
 
 
-# Настройка синхронного движка
-engine = create_engine(DATABASE_URL, echo=True)
-
-# Настройка фабрики для создания сессий
+# Миграции используют общий движок приложения (без echo — SQL миграций и так логируется ниже)
 Session = sessionmaker(bind=engine)
 
 def check_tables_exist():  # Синхронная проверка
@@ -20,6 +18,11 @@ def check_tables_exist():  # Синхронная проверка
         )
         return result.scalar()
 
+def get_migration_number(name: str) -> int:
+    """ Номер миграции для сортировки: migration_10 должна идти после migration_9, а не после migration_1. """
+    match = re.search(r"\d+", name)
+    return int(match.group()) if match else 0
+
 def apply_migrations():
     migrations_folder = 'migrations'
 
@@ -36,7 +39,7 @@ def apply_migrations():
 
         all_migrations = [f for f in os.listdir(migrations_folder) if f.endswith('.sql')]
         new_migrations = [m for m in all_migrations if m not in applied_migrations]
-        new_migrations.sort()
+        new_migrations.sort(key=get_migration_number)
 
         if new_migrations:
             logging.info(f"Найдено {len(new_migrations)} новых миграций: {new_migrations}")
@@ -1,5 +1,6 @@
 from sqlalchemy import (
-    Column, Integer, String, DateTime, ForeignKey, Text, Boolean, JSON, func, BigInteger, TIMESTAMP, text
+    Column, Integer, String, DateTime, ForeignKey, Text, Boolean, JSON, func, BigInteger, TIMESTAMP, text,
+    UniqueConstraint, Date, Float
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects.postgresql import JSONB
@@ -33,6 +34,8 @@ class EmailConnections(Base):
     smtp_port = Column(Integer, nullable=False)
     imap_server = Column(String, nullable=False)
     imap_port = Column(Integer, nullable=False)
+    uid_validity = Column(BigInteger, nullable=True)  # UIDVALIDITY папки INBOX
+    last_seen_uid = Column(BigInteger, nullable=True)  # UID последнего обработанного входящего письма
 
     company = relationship("Company", back_populates="email_connections")
 
@@ -110,6 +113,7 @@ class Campaigns(Base):
     status_for_user = Column(Boolean, default=True, nullable=False)
     filters = Column(JSON, nullable=True)
     email_table_id = Column(Integer, ForeignKey("email_tables.email_table_id"), nullable=True)  # Добавляем email_table_id
+    segment_refreshed_at = Column(DateTime, nullable=True)  # Когда сегмент был материализован в campaign_leads
 
     # Связи
     templates = relationship("Templates", back_populates="campaign")
@@ -119,6 +123,16 @@ class Campaigns(Base):
     chat_thread = relationship("ChatThread", backref="campaigns")
     email_table = relationship("EmailTable", backref="campaigns")
 
+class CampaignLeads(Base):
+    """
+    Материализованный сегмент кампании: id лидов email-таблицы, подходящих под фильтры кампании.
+    """
+    __tablename__ = "campaign_leads"
+
+    campaign_id = Column(Integer, ForeignKey("campaigns.campaign_id", ondelete="CASCADE"), primary_key=True)
+    lead_id = Column(Integer, primary_key=True)  # id строки в динамической email-таблице
+    added_at = Column(DateTime, default=func.now(), nullable=False)
+
 class EmailTable(Base):
     __tablename__ = "email_tables"
 
@@ -153,6 +167,8 @@ class Waves(Base):
     company_id = Column(Integer, ForeignKey("companies.company_id"), nullable=False)  # Связь с Company
     send_date = Column(DateTime, nullable=False)  # Дата отправки
     subject = Column(String, nullable=False)  # Тема рассылки
+    paused_at = Column(DateTime, nullable=True)  # Генерация остановлена (превышен бюджет LLM)
+    pause_reason = Column(Text, nullable=True)
 
     # Связи
     content_plan = relationship("ContentPlan", back_populates="waves")
@@ -176,6 +192,95 @@ class Templates(Base):
     campaign = relationship("Campaigns", back_populates="templates")
     wave = relationship("Waves", foreign_keys=[wave_id])
 
+class Drafts(Base):
+    """
+    Черновики писем для лидов волны и состояние их доставки.
+    Статусы: generated → approved → sending → sent | failed.
+    """
+    __tablename__ = "drafts"
+    __table_args__ = (UniqueConstraint("wave_id", "lead_id", name="uq_drafts_wave_lead"),)
+
+    draft_id = Column(Integer, primary_key=True, autoincrement=True)
+    wave_id = Column(Integer, ForeignKey("waves.wave_id", ondelete="CASCADE"), nullable=False, index=True)
+    company_id = Column(Integer, ForeignKey("companies.company_id", ondelete="CASCADE"), nullable=False)
+    lead_id = Column(Integer, nullable=False)  # id строки в динамической email-таблице
+    email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    text = Column(Text, nullable=False)
+    status = Column(String, default="generated", nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)  # Количество попыток отправки
+    last_error = Column(Text, nullable=True)
+    message_id = Column(String, nullable=True, unique=True)  # Message-ID отправленного письма (для поиска ответов)
+    sender = Column(String, nullable=True)  # Ящик, с которого отправлено письмо
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+
+    wave = relationship("Waves", backref="drafts")
+
+class ColumnMappings(Base):
+    """
+    Кэш сопоставления колонок загружаемых таблиц с полями email-сегмента.
+    Ключ — сигнатура нормализованных заголовков; company_id = NULL для глобального кэша.
+    """
+    __tablename__ = "column_mappings"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    company_id = Column(Integer, ForeignKey("companies.company_id", ondelete="CASCADE"), nullable=True)
+    header_signature = Column(String(64), nullable=False)  # sha256 отсортированных нормализованных заголовков
+    mapping = Column(JSON, nullable=False)  # {нормализованный заголовок: поле или null}
+    hits = Column(Integer, default=0, nullable=False)  # Сколько раз маппинг взят из кэша
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+class FsmStates(Base):
+    """
+    Общее для всех процессов бота хранилище FSM (состояние и данные по ключу чата/пользователя).
+    """
+    __tablename__ = "fsm_states"
+
+    key = Column(String, primary_key=True)  # Ключ aiogram: bot_id:chat_id:user_id[:thread_id]:destiny
+    state = Column(String, nullable=True)
+    data = Column(JSON, nullable=True)  # DataFrame в данных заменены ссылками на FsmFrames
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class FsmFrames(Base):
+    """
+    Таблицы (DataFrame) из данных FSM: в fsm_states.data на них остаются ссылки по frame_id.
+    """
+    __tablename__ = "fsm_frames"
+
+    fsm_key = Column(String, primary_key=True)  # Ключ записи fsm_states
+    frame_id = Column(String(64), primary_key=True)  # sha256 содержимого таблицы
+    payload = Column(Text, nullable=False)  # DataFrame.to_json(orient="split")
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+
+class ProcessedUpdates(Base):
+    """
+    update_id уже принятых апдейтов Telegram — защита от повторной обработки при ретраях вебхука.
+    """
+    __tablename__ = "processed_updates"
+
+    update_id = Column(BigInteger, primary_key=True)
+    received_at = Column(DateTime, default=func.now(), nullable=False, index=True)
+
+class LlmCache(Base):
+    """
+    Кэш ответов LLM для детерминированных промптов извлечения данных.
+    Ключ — sha256 от модели, сообщений и параметров запроса.
+    """
+    __tablename__ = "llm_cache"
+
+    cache_key = Column(String(64), primary_key=True)
+    model = Column(String, nullable=False)
+    operation = Column(String, nullable=False)  # Операция, для которой ответ получен впервые (для статистики)
+    response = Column(Text, nullable=False)
+    size_bytes = Column(Integer, nullable=False)  # Размер ответа: кэш ограничен суммарным объёмом
+    hits = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    last_hit_at = Column(DateTime, default=func.now(), nullable=False, index=True)  # Для вытеснения LRU
+    expires_at = Column(DateTime, nullable=False, index=True)
+
 class Migration(Base):
     """
     Таблица для хранения информации о применённых миграциях.
@@ -184,4 +289,75 @@ class Migration(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)  # Уникальный идентификатор
     migration_name = Column(String, nullable=False, unique=True)  # Имя файла миграции
-    applied_at = Column(DateTime, default=func.now(), nullable=False)  # Время применения
\ No newline at end of file
+    applied_at = Column(DateTime, default=func.now(), nullable=False)  # Время применения
+
+class DraftBatch(Base):
+    """
+    Пакетное задание генерации черновиков волны (OpenAI Batch API или локальная замена).
+    Статусы: pending → submitted → in_progress → completed → ingested | failed | cancelled | expired.
+    """
+    __tablename__ = "draft_batches"
+
+    batch_job_id = Column(Integer, primary_key=True, autoincrement=True)
+    wave_id = Column(Integer, ForeignKey("waves.wave_id", ondelete="CASCADE"), nullable=False, index=True)
+    provider_batch_id = Column(String, nullable=True, unique=True)  # ID задания у провайдера (после отправки)
+    backend = Column(String, nullable=False)  # openai | local
+    model = Column(String, nullable=False)
+    status = Column(String, default="submitted", nullable=False, index=True)
+    request_count = Column(Integer, default=0, nullable=False)
+    saved_count = Column(Integer, default=0, nullable=False)  # Черновиков сохранено из результатов
+    failed_count = Column(Integer, default=0, nullable=False)  # Запросов без корректного ответа
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class LlmUsage(Base):
+    """
+    Учёт запросов к LLM по компаниям, кампаниям и волнам за день (0 — запрос не привязан).
+    Пополняется агрегатами из utils.usage, а не отдельной строкой на каждый запрос.
+    """
+    __tablename__ = "llm_usage"
+    __table_args__ = (
+        UniqueConstraint("usage_date", "company_id", "campaign_id", "wave_id", "model", "operation",
+                         name="uq_llm_usage_key"),
+    )
+
+    usage_id = Column(Integer, primary_key=True, autoincrement=True)
+    usage_date = Column(Date, nullable=False)
+    company_id = Column(Integer, default=0, nullable=False)
+    campaign_id = Column(Integer, default=0, nullable=False)
+    wave_id = Column(Integer, default=0, nullable=False)
+    model = Column(String, nullable=False)
+    operation = Column(String, nullable=False)
+    requests = Column(Integer, default=0, nullable=False)
+    prompt_tokens = Column(BigInteger, default=0, nullable=False)
+    completion_tokens = Column(BigInteger, default=0, nullable=False)
+    cost_usd = Column(Float, default=0, nullable=False)
+
+
+class LlmQuota(Base):
+    """ Месячные лимиты LLM компании (NULL — значение по умолчанию из конфигурации, 0 — без лимита). """
+    __tablename__ = "llm_quotas"
+
+    company_id = Column(Integer, ForeignKey("companies.company_id", ondelete="CASCADE"), primary_key=True)
+    monthly_budget_usd = Column(Float, nullable=True)
+    monthly_token_limit = Column(BigInteger, nullable=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class IntentSample(Base):
+    """
+    Классификация сообщения: ответ LLM (обучающая разметка) и ответ локальной модели (для сравнения с LLM).
+    """
+    __tablename__ = "intent_samples"
+
+    sample_id = Column(Integer, primary_key=True, autoincrement=True)
+    text = Column(Text, nullable=False)
+    action_type = Column(String, nullable=True)
+    entity_type = Column(String, nullable=True)
+    predicted_action = Column(String, nullable=True)
+    predicted_entity = Column(String, nullable=True)
+    confidence = Column(Float, nullable=True)
+    model_version = Column(String, nullable=True, index=True)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
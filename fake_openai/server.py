@@ -0,0 +1,241 @@
+"""
+Локальный OpenAI-совместимый сервер-заглушка для нагрузочных тестов и работы без сети.
+
+Отвечает на POST /v1/chat/completions (в том числе stream=True) заготовленными ответами по типу промпта,
+с настраиваемой задержкой, долей ошибок 500 и ответами 429 (случайными или по лимиту запросов в минуту).
+GET /stats — счётчики запросов и пиковое число одновременных запросов.
+
+Запуск из корня проекта:
+    python -m fake_openai.server --port 8800 --latency lognormal:0.8,0.5 --error-rate 0.02 --rpm 300
+Бот и скрипты направляются на заглушку через OPENAI_BASE_URL=http://127.0.0.1:8800/v1
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import uuid
+from collections import deque
+from string import Template
+from typing import Callable
+
+from aiohttp import web
+
+# Заготовленные ответы по типу промпта: (тип, регулярное выражение, ответ).
+# Ответ — строка-шаблон ($имя подставляет именованную группу) или функция от найденного совпадения.
+DEFAULT_REPLIES = [
+    ("classify", r"классификации пользовательских запросов", '{"action_type": "view", "entity_type": "company"}'),
+    ("company", r"Извлеки данные о компании из следующей информации:\s*(?P<name>[^\n]{0,60})",
+     lambda match: json.dumps({"company_name": match["name"].strip(), "industry": "Не указано",
+                               "description": match["name"].strip()}, ensure_ascii=False)),
+    ("map_columns", r"Пользователь загрузил таблицу со следующими колонками: (?P<columns>[^\n]*)\.",
+     lambda match: json.dumps({column.strip(): None for column in match["columns"].split(",")}, ensure_ascii=False)),
+    ("draft_cluster", r"Профиль сегмента",
+     json.dumps({"variants": [{"subject": "Предложение для [company_name]",
+                               "text": f"Здравствуйте, [director_name]! Вариант {number} для [company_name], [region]."}
+                              for number in (1, 2, 3)]}, ensure_ascii=False)),
+    ("draft", r"- Название: (?P<company>[^\n]*)",
+     lambda match: json.dumps({"subject": f"Предложение для {match['company']}",
+                               "text": f"Здравствуйте! Пишем компании {match['company']} с предложением."},
+                              ensure_ascii=False)),
+    ("segment", r"таблицу сегментации", '{"filters": {"region": "Москва"}}'),
+    ("template", r"Сгенерируй текст письма|редактор email-рассылок", "Здравствуйте! Предлагаем обсудить сотрудничество."),
+]
+DEFAULT_REPLY = "Ответ тестового сервера."
+
+FAKE_OPENAI_KEY = web.AppKey("fake_openai", object)
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Разбирает распределение задержки ответа.
+
+    :param spec: "fixed:0.5", "uniform:0.2,1.5", "normal:0.8,0.2", "lognormal:<медиана>,<sigma>" или "exp:<среднее>".
+    :return: Функция, возвращающая задержку в секундах для генератора случайных чисел.
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value.strip()]
+    distributions = {
+        "fixed": (1, lambda rng: values[0]),
+        "uniform": (2, lambda rng: rng.uniform(values[0], values[1])),
+        "normal": (2, lambda rng: max(0.0, rng.gauss(values[0], values[1]))),
+        "lognormal": (2, lambda rng: rng.lognormvariate(math.log(values[0]), values[1])),
+        "exp": (1, lambda rng: rng.expovariate(1 / values[0])),
+    }
+    if kind not in distributions or len(values) != distributions[kind][0]:
+        raise ValueError(f"Некорректное распределение задержки: {spec}")
+    return distributions[kind][1]
+
+
+def load_replies(path: str | None) -> list:
+    """
+    Загружает правила ответов из JSON-файла (список {"type", "match", "reply"}) перед встроенными правилами.
+
+    :param path: Путь к файлу или None.
+    :return: Список скомпилированных правил (тип, regex, ответ).
+    """
+    rules = []
+    if path:
+        with open(path, encoding="utf-8") as file:
+            for rule in json.load(file):
+                reply = rule["reply"]
+                if not isinstance(reply, str):
+                    reply = json.dumps(reply, ensure_ascii=False)
+                rules.append((rule.get("type", "custom"), rule["match"], reply))
+    return [(kind, re.compile(pattern, re.S), reply) for kind, pattern, reply in rules + DEFAULT_REPLIES]
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class FakeOpenAI:
+    """
+    Состояние заглушки: правила ответов, задержка, вероятности ошибок, лимит запросов и статистика.
+    """
+
+    def __init__(self, latency: str = "fixed:0", error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 rpm: int = 0, replies: str | None = None, seed: int | None = None):
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self.rules = load_replies(replies)
+        self.rng = random.Random(seed)
+        self._window = deque()
+        self.in_flight = 0
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0, "max_in_flight": 0, "by_type": {}}
+
+    def match_reply(self, prompt: str) -> tuple[str, str]:
+        """ Подбирает ответ по тексту промпта: (тип промпта, текст ответа). """
+        for kind, pattern, reply in self.rules:
+            match = pattern.search(prompt)
+            if match:
+                content = reply(match) if callable(reply) else Template(reply).safe_substitute(match.groupdict())
+                return kind, content
+        return "default", DEFAULT_REPLY
+
+    def is_rate_limited(self) -> bool:
+        now = time.monotonic()
+        if self.rpm:
+            while self._window and now - self._window[0] > 60:
+                self._window.popleft()
+            if len(self._window) >= self.rpm:
+                return True
+            self._window.append(now)
+        return self.rng.random() < self.rate_limit_rate
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.stats["requests"] += 1
+
+        if self.is_rate_limited():
+            self.stats["rate_limited"] += 1
+            return _error_response(429, "rate_limit_exceeded", "Rate limit reached (fake server).",
+                                   headers={"Retry-After": "1"})
+
+        self.in_flight += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+        try:
+            await asyncio.sleep(self.latency(self.rng))
+            if self.rng.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return _error_response(500, "server_error", "Internal error (fake server).")
+
+            prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+            kind, content = self.match_reply(prompt)
+            self.stats["ok"] += 1
+            self.stats["by_type"][kind] = self.stats["by_type"].get(kind, 0) + 1
+
+            model = body.get("model", "gpt-3.5-turbo")
+            usage = {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": estimate_tokens(content)}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            if body.get("stream"):
+                include_usage = (body.get("stream_options") or {}).get("include_usage")
+                return await _stream_response(request, model, content, usage if include_usage else None)
+            return web.json_response({
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+        finally:
+            self.in_flight -= 1
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.stats, "in_flight": self.in_flight})
+
+    async def list_models(self, request: web.Request) -> web.Response:
+        models = ["gpt-3.5-turbo", "gpt-4", "gpt-4o", "gpt-4o-mini"]
+        return web.json_response({"object": "list", "data": [{"id": model, "object": "model"} for model in models]})
+
+
+def _error_response(status: int, code: str, message: str, headers: dict | None = None) -> web.Response:
+    error = {"error": {"message": message, "type": code, "code": code, "param": None}}
+    return web.json_response(error, status=status, headers=headers)
+
+
+async def _stream_response(request: web.Request, model: str, content: str,
+                           usage: dict | None = None) -> web.StreamResponse:
+    """ Отдаёт ответ частями в формате server-sent events, как stream=True у OpenAI (usage — последним чанком). """
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    words = re.findall(r"\S+\s*", content) or [""]
+    for index, word in enumerate(words + [None]):
+        delta = {"content": word} if word is not None else {}
+        if index == 0:
+            delta["role"] = "assistant"
+        chunk = {
+            "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": None if word is not None else "stop"}],
+        }
+        await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+    if usage is not None:
+        chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                 "choices": [], "usage": usage}
+        await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+def create_app(fake: FakeOpenAI | None = None) -> web.Application:
+    """
+    Создаёт aiohttp-приложение заглушки.
+
+    :param fake: Настроенная заглушка (по умолчанию — без задержек и ошибок).
+    :return: web.Application.
+    """
+    fake = fake or FakeOpenAI()
+    app = web.Application()
+    app[FAKE_OPENAI_KEY] = fake
+    app.router.add_post("/v1/chat/completions", fake.chat_completions)
+    app.router.add_get("/v1/models", fake.list_models)
+    app.router.add_get("/stats", fake.get_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-совместимый сервер-заглушка")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", default="fixed:0", help="fixed:S | uniform:A,B | normal:M,SD | lognormal:MED,SIGMA | exp:M")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля случайных ответов 429")
+    parser.add_argument("--rpm", type=int, default=0, help="Лимит запросов в минуту (сверх него — 429)")
+    parser.add_argument("--replies", help="JSON-файл с дополнительными правилами ответов")
+    parser.add_argument("--seed", type=int, help="Зерно генератора (воспроизводимые задержки и ошибки)")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(args.latency, args.error_rate, args.rate_limit_rate, args.rpm, args.replies, args.seed)
+    web.run_app(create_app(fake), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import asyncio
+
 from aiogram.types import FSInputFile
 from sqlalchemy.sql import text
 from aiogram.filters import StateFilter
@@ -12,10 +14,15 @@ from aiogram import Router
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 
-from utils.segment_utils import extract_filters_from_text, apply_filters_to_email_table, generate_excel_from_df
+from utils.segment_utils import (
+    extract_filters_from_text, preview_segment, format_segment_preview, export_campaign_segment
+)
 
 router = Router()
 
+# Ссылки на фоновые выгрузки сегментов, чтобы задачи не были собраны сборщиком мусора до завершения
+_background_exports: set[asyncio.Task] = set()
+
 
 @router.message(StateFilter(None))
 async def handle_add_campaign(message: Message, state: FSMContext):
@@ -115,8 +122,8 @@ async def process_campaign_name(message: Message, state: FSMContext):
 @router.message(StateFilter(AddCampaignState.waiting_for_filters))
 async def process_filters(message: Message, state: FSMContext):
     """
-    Обрабатывает ввод фильтров сегментации с помощью модели, обновляет кампанию в БД
-    и генерирует Excel-таблицу с отфильтрованными email-лидами.
+    Обрабатывает ввод фильтров сегментации с помощью модели, обновляет кампанию в БД,
+    сразу показывает оценку размера и превью сегмента, а Excel-таблицу с лидами готовит в фоне.
     """
     user_input = message.text.strip()
     logger.info(f"🔹 Получен ввод от пользователя: {user_input}")
@@ -144,32 +151,40 @@ async def process_filters(message: Message, state: FSMContext):
             return
 
         with SessionLocal() as db:
-            # 🔹 Применяем фильтры
-            filtered_df = apply_filters_to_email_table(db, email_table_id, filters)
-            logger.info(f"🔹 Количество строк после фильтрации: {len(filtered_df)}")
+            # 🔹 Быстрая оценка сегмента: превью и приблизительный размер без полного чтения таблицы
+            segment = preview_segment(db, email_table_id, filters)
+            if segment is None:
+                await message.reply("❌ Ошибка: Кампания или email-таблица не найдена.")
+                return
 
-            if filtered_df.empty:
+            logger.info(f"🔹 Оценка сегмента: {segment['count']} (точно: {segment['exact']})")
+
+            if segment["preview"].empty:
                 logger.warning("⚠️ По заданным фильтрам не найдено ни одной записи.")
                 await message.reply("⚠️ По заданным фильтрам не найдено ни одной записи.")
                 return
 
-            # 🔹 Обновляем фильтры кампании в БД
-            update_status = update_campaign_filters(db, campaign_id, filters)
+            # 🔹 Обновляем фильтры кампании в БД (сегмент материализуется в фоне вместе с выгрузкой)
+            update_status = update_campaign_filters(db, campaign_id, filters, materialize=False)
             logger.info(f"🔹 Обновление фильтров в БД: {'Успешно' if update_status else 'Ошибка'}")
 
             if not update_status:
                 await message.reply("❌ Ошибка при обновлении фильтров кампании.")
                 return
 
-            # 🔹 Генерируем Excel-файл
-            excel_path = generate_excel_from_df(filtered_df, company_id, campaign_id)
-            logger.info(f"🔹 Excel-файл создан: {excel_path}")
+        count_text = str(segment["count"]) if segment["exact"] else f"≈{segment['count']}"
+        await message.reply(
+            f"🎯 Под фильтры подходит {count_text} лидов. Первые записи:\n\n"
+            f"{format_segment_preview(segment['preview'])}\n\n"
+            f"📂 Полную выгрузку пришлю отдельным файлом, как только она будет готова."
+        )
 
-        # 🔹 Отправляем файл пользователю
-        await message.reply_document(
-            FSInputFile(excel_path),
-            caption="📂 Готово! 📊 Сегментированная база для данной рекламной кампании подготовлена."
+        # 🔹 Точная выгрузка сегмента в Excel выполняется в фоне
+        task = asyncio.create_task(
+            send_segment_export(message, company_id, campaign_id, segment["table_name"])
         )
+        _background_exports.add(task)
+        task.add_done_callback(_background_exports.discard)
 
         # 🔹 Обновляем состояние с новыми фильтрами
         campaign_data["filters"] = filters
@@ -185,3 +200,21 @@ async def process_filters(message: Message, state: FSMContext):
         logger.error(f"❌ Ошибка обработки фильтров через модель: {e}", exc_info=True)
         await message.reply("❌ Произошла ошибка при обработке фильтров. Попробуйте ещё раз.")
 
+
+async def send_segment_export(message: Message, company_id: int, campaign_id: int, table_name: str):
+    """
+    Материализует сегмент кампании, выгружает его в Excel (в отдельном потоке) и отправляет файл пользователю.
+    """
+    try:
+        excel_path, count = await asyncio.to_thread(export_campaign_segment, company_id, campaign_id, table_name)
+        if not excel_path:
+            await message.reply("❌ Не удалось подготовить выгрузку сегмента.")
+            return
+
+        await message.reply_document(
+            FSInputFile(excel_path),
+            caption=f"📂 Готово! 📊 Сегментированная база для данной рекламной кампании подготовлена: {count} лидов."
+        )
+    except Exception as e:
+        logger.error(f"❌ Ошибка фоновой выгрузки сегмента кампании {campaign_id}: {e}", exc_info=True)
+        await message.reply("❌ Не удалось подготовить выгрузку сегмента.")
@@ -7,12 +7,13 @@ from aiogram.fsm.context import FSMContext
 
 from sqlalchemy.orm import Session
 
-from classifier import extract_company_data, client
+from classifier import extract_company_data
 from db.models import CompanyInfo
 from promts.company_promt import generate_edit_company_prompt
 from states.states import AddCompanyState, BaseState, EditCompanyState
 from logger import logger
 from db.db import SessionLocal
+from utils.llm_router import TASK_EDIT, route_chat_completion
 from utils.utils import process_message
 from db.db_company import (save_company_info,
                            get_company_by_chat_id,)
@@ -175,8 +176,9 @@ async def process_edit_company_information(message: Message, state: FSMContext):
 
         # Генерируем промт и отправляем запрос к модели
         prompt = generate_edit_company_prompt(current_info, new_info)
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+        response = route_chat_completion(
+            TASK_EDIT,
+            "edit_company",
             messages=[{"role": "user", "content": prompt}]
         )
         updated_info = response.choices[0].message.content.strip()
@@ -1,4 +1,3 @@
-import json
 from aiogram.filters import StateFilter
 from aiogram import Router
 from aiogram.types import Message
@@ -10,7 +9,9 @@ from db.models import User, Campaigns, Company, ChatThread
 from handlers.template_handlers.template_handler import add_template
 from states.states import AddContentPlanState
 from logger import logger
-from utils.utils import send_to_model  # Функция для отправки текста в модель # Импортируем первую функцию модуля шаблонов
+from utils.llm_router import TASK_EXTRACT
+from promts.output_schemas import AudienceStyle
+from utils.structured_output import StructuredOutputError, request_structured
 from datetime import datetime, date
 
 
@@ -141,14 +142,12 @@ async def process_audience_style(message: Message, state: FSMContext):
 
     logger.debug(f"Отправляем запрос в модель с prompt: {prompt}")
 
-    response = send_to_model(prompt)
-
     try:
-        logger.debug(f"Ответ модели: {response}")
+        model_data = request_structured(TASK_EXTRACT, "audience_style", prompt, AudienceStyle, cacheable=True)
+        logger.debug(f"Ответ модели: {model_data}")
 
-        model_data = json.loads(response)
-        audience = model_data.get("audience", "").strip()
-        style = model_data.get("style", "").strip()
+        audience = model_data.audience.strip()
+        style = model_data.style.strip()
 
         if not audience or not style:
             logger.warning("Модель вернула пустые значения. Повторный ввод.")
@@ -165,7 +164,7 @@ async def process_audience_style(message: Message, state: FSMContext):
         await state.set_state(AddContentPlanState.waiting_for_send_date)
        # await state.set_state(AddContentPlanState.waiting_for_wave_name)
 
-    except json.JSONDecodeError as e:
+    except StructuredOutputError as e:
         logger.error(f"Ошибка обработки данных от модели: {e}", exc_info=True)
         await message.reply("Произошла ошибка при анализе ответа. Попробуйте ещё раз.")
 
@@ -1,24 +1,40 @@
-import json
-
 import asyncio
+import random
+import time
+
 import pandas as pd
 from sqlalchemy.orm import Session
 
+from config import DRAFT_CLUSTER_MIN_SIZE, DRAFT_CLUSTER_VARIANTS
 from db import db
+from db.db_draft import save_drafts
+from db.db_usage import pause_wave, resume_wave
 from db.models import Templates, ContentPlan, Waves, Company
 from logger import logger
-from promts.draft_promts import EMAIL_GENERATION_PROMPT, FORBIDDEN_WORDS
+from promts.draft_promts import CLUSTER_EMAIL_GENERATION_PROMPT, EMAIL_GENERATION_PROMPT, FORBIDDEN_WORDS
+from promts.output_schemas import DraftEmail, DraftVariants
+from utils.draft_clusters import cluster_leads, describe_profile, personalize_drafts, use_clustered_generation
 from utils.google_doc import append_drafts_to_sheet
-from utils.utils import send_to_model
+from utils.llm_guard import PRIORITY_BULK, llm_priority, run_llm_in_thread
+from utils.llm_router import TASK_GENERATE, get_route
+from utils.metrics import DRAFT_BATCH_LATENCY, DRAFTS_GENERATED
+from utils.structured_output import StructuredOutputError, request_structured
+from utils.usage import ESTIMATE_SAMPLE_LEADS, check_budget, estimate_draft_usage, usage_context
+
+# Пауза перед первой повторной попыткой генерации письма (секунды), дальше удваивается
+DRAFT_RETRY_BACKOFF = 2
+# Сколько сегментов волны генерируется одновременно (между партиями проверяется бюджет)
+CLUSTER_BATCH_SIZE = 10
 
 
 async def generate_drafts_for_wave(db_session, df, wave_id):
     """
-    Генерация черновиков для волны и сохранение в Google Таблицу.
+    Генерация черновиков для волны, сохранение в таблицу drafts (очередь отправки) и в Google Таблицу.
 
     :param db_session: Сессия БД.
     :param df: DataFrame с лидами.
     :param wave_id: ID волны рассылки.
+    :return: Количество сохранённых черновиков.
     """
     logger.info(f"🚀 Запуск генерации черновиков для волны ID {wave_id}")
 
@@ -42,31 +58,242 @@ async def generate_drafts_for_wave(db_session, df, wave_id):
         logger.error(f"❌ Нет шаблона для волны ID {wave.wave_id}. Пропускаем.")
         return
 
-    content_plan = db_session.query(ContentPlan).filter_by(content_plan_id=wave.content_plan_id).first()
-    description = content_plan.description if content_plan else "Описание отсутствует"
+    description = get_wave_description(db_session, wave)
     email_subject = wave.subject
 
+    # Большие волны: запросы к модели по сегментам похожих лидов, а не по каждому лиду
+    if use_clustered_generation(len(df)):
+        return await generate_clustered_drafts(db_session, wave, company, template, description, df)
+
+    # Предварительная оценка: волна, которая не укладывается в бюджет компании, не начинается
+    tokens_per_lead, cost_per_lead = estimate_lead_usage(db_session, wave, template, description, df)
+    if not check_wave_budget(db_session, wave, tokens_per_lead * len(df), cost_per_lead * len(df)):
+        return 0
+
     batch_size = 50
     leads_batches = [df[i:i + batch_size] for i in range(0, len(df), batch_size)]
     logger.info(f"📦 Разбивка данных: {len(leads_batches)} партий по {batch_size} лидов")
 
-    for batch_num, batch in enumerate(leads_batches, start=1):
-        logger.info(f"⚙️ Обработка партии {batch_num} из {len(leads_batches)}")
+    saved_count = 0
+
+    # Потребление LLM учитывается на компанию, кампанию и волну; при перегрузке модели генерация ждёт, а не получает отказ
+    with usage_context(company_id=wave.company_id, campaign_id=wave.campaign_id, wave_id=wave.wave_id), \
+            llm_priority(PRIORITY_BULK):
+        for batch_num, batch in enumerate(leads_batches, start=1):
+            logger.info(f"⚙️ Обработка партии {batch_num} из {len(leads_batches)}")
+
+            # Оценка могла оказаться заниженной: проверяем бюджет перед каждой партией и останавливаемся между ними
+            reason = check_budget(db_session, wave.company_id, tokens_per_lead * len(batch), cost_per_lead * len(batch))
+            if reason:
+                pause_wave(db_session, wave.wave_id, reason)
+                logger.warning(f"⏸️ Волна ID {wave.wave_id} остановлена после {batch_num - 1} партий: {reason}")
+                break
+
+            tasks = [
+                generate_draft_for_lead(template, lead, email_subject, wave.wave_id, description)
+                for _, lead in batch.iterrows()
+            ]
+
+            batch_start = time.perf_counter()
+            results = await asyncio.gather(*tasks)
+            DRAFT_BATCH_LATENCY.observe(time.perf_counter() - batch_start)
+            successful_drafts = [res for res in results if res]
+            DRAFTS_GENERATED.labels("generated").inc(len(successful_drafts))
+            DRAFTS_GENERATED.labels("failed").inc(len(results) - len(successful_drafts))
+
+            if successful_drafts:
+                logger.info(f"✅ Успешно сгенерировано {len(successful_drafts)} черновиков. Отправляем в Google Sheets.")
+                saved_count += save_drafts(db_session, wave.company_id, successful_drafts)
+                logger.info(f"✅ Успешно добавлено {len(successful_drafts)} черновиков в Google Таблицу.")
+                append_drafts_to_sheet(company.google_sheet_url, company.google_sheet_name, successful_drafts)
+            else:
+                logger.warning("⚠️ Ни один черновик не был успешно создан в этой партии.")
+
+    return saved_count
+
+
+def check_wave_budget(db_session, wave, tokens: int, cost: float) -> bool:
+    """
+    Предварительная проверка бюджета: волна, которая не укладывается в лимиты компании, останавливается
+    до начала генерации; остановленная ранее волна возобновляется, если бюджет позволяет.
+
+    :param db_session: Сессия БД.
+    :param wave: Волна.
+    :param tokens: Оценка токенов генерации волны.
+    :param cost: Оценка стоимости генерации волны (USD).
+    :return: True, если генерацию можно начинать.
+    """
+    logger.info(f"💰 Оценка волны ID {wave.wave_id}: ~{tokens} токенов, ~${cost:.2f}")
+    reason = check_budget(db_session, wave.company_id, tokens, cost)
+    if reason:
+        pause_wave(db_session, wave.wave_id, reason)
+        logger.warning(f"⏸️ Волна ID {wave.wave_id} остановлена: {reason}")
+        return False
+    if wave.paused_at:
+        resume_wave(db_session, wave.wave_id)
+        logger.info(f"▶️ Волна ID {wave.wave_id} возобновлена: бюджет позволяет.")
+    return True
+
+
+async def generate_clustered_drafts(db_session, wave, company, template, description: str, df) -> int:
+    """
+    Генерация черновиков по сегментам: лиды группируются по виду деятельности, региону и размеру компании,
+    на сегмент модель пишет DRAFT_CLUSTER_VARIANTS вариантов с плейсхолдерами, а данные каждого лида
+    подставляются локально. Число запросов к модели растёт с числом сегментов, а не лидов.
+
+    :param db_session: Сессия БД.
+    :param wave: Волна.
+    :param company: Компания волны.
+    :param template: Шаблон письма.
+    :param description: Описание контент-плана.
+    :param df: DataFrame с лидами.
+    :return: Количество сохранённых черновиков.
+    """
+    clusters = cluster_leads(df, DRAFT_CLUSTER_MIN_SIZE)
+    prompts = [build_cluster_prompt(template, profile, leads, description) for profile, leads in clusters]
+    logger.info(f"🧩 Волна ID {wave.wave_id}: {len(df)} лидов в {len(clusters)} сегментах")
+
+    tokens_per_cluster, cost_per_cluster = estimate_cluster_usage(db_session, wave, prompts)
+    if not check_wave_budget(db_session, wave, tokens_per_cluster * len(clusters), cost_per_cluster * len(clusters)):
+        return 0
+
+    saved_count = 0
+    with usage_context(company_id=wave.company_id, campaign_id=wave.campaign_id, wave_id=wave.wave_id), \
+            llm_priority(PRIORITY_BULK):
+        for start in range(0, len(clusters), CLUSTER_BATCH_SIZE):
+            batch = clusters[start:start + CLUSTER_BATCH_SIZE]
+            reason = check_budget(db_session, wave.company_id, tokens_per_cluster * len(batch),
+                                  cost_per_cluster * len(batch))
+            if reason:
+                pause_wave(db_session, wave.wave_id, reason)
+                logger.warning(f"⏸️ Волна ID {wave.wave_id} остановлена после {start} сегментов: {reason}")
+                break
+
+            batch_start = time.perf_counter()
+            results = await asyncio.gather(*(
+                request_draft(prompt, DraftVariants, "draft_cluster", f"сегмента {profile}")
+                for (profile, _), prompt in zip(batch, prompts[start:start + CLUSTER_BATCH_SIZE])
+            ))
+            DRAFT_BATCH_LATENCY.observe(time.perf_counter() - batch_start)
+
+            drafts, failed = [], 0
+            for (_, leads), result in zip(batch, results):
+                if result is None:
+                    failed += len(leads)
+                    continue
+                drafts.extend(personalize_drafts(leads, result.variants, wave.wave_id))
+            DRAFTS_GENERATED.labels("generated").inc(len(drafts))
+            DRAFTS_GENERATED.labels("failed").inc(failed)
+
+            if drafts:
+                saved_count += save_drafts(db_session, wave.company_id, drafts)
+                append_drafts_to_sheet(company.google_sheet_url, company.google_sheet_name, drafts)
+                logger.info(f"✅ Сегменты {start + 1}–{start + len(batch)}: {len(drafts)} черновиков.")
+
+    return saved_count
+
+
+def build_draft_prompt(template, lead_data, description: str) -> str:
+    """
+    Собирает промпт генерации письма для лида.
+
+    :param template: Шаблон письма.
+    :param lead_data: Данные лида (dict или строка DataFrame).
+    :param description: Описание контентного плана.
+    :return: Промпт для модели.
+    """
+    return EMAIL_GENERATION_PROMPT.format(
+        template_content=template.template_content,
+        company_name=lead_data.get("name", "Клиент"),
+        region=lead_data.get("region", "не указан"),
+        map_registry=lead_data.get("map_registry", "не указано"),
+        director_name=lead_data.get("director_name", "не указан"),
+        director_position=lead_data.get("director_position", "не указана"),
+        phone_number=lead_data.get("phone_number", "не указан"),
+        website=lead_data.get("website", "не указан"),
+        primary_activity=lead_data.get("primary_activity", "не указана"),
+        revenue=lead_data.get("revenue", "не указана"),
+        employee_count=lead_data.get("employee_count", "не указано"),
+        branch_count=lead_data.get("branch_count", "не указано"),
+        description=description,
+        forbidden_words=", ".join(FORBIDDEN_WORDS)
+    )
+
+
+def build_cluster_prompt(template, profile: dict, leads, description: str) -> str:
+    """
+    Собирает промпт генерации вариантов письма для сегмента лидов.
+
+    :param template: Шаблон письма.
+    :param profile: Профиль сегмента (cluster_leads).
+    :param leads: Лиды сегмента.
+    :param description: Описание контентного плана.
+    :return: Промпт для модели.
+    """
+    return CLUSTER_EMAIL_GENERATION_PROMPT.format(
+        template_content=template.template_content,
+        description=description,
+        variants=DRAFT_CLUSTER_VARIANTS,
+        forbidden_words=", ".join(FORBIDDEN_WORDS),
+        **describe_profile(profile, leads),
+    )
+
 
-        tasks = [
-            generate_draft_for_lead(template, lead, email_subject, wave.wave_id, description)
-            for _, lead in batch.iterrows()
-        ]
+def estimate_lead_usage(db_session, wave, template, description: str, df) -> tuple[int, float]:
+    """
+    Оценивает токены и стоимость генерации письма на одного лида волны по выборке лидов.
 
-        results = await asyncio.gather(*tasks)
-        successful_drafts = [res for res in results if res]
+    :param db_session: Сессия БД.
+    :param wave: Волна.
+    :param template: Шаблон письма.
+    :param description: Описание контент-плана.
+    :param df: DataFrame с лидами.
+    :return: (токенов на лида, USD на лида).
+    """
+    prompts = [build_draft_prompt(template, lead, description) for _, lead in df.head(ESTIMATE_SAMPLE_LEADS).iterrows()]
+    return estimate_draft_usage(db_session, wave.company_id, prompts, get_route(TASK_GENERATE)[0][0])
 
-        if successful_drafts:
-            logger.info(f"✅ Успешно сгенерировано {len(successful_drafts)} черновиков. Отправляем в Google Sheets.")
-            logger.info(f"✅ Успешно добавлено {len(successful_drafts)} черновиков в Google Таблицу.")
-            append_drafts_to_sheet(company.google_sheet_url, company.google_sheet_name, successful_drafts)
-        else:
-            logger.warning("⚠️ Ни один черновик не был успешно создан в этой партии.")
+
+def estimate_cluster_usage(db_session, wave, prompts: list[str]) -> tuple[int, float]:
+    """
+    Оценивает токены и стоимость генерации вариантов письма на один сегмент волны по выборке промптов.
+
+    :param db_session: Сессия БД.
+    :param wave: Волна.
+    :param prompts: Промпты сегментов (build_cluster_prompt).
+    :return: (токенов на сегмент, USD на сегмент).
+    """
+    return estimate_draft_usage(
+        db_session, wave.company_id, prompts[:ESTIMATE_SAMPLE_LEADS], get_route(TASK_GENERATE)[0][0],
+        operation="draft_cluster", variants=DRAFT_CLUSTER_VARIANTS,
+    )
+
+
+def estimate_wave_usage(db_session, wave, template, description: str, df) -> tuple[int, float]:
+    """
+    Оценивает токены и стоимость генерации черновиков всей волны тем же способом, каким волна будет
+    сгенерирована: по сегментам для больших волн, по лидам для остальных.
+
+    :param db_session: Сессия БД.
+    :param wave: Волна.
+    :param template: Шаблон письма.
+    :param description: Описание контент-плана.
+    :param df: DataFrame с лидами.
+    :return: (токенов на волну, USD на волну).
+    """
+    if use_clustered_generation(len(df)):
+        clusters = cluster_leads(df, DRAFT_CLUSTER_MIN_SIZE)
+        prompts = [build_cluster_prompt(template, profile, leads, description) for profile, leads in clusters]
+        tokens_per_cluster, cost_per_cluster = estimate_cluster_usage(db_session, wave, prompts)
+        return tokens_per_cluster * len(clusters), cost_per_cluster * len(clusters)
+    tokens_per_lead, cost_per_lead = estimate_lead_usage(db_session, wave, template, description, df)
+    return tokens_per_lead * len(df), cost_per_lead * len(df)
+
+
+def get_wave_description(db_session, wave) -> str:
+    """ Описание контент-плана волны для промпта. """
+    content_plan = db_session.query(ContentPlan).filter_by(content_plan_id=wave.content_plan_id).first()
+    return content_plan.description if content_plan else "Описание отсутствует"
 
 
 async def generate_draft_for_lead(template, lead_data, subject, wave_id, description):
@@ -83,63 +310,49 @@ async def generate_draft_for_lead(template, lead_data, subject, wave_id, descrip
     lead_id = lead_data.get("id")
     email = lead_data.get("email")
     company_name = lead_data.get("name", "Клиент")
-    region = lead_data.get("region", "не указан")
-    map_registry = lead_data.get("map_registry", "не указано")
-    director_name = lead_data.get("director_name", "не указан")
-    director_position = lead_data.get("director_position", "не указана")
-    phone_number = lead_data.get("phone_number", "не указан")
-    website = lead_data.get("website", "не указан")
-    primary_activity = lead_data.get("primary_activity", "не указана")
-    revenue = lead_data.get("revenue", "не указана")
-    employee_count = lead_data.get("employee_count", "не указано")
-    branch_count = lead_data.get("branch_count", "не указано")
 
     logger.info(f"📝 Генерируем черновик для {company_name} (lead_id={lead_id})...")
 
     # Формируем промпт с подставленными данными
-    prompt = EMAIL_GENERATION_PROMPT.format(
-        template_content=template.template_content,
-        company_name=company_name,
-        region=region,
-        map_registry=map_registry,
-        director_name=director_name,
-        director_position=director_position,
-        phone_number=phone_number,
-        website=website,
-        primary_activity=primary_activity,
-        revenue=revenue,
-        employee_count=employee_count,
-        branch_count=branch_count,
-        description=description,
-        forbidden_words=", ".join(FORBIDDEN_WORDS)
-    )
+    prompt = build_draft_prompt(template, lead_data, description)
 
-    # Попытки генерации черновика (3 раза)
-    for attempt in range(3):
-        try:
-            response = send_to_model(prompt)
-            if not response:
-                raise ValueError("Ответ от модели пуст")
-
-            # Парсим JSON, который вернула модель
-            generated_data = json.loads(response)
-
-            if "subject" not in generated_data or "text" not in generated_data:
-                raise ValueError("Ответ модели не содержит subject или text")
-
-            break  # Успешная генерация — выходим из цикла
-        except Exception as e:
-            logger.warning(f"⚠️ Попытка {attempt + 1}: Ошибка генерации для lead_id={lead_id}: {e}")
-            if attempt == 2:
-                logger.error(f"❌ Не удалось сгенерировать письмо для lead_id={lead_id}", exc_info=True)
-                return None
-            await asyncio.sleep(2)  # Подождать перед повторной попыткой
+    generated_data = await request_draft(prompt, DraftEmail, "draft", f"lead_id={lead_id}")
+    if generated_data is None:
+        return None
 
     return {
         "wave_id": wave_id,
         "lead_id": lead_id,
         "email": email,
         "company_name": company_name,
-        "subject": generated_data["subject"],
-        "text": generated_data["text"]
-    }
\ No newline at end of file
+        "subject": generated_data.subject,
+        "text": generated_data.text
+    }
+
+
+async def request_draft(prompt: str, schema, operation: str, target: str):
+    """
+    Запрос письма (или вариантов письма) у модели генерации.
+
+    :param prompt: Промпт.
+    :param schema: Схема ответа (DraftEmail, DraftVariants).
+    :param operation: Операция для метрик.
+    :param target: Для кого письмо (для логов).
+    :return: Разобранный ответ или None, если сгенерировать не удалось.
+    """
+    # Попытки генерации (3 раза): повторяем только сбои API — неверный JSON исправляется
+    # локально или одним уточняющим запросом внутри request_structured. Запрос выполняется в пуле потоков LLM,
+    # поэтому письма партии генерируются параллельно в пределах адаптивного лимита модели
+    for attempt in range(3):
+        try:
+            return await run_llm_in_thread(request_structured, TASK_GENERATE, operation, prompt, schema)
+        except StructuredOutputError as e:
+            logger.error(f"❌ Не удалось сгенерировать письмо для {target}: {e}")
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ Попытка {attempt + 1}: Ошибка генерации для {target}: {e}")
+            if attempt == 2:
+                logger.error(f"❌ Не удалось сгенерировать письмо для {target}", exc_info=True)
+                return None
+            # Экспоненциальная пауза со случайной добавкой, чтобы повторы партии не приходили к модели разом
+            await asyncio.sleep(DRAFT_RETRY_BACKOFF * 2 ** attempt + random.uniform(0, DRAFT_RETRY_BACKOFF))
@@ -0,0 +1,94 @@
+import asyncio
+
+from aiogram import Router, types, F
+from aiogram.filters import Command
+from aiogram.types import CallbackQuery
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from db.db import SessionLocal
+from db.db_campaign import get_campaign_by_thread_id
+from db.db_draft import approve_wave_drafts, get_wave_delivery_stats
+from db.models import Waves
+from logger import logger
+from utils.email_sender import send_wave
+
+router = Router()
+
+# Ссылки на фоновые задачи отправки, чтобы их не собрал сборщик мусора
+_sending_tasks: set[asyncio.Task] = set()
+
+
+def format_delivery_stats(statuses: dict) -> str:
+    return ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items())) or "черновиков нет"
+
+
+@router.message(Command("send_wave"))
+async def choose_wave_to_send(message: types.Message):
+    """
+    Показывает волны кампании текущего топика для запуска отправки.
+    """
+    with SessionLocal() as db:
+        campaign = get_campaign_by_thread_id(db, message.message_thread_id)
+        if not campaign:
+            await message.reply("Кампания, связанная с этим чатом, не найдена.")
+            return
+
+        waves = db.query(Waves).filter_by(campaign_id=campaign.campaign_id).order_by(Waves.send_date).all()
+        if not waves:
+            await message.reply("В этой кампании нет волн рассылки.")
+            return
+
+        keyboard = InlineKeyboardBuilder()
+        for wave in waves:
+            statuses = get_wave_delivery_stats(db, wave.wave_id)
+            keyboard.row(types.InlineKeyboardButton(
+                text=f"{wave.send_date:%d.%m.%Y} — {wave.subject} ({sum(statuses.values())} писем)",
+                callback_data=f"send_wave:{wave.wave_id}"
+            ))
+
+    await message.reply("Выберите волну для отправки:", reply_markup=keyboard.as_markup())
+
+
+@router.callback_query(F.data.startswith("send_wave:"))
+async def start_wave_sending(callback: CallbackQuery):
+    """
+    Подтверждает черновики волны и запускает их отправку в фоне.
+    """
+    wave_id = int(callback.data.split(":")[1])
+
+    with SessionLocal() as db:
+        approved = approve_wave_drafts(db, wave_id)
+        statuses = get_wave_delivery_stats(db, wave_id)
+
+    if not statuses.get("approved"):
+        await callback.message.edit_text(
+            f"⚠️ В волне нет писем к отправке ({format_delivery_stats(statuses)})."
+        )
+        return
+
+    await callback.message.edit_text(
+        f"📤 Отправка волны запущена: {statuses['approved']} писем в очереди (подтверждено сейчас: {approved})."
+    )
+
+    task = asyncio.create_task(_send_wave_and_report(callback.message, wave_id))
+    _sending_tasks.add(task)
+    task.add_done_callback(_sending_tasks.discard)
+    await callback.answer()
+
+
+async def _send_wave_and_report(message: types.Message, wave_id: int):
+    try:
+        stats = await send_wave(wave_id)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при отправке волны ID {wave_id}: {e}", exc_info=True)
+        await message.answer("❌ Ошибка при отправке волны. Неотправленные письма остались в очереди.")
+        return
+
+    if not stats:
+        await message.answer("⚠️ Волна не отправлена: проверьте подключённые почтовые ящики.")
+        return
+
+    await message.answer(
+        f"✅ Отправка волны завершена. Отправлено: {stats['sent']}, ошибок: {stats['failed']}, "
+        f"осталось в очереди: {stats['requeued']}.\nИтого по волне: {format_delivery_stats(stats['statuses'])}."
+    )
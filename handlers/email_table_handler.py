@@ -67,21 +67,22 @@ async def handle_email_table_request(message: Message, state: FSMContext):
                 return
 
             company_id = company.company_id  # company.id должен быть целым числом
-            logger.debug(f"🔹 Найден company_id={company_id} для chat_id={chat_id}")
+            logger.debug("🔹 Найден company_id=%s для chat_id=%s", company_id, chat_id)
 
         segment_table_name = generate_segment_table_name(chat_id)
         if segment_table_name is None:
             logger.error("❌ Ошибка: segment_table_name не был сгенерирован!")
             return
 
-        logger.debug(f"📌 Сгенерированное имя таблицы: {segment_table_name}")
+        logger.debug("📌 Сгенерированное имя таблицы: %s", segment_table_name)
 
         # Сохранение состояния и данных
         await state.update_data(segment_table_name=segment_table_name)
         await state.set_state(EmailUploadState.waiting_for_file_upload)
 
-        logger.debug(f"Состояние установлено: {await state.get_state()}")
-        logger.debug(f"Сохранённые данные состояния: {await state.get_data()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Состояние установлено: %s", await state.get_state())
+            logger.debug("Сохранённые данные состояния: %s", await state.get_data())
 
         await message.reply(
             f"Для запуска рассылок мне нужна база адресов электронной почты.Пожалуйста, загрузите файл 📂 с емейлами в "
@@ -98,7 +99,8 @@ async def handle_file_upload(message: Message, state: FSMContext):
     """
     Обработчик загрузки таблицы с email-сегментацией.
     """
-    logger.debug(f"Получено сообщение. Текущее состояние: {await state.get_state()}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Получено сообщение. Текущее состояние: %s", await state.get_state())
     await message.reply(f"Начинаю обработку таблицы, это может занять некоторое время...")
 
     if not message.document:
@@ -131,7 +133,7 @@ async def handle_file_upload(message: Message, state: FSMContext):
         if not state_data.get("file_name"):
             logger.error("❌ Ошибка: file_name не был сохранён в FSMContext!")
         else:
-            logger.debug(f"✅ file_name сохранён: {state_data.get('file_name')}")
+            logger.debug("✅ file_name сохранён: %s", state_data.get('file_name'))
 
         # Получаем данные из state
         state_data = await state.get_data()
@@ -149,11 +151,11 @@ async def handle_file_upload(message: Message, state: FSMContext):
 
                 company_id = company.company_id
                 segment_table_name = generate_segment_table_name(company_id)
-                logger.debug(f"🔄 Повторное создание имени таблицы: {segment_table_name}")
+                logger.debug("🔄 Повторное создание имени таблицы: %s", segment_table_name)
 
             await state.update_data(segment_table_name=segment_table_name)
 
-        logger.debug(f"📌 Используемое имя таблицы: {segment_table_name}")
+        logger.debug("📌 Используемое имя таблицы: %s", segment_table_name)
 
         # Обрабатываем файл
         is_processed = await process_email_table(file_path, segment_table_name, message, state)
@@ -180,31 +182,35 @@ async def process_email_table(file_path: str, segment_table_name: str, message:
     """
     try:
         df = pd.read_excel(file_path)
-        logger.debug(f"📊 Исходные данные (первые 5 строк):\n{df.head()}")
+        logger.debug("📊 Исходные данные (первые 5 строк):\n%s", df.head())
 
         if df.empty:
             await message.reply("❌ Файл пуст или не содержит данных.")
             return False
 
         df = clean_dataframe(df)
-        logger.debug(f"📊 Данные после очистки (первые 5 строк):\n{df.head()}")
+        logger.debug("📊 Данные после очистки (первые 5 строк):\n%s", df.head())
 
         if df.empty:
             await message.reply("❌ Файл не содержит значимых данных после очистки. Проверьте его содержимое.")
             return False
 
         user_columns = df.columns.tolist()
-        logger.debug(f"📊 Колонки пользователя перед маппингом: {user_columns}")
+        logger.debug("📊 Колонки пользователя перед маппингом: %s", user_columns)
 
-        mapping = await map_columns(user_columns)
-        logger.debug(f"🎯 Полученный маппинг колонок: {mapping}")
+        with SessionLocal() as db:
+            company = get_company_by_chat_id(db, str(message.chat.id))
+            company_id = company.company_id if company else None
+
+        mapping = await map_columns(user_columns, company_id)
+        logger.debug("🎯 Полученный маппинг колонок: %s", mapping)
 
         if not mapping:
             await message.reply("❌ Не удалось сопоставить загруженные данные с фиксированными колонками.")
             return False
 
         df.rename(columns=mapping, inplace=True)
-        logger.debug(f"📊 Данные после маппинга (первые 5 строк):\n{df.head()}")
+        logger.debug("📊 Данные после маппинга (первые 5 строк):\n%s", df.head())
 
         state_data = await state.get_data()
         file_name = state_data.get("file_name")
@@ -214,12 +220,12 @@ async def process_email_table(file_path: str, segment_table_name: str, message:
             return False
 
         df["file_name"] = file_name  # ✅ Добавляем колонку с именем файла
-        logger.debug(f"📌 Добавлен file_name в DataFrame: {file_name}")
+        logger.debug("📌 Добавлен file_name в DataFrame: %s", file_name)
 
         # 🔹 Фильтруем: оставляем только строки, где email содержит "@"
         if "email" in df.columns:
             total_rows = len(df)
-            logger.debug(f"📊 Количество строк перед фильтрацией email: {total_rows}")
+            logger.debug("📊 Количество строк перед фильтрацией email: %s", total_rows)
 
             df = df[df["email"].astype(str).str.contains("@", na=False)]
             filtered_out_rows = total_rows - len(df)
@@ -233,7 +239,7 @@ async def process_email_table(file_path: str, segment_table_name: str, message:
 
         # 🔥 **Обрабатываем email и проверяем, есть ли дубликаты в ячейках**
         df, valid_emails, multi_email_count, multi_email_rows, problematic_values = clean_and_validate_emails(df)
-        logger.debug(f"📊 Данные после валидации email (первые 5 строк):\n{df.head()}")
+        logger.debug("📊 Данные после валидации email (первые 5 строк):\n%s", df.head())
 
         if valid_emails is None:
             await message.reply("❌ Ошибка: В загружаемой таблице не найдена колонка email.")
@@ -254,7 +260,8 @@ async def process_email_table(file_path: str, segment_table_name: str, message:
 
             # 🔥 **Меняем состояние FSM на ожидание решения пользователя**
             await state.set_state(EmailUploadState.duplicate_email_check)
-            logger.debug(f"📌 Установлено новое состояние: {await state.get_state()}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📌 Установлено новое состояние: %s", await state.get_state())
 
             # 🔥 **Отправляем пользователю кнопки выбора**
             await message.reply(
@@ -283,8 +290,8 @@ async def handle_email_choice_callback(call: CallbackQuery, state: FSMContext):
     Обрабатывает выбор пользователя: разделить email-адреса или запросить новый файл.
     """
     current_state = await state.get_state()
-    logger.debug(f"📌 Текущее состояние перед обработкой колбэка: {current_state}")
-    logger.debug(f"🎯 Получен колбек: {call.data}")
+    logger.debug("📌 Текущее состояние перед обработкой колбэка: %s", current_state)
+    logger.debug("🎯 Получен колбек: %s", call.data)
 
     choice = call.data
     data = await state.get_data()
@@ -306,7 +313,7 @@ async def handle_email_choice_callback(call: CallbackQuery, state: FSMContext):
         df = df[df[email_column] != ""]
 
         # **Логируем результат**
-        logger.debug(f"📊 Данные после разбиения email (первые 5 строк):\n{df.head()}")
+        logger.debug("📊 Данные после разбиения email (первые 5 строк):\n%s", df.head())
 
         # **Обновляем данные в FSM**
         await state.update_data(processing_df=df)
@@ -333,11 +340,11 @@ async def ask_about_more_files(message: Message, state: FSMContext):
     """
     Спрашивает пользователя, хочет ли он загрузить еще один файл.
     """
-    logger.debug(f"🔄 Устанавливаем состояние: {EmailProcessingDecisionState.waiting_for_more_files_decision}")
+    logger.debug("🔄 Устанавливаем состояние: %s", EmailProcessingDecisionState.waiting_for_more_files_decision)
     await state.set_state(EmailProcessingDecisionState.waiting_for_more_files_decision)
 
     current_state = await state.get_state()
-    logger.debug(f"✅ После паузы состояние: {current_state}")
+    logger.debug("✅ После паузы состояние: %s", current_state)
 
     await message.reply(
         "Вы хотите загрузить еще один файл с базой email?",
@@ -353,19 +360,21 @@ async def handle_first_question_decision(call: CallbackQuery, state: FSMContext)
     - "Нет" -> Переход ко второму вопросу про кампанию.
     """
     current_state = await state.get_state()
-    logger.debug(f"📌 Текущее состояние перед обработкой колбэка: {current_state}")
-    logger.debug(f"🎯 Получен колбек: {call.data}")
+    logger.debug("📌 Текущее состояние перед обработкой колбэка: %s", current_state)
+    logger.debug("🎯 Получен колбек: %s", call.data)
 
     if call.data == "load_more_files":
         logger.info("🔄 Пользователь выбрал загрузку еще одного файла.")
         await state.set_state(EmailUploadState.waiting_for_file_upload)
-        logger.debug(f"✅ Установлено новое состояние: {await state.get_state()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("✅ Установлено новое состояние: %s", await state.get_state())
         await call.message.edit_text("🔄 Пожалуйста, загрузите новый файл с email-базой.")
 
     elif call.data == "ask_campaign_question":
         logger.info("🔄 Пользователь отказался загружать файлы. Спрашиваем про кампанию.")
         await state.set_state(EmailProcessingDecisionState.waiting_for_campaign_decision)
-        logger.debug(f"✅ Установлено новое состояние: {await state.get_state()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("✅ Установлено новое состояние: %s", await state.get_state())
         await call.message.edit_text(
             "Вы готовы приступить к созданию рекламной кампании?",
             reply_markup=get_second_question_keyboard()
@@ -380,8 +389,8 @@ async def handle_second_question_decision(call: CallbackQuery, state: FSMContext
     - "Нет" -> Возвращение к загрузке файлов + сообщение пользователю.
     """
     current_state = await state.get_state()
-    logger.debug(f"📌 Текущее состояние перед обработкой колбэка: {current_state}")
-    logger.debug(f"🎯 Получен колбек: {call.data}")
+    logger.debug("📌 Текущее состояние перед обработкой колбэка: %s", current_state)
+    logger.debug("🎯 Получен колбек: %s", call.data)
 
     if call.data == "proceed_to_campaign":
         logger.info("🎯 Пользователь готов к созданию рекламной кампании.")
@@ -398,8 +407,9 @@ async def handle_campaign_decision(call: CallbackQuery, state: FSMContext):
     """
     Обрабатывает выбор пользователя: начинать кампанию или вернуться к загрузке файлов.
     """
-    logger.debug(f"📌 Текущее состояние перед обработкой кампании: {await state.get_state()}")
-    logger.debug(f"🎯 Получен колбек: {call.data}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📌 Текущее состояние перед обработкой кампании: %s", await state.get_state())
+    logger.debug("🎯 Получен колбек: %s", call.data)
 
     if call.data == "proceed_to_campaign":
         logger.info("🚀 Пользователь выбрал запуск кампании.")
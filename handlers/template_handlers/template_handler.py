@@ -13,12 +13,15 @@ from db.db_template import get_campaign_by_thread, get_company_by_id, get_conten
     get_waves_by_content_plan, get_wave_by_id, save_template, get_chat_thread_by_chat_id, \
     get_company_info_and_content_plan, get_content_plan_by_id
 from db.models import Templates, Waves, Company, CompanyInfo, ContentPlan, Campaigns, ChatThread
-from handlers.draft_handlers.draft_handler import generate_drafts_for_wave
+from handlers.draft_handlers.draft_handler import estimate_wave_usage, generate_drafts_for_wave, get_wave_description
 from promts.template_promt import generate_email_template_prompt
 from states.states import TemplateStates
 import logging
 
-from utils.utils import send_to_model
+from utils.company_context import get_company_context
+from utils.llm_router import TASK_GENERATE, stream_route_chat_completion
+from utils.telegram_stream import finish_stream_message, stream_to_message
+from utils.usage import check_budget, usage_context
 from utils.wave_shedulers import get_filtered_leads_for_wave
 
 logger = logging.getLogger(__name__)
@@ -258,15 +261,28 @@ async def handle_user_input(message: types.Message, state: FSMContext):
 
         logger.debug(f"[User {message.from_user.id}] Подготовленные данные для генерации: {company_details}")
 
-        # Генерируем промпт
-        prompt = generate_email_template_prompt(company_details)
+        # Генерируем промпт: сведения о компании сокращаются под бюджет токенов (и кэшируются до изменения брифа)
+        company_context = get_company_context(company_id, company_details, "template")
+        prompt = generate_email_template_prompt(company_details, company_context)
         logger.debug(f"[User {message.from_user.id}] Сгенерированный промпт: {prompt}")
 
-        # Отправляем запрос в модель
-        template_response = send_to_model(prompt)
+        # Отправляем запрос в модель и показываем шаблон по мере генерации, правя одно сообщение
+        chunks = stream_route_chat_completion(TASK_GENERATE, "template", [{"role": "user", "content": prompt}])
+        try:
+            with usage_context(company_id=company_id, wave_id=state_data.get("wave_id")):
+                template_response, reply = await stream_to_message(
+                    message, chunks, header="Сгенерированный шаблон:\n\n", placeholder="⏳ Генерирую шаблон...",
+                    error_text="Ошибка при генерации шаблона. Попробуйте позже."
+                )
+        except Exception as e:
+            # Сообщение с заглушкой уже заменено текстом ошибки в stream_to_message
+            logger.error(f"[User {message.from_user.id}] Ошибка при генерации шаблона: {e}", exc_info=True)
+            return
+
+        template_response = template_response.strip()
         if not template_response:
             logger.error(f"[User {message.from_user.id}] Ошибка при генерации шаблона.")
-            await message.reply("Ошибка при генерации шаблона. Попробуйте позже.")
+            await reply.edit_text("Ошибка при генерации шаблона. Попробуйте позже.")
             return
 
         await state.update_data(
@@ -275,8 +291,8 @@ async def handle_user_input(message: types.Message, state: FSMContext):
         )
         logger.info(f"[User {message.from_user.id}] Шаблон успешно сгенерирован.")
 
-        # Отправляем пользователю сгенерированный шаблон
-        await message.reply(f"Сгенерированный шаблон:\n\n{template_response}\n\nПодтвердите? (да/нет)")
+        # Итоговая правка: полный шаблон без курсора и вопрос о подтверждении
+        await finish_stream_message(reply, f"Сгенерированный шаблон:\n\n{template_response}\n\nПодтвердите? (да/нет)")
         await state.set_state(TemplateStates.waiting_for_confirmation)
 
     finally:
@@ -358,12 +374,28 @@ async def confirm_template(message: types.Message, state: FSMContext):
             await message.reply("⚠️ Ошибка: Нет лидов для данной волны. Проверьте настройки и попробуйте снова.")
             return
 
+        # Предварительная оценка стоимости волны и проверка месячного бюджета компании
+        template = db_session.query(Templates).filter_by(wave_id=wave_id).first()
+        tokens, cost = estimate_wave_usage(db_session, wave, template, get_wave_description(db_session, wave), df)
+        reason = check_budget(db_session, company_id, tokens, cost)
+        if reason:
+            await message.reply(f"⏸️ Генерация черновиков не запущена. {reason}.")
+            return
+        await message.reply(f"💰 Оценка: {len(df)} писем, ~{tokens} токенов, ~${cost:.2f}.")
+
         # Вызов функции генерации черновиков в фоновом режиме
             # Вызов функции генерации черновиков в фоновом режиме
         generated_drafts = await generate_drafts_for_wave(db_session, df, wave_id)
 
             # Проверяем, успешно ли сгенерировались черновики
-        if generated_drafts:
+        db_session.refresh(wave)
+        if wave.paused_at:
+            # Бюджет закончился до или во время генерации: остальные черновики догенерирует ежедневная задача
+            await message.reply(
+                f"⏸️ Генерация черновиков остановлена: {wave.pause_reason}. Сгенерировано: {generated_drafts or 0} "
+                f"из {len(df)}. Остальные черновики будут созданы автоматически, когда бюджет позволит."
+            )
+        elif generated_drafts:
             await message.reply("✅ Черновики успешно сгенерированы и добавлены в систему.")
         else:
             await message.reply("⚠️ Ошибка при генерации черновиков. Проверьте настройки и попробуйте снова.")
@@ -1,5 +1,142 @@
+import json
 import logging
+import threading
+import time
+
+from config import LOG_FORMAT, LOG_LEVEL, LOG_LEVELS
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Шумные библиотеки по умолчанию пишут только предупреждения (переопределяются через LOG_LEVELS)
+DEFAULT_MODULE_LEVELS = {
+    "aiogram.event": "INFO",
+    "aiosmtplib": "WARNING",
+    "aioimaplib": "WARNING",
+    "httpcore": "WARNING",
+    "httpx": "WARNING",
+    "openai": "WARNING",
+    "urllib3": "WARNING",
+    "asyncio": "WARNING",
+}
+
+# Атрибуты LogRecord, которые не относятся к пользовательским полям extra
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Форматирует запись в одну JSON-строку: время, уровень, логгер, сообщение, поля из extra и стек ошибки.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def parse_module_levels(value: str) -> dict[str, str]:
+    """
+    Разбирает строку уровней модулей "модуль=УРОВЕНЬ,модуль=УРОВЕНЬ".
+
+    :param value: Строка из LOG_LEVELS.
+    :return: Словарь {имя логгера: уровень}.
+    """
+    levels = {}
+    for item in value.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level: str = LOG_LEVEL, module_levels: str = LOG_LEVELS, log_format: str = LOG_FORMAT):
+    """
+    Настраивает корневой логгер: уровень, формат (text/json) и уровни отдельных модулей.
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    for name, module_level in {**DEFAULT_MODULE_LEVELS, **parse_module_levels(module_levels)}.items():
+        logging.getLogger(name).setLevel(module_level)
+
+
+class SampledLogger:
+    """
+    Канал для частых событий (построчная обработка, отдельные письма): пишет каждое every-е событие
+    и не больше per_second записей в секунду. Если уровень отключён, вызов стоит одной проверки —
+    сообщение не форматируется. В записи передаётся число пропущенных с прошлого вывода событий.
+    """
+
+    def __init__(self, logger: logging.Logger, every: int = 1, per_second: float = 10):
+        self.logger = logger
+        self.every = max(1, every)
+        self.per_second = per_second
+        self._seen = 0
+        self._suppressed = 0
+        self._tokens = per_second
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _allow(self) -> tuple[bool, int]:
+        with self._lock:
+            self._seen += 1
+            if self._seen % self.every:
+                self._suppressed += 1
+                return False, 0
+
+            now = time.monotonic()
+            self._tokens = min(self.per_second, self._tokens + (now - self._last) * self.per_second)
+            self._last = now
+            if self._tokens < 1:
+                self._suppressed += 1
+                return False, 0
+
+            self._tokens -= 1
+            suppressed, self._suppressed = self._suppressed, 0
+            return True, suppressed
+
+    def log(self, level: int, msg: str, *args, **kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+        allowed, suppressed = self._allow()
+        if allowed:
+            extra = kwargs.pop("extra", {})
+            self.logger.log(level, msg, *args, extra={**extra, "suppressed": suppressed}, stacklevel=3, **kwargs)
+
+    def debug(self, msg: str, *args, **kwargs):
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg: str, *args, **kwargs):
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+
+def get_sampled_logger(name: str, every: int = 1, per_second: float = 10) -> SampledLogger:
+    """
+    Возвращает канал с выборкой и ограничением частоты для частых событий модуля.
+
+    :param name: Имя логгера (обычно __name__).
+    :param every: Писать каждое every-е событие.
+    :param per_second: Не больше стольких записей в секунду.
+    :return: SampledLogger.
+    """
+    return SampledLogger(logging.getLogger(name), every=every, per_second=per_second)
+
 
 # Настройка логгера
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
\ No newline at end of file
+setup_logging()
+logger = logging.getLogger(__name__)
@@ -1,10 +1,15 @@
 import asyncio
+import multiprocessing
+
 from aiogram import Dispatcher
 from aiogram.filters import Command
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 from bot import bot
-from db.db import init_db
+from db.db import engine, init_db
 from db.migration_manager import apply_migrations
 from logger import logger
 from handlers.campaign_handlers.campaign_delete_handler import (
@@ -17,41 +22,180 @@ from admin.admin_commands import router as home_router
 from handlers.company_handlers.company_handlers import router as company_router
 from handlers.onboarding_handler import router as onboarding_router
 from handlers.template_handlers.template_handler import router as template_router
+from handlers.draft_handlers.draft_send_handler import router as draft_send_router
 from handlers.campaign_handlers.campaign_handlers import router as campaign_router
-from config import TARGET_CHAT_ID
-from utils.wave_shedulers import start_scheduler
-
-
-async def main():
-    # Логирование начала работы бота
-    logger.info("Запуск бота...")
-
-    # Применение миграций перед запуском
+from config import (
+    TARGET_CHAT_ID, EMAIL_LISTENER_ENABLED, BOT_MODE, FSM_STORAGE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBAPP_HOST, WEBAPP_PORT, WEB_WORKERS, METRICS_HOST, METRICS_PORT, LLM_BATCH_ENABLED
+)
+from utils.chat_queue import chat_queue
+from utils.email_listner import start_reply_listener
+from utils.email_sender import close_smtp_pools
+from utils.metrics import instrument_dispatcher, instrument_engine, start_metrics_server
+from utils.fsm_storage import PostgresStorage, UpdateDedupMiddleware, cleanup_processed_updates_loop
+from utils.draft_batches import draft_batch_loop
+from utils.llm_cache import llm_cache_cleanup_loop
+from utils.usage import UsageContextMiddleware, ledger, usage_flush_loop
+from utils.wave_shedulers import scheduler_loop, start_scheduler
+
+
+def prepare_database():
+    """ Применяет миграции перед запуском (один раз, до старта процессов-обработчиков). """
     logger.info("Применение миграций...")
     apply_migrations()
     logger.info("Миграции успешно применены.")
 
     init_db()
 
-    dp = Dispatcher(storage=MemoryStorage())
+
+def create_dispatcher(storage: BaseStorage) -> Dispatcher:
+    """
+    Создаёт диспетчер с маршрутизаторами и middleware.
+
+    :param storage: Хранилище FSM.
+    :return: Dispatcher.
+    """
+    dp = Dispatcher(storage=storage)
+
+    # Апдейты одного чата обрабатываются строго по очереди, разные чаты — параллельно
+    dp.message.outer_middleware(chat_queue)
+    dp.callback_query.outer_middleware(chat_queue)
+    # Запросы к LLM из хендлеров учитываются на компанию чата
+    dp.message.middleware(UsageContextMiddleware())
+    dp.callback_query.middleware(UsageContextMiddleware())
 
     # Настраиваем маршрутизаторы
     setup_routers(dp)
+    instrument_dispatcher(dp)
+    instrument_engine(engine)
     logger.info("Маршрутизаторы настроены.")
     logger.info(f"Целевой ID чата: {TARGET_CHAT_ID}")
+    return dp
+
+
+async def main():
+    # Логирование начала работы бота
+    logger.info("Запуск бота...")
+    prepare_database()
+
+    dp = create_dispatcher(PostgresStorage() if FSM_STORAGE == "postgres" else MemoryStorage())
+    start_metrics_server(METRICS_PORT, METRICS_HOST)
+
+    # Очистка кэша ответов LLM (устаревшие и вытесняемые по объёму записи)
+    asyncio.create_task(llm_cache_cleanup_loop())
+    asyncio.create_task(usage_flush_loop())
+
+    # Пакетная генерация черновиков для волн, запланированных на ближайшие дни
+    if LLM_BATCH_ENABLED:
+        asyncio.create_task(draft_batch_loop())
+        logger.info("📦 Пакетная генерация черновиков запущена.")
 
     #  Запускаем задачу для прослушивания почты (параллельно боту)
-    #asyncio.create_task(check_new_emails())
-    #logger.info("📧 Модуль прослушивания почты запущен.")
+    if EMAIL_LISTENER_ENABLED:
+        asyncio.create_task(start_reply_listener(bot))
+        logger.info("📧 Модуль прослушивания почты запущен.")
 
-    # Запускаем планировщик волн
-    #start_scheduler()
+    # Запускаем планировщик волн: генерация черновиков в день отправки и догенерация остановленных волн
+    start_scheduler()
 
     # Запуск поллинга
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await close_smtp_pools()
+        await asyncio.to_thread(ledger.flush)
     logger.info("Бот начал опрос сообщений.")
 
 
+async def set_webhook(dp: Dispatcher):
+    """ Регистрирует вебхук в Telegram (выполняет только процесс 0). """
+    await bot.set_webhook(
+        f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(f"🌐 Вебхук установлен: {WEBHOOK_BASE_URL}{WEBHOOK_PATH}")
+
+
+async def run_webhook_worker(worker_index: int):
+    """
+    Процесс-обработчик вебхука: aiohttp-приложение на общем порту, FSM в PostgreSQL,
+    повторные апдейты отсекаются по update_id.
+
+    :param worker_index: Номер процесса; вебхук и фоновые задачи (почта, очистка) регистрирует только процесс 0.
+    """
+    dp = create_dispatcher(PostgresStorage())
+    dp.update.outer_middleware(UpdateDedupMiddleware())
+    # У каждого процесса свой реестр метрик, поэтому и свой порт
+    start_metrics_server(METRICS_PORT and METRICS_PORT + worker_index, METRICS_HOST)
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT, reuse_port=WEB_WORKERS > 1).start()
+    logger.info(f"🚀 Обработчик вебхука #{worker_index} слушает {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+
+    # Учёт потребления LLM накапливается в каждом процессе отдельно
+    background_tasks = [asyncio.create_task(usage_flush_loop())]
+    if worker_index == 0:
+        await set_webhook(dp)
+        background_tasks.append(asyncio.create_task(cleanup_processed_updates_loop()))
+        background_tasks.append(asyncio.create_task(llm_cache_cleanup_loop()))
+        background_tasks.append(asyncio.create_task(scheduler_loop()))
+        if LLM_BATCH_ENABLED:
+            background_tasks.append(asyncio.create_task(draft_batch_loop()))
+        if EMAIL_LISTENER_ENABLED:
+            background_tasks.append(asyncio.create_task(start_reply_listener(bot)))
+            logger.info("📧 Модуль прослушивания почты запущен.")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await runner.cleanup()
+        await close_smtp_pools()
+        await asyncio.to_thread(ledger.flush)
+
+
+def run_webhook_worker_process(worker_index: int):
+    try:
+        asyncio.run(run_webhook_worker(worker_index))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_webhook():
+    """ Запуск в режиме вебхука: WEB_WORKERS процессов на одном порту за локальным reverse proxy. """
+    logger.info(f"Запуск бота в режиме webhook ({WEB_WORKERS} процессов)...")
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("Для режима webhook укажите WEBHOOK_BASE_URL")
+    prepare_database()
+
+    if WEB_WORKERS <= 1:
+        run_webhook_worker_process(0)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_webhook_worker_process, args=(index,), name=f"webhook-worker-{index}")
+        for index in range(WEB_WORKERS)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+
 def setup_routers(dp: Dispatcher):
     """
     Настраивает маршрутизаторы, подключая обработчики для чата с пользователями
@@ -62,6 +206,7 @@ def setup_routers(dp: Dispatcher):
     dp.include_router(company_router)
     dp.include_router(campaign_router)
     dp.include_router(template_router)
+    dp.include_router(draft_send_router)
     dp.include_router(email_router)
 
     # Регистрация маршрутизатора для онбординга
@@ -82,4 +227,7 @@ def setup_routers(dp: Dispatcher):
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if BOT_MODE == "webhook":
+        run_webhook()
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,16 @@
+-- intent_samples: классификации сообщений для обучения локальной модели и сравнения её с LLM.
+-- action_type/entity_type — ответ LLM (NULL, если сообщение классифицировала только локальная модель),
+-- predicted_* и confidence — ответ локальной модели версии model_version (NULL, если модели ещё нет)
+CREATE TABLE IF NOT EXISTS intent_samples (
+    sample_id SERIAL PRIMARY KEY,
+    text TEXT NOT NULL,
+    action_type VARCHAR,
+    entity_type VARCHAR,
+    predicted_action VARCHAR,
+    predicted_entity VARCHAR,
+    confidence DOUBLE PRECISION,
+    model_version VARCHAR,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_intent_samples_model_version ON intent_samples (model_version);
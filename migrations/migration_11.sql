@@ -0,0 +1,12 @@
+-- fsm_states.data: данные FSM хранятся в JSON вместо pickle (незавершённые диалоги при переходе сбрасываются)
+ALTER TABLE fsm_states DROP COLUMN IF EXISTS data;
+ALTER TABLE fsm_states ADD COLUMN IF NOT EXISTS data JSON;
+
+-- fsm_frames: таблицы (DataFrame) из данных FSM в JSON, данные FSM ссылаются на них по frame_id (хеш содержимого)
+CREATE TABLE IF NOT EXISTS fsm_frames (
+    fsm_key VARCHAR NOT NULL,
+    frame_id VARCHAR(64) NOT NULL,
+    payload TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    PRIMARY KEY (fsm_key, frame_id)
+);
@@ -0,0 +1,3 @@
+-- draft_batches: запись задания создаётся до отправки пакета провайдеру (статус pending), ID задания
+-- у провайдера появляется после отправки
+ALTER TABLE draft_batches ALTER COLUMN provider_batch_id DROP NOT NULL;
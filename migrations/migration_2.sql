@@ -0,0 +1,10 @@
+-- campaign_leads: материализованные сегменты кампаний (id лидов из email-таблицы)
+CREATE TABLE IF NOT EXISTS campaign_leads (
+    campaign_id INTEGER NOT NULL REFERENCES campaigns(campaign_id) ON DELETE CASCADE,
+    lead_id INTEGER NOT NULL,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    PRIMARY KEY (campaign_id, lead_id)
+);
+
+-- campaigns: время последней материализации сегмента
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS segment_refreshed_at TIMESTAMP;
@@ -0,0 +1,3 @@
+-- email_connections: позиция слушателя входящих писем (IMAP UIDVALIDITY и последний обработанный UID)
+ALTER TABLE email_connections ADD COLUMN IF NOT EXISTS uid_validity BIGINT;
+ALTER TABLE email_connections ADD COLUMN IF NOT EXISTS last_seen_uid BIGINT;
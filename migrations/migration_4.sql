@@ -0,0 +1,21 @@
+-- drafts: черновики писем по лидам волны и состояние их доставки
+CREATE TABLE IF NOT EXISTS drafts (
+    draft_id SERIAL PRIMARY KEY,
+    wave_id INTEGER NOT NULL REFERENCES waves(wave_id) ON DELETE CASCADE,
+    company_id INTEGER NOT NULL REFERENCES companies(company_id) ON DELETE CASCADE,
+    lead_id INTEGER NOT NULL,
+    email VARCHAR NOT NULL,
+    subject VARCHAR NOT NULL,
+    text TEXT NOT NULL,
+    status VARCHAR DEFAULT 'generated' NOT NULL,
+    attempts INTEGER DEFAULT 0 NOT NULL,
+    last_error TEXT,
+    message_id VARCHAR UNIQUE,
+    sender VARCHAR,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    sent_at TIMESTAMP,
+    CONSTRAINT uq_drafts_wave_lead UNIQUE (wave_id, lead_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_drafts_wave_id ON drafts (wave_id);
+CREATE INDEX IF NOT EXISTS ix_drafts_wave_status ON drafts (wave_id, status);
@@ -0,0 +1,15 @@
+-- column_mappings: кэш сопоставления колонок загружаемых таблиц (по компании и глобальный)
+CREATE TABLE IF NOT EXISTS column_mappings (
+    id SERIAL PRIMARY KEY,
+    company_id INTEGER REFERENCES companies(company_id) ON DELETE CASCADE,
+    header_signature VARCHAR(64) NOT NULL,
+    mapping JSON NOT NULL,
+    hits INTEGER DEFAULT 0 NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_column_mappings_company
+    ON column_mappings (company_id, header_signature) WHERE company_id IS NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_column_mappings_global
+    ON column_mappings (header_signature) WHERE company_id IS NULL;
@@ -0,0 +1,15 @@
+-- fsm_states: FSM-хранилище, общее для нескольких процессов бота (режим вебхука)
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key VARCHAR PRIMARY KEY,
+    state VARCHAR,
+    data BYTEA,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+-- processed_updates: принятые update_id для идемпотентной обработки апдейтов
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_id BIGINT PRIMARY KEY,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_processed_updates_received_at ON processed_updates (received_at);
@@ -0,0 +1,15 @@
+-- llm_cache: кэш ответов LLM для детерминированных промптов извлечения (фильтры, компания, колонки, аудитория)
+CREATE TABLE IF NOT EXISTS llm_cache (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    model VARCHAR NOT NULL,
+    operation VARCHAR NOT NULL,
+    response TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    hits INTEGER DEFAULT 0 NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    last_hit_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_llm_cache_last_hit_at ON llm_cache (last_hit_at);
+CREATE INDEX IF NOT EXISTS ix_llm_cache_expires_at ON llm_cache (expires_at);
@@ -0,0 +1,18 @@
+-- draft_batches: пакетная генерация черновиков для волн с датой отправки в будущем (OpenAI Batch API)
+CREATE TABLE IF NOT EXISTS draft_batches (
+    batch_job_id SERIAL PRIMARY KEY,
+    wave_id INTEGER NOT NULL REFERENCES waves (wave_id) ON DELETE CASCADE,
+    provider_batch_id VARCHAR NOT NULL UNIQUE,
+    backend VARCHAR NOT NULL,
+    model VARCHAR NOT NULL,
+    status VARCHAR DEFAULT 'submitted' NOT NULL,
+    request_count INTEGER DEFAULT 0 NOT NULL,
+    saved_count INTEGER DEFAULT 0 NOT NULL,
+    failed_count INTEGER DEFAULT 0 NOT NULL,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_draft_batches_wave_id ON draft_batches (wave_id);
+CREATE INDEX IF NOT EXISTS ix_draft_batches_status ON draft_batches (status);
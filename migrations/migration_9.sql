@@ -0,0 +1,29 @@
+-- llm_usage: учёт токенов и стоимости LLM по компаниям, кампаниям и волнам за день (0 — не привязано)
+CREATE TABLE IF NOT EXISTS llm_usage (
+    usage_id SERIAL PRIMARY KEY,
+    usage_date DATE NOT NULL,
+    company_id INTEGER DEFAULT 0 NOT NULL,
+    campaign_id INTEGER DEFAULT 0 NOT NULL,
+    wave_id INTEGER DEFAULT 0 NOT NULL,
+    model VARCHAR NOT NULL,
+    operation VARCHAR NOT NULL,
+    requests INTEGER DEFAULT 0 NOT NULL,
+    prompt_tokens BIGINT DEFAULT 0 NOT NULL,
+    completion_tokens BIGINT DEFAULT 0 NOT NULL,
+    cost_usd DOUBLE PRECISION DEFAULT 0 NOT NULL,
+    CONSTRAINT uq_llm_usage_key UNIQUE (usage_date, company_id, campaign_id, wave_id, model, operation)
+);
+
+CREATE INDEX IF NOT EXISTS ix_llm_usage_company_date ON llm_usage (company_id, usage_date);
+
+-- llm_quotas: месячные лимиты компании (NULL — значение по умолчанию из конфигурации, 0 — без лимита)
+CREATE TABLE IF NOT EXISTS llm_quotas (
+    company_id INTEGER PRIMARY KEY REFERENCES companies (company_id) ON DELETE CASCADE,
+    monthly_budget_usd DOUBLE PRECISION,
+    monthly_token_limit BIGINT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+-- Волны, остановленные из-за превышения бюджета LLM
+ALTER TABLE waves ADD COLUMN IF NOT EXISTS paused_at TIMESTAMP;
+ALTER TABLE waves ADD COLUMN IF NOT EXISTS pause_reason TEXT;
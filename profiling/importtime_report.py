@@ -0,0 +1,52 @@
+"""
+Профиль времени импорта при старте бота (python -X importtime).
+
+Запуск из корня проекта:
+    python profiling/importtime_report.py [модуль] [--min-ms 50] [--depth 3]
+"""
+import argparse
+import re
+import subprocess
+import sys
+
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def collect_importtime(module: str) -> list[tuple[int, int, int, str]]:
+    """
+    Импортирует модуль в отдельном процессе с -X importtime.
+
+    :param module: Импортируемый модуль.
+    :return: Список (собственное время мкс, накопленное время мкс, глубина, модуль) в порядке вывода.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            rows.append((int(own), int(cumulative), len(indent) // 2, name))
+    return rows
+
+
+def format_report(rows: list, min_ms: float, depth: int) -> str:
+    lines = []
+    for own, cumulative, level, name in rows:
+        if level <= depth and cumulative >= min_ms * 1000:
+            lines.append(f"{cumulative / 1000:9.1f} ms  {'  ' * level}{name}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("module", nargs="?", default="main")
+    parser.add_argument("--min-ms", type=float, default=50)
+    parser.add_argument("--depth", type=int, default=3)
+    args = parser.parse_args()
+
+    # Первый прогон прогревает кэш байткода, чтобы не учитывать компиляцию .pyc
+    collect_importtime(args.module)
+    print(format_report(collect_importtime(args.module), args.min_ms, args.depth))
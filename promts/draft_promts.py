@@ -40,4 +40,33 @@ EMAIL_GENERATION_PROMPT = """
   {{"subject": "<сгенерированная тема>", "text": "<сгенерированный текст>"}}
 
 🚨 **Важно:** Если в каких-то переменных будет `None`, не используй их в тексте письма.
-"""
\ No newline at end of file
+"""
+# Генерация писем для сегмента похожих лидов (один вид деятельности, регион, размер): модель пишет несколько
+# вариантов с плейсхолдерами, которые затем заполняются данными каждого лида без обращения к модели
+CLUSTER_EMAIL_GENERATION_PROMPT = """
+Шаблон письма:
+{template_content}
+
+Профиль сегмента получателей:
+- Основной вид деятельности: {primary_activity}
+- Регион: {region}
+- Размер компаний: {size}
+- Примеры компаний сегмента: {examples}
+
+📢 Описание контентного плана:
+{description}
+
+🎯 Задача:
+- Напиши разные варианты письма для компаний этого сегмента, всего вариантов: {variants}.
+- Упомяни их деятельность и особенности сегмента, используй описание контентного плана.
+- Варианты должны отличаться вступлением, порядком абзацев, формулировками и темой.
+- Личные данные не выдумывай — используй плейсхолдеры, они будут заменены данными каждой компании:
+  [company_name] — название компании, [director_name] — имя руководителя,
+  [director_position] — должность руководителя, [region] — регион, [website] — сайт.
+- Если значения не окажется, плейсхолдер будет удалён вместе с запятой перед ним, поэтому текст должен
+  оставаться грамотным и без него (например, «Здравствуйте, [director_name]!»).
+- **Строго запрещено** использовать следующие слова или их вариации:
+  {forbidden_words}.
+- В ответе верни JSON-объект формата:
+  {{"variants": [{{"subject": "<тема>", "text": "<текст>"}}, ...]}}
+"""
@@ -0,0 +1,47 @@
+from typing import Any, Literal
+
+from pydantic import BaseModel, ConfigDict, Field, RootModel
+
+
+class MessageClassification(BaseModel):
+    """ Ответ классификатора сообщений (BASE_PROMPT). """
+    action_type: Literal["add", "edit", "delete", "view", "unknown"] = "unknown"
+    # "draft" — из примера в BASE_PROMPT, "drafts" — из списка сущностей промта: модель отвечает обоими
+    entity_type: Literal[
+        "campaign", "template", "email_table", "content_plan", "company", "segment", "draft", "drafts", "unknown"
+    ] = "unknown"
+
+
+class CompanyData(BaseModel):
+    """ Данные компании (PROCESS_COMPANY_INFORMATION_PROMPT). """
+    model_config = ConfigDict(extra="allow")
+
+    company_name: str | None = None
+    industry: str | None = None
+    description: str | None = None
+
+
+class ColumnMapping(RootModel[dict[str, str | None]]):
+    """ Сопоставление колонок пользователя с полями email-сегмента: {колонка: поле или null}. """
+
+
+class SegmentFilters(BaseModel):
+    """ Фильтры сегментации из текста пользователя. """
+    filters: dict[str, Any] = Field(default_factory=dict)
+
+
+class AudienceStyle(BaseModel):
+    """ Аудитория и стиль общения контент-плана. """
+    audience: str = ""
+    style: str = ""
+
+
+class DraftEmail(BaseModel):
+    """ Сгенерированное письмо для лида (EMAIL_GENERATION_PROMPT). """
+    subject: str = Field(min_length=1)
+    text: str = Field(min_length=1)
+
+
+class DraftVariants(BaseModel):
+    """ Варианты письма для сегмента лидов с плейсхолдерами личных данных (CLUSTER_EMAIL_GENERATION_PROMPT). """
+    variants: list[DraftEmail] = Field(min_length=1)
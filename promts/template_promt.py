@@ -1,22 +1,22 @@
-from langchain.prompts import ChatPromptTemplate
+# Шаблоны промтов агента шаблонов (ChatPromptTemplate из них собирает agents/tempate_agent.py при первом вызове)
 
 # 1. Промт для запроса пожеланий у пользователя
-invite_prompt = ChatPromptTemplate.from_template("""
+invite_prompt = """
 Ты AI-ассистент. Попроси пользователя тактично ввести пожелания для генерации шаблонов письма. 
 Формулируй просьбу по-разному каждый раз, чтобы пользователь не замечал однотипности.
 Отвечай только одной строкой текста без дополнительных структур JSON или метаданных.
-""")
+"""
 
 # 2. Промт для анализа пользовательского ввода (если снова понадобится)
-context_analysis_prompt = ChatPromptTemplate.from_template("""
+context_analysis_prompt = """
 Мы ожидаем текст с пожеланиями для шаблона письма. Текст: {input}
 
 Если текст соответствует ожиданиям, ответь "valid".
 Если текст не соответствует, ответь "invalid" и кратко объясни, почему.
-""")
+"""
 
 # 3. Промт для генерации письма с учётом компании и контентного плана
-template_generation_prompt = ChatPromptTemplate.from_template("""
+template_generation_prompt = """
 Сгенерируй текст письма для компании "{company_name}" (сфера: {industry}).
 
 Контентный план: {content_plan}
@@ -26,9 +26,9 @@ template_generation_prompt = ChatPromptTemplate.from_template("""
 {user_request}
 
 Ответ должен быть строго на русском
-""")
+"""
 
-template_edit_prompt = ChatPromptTemplate.from_template("""
+template_edit_prompt = """
 Ты – профессиональный редактор email-рассылок. Твоя задача – внести изменения в шаблон письма на основе комментариев пользователя.
 
 **Исходный текст письма**:
@@ -44,15 +44,49 @@ template_edit_prompt = ChatPromptTemplate.from_template("""
 - Отвечай **только новым текстом письма**, без пояснений.
 
 📝 **Новый текст письма**:
-""")
+"""
 
-def generate_email_template_prompt(company_details: dict) -> str:
+# Поля брифа компании (CompanyInfo) и их подписи в промтах, в порядке вывода
+COMPANY_CONTEXT_FIELDS = {
+    "company_name": "Название компании",
+    "company_mission": "Миссия компании",
+    "company_values": "Ценности компании",
+    "business_sector": "Отрасль",
+    "office_addresses_and_hours": "Адреса и время работы",
+    "resource_links": "Ссылки на ресурсы",
+    "target_audience_b2b_b2c_niche_geography": "Целевая аудитория и география",
+    "unique_selling_proposition": "УТП",
+    "customer_pain_points": "Боли клиентов",
+    "competitor_differences": "Отличия от конкурентов",
+    "promoted_products_and_services": "Продукты и услуги",
+    "delivery_availability_geographical_coverage": "Доставка и покрытие",
+    "frequently_asked_questions_with_answers": "FAQ",
+    "common_customer_objections_and_responses": "Типичные возражения клиентов и ответы",
+    "successful_case_studies": "Успешные кейсы",
+    "additional_information": "Дополнительная информация",
+}
+
+
+def format_company_context(company_details: dict) -> str:
+    """ Сведения о компании для промта: по строке на каждое заполненное поле COMPANY_CONTEXT_FIELDS. """
+    return "\n".join(
+        f"- {label}: {company_details[field]}"
+        for field, label in COMPANY_CONTEXT_FIELDS.items() if company_details.get(field)
+    )
+
+
+def generate_email_template_prompt(company_details: dict, company_context: str | None = None) -> str:
     """
     Формирует промт для генерации email-шаблона с учетом запрета на определенные слова.
 
     :param company_details: Словарь с деталями о компании и пользовательским запросом.
+    :param company_context: Сведения о компании, сокращённые под бюджет токенов (utils/company_context.py);
+                            по умолчанию — все заполненные поля company_details целиком.
     :return: Текстовый промт.
     """
+    if company_context is None:
+        company_context = format_company_context(company_details)
+
     forbidden_words = [
         "Нажми сюда!", "Получили миллион за минуту!", "бесплатно", "прибыль", "профит", "100%", "0%",
         "получи бесплатно", "Финансовый успех", "Деньги", "Кредит", "Жми", "Кликни", "Купи", "Скачай",
@@ -65,22 +99,7 @@ def generate_email_template_prompt(company_details: dict) -> str:
 
     return (
         f"Ты – AI-ассистент, создающий email-шаблоны для компаний. Учитывай следующую информацию:\n\n"
-        f"- Название компании: {company_details.get('company_name')}\n"
-        f"- Миссия компании: {company_details.get('company_mission')}\n"
-        f"- Ценности компании: {company_details.get('company_values')}\n"
-        f"- Отрасль: {company_details.get('business_sector')}\n"
-        f"- Адреса и время работы: {company_details.get('office_addresses_and_hours')}\n"
-        f"- Ссылки на ресурсы: {company_details.get('resource_links')}\n"
-        f"- Целевая аудитория и география: {company_details.get('target_audience_b2b_b2c_niche_geography')}\n"
-        f"- УТП: {company_details.get('unique_selling_proposition')}\n"
-        f"- Боли клиентов: {company_details.get('customer_pain_points')}\n"
-        f"- Отличия от конкурентов: {company_details.get('competitor_differences')}\n"
-        f"- Продукты и услуги: {company_details.get('promoted_products_and_services')}\n"
-        f"- Доставка и покрытие: {company_details.get('delivery_availability_geographical_coverage')}\n"
-        f"- FAQ: {company_details.get('frequently_asked_questions_with_answers')}\n"
-        f"- Типичные возражения клиентов и ответы: {company_details.get('common_customer_objections_and_responses')}\n"
-        f"- Успешные кейсы: {company_details.get('successful_case_studies')}\n"
-        f"- Дополнительная информация: {company_details.get('additional_information')}\n\n"
+        f"{company_context}\n\n"
         f"Контент-план:\n"
         f"- {company_details.get('content_plan_description')}\n\n"
         f"Пользователь просит создать шаблон с учетом следующих пожеланий:\n"
@@ -0,0 +1,71 @@
+import asyncio
+from datetime import datetime
+
+from aiogram.types import Chat, Message, User
+
+from utils.chat_queue import ChatQueueMiddleware
+
+
+def _message(chat_id: int, text: str, message_id: int = 1) -> Message:
+    return Message(
+        message_id=message_id,
+        date=datetime.now(),
+        chat=Chat(id=chat_id, type="supergroup"),
+        from_user=User(id=chat_id * 10, is_bot=False, first_name="Lead"),
+        text=text,
+    )
+
+
+async def test_updates_are_serialized_per_chat_and_parallel_across_chats():
+    middleware = ChatQueueMiddleware()
+    log = []
+    active = {}
+
+    async def handler(event, data):
+        chat_id = event.chat.id
+        active[chat_id] = active.get(chat_id, 0) + 1
+        assert active[chat_id] == 1
+        log.append(("start", chat_id, event.text))
+        await asyncio.sleep(0.02)
+        log.append(("end", chat_id, event.text))
+        active[chat_id] -= 1
+        return event.text
+
+    results = await asyncio.gather(*(
+        middleware(handler, _message(chat_id, f"{chat_id}-{number}"), {})
+        for number in range(3) for chat_id in (1, 2)
+    ))
+
+    assert results == ["1-0", "2-0", "1-1", "2-1", "1-2", "2-2"]
+    for chat_id in (1, 2):
+        assert [text for kind, chat, text in log if kind == "start" and chat == chat_id] == [
+            f"{chat_id}-0", f"{chat_id}-1", f"{chat_id}-2"
+        ]
+    # Чаты обрабатываются параллельно: второй чат стартует до окончания первого сообщения первого чата
+    assert log[:2] == [("start", 1, "1-0"), ("start", 2, "2-0")]
+    assert middleware.get_queue_depths() == {}
+
+
+async def test_queue_sheds_overflow_and_coalesces_duplicates():
+    middleware = ChatQueueMiddleware(max_depth=3)
+    release = asyncio.Event()
+    handled = []
+
+    async def handler(event, data):
+        await release.wait()
+        handled.append(event.text)
+
+    tasks = [asyncio.create_task(middleware(handler, _message(1, "загрузка", 1), {}))]
+    await asyncio.sleep(0)
+    for number, text in enumerate(["привет", "привет", "статус", "ещё", "и ещё"], start=2):
+        tasks.append(asyncio.create_task(middleware(handler, _message(1, text, number), {})))
+        await asyncio.sleep(0)
+
+    assert middleware.get_queue_depths() == {1: 3}
+    release.set()
+    await asyncio.gather(*tasks)
+
+    assert handled == ["загрузка", "привет", "статус"]
+    assert middleware.stats["coalesced"] == 1
+    assert middleware.stats["shed"] == 2
+    assert middleware.stats["processed"] == 3
@@ -0,0 +1,56 @@
+import utils.parser_email_table as parser
+from utils.column_mapping import get_header_signature, match_columns, match_header
+
+
+def test_match_header_synonyms_typos_and_units():
+    assert match_header("Наименование организации") == "name"
+    assert match_header("E-mail") == "email"
+    assert match_header("Телефн") == "phone_number"
+    assert match_header("Выручка, тыс. руб.") == "revenue"
+    assert match_header("Основной вид деятельности (ОКВЭД)") == "primary_activity"
+    assert match_header("ИНН") is None
+    assert match_header("Название региона") is None
+
+
+def test_match_columns_leaves_conflicts_unresolved():
+    resolved, unresolved = match_columns(["Email", "Телефон", "Контактный телефон", "ИНН"])
+    assert resolved == {"Email": "email"}
+    assert unresolved == ["Телефон", "Контактный телефон", "ИНН"]
+
+
+def test_header_signature_ignores_order_and_case():
+    assert get_header_signature(["Email", "Сайт"]) == get_header_signature(["сайт ", "EMAIL"])
+
+
+async def test_map_columns_sends_only_unresolved_columns_and_uses_cache(monkeypatch):
+    cache = {}
+    shared = {}  # сигнатура -> сохранён ли маппинг как глобальный
+    sent_to_model = []
+
+    async def fake_model(columns):
+        sent_to_model.append(columns)
+        return {"ИНН": None, "Контакт": "director_name"}
+
+    monkeypatch.setattr(parser, "map_columns_with_model", fake_model)
+    monkeypatch.setattr(parser, "get_cached_column_mapping", lambda db, company_id, signature: cache.get(signature))
+    monkeypatch.setattr(
+        parser, "save_column_mapping",
+        lambda db, company_id, signature, mapping, **kwargs:
+        cache.update({signature: mapping}) or shared.update({signature: kwargs.get("shared", False)})
+    )
+
+    columns = ["Email", "Сайт", "ИНН", "Контакт"]
+    expected = {"Email": "email", "Сайт": "website", "ИНН": None, "Контакт": "director_name"}
+
+    assert await parser.map_columns(columns, company_id=1) == expected
+    assert sent_to_model == [["ИНН", "Контакт"]]
+    # Ответ модели не попадает в глобальный кэш, полностью локальный маппинг — попадает
+    assert shared == {get_header_signature(columns): False}
+    await parser.map_columns(["Email", "Сайт"], company_id=1)
+    assert shared[get_header_signature(["Email", "Сайт"])] is True
+
+    # Та же выгрузка с другим порядком и регистром колонок модель не вызывает
+    assert await parser.map_columns(["контакт", "EMAIL", "Сайт", "ИНН"], company_id=1) == {
+        "контакт": "director_name", "EMAIL": "email", "Сайт": "website", "ИНН": None
+    }
+    assert len(sent_to_model) == 1
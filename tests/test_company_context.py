@@ -0,0 +1,57 @@
+import pytest
+
+from utils import company_context, token_counter
+from utils.company_context import compact_company_context, get_company_context, invalidate_company_context
+from utils.token_counter import count_tokens
+
+BRIEF = {
+    "company_name": "ООО Ромашка",
+    "business_sector": "IT-аутсорсинг",
+    "unique_selling_proposition": "Запускаем CRM за две недели.",
+    "frequently_asked_questions_with_answers": "Вопрос: сколько стоит? Ответ: от 100 тысяч рублей.\n\n" * 300,
+    "successful_case_studies": "Внедрили CRM в сети аптек, конверсия выросла на 20%. " * 300,
+}
+
+
+@pytest.fixture(autouse=True)
+def approximate_tokens(monkeypatch):
+    # Оценка по длине текста: тест не зависит от загрузки словаря tiktoken
+    monkeypatch.setattr(token_counter, "get_encoding", lambda model: None)
+
+
+def test_context_fits_budget_and_keeps_important_fields_whole():
+    context = compact_company_context(BRIEF, max_tokens=400)
+
+    assert count_tokens(context) <= 400
+    assert "- УТП: Запускаем CRM за две недели.\n" in context
+    assert "- Успешные кейсы: Внедрили CRM" in context
+    # Длинные поля обрезаются по границе предложения
+    assert context.count("…") == 2 and "20%. …" in context
+
+
+def test_context_is_cached_until_brief_is_saved(monkeypatch):
+    calls = []
+    monkeypatch.setattr(company_context, "_cache", {})
+    monkeypatch.setattr(company_context, "compact_company_context",
+                        lambda details, task, model: calls.append(task) or "- Название компании: ООО Ромашка")
+
+    get_company_context(42, BRIEF)
+    get_company_context(42, BRIEF)
+    invalidate_company_context(42)
+    get_company_context(42, BRIEF)
+
+    assert calls == ["template", "template"]
+
+
+def test_context_is_rebuilt_when_brief_changes_elsewhere(monkeypatch):
+    calls = []
+    monkeypatch.setattr(company_context, "_cache", {})
+    monkeypatch.setattr(company_context, "compact_company_context",
+                        lambda details, task, model: calls.append(details["company_name"]) or details["company_name"])
+
+    # Бриф сохранён в другом процессе: здесь invalidate_company_context не вызывался
+    assert get_company_context(42, BRIEF) == "ООО Ромашка"
+    assert get_company_context(42, {**BRIEF, "company_name": "ООО Василёк"}) == "ООО Василёк"
+
+    assert calls == ["ООО Ромашка", "ООО Василёк"]
+    assert len(company_context._cache) == 1
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+import classifier
+from utils import draft_batches
+from utils.batch_client import LocalBatchClient
+from utils.draft_batches import build_batch_requests, parse_batch_results, submit_wave_batch
+
+
+def test_local_batch_round_trip(tmp_path, monkeypatch):
+    def create_chat_completion(operation, model, messages, **kwargs):
+        if "Второй" in messages[-1]["content"]:
+            raise TimeoutError("timeout")
+        return SimpleNamespace(model_dump=lambda: {
+            "choices": [{"message": {"content": '```json\n{"subject": "Тема", "text": "Письмо"}\n```'}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5},
+        })
+
+    monkeypatch.setattr(classifier, "create_chat_completion", create_chat_completion)
+    template = SimpleNamespace(template_content="Шаблон")
+    leads = pd.DataFrame([{"id": 7, "name": "Первый", "email": "a@a.ru"}, {"id": 8, "name": "Второй", "email": "b@b.ru"}])
+
+    requests = build_batch_requests(template, leads, wave_id=3, description="План", model="gpt-4o")
+    assert [request["custom_id"] for request in requests] == ["wave-3-lead-7", "wave-3-lead-8"]
+    assert requests[0]["body"]["response_format"] == {"type": "json_object"}
+
+    client = LocalBatchClient(str(tmp_path))
+    batch_id = client.submit(requests, metadata={"wave_id": "3"})
+    state = client.retrieve(batch_id)
+    assert state["status"] == "completed"
+
+    drafts, failed, usages = parse_batch_results(client.download(state["output_file_id"]))
+    assert {lead_id: draft.subject for lead_id, draft in drafts.items()} == {7: "Тема"}
+    assert failed == 1
+    assert usages == [{"prompt_tokens": 10, "completion_tokens": 5}]
+
+
+class FakeBatchClient:
+    name = "local"
+
+    def __init__(self, events):
+        self.events = events
+
+    def submit(self, requests, metadata=None):
+        self.events.append(("submit", [request["custom_id"] for request in requests]))
+        return "batch-1"
+
+    def cancel(self, batch_id):
+        self.events.append(("cancel", batch_id))
+
+
+def prepare_wave_batch(monkeypatch, events, saved=True):
+    leads = pd.DataFrame([{"id": lead_id, "name": f"Компания {lead_id}"} for lead_id in (1, 2, 3)])
+    monkeypatch.setattr(draft_batches, "LLM_BATCH_MIN_LEADS", 1)
+    monkeypatch.setattr(draft_batches, "get_filtered_leads_for_wave", lambda db, wave_id: leads)
+    monkeypatch.setattr(draft_batches, "get_drafted_lead_ids", lambda db, wave_id: {2})
+    monkeypatch.setattr(draft_batches, "get_wave_description", lambda db, wave: "План")
+    monkeypatch.setattr(draft_batches, "estimate_lead_usage", lambda *args: (100, 0.001))
+    monkeypatch.setattr(draft_batches, "check_budget", lambda *args: None)
+    monkeypatch.setattr(draft_batches, "create_draft_batch", lambda db, wave_id, backend, model, count: (
+        events.append(("create", count)) or SimpleNamespace(batch_job_id=5)
+    ))
+    monkeypatch.setattr(draft_batches, "update_draft_batch", lambda db, batch_job_id, **values: (
+        events.append(("update", values.get("status"))) or saved
+    ))
+    db = SimpleNamespace(
+        query=lambda model: SimpleNamespace(filter_by=lambda **kwargs: SimpleNamespace(
+            first=lambda: SimpleNamespace(template_content="Шаблон"))),
+        refresh=lambda batch: None,
+    )
+    return db, SimpleNamespace(wave_id=3, company_id=1)
+
+
+def test_batch_row_is_written_before_submit_and_skips_drafted_leads(monkeypatch):
+    events = []
+    db, wave = prepare_wave_batch(monkeypatch, events)
+
+    assert submit_wave_batch(db, wave, FakeBatchClient(events)).batch_job_id == 5
+    assert events == [("create", 2), ("submit", ["wave-3-lead-1", "wave-3-lead-3"]), ("update", "submitted")]
+
+
+def test_batch_is_cancelled_when_its_id_cannot_be_saved(monkeypatch):
+    events = []
+    db, wave = prepare_wave_batch(monkeypatch, events, saved=False)
+
+    assert submit_wave_batch(db, wave, FakeBatchClient(events)) is None
+    assert events[-1] == ("cancel", "batch-1")
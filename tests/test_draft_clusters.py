@@ -0,0 +1,50 @@
+import pandas as pd
+
+from promts.output_schemas import DraftEmail
+from utils.draft_clusters import cluster_leads, personalize, personalize_drafts
+
+
+def make_leads(rows):
+    return pd.DataFrame([
+        {"id": lead_id, "name": f"Компания {lead_id}", "primary_activity": activity, "region": region,
+         "employee_count": employees}
+        for lead_id, (activity, region, employees) in enumerate(rows, start=1)
+    ])
+
+
+def test_small_segments_are_merged_into_coarser_profiles():
+    df = make_leads(
+        [("Строительство", "Москва", 10)] * 5
+        + [("Строительство", "Казань", 10)] * 2
+        + [("Строительство", "Тверь", 10)] * 2
+        + [("Логистика", "Омск", 500)] * 1
+    )
+
+    clusters = cluster_leads(df, min_size=4)
+
+    assert [profile for profile, _ in clusters] == [
+        {"primary_activity": "строительство", "region": "москва", "size": "micro"},
+        {"primary_activity": "строительство", "size": "micro"},
+        {},
+    ]
+    assert sorted(lead_id for _, leads in clusters for lead_id in leads["id"]) == list(df["id"])
+    assert len(clusters) <= len(df) // 4 + 1
+
+
+def test_personalize_drops_empty_placeholders_with_comma():
+    text = "Здравствуйте, [director_name]! Пишем [company_name], [region]."
+
+    assert personalize(text, {"director_name": "", "company_name": "ООО Ромашка"}) == \
+        "Здравствуйте! Пишем ООО Ромашка."
+
+
+def test_lead_keeps_its_variant_between_runs():
+    df = make_leads([("IT", "Москва", 20)] * 4)
+    variants = [DraftEmail(subject=f"Тема {n}", text=f"Вариант {n} для [company_name]") for n in range(3)]
+
+    drafts = personalize_drafts(df, variants, wave_id=7)
+
+    assert drafts == personalize_drafts(df.iloc[::-1], variants, wave_id=7)[::-1]
+    assert drafts[0]["text"] == "Вариант 1 для Компания 1"
+    assert drafts[3] == {"wave_id": 7, "lead_id": 4, "email": None, "company_name": "Компания 4",
+                         "subject": "Тема 1", "text": "Вариант 1 для Компания 4"}
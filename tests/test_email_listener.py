@@ -0,0 +1,119 @@
+import asyncio
+
+from aioimaplib.imap_testing_server import MockImapServer, Mail
+
+from utils.email_listner import MailboxListener, ReplyIndex, normalize_subject, sync_mailbox_listeners
+
+MAILBOX = "sales@example.ru"
+
+
+async def _wait_idle(imap_server: MockImapServer):
+    # Письма, пришедшие до того, как сервер принял IDLE, сервер не присылает до следующей команды
+    while imap_server.get_connection(MAILBOX) is None or not imap_server.get_connection(MAILBOX).idle_tag:
+        await asyncio.sleep(0.01)
+
+
+async def _run_server() -> tuple[MockImapServer, object, int]:
+    imap_server = MockImapServer()
+    server = await imap_server.run_server(host="127.0.0.1", port=0)
+    return imap_server, server, server.sockets[0].getsockname()[1]
+
+
+def _connection(port: int, **fields) -> dict:
+    return {
+        "id": 1, "company_id": 1, "chat_id": -100, "login": MAILBOX, "password": "secret",
+        "imap_server": "127.0.0.1", "imap_port": port, "uid_validity": None, "last_seen_uid": 0, **fields,
+    }
+
+
+def test_normalize_subject_strips_reply_prefixes():
+    assert normalize_subject("Re: RE:  Новое   предложение") == "новое предложение"
+    assert normalize_subject("Ответ: Fwd[2]: Скидки") == "скидки"
+    assert normalize_subject(None) == ""
+
+
+async def test_listener_matches_replies_by_subject_and_thread():
+    imap_server, server, port = await _run_server()
+
+    index = ReplyIndex()
+    index.add_wave(company_id=1, wave_id=7, campaign_id=3, thread_id=55, subject="Новое предложение")
+    index.add_message_id("<sent-1@example.ru>", {"wave_id": 8, "campaign_id": 3, "thread_id": 55, "subject": "Итоги"})
+
+    # Письмо, пришедшее до запуска, обрабатывается после подключения (позиция сохранена как UID 0)
+    imap_server.receive(Mail.create([MAILBOX], mail_from="lead@client.ru", subject="Re: Новое предложение"))
+
+    notified = []
+    positions = []
+    got_two = asyncio.Event()
+
+    async def notify(connection, entry, headers):
+        notified.append((entry["wave_id"], headers["from"]))
+        if len(notified) == 2:
+            got_two.set()
+
+    listener = MailboxListener(
+        _connection(port), index, notify,
+        save_position=lambda *args: positions.append(args),
+        use_ssl=False,
+    )
+    task = asyncio.create_task(listener.run())
+
+    try:
+        await asyncio.wait_for(_wait_idle(imap_server), 5)
+        assert notified == [(7, "lead@client.ru")]
+
+        # Во время IDLE приходят ответ по цепочке (другая тема) и постороннее письмо
+        imap_server.receive(Mail.create(
+            [MAILBOX], mail_from="other@client.ru", subject="Вопрос", in_reply_to="sent-1@example.ru"
+        ))
+        imap_server.receive(Mail.create([MAILBOX], mail_from="spam@spam.ru", subject="Реклама"))
+
+        await asyncio.wait_for(got_two.wait(), 5)
+        await asyncio.sleep(0.2)
+        assert notified == [(7, "lead@client.ru"), (8, "other@client.ru")]
+        assert positions[-1][2] == 3
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        server.close()
+
+
+async def test_listeners_follow_connection_changes():
+    first_server, first, first_port = await _run_server()
+    second_server, second, second_port = await _run_server()
+
+    async def notify(connection, entry, headers):
+        pass
+
+    listeners = {}
+
+    def sync(connections):
+        sync_mailbox_listeners(listeners, connections, ReplyIndex(), notify,
+                               save_position=lambda *args: None, use_ssl=False)
+
+    try:
+        sync([_connection(first_port)])
+        _, first_task = listeners[1]
+        await asyncio.wait_for(_wait_idle(first_server), 5)
+
+        # Повторная синхронизация с теми же параметрами не трогает слушатель, даже если сдвинулась позиция
+        sync([_connection(first_port, last_seen_uid=5)])
+        assert listeners[1][1] is first_task
+
+        # Ящик перенесли на другой сервер: старый слушатель останавливается, новый подключается
+        sync([_connection(second_port, password="new-secret")])
+        _, second_task = listeners[1]
+        await asyncio.gather(first_task, return_exceptions=True)
+        assert first_task.cancelled() and second_task is not first_task
+        await asyncio.wait_for(_wait_idle(second_server), 5)
+
+        # Подключение удалено
+        sync([])
+        await asyncio.gather(second_task, return_exceptions=True)
+        assert second_task.cancelled() and listeners == {}
+    finally:
+        for _, task in listeners.values():
+            task.cancel()
+        await asyncio.gather(*(task for _, task in listeners.values()), return_exceptions=True)
+        first.close()
+        second.close()
@@ -0,0 +1,106 @@
+import asyncio
+import socket
+from types import SimpleNamespace
+
+import pytest
+from aiosmtpd.controller import Controller
+from aiosmtpd.handlers import Sink
+
+import utils.email_sender as email_sender
+from utils.email_sender import RateLimiter, SmtpConnectionPool, interleave_by_domain
+
+
+class RecordingHandler(Sink):
+    def __init__(self, reject: set[str] = frozenset()):
+        self.messages = []
+        self.sessions = set()
+        self.reject = reject
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.reject:
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos[0], envelope.content))
+        self.sessions.add(id(session))
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp_server():
+    def start(handler):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        controller = Controller(handler, hostname="127.0.0.1", port=port)
+        controller.start()
+        controllers.append(controller)
+        return port
+
+    controllers = []
+    yield start
+    for controller in controllers:
+        controller.stop()
+
+
+def _connection(port: int) -> dict:
+    return {"id": 1, "login": "sales@example.ru", "password": "secret", "smtp_server": "127.0.0.1", "smtp_port": port}
+
+
+def test_interleave_by_domain_alternates_domains():
+    drafts = [{"email": email} for email in ("a@mail.ru", "b@mail.ru", "c@mail.ru", "d@ya.ru", "e@gmail.com")]
+    domains = [draft["email"].split("@")[1] for draft in interleave_by_domain(drafts)]
+    assert domains == ["mail.ru", "ya.ru", "gmail.com", "mail.ru", "mail.ru"]
+
+
+async def test_rate_limiter_spaces_events():
+    limiter = RateLimiter(per_minute=60 * 20)  # интервал 50 мс
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await asyncio.gather(*(limiter.wait() for _ in range(4)))
+    assert loop.time() - start >= 0.15
+
+
+async def test_pool_reuses_connections(smtp_server):
+    handler = RecordingHandler()
+    pool = SmtpConnectionPool(_connection(smtp_server(handler)), size=2)
+    draft = {"email": "lead@client.ru", "subject": "Тема", "text": "Текст"}
+
+    for _ in range(5):
+        async with pool.acquire() as client:
+            await client.send_message(email_sender.build_message(pool.sender, draft))
+    await pool.close()
+
+    assert len(handler.messages) == 5
+    assert len(handler.sessions) == 1
+
+
+async def test_wave_delivery_marks_sent_and_failed(smtp_server, monkeypatch):
+    handler = RecordingHandler(reject={"ghost@client.ru"})
+    port = smtp_server(handler)
+
+    sent, failed = {}, {}
+    monkeypatch.setattr(email_sender, "mark_draft_sent", lambda db, draft_id, message_id, sender, attempts: sent.update({draft_id: message_id}))
+    monkeypatch.setattr(email_sender, "mark_draft_failed", lambda db, draft_id, error, attempts: failed.update({draft_id: error}))
+    monkeypatch.setattr(email_sender, "_pools", {})
+    monkeypatch.setattr(email_sender, "_domain_limiters", {})
+    monkeypatch.setattr(email_sender, "_sender_limiters", {})
+    monkeypatch.setattr(email_sender, "DOMAIN_MESSAGES_PER_MINUTE", 6000)
+    monkeypatch.setattr(email_sender, "SENDER_MESSAGES_PER_MINUTE", 6000)
+
+    drafts = [
+        {"draft_id": number, "email": f"lead{number}@client{number % 3}.ru", "subject": "Тема", "text": "Текст"}
+        for number in range(1, 10)
+    ] + [{"draft_id": 100, "email": "ghost@client.ru", "subject": "Тема", "text": "Текст"}]
+
+    delivery = email_sender._WaveDelivery(None, SimpleNamespace(company_id=1), [_connection(port)], drafts)
+    stats = await delivery.run()
+    await email_sender.close_smtp_pools()
+
+    assert stats == {"sent": 9, "failed": 1, "requeued": 0}
+    assert set(sent) == set(range(1, 10))
+    assert len(set(sent.values())) == 9
+    assert "550" in failed[100]
+    assert len(handler.messages) == 9
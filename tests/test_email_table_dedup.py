@@ -0,0 +1,34 @@
+from sqlalchemy import create_engine
+
+from db.dynamic_table_manager import ensure_email_dedup_index
+from db.email_table_db import normalize_email, deduplicate_records
+
+
+def test_normalize_email():
+    assert normalize_email("  Ivan@Example.RU ") == "ivan@example.ru"
+    assert normalize_email("") is None
+    assert normalize_email(None) is None
+    assert normalize_email(float("nan")) is None
+
+
+def test_deduplicate_records_merges_empty_fields():
+    records = [
+        {"email": "a@x.ru", "name": "Альфа", "region": ""},
+        {"email": " A@X.ru", "name": "", "region": "Москва"},
+        {"email": "b@x.ru", "name": "Бета", "region": "СПб"},
+        {"email": "", "name": "Без email", "region": ""},
+    ]
+
+    unique, duplicates = deduplicate_records(records)
+
+    assert duplicates == 1
+    assert [r["email_normalized"] for r in unique] == ["a@x.ru", "b@x.ru", None]
+    assert unique[0]["name"] == "Альфа"
+    assert unique[0]["region"] == "Москва"
+
+
+def test_dedup_index_error_is_not_reported_as_ready():
+    # Таблицы нет: ошибка не должна выглядеть как «индекс готов», иначе загрузка пойдёт через ON CONFLICT
+    engine = create_engine("sqlite://")
+
+    assert ensure_email_dedup_index(engine, "missing_table") is None
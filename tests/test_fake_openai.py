@@ -0,0 +1,71 @@
+import json
+
+import openai
+import pytest
+from aiohttp.test_utils import TestServer
+
+from fake_openai.server import FAKE_OPENAI_KEY, FakeOpenAI, create_app, parse_latency
+from promts.draft_promts import EMAIL_GENERATION_PROMPT
+from promts.email_table_promt import generate_column_mapping_prompt
+
+
+async def _client(fake: FakeOpenAI) -> tuple[TestServer, openai.AsyncOpenAI]:
+    server = TestServer(create_app(fake))
+    await server.start_server()
+    client = openai.AsyncOpenAI(api_key="test", base_url=str(server.make_url("/v1")), max_retries=0)
+    return server, client
+
+
+async def _ask(client: openai.AsyncOpenAI, prompt: str):
+    return await client.chat.completions.create(model="gpt-4", messages=[{"role": "user", "content": prompt}])
+
+
+async def test_canned_replies_by_prompt_type():
+    server, client = await _client(FakeOpenAI(seed=1))
+    try:
+        prompt = EMAIL_GENERATION_PROMPT.format(
+            template_content="Шаблон", company_name="ООО Ромашка", region="", map_registry="", director_name="",
+            director_position="", phone_number="", website="", primary_activity="", revenue="",
+            employee_count="", branch_count="", description="", forbidden_words=""
+        )
+        draft = json.loads((await _ask(client, prompt)).choices[0].message.content)
+        assert "ООО Ромашка" in draft["subject"]
+
+        mapping = await _ask(client, generate_column_mapping_prompt(["Почта", "Город"]))
+        assert json.loads(mapping.choices[0].message.content) == {"Почта": None, "Город": None}
+        assert mapping.usage.prompt_tokens > 0
+    finally:
+        await client.close()
+        await server.close()
+
+
+async def test_rate_limit_returns_429():
+    server, client = await _client(FakeOpenAI(rpm=1))
+    try:
+        await _ask(client, "первый запрос")
+        with pytest.raises(openai.RateLimitError):
+            await _ask(client, "второй запрос")
+        assert server.app[FAKE_OPENAI_KEY].stats["rate_limited"] == 1
+    finally:
+        await client.close()
+        await server.close()
+
+
+async def test_streaming_reply_is_split_into_chunks():
+    server, client = await _client(FakeOpenAI())
+    try:
+        stream = await client.chat.completions.create(
+            model="gpt-4", messages=[{"role": "user", "content": "таблицу сегментации"}], stream=True
+        )
+        parts = [chunk.choices[0].delta.content async for chunk in stream if chunk.choices[0].delta.content]
+        assert len(parts) > 1
+        assert json.loads("".join(parts)) == {"filters": {"region": "Москва"}}
+    finally:
+        await client.close()
+        await server.close()
+
+
+def test_parse_latency_rejects_unknown_distribution():
+    assert parse_latency("fixed:0.5")(None) == 0.5
+    with pytest.raises(ValueError):
+        parse_latency("gamma:1,2")
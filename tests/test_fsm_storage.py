@@ -0,0 +1,99 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Update
+
+from config import DATABASE_URL
+from utils import fsm_storage
+from utils.fsm_storage import FRAME_MARKER, PostgresStorage, UpdateDedupMiddleware
+
+KEY = StorageKey(bot_id=1, chat_id=777, user_id=777)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """ Таблицы fsm_states/fsm_frames в памяти вместо PostgreSQL. """
+    states, frames = {}, {}
+
+    def save_fsm_data(db, key, data, new_frames, frame_ids=None):
+        frame_ids = set(new_frames) if frame_ids is None else frame_ids
+        states[key] = data
+        stored = {**frames.get(key, {}), **new_frames}
+        frames[key] = {frame_id: frame for frame_id, frame in stored.items() if frame_id in frame_ids}
+
+    monkeypatch.setattr(fsm_storage, "lock_fsm_key", lambda db, key: None)
+    monkeypatch.setattr(fsm_storage, "get_fsm_record", lambda db, key: (None, states.get(key)))
+    monkeypatch.setattr(fsm_storage, "get_fsm_frames", lambda db, key, frame_ids: {
+        frame_id: frame for frame_id, frame in frames.get(key, {}).items() if frame_id in frame_ids
+    })
+    monkeypatch.setattr(fsm_storage, "save_fsm_data", save_fsm_data)
+    return states, frames
+
+
+async def test_data_is_stored_as_json_with_frame_references(store):
+    states, frames = store
+    storage = PostgresStorage()
+    df = pd.DataFrame({"email": ["a@a.ru", "b@b.ru"], "region": ["Москва", None]})
+
+    await storage.set_data(KEY, {"df": df, "copy": [df], "count": np.int64(2)})
+
+    (key, data), = states.items()
+    frame_id = data["df"][FRAME_MARKER]
+    assert data == {"df": {FRAME_MARKER: frame_id}, "copy": [{FRAME_MARKER: frame_id}], "count": 2}
+    assert list(frames[key]) == [frame_id]
+
+    loaded = await storage.get_data(KEY)
+    assert loaded["df"].equals(df) and loaded["copy"][0] is loaded["df"] and loaded["count"] == 2
+
+
+async def test_update_data_keeps_stored_frames_and_drops_unreferenced(store):
+    states, frames = store
+    storage = PostgresStorage()
+    await storage.set_data(KEY, {"df": pd.DataFrame({"a": [1]}), "step": 1})
+
+    data = await storage.update_data(KEY, {"step": 2})
+    assert data["step"] == 2 and data["df"].equals(pd.DataFrame({"a": [1]}))
+
+    await storage.update_data(KEY, {"df": None})
+    assert frames[fsm_storage.DefaultKeyBuilder(with_destiny=True).build(KEY)] == {}
+    assert await storage.get_data(KEY) == {"df": None, "step": 2}
+
+
+async def test_dedup_middleware_skips_repeated_updates(monkeypatch):
+    seen = set()
+    monkeypatch.setattr(fsm_storage, "register_update",
+                        lambda db, update_id: update_id not in seen and not seen.add(update_id))
+    middleware = UpdateDedupMiddleware()
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.update_id)
+        return "ok"
+
+    assert await middleware(handler, Update(update_id=1), {}) == "ok"
+    assert await middleware(handler, Update(update_id=1), {}) is None
+    assert await middleware(handler, Update(update_id=2), {}) == "ok"
+    assert handled == [1, 2]
+
+
+@pytest.mark.skipif(not (DATABASE_URL or "").startswith("postgresql"), reason="нужен PostgreSQL")
+def test_concurrent_updates_from_workers_are_not_lost():
+    storage = PostgresStorage()
+    key = StorageKey(bot_id=1, chat_id=-424242, user_id=424242)
+    asyncio.run(storage.set_data(key, {"df": pd.DataFrame({"a": [1, 2]})}))
+
+    # Отдельные циклы событий в потоках — как апдейты одного чата в разных процессах вебхука
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda n: asyncio.run(storage.update_data(key, {f"field_{n}": n})), range(16)))
+
+    try:
+        data = asyncio.run(storage.get_data(key))
+        assert {name for name in data if name.startswith("field_")} == {f"field_{n}" for n in range(16)}
+        assert data["df"].equals(pd.DataFrame({"a": [1, 2]}))
+    finally:
+        asyncio.run(storage.set_data(key, {}))
+        asyncio.run(storage.set_state(key, None))
@@ -0,0 +1,73 @@
+import pytest
+
+from utils import intent_model
+from utils.intent_model import (
+    IntentScorer, classify_with_local_model, join_label, score_predictions, train_intent_model,
+)
+
+
+class FakeModel:
+    version = "1"
+
+    def __init__(self, confidence):
+        self.confidence = confidence
+
+    def predict(self, text):
+        return {"action_type": "create", "entity_type": "campaign"}, self.confidence
+
+
+@pytest.fixture
+def saved_samples(monkeypatch):
+    samples = []
+    monkeypatch.setattr(intent_model, "save_intent_sample", lambda db, text, **kwargs: samples.append(kwargs))
+    return samples
+
+
+def llm_answer(text):
+    return {"action_type": "create", "entity_type": "company"}
+
+
+def test_confident_local_prediction_skips_llm(monkeypatch, saved_samples):
+    monkeypatch.setattr(intent_model, "intent_model", FakeModel(0.99))
+    monkeypatch.setattr(intent_model, "INTENT_AB_RATE", 0.0)
+
+    def fail(text):
+        raise AssertionError("LLM не должна вызываться")
+
+    assert classify_with_local_model("создай кампанию", fail) == {"action_type": "create", "entity_type": "campaign"}
+    assert saved_samples[0]["confidence"] == 0.99 and "labels" not in saved_samples[0]
+
+
+def test_unsure_prediction_falls_back_to_llm_and_logs_both(monkeypatch, saved_samples):
+    monkeypatch.setattr(intent_model, "intent_model", FakeModel(0.4))
+
+    assert classify_with_local_model("добавь компанию", llm_answer) == llm_answer("")
+    assert saved_samples == [{
+        "labels": llm_answer(""), "prediction": {"action_type": "create", "entity_type": "campaign"},
+        "confidence": 0.4, "model_version": "1",
+    }]
+
+
+def test_score_predictions_reports_coverage_and_confident_accuracy():
+    report = score_predictions(["a", "a", "b", "b"], ["a", "b", "b", "a"], [0.9, 0.95, 0.5, 0.3], threshold=0.8)
+    assert report == {"samples": 4, "accuracy": 0.5, "coverage": 0.5, "confident_accuracy": 0.5}
+
+
+def test_train_intent_model_learns_simple_intents():
+    pytest.importorskip("sklearn")
+    phrases = {
+        ("create", "campaign"): ["создай кампанию", "новая кампания рассылки", "запусти кампанию", "сделай кампанию"],
+        ("edit", "company"): ["измени данные компании", "поменяй описание компании", "исправь название компании",
+                              "обнови компанию"],
+    }
+    samples = [(text, *label) for label, texts in phrases.items() for text in texts] * 5
+
+    pipeline, report = train_intent_model(samples, threshold=0.5)
+
+    assert report["classes"] == 2 and report["holdout"]["accuracy"] == 1.0
+    assert pipeline.predict(["создай новую кампанию"])[0] == join_label("create", "campaign")
+
+    # Быстрый расчёт совпадает с predict_proba, в том числе для незнакомых слов
+    scorer = IntentScorer(pipeline)
+    for text in ("создай новую кампанию", "обнови", "qwerty"):
+        assert scorer.predict_proba(text) == pytest.approx(pipeline.predict_proba([text])[0])
@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+import classifier
+from utils import llm_cache
+from utils.llm_cache import get_llm_cache_key
+
+MESSAGES = [{"role": "user", "content": "Фильтрация по Москве"}]
+
+
+def test_cache_key_depends_on_model_messages_and_params():
+    key = get_llm_cache_key("gpt-4", MESSAGES, {"temperature": 0})
+    assert key == get_llm_cache_key("gpt-4", [dict(MESSAGES[0])], {"temperature": 0})
+    assert key != get_llm_cache_key("gpt-3.5-turbo", MESSAGES, {"temperature": 0})
+    assert key != get_llm_cache_key("gpt-4", MESSAGES, {"temperature": 1})
+
+
+def test_only_cacheable_calls_use_cache(monkeypatch):
+    stored = {}
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='{"filters": {}}'))], usage=None)
+
+    monkeypatch.setattr(classifier, "get_openai_client",
+                        lambda: SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+    monkeypatch.setattr(llm_cache, "get_cached_completion",
+                        lambda operation, model, messages, params: stored.get(get_llm_cache_key(model, messages, params)))
+    monkeypatch.setattr(llm_cache, "save_completion",
+                        lambda operation, model, messages, params, response:
+                        stored.setdefault(get_llm_cache_key(model, messages, params), response))
+
+    for _ in range(2):
+        classifier.create_chat_completion("extract_filters", "gpt-4", MESSAGES, cacheable=True)
+    assert len(calls) == 1
+
+    for _ in range(2):
+        classifier.create_chat_completion("draft", "gpt-4", MESSAGES)
+    assert len(calls) == 3
@@ -0,0 +1,172 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import classifier
+from utils import llm_guard
+from utils.llm_guard import (
+    BREAKER_CLOSED, BREAKER_HALF_OPEN, BREAKER_OPEN, PRIORITY_BULK, AdaptiveLimiter, CircuitBreaker, LLMGuard,
+    LLMUnavailableError, llm_priority,
+)
+from utils.llm_router import TASK_EXTRACT, get_route, route_chat_completion
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def rate_limit_error():
+    response = httpx.Response(429, request=httpx.Request("POST", "http://test"))
+    return openai.RateLimitError("Rate limit", response=response, body=None)
+
+
+def test_limiter_grows_additively_and_halves_on_congestion():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=8, tolerance=2.0, clock=clock)
+
+    for _ in range(4):
+        limiter.on_success(1.0)
+    assert int(limiter.limit) == 4 and limiter.limit > 4.9
+
+    limiter.on_congestion()
+    # Повторный сигнал в ту же секунду — та же перегрузка
+    limiter.on_congestion()
+    assert limiter.limit == pytest.approx(2.45, abs=0.05)
+
+    clock.now = 5.0
+    limiter.on_success(10.0)
+    assert limiter.limit == pytest.approx(1.2, abs=0.05)
+
+
+def test_slow_operation_does_not_collapse_limit_of_fast_one():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=8, tolerance=2.0, clock=clock)
+
+    # Классификация и генерация письма на одной модели: у каждой своя обычная задержка
+    for _ in range(20):
+        clock.now += 2
+        limiter.on_success(0.5, "classify")
+        limiter.on_success(8.0, "draft_cluster")
+    assert limiter.limit == 8
+
+    # Устойчивое замедление входит в базовую задержку: лимит снижается, но затем снова растёт
+    for _ in range(60):
+        clock.now += 2
+        limiter.on_success(2.0, "classify")
+    assert limiter.baselines["classify"] > 1.0
+    assert limiter.limit > 4
+
+
+def test_interactive_requests_go_before_bulk():
+    limiter = AdaptiveLimiter(initial=1, minimum=1, maximum=1)
+    assert limiter.acquire(PRIORITY_BULK)
+    # Место занято: интерактивный запрос ждёт не дольше своего таймаута
+    assert not limiter.acquire(timeout=0.01)
+
+    limiter._interactive_waiting = 1
+    limiter.release()
+    assert not limiter.acquire(PRIORITY_BULK, timeout=0.01)
+    assert limiter.acquire(timeout=0.01)
+
+
+async def test_cancelled_async_waiter_does_not_take_a_slot():
+    limiter = AdaptiveLimiter(initial=1, minimum=1, maximum=1)
+    assert limiter.acquire(PRIORITY_BULK)
+
+    waiter = asyncio.create_task(limiter.acquire_async(PRIORITY_BULK))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    limiter.release()
+    assert limiter.in_flight == 0 and not limiter._async_waiters
+
+    # Освободившееся место достаётся ожидающему в цикле событий запросу
+    assert limiter.acquire(PRIORITY_BULK)
+    waiter = asyncio.create_task(limiter.acquire_async(PRIORITY_BULK))
+    await asyncio.sleep(0.01)
+    limiter.release()
+    assert await asyncio.wait_for(waiter, 1) and limiter.in_flight == 1
+
+
+def test_breaker_opens_rejects_interactive_and_recovers():
+    clock = FakeClock()
+    guard = LLMGuard("test-model", breaker=CircuitBreaker(failure_threshold=2, cooldown=30, clock=clock))
+
+    for _ in range(2):
+        with pytest.raises(openai.RateLimitError), guard.slot():
+            raise rate_limit_error()
+    assert guard.breaker.state == BREAKER_OPEN
+
+    with pytest.raises(LLMUnavailableError), guard.slot():
+        pass
+    assert guard.limiter.in_flight == 0
+
+    clock.now = 30.0
+    assert guard.breaker.state == BREAKER_HALF_OPEN
+    with guard.slot():
+        pass
+    assert guard.breaker.failures == 0 and guard.breaker.opened_at is None
+
+
+def test_bulk_waits_for_breaker_cooldown(monkeypatch):
+    clock = FakeClock()
+    guard = LLMGuard("test-model", breaker=CircuitBreaker(failure_threshold=1, cooldown=30, clock=clock))
+    guard.breaker.record_failure()
+
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr(llm_guard, "time", SimpleNamespace(sleep=sleep, perf_counter=time.perf_counter))
+    with llm_priority(PRIORITY_BULK), guard.slot():
+        pass
+    assert sleeps == [30]
+
+
+def test_router_skips_model_with_open_breaker(monkeypatch):
+    models, _ = get_route(TASK_EXTRACT)
+    primary = LLMGuard(models[0], breaker=CircuitBreaker(failure_threshold=1))
+    primary.breaker.record_failure()
+    monkeypatch.setattr(llm_guard, "_guards", {models[0]: primary})
+
+    calls = []
+
+    def create_chat_completion(operation, model, messages, cacheable=False, **kwargs):
+        calls.append(model)
+        return "ok"
+
+    monkeypatch.setattr(classifier, "create_chat_completion", create_chat_completion)
+
+    assert route_chat_completion(TASK_EXTRACT, "extract_filters", [{"role": "user", "content": "x"}]) == "ok"
+    assert calls == [models[1]]
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    clock = FakeClock()
+    guard = LLMGuard("test-model", breaker=CircuitBreaker(failure_threshold=1, cooldown=30, clock=clock))
+    guard.breaker.record_failure()
+    clock.now = 30.0
+
+    with guard.slot():
+        # Пока идёт пробный запрос, остальные не пропускаются
+        assert not guard.breaker.is_available()
+        with pytest.raises(LLMUnavailableError), guard.slot():
+            pass
+    assert guard.breaker.state == BREAKER_CLOSED
+
+    guard.breaker.record_failure()
+    clock.now = 60.0
+    # Проба без ответа о перегрузке (отмена) освобождает место пробы
+    with pytest.raises(KeyboardInterrupt), guard.slot():
+        raise KeyboardInterrupt
+    assert guard.breaker.state == BREAKER_HALF_OPEN and guard.breaker.is_available()
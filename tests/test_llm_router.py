@@ -0,0 +1,39 @@
+import httpx
+import openai
+import pytest
+
+import classifier
+from utils.llm_router import TASK_EXTRACT, get_route, parse_routes, parse_timeouts, route_chat_completion
+
+
+def test_parse_route_overrides():
+    assert parse_routes("extract=gpt-4o-mini|gpt-3.5-turbo, generate=gpt-4,bad") == {
+        "extract": ["gpt-4o-mini", "gpt-3.5-turbo"], "generate": ["gpt-4"]
+    }
+    assert parse_timeouts("Extract=2.5") == {"extract": 2.5}
+
+
+def test_falls_back_to_next_model_on_timeout(monkeypatch):
+    models, timeout = get_route(TASK_EXTRACT)
+    calls = []
+
+    def create_chat_completion(operation, model, messages, cacheable=False, **kwargs):
+        calls.append((model, kwargs["timeout"]))
+        if model == models[0]:
+            raise openai.APITimeoutError(request=httpx.Request("POST", "http://test"))
+        return "ok"
+
+    monkeypatch.setattr(classifier, "create_chat_completion", create_chat_completion)
+
+    assert route_chat_completion(TASK_EXTRACT, "extract_filters", [{"role": "user", "content": "x"}]) == "ok"
+    assert calls == [(models[0], timeout), (models[1], timeout)]
+
+
+def test_does_not_fall_back_on_bad_request(monkeypatch):
+    def create_chat_completion(operation, model, messages, cacheable=False, **kwargs):
+        raise ValueError("некорректный запрос")
+
+    monkeypatch.setattr(classifier, "create_chat_completion", create_chat_completion)
+
+    with pytest.raises(ValueError):
+        route_chat_completion(TASK_EXTRACT, "extract_filters", [{"role": "user", "content": "x"}])
@@ -0,0 +1,59 @@
+import json
+import logging
+
+from logger import JsonFormatter, SampledLogger, parse_module_levels
+
+
+class _Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _logger(name: str, level: int) -> tuple[logging.Logger, _Collect]:
+    log = logging.getLogger(name)
+    log.setLevel(level)
+    log.propagate = False
+    handler = _Collect()
+    log.handlers = [handler]
+    return log, handler
+
+
+def test_sampled_logger_skips_formatting_when_level_disabled():
+    log, handler = _logger("tests.sampled.disabled", logging.INFO)
+
+    class Explodes:
+        def __str__(self):
+            raise AssertionError("сообщение не должно форматироваться")
+
+    SampledLogger(log).debug("строка %s", Explodes())
+    assert handler.records == []
+
+
+def test_sampled_logger_samples_and_reports_suppressed():
+    log, handler = _logger("tests.sampled.enabled", logging.DEBUG)
+    sampled = SampledLogger(log, every=10, per_second=1000)
+
+    for row in range(1, 31):
+        sampled.debug("строка %d", row)
+
+    assert [record.getMessage() for record in handler.records] == ["строка 10", "строка 20", "строка 30"]
+    assert [record.suppressed for record in handler.records] == [9, 9, 9]
+
+
+def test_json_formatter_includes_extra_fields():
+    record = logging.LogRecord("utils.chat_queue", logging.INFO, __file__, 1, "очередь %d", (3,), None)
+    record.chat_id = 42
+    payload = json.loads(JsonFormatter().format(record))
+    assert payload["msg"] == "очередь 3"
+    assert payload["level"] == "INFO"
+    assert payload["chat_id"] == 42
+
+
+def test_parse_module_levels():
+    assert parse_module_levels("sqlalchemy.engine=warning, utils.parser_email_table=DEBUG,,bad") == {
+        "sqlalchemy.engine": "WARNING", "utils.parser_email_table": "DEBUG"
+    }
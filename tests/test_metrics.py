@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+
+from utils.metrics import get_llm_cost, instrument_engine, record_llm_usage
+
+
+def _sample(name: str, labels: dict) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_llm_cost_matches_versioned_model_names():
+    assert get_llm_cost("gpt-4", 1000, 1000) == 0.09
+    assert get_llm_cost("gpt-4o-mini-2024-07-18", 1000, 0) == 0.00015
+    assert get_llm_cost("unknown-model", 1000, 1000) == 0
+
+
+def test_record_llm_usage_counts_tokens_and_cost():
+    labels = {"model": "gpt-3.5-turbo", "operation": "test_usage"}
+    before = _sample("llm_tokens_total", {**labels, "kind": "prompt"})
+
+    cost = record_llm_usage("gpt-3.5-turbo", "test_usage", SimpleNamespace(prompt_tokens=200, completion_tokens=50))
+
+    assert _sample("llm_tokens_total", {**labels, "kind": "prompt"}) == before + 200
+    assert _sample("llm_cost_usd_total", labels) == cost > 0
+    assert record_llm_usage("gpt-3.5-turbo", "test_usage", None) == 0.0
+
+
+def test_engine_queries_are_timed_by_statement_type():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    before = _sample("db_query_seconds_count", {"statement": "SELECT"})
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    assert _sample("db_query_seconds_count", {"statement": "SELECT"}) == before + 1
@@ -0,0 +1,52 @@
+import pandas as pd
+from sqlalchemy.dialects import postgresql
+
+from utils.segment_filters import compile_filters, get_filters_hash, load_campaign_filters
+
+LEADS = pd.DataFrame([
+    {"id": 1, "region": "Москва", "director_name": "Сергей", "employee_count": "1 200"},
+    {"id": 2, "region": "г. москва", "director_name": "", "employee_count": "80"},
+    {"id": 3, "region": "Санкт-Петербург", "director_name": None, "employee_count": "н/д"},
+])
+
+
+def _ids(filters: dict) -> list:
+    return compile_filters(filters).apply(LEADS)["id"].tolist()
+
+
+def test_substring_and_list_filters_ignore_case():
+    assert _ids({"region": "МОСКВА"}) == [1, 2]
+    assert _ids({"region": ["москва", "петербург"]}) == [1, 2, 3]
+
+
+def test_presence_filters():
+    assert _ids({"director_name": True}) == [1]
+    assert _ids({"director_name": "false"}) == [2, 3]
+
+
+def test_numeric_operators_skip_non_numeric_values():
+    assert _ids({"employee_count": {">": 500}}) == [1]
+    assert _ids({"employee_count": {"<=": 80}}) == [2]
+
+
+def test_compiled_filters_are_cached_by_hash():
+    first = compile_filters({"region": "Москва", "director_name": True})
+    second = compile_filters({"director_name": True, "region": "Москва"})
+
+    assert first is second
+    assert first.filter_hash == get_filters_hash({"director_name": True, "region": "Москва"})
+
+
+def test_sql_backend_renders_where_clause():
+    query = compile_filters({"region": "Москва"}).select_query("segmentation_email_1", limit=20)
+    sql = str(query.compile(dialect=postgresql.dialect()))
+
+    assert "FROM segmentation_email_1" in sql
+    assert "lower(region) LIKE" in sql
+    assert "LIMIT" in sql
+
+
+def test_load_campaign_filters_accepts_json_string():
+    assert load_campaign_filters('{"region": ["Москва"]}') == {"region": ["Москва"]}
+    assert load_campaign_filters("not json") == {}
+    assert load_campaign_filters(None) == {}
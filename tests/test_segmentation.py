@@ -0,0 +1,91 @@
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from config import DATABASE_URL
+from db.db_segmentation import get_campaign_lead_ids, materialize_campaign_segment, refresh_segments_for_email_table
+from db.dynamic_table_manager import create_dynamic_email_table
+from db.models import Campaigns, ChatThread, Company, EmailTable
+from utils import segment_utils
+from utils.segment_utils import SEGMENT_PREVIEW_EMPTY, estimate_segment_size, format_segment_preview
+
+TABLE_NAME = "segmentation_email_test"
+# ID тестовых записей: вне диапазона, который выдают последовательности
+TEST_ID = 990001
+
+postgres_only = pytest.mark.skipif(not (DATABASE_URL or "").startswith("postgresql"), reason="нужен PostgreSQL")
+
+
+def test_preview_keeps_empty_cells_in_place():
+    preview = pd.DataFrame([
+        {"name": "ООО Ромашка", "region": None, "email": "a@a.ru"},
+        {"name": " ", "region": float("nan"), "email": "b@b.ru"},
+    ])
+
+    header, *rows = format_segment_preview(preview).splitlines()
+
+    assert header.count("|") == 2
+    assert rows == [
+        f"1. ООО Ромашка | {SEGMENT_PREVIEW_EMPTY} | a@a.ru",
+        f"2. {SEGMENT_PREVIEW_EMPTY} | {SEGMENT_PREVIEW_EMPTY} | b@b.ru",
+    ]
+
+
+@pytest.fixture
+def db():
+    """ Сессия в транзакции, которая откатывается после теста (вместе с созданной email-таблицей). """
+    engine = create_engine(DATABASE_URL)
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        session = Session(bind=conn, join_transaction_mode="create_savepoint")
+        create_dynamic_email_table(conn, TABLE_NAME)
+        conn.execute(text(
+            f'INSERT INTO "{TABLE_NAME}" (id, name, region, email) VALUES '
+            f"(1, 'Альфа', 'Москва', 'a@a.ru'), (2, 'Бета', 'Казань', 'b@b.ru'), (3, 'Гамма', 'г. Москва', 'c@c.ru')"
+        ))
+        session.add(Company(company_id=TEST_ID, chat_id=str(TEST_ID), telegram_id=str(TEST_ID)))
+        session.add(ChatThread(chat_id=TEST_ID, thread_id=TEST_ID, thread_name="Тест"))
+        session.flush()
+        session.add(EmailTable(email_table_id=TEST_ID, company_id=TEST_ID, table_name=TABLE_NAME))
+        session.flush()
+        session.add(Campaigns(campaign_id=TEST_ID, company_id=TEST_ID, thread_id=TEST_ID, campaign_name="Тест",
+                              filters={"region": "москва"}, email_table_id=TEST_ID))
+        session.flush()
+        try:
+            yield session
+        finally:
+            session.close()
+            transaction.rollback()
+    engine.dispose()
+
+
+@postgres_only
+def test_segment_is_materialized_and_refreshed_incrementally(db):
+    assert materialize_campaign_segment(db, TEST_ID) == 2
+    assert get_campaign_lead_ids(db, TEST_ID) == [1, 3]
+
+    # Лид 1 переехал, лид 2 попал в сегмент, лид 3 не менялся и не перечитывается
+    db.execute(text(f"UPDATE \"{TABLE_NAME}\" SET region = CASE id WHEN 1 THEN 'Тверь' ELSE 'Москва' END "
+                    f"WHERE id IN (1, 2)"))
+    assert refresh_segments_for_email_table(db, TEST_ID, [1, 2]) == 1
+    assert get_campaign_lead_ids(db, TEST_ID) == [2, 3]
+
+
+@postgres_only
+def test_missing_email_table_is_not_materialized(db):
+    db.query(Campaigns).filter_by(campaign_id=TEST_ID).update({"email_table_id": None})
+
+    assert materialize_campaign_segment(db, TEST_ID) is None
+    assert refresh_segments_for_email_table(db, TEST_ID + 1, [1]) == 0
+
+
+@postgres_only
+def test_segment_size_is_exact_for_small_tables_and_sampled_for_large(db, monkeypatch):
+    monkeypatch.setattr(segment_utils, "estimate_table_rows", lambda db, table_name: 3)
+    assert estimate_segment_size(db, TABLE_NAME, {"region": "москва"}) == (2, True)
+
+    # Большая таблица: доля подходящих строк в выборке (здесь — во всей таблице) умножается на оценку размера
+    monkeypatch.setattr(segment_utils, "estimate_table_rows", lambda db, table_name: 90000)
+    monkeypatch.setattr(segment_utils, "SEGMENT_SAMPLE_ROWS", 90000)
+    assert estimate_segment_size(db, TABLE_NAME, {"region": "москва"}) == (60000, False)
@@ -0,0 +1,71 @@
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from promts.base_promt import BASE_PROMPT
+from promts.output_schemas import DraftEmail, MessageClassification
+from utils import structured_output
+from utils.llm_router import TASK_CLASSIFY, TASK_GENERATE
+from utils.metrics import LLM_RETRIES_AVOIDED
+from utils.structured_output import StructuredOutputError, parse_json_tolerant, request_structured
+
+
+def make_response(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+@pytest.mark.parametrize("text", [
+    '```json\n{"a": 1}\n```',
+    'Ответ: {"a": 1}',
+    '{"a": 1,}',
+    "{'a': 1}",
+    '{“a”: 1}',
+    'Вот результат:\n{"a": 1}\nГотово.',
+])
+def test_parse_json_tolerant_repairs_common_mistakes(text):
+    assert parse_json_tolerant(text) == {"a": 1}
+
+
+def test_repaired_answer_needs_no_retry(monkeypatch):
+    calls = []
+
+    def route_chat_completion(task, operation, messages, **kwargs):
+        calls.append(kwargs)
+        return make_response('Ответ: {"action_type": "view", "entity_type": "company",}')
+
+    monkeypatch.setattr(structured_output, "route_chat_completion", route_chat_completion)
+    avoided = LLM_RETRIES_AVOIDED.labels("classify")._value.get()
+
+    result = request_structured(TASK_CLASSIFY, "classify", "prompt", MessageClassification)
+
+    assert result.entity_type == "company"
+    assert calls == [{"json_mode": True}]
+    assert LLM_RETRIES_AVOIDED.labels("classify")._value.get() == avoided + 1
+
+
+def test_invalid_answer_is_retried_once(monkeypatch):
+    replies = iter(['{"subject": ""}', '{"subject": "Тема", "text": "Письмо"}'])
+    sent = []
+
+    def route_chat_completion(task, operation, messages, **kwargs):
+        sent.append(messages)
+        return make_response(next(replies))
+
+    monkeypatch.setattr(structured_output, "route_chat_completion", route_chat_completion)
+
+    assert request_structured(TASK_GENERATE, "draft", "prompt", DraftEmail).subject == "Тема"
+    assert len(sent) == 2
+    assert sent[1][-1]["role"] == "user" and sent[1][-2]["content"] == '{"subject": ""}'
+
+    monkeypatch.setattr(structured_output, "route_chat_completion", lambda *args, **kwargs: make_response("нет"))
+    with pytest.raises(StructuredOutputError):
+        request_structured(TASK_GENERATE, "draft", "prompt", DraftEmail)
+
+
+def test_base_prompt_examples_match_classification_schema():
+    examples = re.findall(r"\{\{(\"action_type\".*?)\}\}", BASE_PROMPT)
+
+    assert examples
+    for example in examples:
+        MessageClassification.model_validate_json(f"{{{example}}}")
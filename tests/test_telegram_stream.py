@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText
+
+from utils import telegram_stream
+from utils.telegram_stream import STREAM_CURSOR, TELEGRAM_MESSAGE_LIMIT, finish_stream_message, stream_to_message
+
+
+class FakeMessage:
+    def __init__(self):
+        self.edits = []
+        self.answers = []
+        self.retry_after = 0
+
+    async def reply(self, text):
+        self.placeholder = text
+        return self
+
+    async def edit_text(self, text):
+        if self.retry_after:
+            retry_after, self.retry_after = self.retry_after, 0
+            raise TelegramRetryAfter(EditMessageText(text=text), "Flood control exceeded", retry_after)
+        self.edits.append(text)
+
+    async def answer(self, text):
+        self.answers.append(text)
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+async def test_stream_edits_first_chunk_immediately_then_throttles(monkeypatch):
+    clock = iter([0.0, 0.0, 0.5, 1.0, 2.0, 2.0])
+    monkeypatch.setattr(telegram_stream, "time", SimpleNamespace(monotonic=lambda: next(clock)))
+    message = FakeMessage()
+
+    text, reply = await stream_to_message(message, chunks("Здравствуйте", ", ", "коллеги", "!"), interval=1.5)
+
+    assert text == "Здравствуйте, коллеги!"
+    # Первый фрагмент — сразу, следующие два — в пределах интервала, последний — после него
+    assert message.edits == ["Здравствуйте" + STREAM_CURSOR, "Здравствуйте, коллеги!" + STREAM_CURSOR]
+
+
+async def test_finish_waits_for_flood_control_and_splits_long_text(monkeypatch):
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(telegram_stream, "asyncio", SimpleNamespace(sleep=sleep))
+    message = FakeMessage()
+    message.retry_after = 3
+
+    await finish_stream_message(message, "а" * (TELEGRAM_MESSAGE_LIMIT + 10))
+
+    assert sleeps == [3]
+    assert message.edits == ["а" * TELEGRAM_MESSAGE_LIMIT]
+    assert message.answers == ["а" * 10]
+
+
+async def test_failed_stream_replaces_partial_text_with_error():
+    async def failing_chunks():
+        yield "Здравствуйте"
+        raise RuntimeError("обрыв соединения")
+
+    message = FakeMessage()
+
+    with pytest.raises(RuntimeError):
+        await stream_to_message(message, failing_chunks(), error_text="Ошибка при генерации.")
+
+    assert message.edits == ["Здравствуйте" + STREAM_CURSOR, "Ошибка при генерации."]
+    assert message.answers == []
@@ -0,0 +1,40 @@
+import pytest
+from aiohttp.test_utils import TestServer
+
+from agents import tempate_agent
+from fake_openai.server import FAKE_OPENAI_KEY, FakeOpenAI, create_app
+from utils import usage
+from utils.usage import UsageLedger, usage_context
+
+TEMPLATE_INPUT = {
+    "company_name": "ООО Ромашка", "industry": "IT", "content_plan": "Знакомство", "subject": "Приглашение",
+    "user_request": "коротко",
+}
+
+
+@pytest.fixture
+async def fake_server(monkeypatch):
+    server = TestServer(create_app(FakeOpenAI(latency="fixed:0.1", seed=1)))
+    await server.start_server()
+    monkeypatch.setattr(tempate_agent, "OPENAI_BASE_URL", str(server.make_url("/v1")))
+    monkeypatch.setattr(usage, "ledger", UsageLedger())
+    tempate_agent.get_template_chains.cache_clear()
+    yield server.app[FAKE_OPENAI_KEY]
+    tempate_agent.get_template_chains.cache_clear()
+    await server.close()
+
+
+async def test_variants_are_generated_concurrently_and_accounted(fake_server):
+    with usage_context(company_id=1):
+        variants = await tempate_agent.async_template_variants_tool([TEMPLATE_INPUT] * 3)
+
+    assert len(variants) == 3 and all(variants)
+    assert fake_server.stats["max_in_flight"] == 3
+    assert usage.ledger.pending_usage(1)["requests"] == 3
+
+
+async def test_stream_yields_text_chunks(fake_server):
+    chunks = [chunk async for chunk in tempate_agent.stream_template_chain("template_generation", TEMPLATE_INPUT)]
+
+    assert len(chunks) > 1
+    assert "".join(chunks) == await tempate_agent.async_template_generation_tool(TEMPLATE_INPUT)
@@ -0,0 +1,39 @@
+import asyncio
+from types import SimpleNamespace
+
+from utils import usage
+from utils.usage import UsageLedger, check_budget, usage_context
+
+
+def test_ledger_aggregates_usage_by_context(monkeypatch):
+    ledger = UsageLedger()
+    monkeypatch.setattr(usage, "ledger", ledger)
+
+    async def generate_draft():
+        usage.record_usage("gpt-4", "draft", SimpleNamespace(prompt_tokens=100, completion_tokens=50))
+
+    async def generate_wave():
+        with usage_context(company_id=1, campaign_id=2, wave_id=3):
+            await asyncio.gather(generate_draft(), generate_draft())
+        usage.record_usage("gpt-4o-mini", "classify", SimpleNamespace(prompt_tokens=10, completion_tokens=1))
+
+    asyncio.run(generate_wave())
+
+    pending = ledger.pending_usage(1)
+    assert pending["requests"] == 2
+    assert pending["prompt_tokens"] == 200 and pending["completion_tokens"] == 100
+    assert pending["cost_usd"] > 0
+    # Запрос вне контекста волны компании не засчитывается
+    assert ledger.pending_usage(0)["requests"] == 1
+
+
+def test_check_budget_uses_quota_override_and_pending_usage(monkeypatch):
+    monkeypatch.setattr(usage, "get_company_quota",
+                        lambda db, company_id: SimpleNamespace(monthly_budget_usd=10.0, monthly_token_limit=None))
+    monkeypatch.setattr(usage, "get_company_usage", lambda db, company_id, since: {
+        "requests": 10, "prompt_tokens": 1000, "completion_tokens": 500, "cost_usd": 9.0
+    })
+    monkeypatch.setattr(usage, "ledger", UsageLedger())
+
+    assert check_budget(None, 1, tokens=100, cost=0.5) is None
+    assert "Бюджет" in check_budget(None, 1, tokens=100, cost=1.5)
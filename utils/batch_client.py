@@ -0,0 +1,148 @@
+import json
+import os
+import uuid
+
+from config import LLM_BATCH_BACKEND, LLM_BATCH_DIR
+from logger import logger
+
+# Эндпоинт, для которого собираются запросы пакета
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Окно выполнения пакета OpenAI (других значений API не принимает)
+BATCH_COMPLETION_WINDOW = "24h"
+
+
+def dump_jsonl(rows: list[dict]) -> bytes:
+    return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode("utf-8")
+
+
+def load_jsonl(text: str) -> list[dict]:
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+class OpenAIBatchClient:
+    """ Пакетные задания через OpenAI Batch API: дешевле обычных запросов и не делят лимиты с интерактивными. """
+
+    name = "openai"
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from classifier import get_openai_client
+
+            self._client = get_openai_client()
+        return self._client
+
+    def submit(self, requests: list[dict], metadata: dict | None = None) -> str:
+        """
+        Загружает запросы JSONL-файлом и создаёт пакетное задание.
+
+        :param requests: Строки пакета (custom_id, method, url, body).
+        :param metadata: Метаданные задания (строковые значения).
+        :return: ID задания.
+        """
+        input_file = self.client.files.create(file=("drafts.jsonl", dump_jsonl(requests)), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+            metadata=metadata,
+        )
+        return batch.id
+
+    def retrieve(self, batch_id: str) -> dict:
+        """
+        Возвращает состояние задания.
+
+        :param batch_id: ID задания.
+        :return: {"status", "output_file_id", "error_file_id"}; статусы — как в OpenAI Batch API.
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        return {"status": batch.status, "output_file_id": batch.output_file_id, "error_file_id": batch.error_file_id}
+
+    def download(self, file_id: str) -> list[dict]:
+        """ Скачивает файл результатов или ошибок задания. """
+        return load_jsonl(self.client.files.content(file_id).text)
+
+    def cancel(self, batch_id: str):
+        self.client.batches.cancel(batch_id)
+
+
+class LocalBatchClient:
+    """
+    Локальная замена Batch API с тем же интерфейсом: задание — каталог с input.jsonl, запросы выполняются
+    обычными вызовами модели при первом опросе, результаты пишутся в output.jsonl в формате OpenAI.
+    Для разработки и тестов (в том числе с заглушкой fake_openai).
+    """
+
+    name = "local"
+
+    def __init__(self, directory: str = LLM_BATCH_DIR):
+        self.directory = directory
+
+    def _path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.directory, batch_id, name)
+
+    def submit(self, requests: list[dict], metadata: dict | None = None) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex}"
+        os.makedirs(os.path.join(self.directory, batch_id))
+        with open(self._path(batch_id, "input.jsonl"), "wb") as file:
+            file.write(dump_jsonl(requests))
+        with open(self._path(batch_id, "metadata.json"), "w", encoding="utf-8") as file:
+            json.dump(metadata or {}, file, ensure_ascii=False)
+        return batch_id
+
+    def retrieve(self, batch_id: str) -> dict:
+        if os.path.exists(self._path(batch_id, "cancelled")):
+            return {"status": "cancelled", "output_file_id": None, "error_file_id": None}
+        if not os.path.exists(self._path(batch_id, "output.jsonl")):
+            self._run(batch_id)
+        return {"status": "completed", "output_file_id": f"{batch_id}/output.jsonl", "error_file_id": None}
+
+    def download(self, file_id: str) -> list[dict]:
+        with open(os.path.join(self.directory, file_id), encoding="utf-8") as file:
+            return load_jsonl(file.read())
+
+    def cancel(self, batch_id: str):
+        open(self._path(batch_id, "cancelled"), "w").close()
+
+    def _run(self, batch_id: str):
+        from classifier import create_chat_completion
+        from utils.llm_guard import PRIORITY_BULK, llm_priority
+
+        with open(self._path(batch_id, "input.jsonl"), encoding="utf-8") as file:
+            requests = load_jsonl(file.read())
+
+        results = []
+        for request in requests:
+            body = dict(request["body"])
+            try:
+                with llm_priority(PRIORITY_BULK):
+                    response = create_chat_completion("draft_batch", body.pop("model"), body.pop("messages"), **body)
+                results.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                                "response": {"status_code": 200, "body": response.model_dump()}, "error": None})
+            except Exception as e:
+                logger.warning(f"⚠️ Запрос {request['custom_id']} локального пакета {batch_id} не выполнен: {e}")
+                results.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                                "response": None, "error": {"code": type(e).__name__, "message": str(e)}})
+
+        # Сначала во временный файл: недописанный output.jsonl не должен считаться готовым результатом
+        tmp_path = self._path(batch_id, "output.jsonl.tmp")
+        with open(tmp_path, "wb") as file:
+            file.write(dump_jsonl(results))
+        os.replace(tmp_path, self._path(batch_id, "output.jsonl"))
+
+
+def get_batch_client(backend: str = LLM_BATCH_BACKEND):
+    """
+    Возвращает клиент пакетных заданий.
+
+    :param backend: "openai" или "local".
+    :return: OpenAIBatchClient или LocalBatchClient.
+    """
+    clients = {OpenAIBatchClient.name: OpenAIBatchClient, LocalBatchClient.name: LocalBatchClient}
+    if backend not in clients:
+        raise ValueError(f"Неизвестный провайдер пакетной генерации: {backend}")
+    return clients[backend]()
@@ -0,0 +1,141 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from logger import logger
+from utils.metrics import CHAT_QUEUE_DEPTH, CHAT_QUEUE_DROPPED, CHAT_QUEUE_WAIT
+
+# Сколько апдейтов одного чата может ждать обработки; лишние отбрасываются с уведомлением пользователя
+CHAT_QUEUE_MAX_DEPTH = 10
+# Ожидание в очереди дольше этого порога логируется как предупреждение (секунды)
+CHAT_QUEUE_SLOW_WAIT = 10
+CHAT_QUEUE_OVERLOAD_TEXT = "⏳ Я ещё обрабатываю ваши предыдущие сообщения. Подождите немного и повторите."
+
+
+class _QueuedUpdate:
+    def __init__(self, handler, event, data, key):
+        self.handler = handler
+        self.event = event
+        self.data = data
+        self.key = key
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class ChatQueueMiddleware(BaseMiddleware):
+    """
+    Последовательная обработка апдейтов каждого чата: строго по порядку внутри чата и параллельно между чатами.
+    Очередь чата ограничена по глубине (лишние апдейты отбрасываются), а повторы одного и того же
+    сообщения или нажатия кнопки, уже ожидающие в очереди, схлопываются.
+    """
+
+    def __init__(self, max_depth: int = CHAT_QUEUE_MAX_DEPTH):
+        self.max_depth = max_depth
+        self._queues: dict[int, list[_QueuedUpdate]] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+        self.stats = {"processed": 0, "shed": 0, "coalesced": 0, "max_depth": 0, "max_wait": 0.0, "total_wait": 0.0}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        chat_id = get_event_chat_id(event)
+        if chat_id is None:
+            return await handler(event, data)
+
+        queue = self._queues.setdefault(chat_id, [])
+        key = get_event_dedup_key(event)
+
+        if key is not None and any(queued.key == key for queued in queue[1:]):
+            self.stats["coalesced"] += 1
+            CHAT_QUEUE_DROPPED.labels("coalesced").inc()
+            logger.info(f"🔁 Чат {chat_id}: повторное сообщение уже ждёт в очереди, дубликат пропущен.")
+            return None
+
+        if len(queue) >= self.max_depth:
+            self.stats["shed"] += 1
+            CHAT_QUEUE_DROPPED.labels("shed").inc()
+            logger.warning(f"⚠️ Чат {chat_id}: очередь переполнена ({len(queue)}), апдейт отброшен.")
+            await notify_overload(event)
+            return None
+
+        queued = _QueuedUpdate(handler, event, data, key)
+        queue.append(queued)
+        CHAT_QUEUE_DEPTH.inc()
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(queue))
+
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._run_chat(chat_id))
+
+        return await queued.future
+
+    async def _run_chat(self, chat_id: int):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                # Апдейт остаётся в очереди во время обработки: так глубина учитывает и выполняющийся
+                queued = queue[0]
+                wait = time.monotonic() - queued.enqueued_at
+                self.stats["total_wait"] += wait
+                self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+                CHAT_QUEUE_WAIT.observe(wait)
+                if wait > CHAT_QUEUE_SLOW_WAIT:
+                    logger.warning(f"🐢 Чат {chat_id}: апдейт ждал обработки {wait:.1f} с (в очереди {len(queue)}).")
+
+                try:
+                    result = await queued.handler(queued.event, queued.data)
+                except Exception as e:
+                    if not queued.future.done():
+                        queued.future.set_exception(e)
+                else:
+                    if not queued.future.done():
+                        queued.future.set_result(result)
+                finally:
+                    queue.pop(0)
+                    CHAT_QUEUE_DEPTH.dec()
+                    self.stats["processed"] += 1
+        finally:
+            self._workers.pop(chat_id, None)
+            if not queue:
+                self._queues.pop(chat_id, None)
+
+    def get_queue_depths(self) -> dict[int, int]:
+        """ Текущая глубина очередей по чатам (включая апдейт, который обрабатывается). """
+        return {chat_id: len(queue) for chat_id, queue in self._queues.items() if queue}
+
+
+def get_event_chat_id(event: TelegramObject) -> int | None:
+    if isinstance(event, Message):
+        return event.chat.id
+    if isinstance(event, CallbackQuery) and event.message:
+        return event.message.chat.id
+    return None
+
+
+def get_event_dedup_key(event: TelegramObject) -> tuple | None:
+    """ Ключ для схлопывания повторов: тот же пользователь, тот же текст или та же кнопка. """
+    user_id = event.from_user.id if getattr(event, "from_user", None) else None
+    if isinstance(event, Message) and event.text:
+        return "message", user_id, event.message_thread_id, event.text.strip()
+    if isinstance(event, CallbackQuery) and event.data:
+        return "callback", user_id, event.data
+    return None
+
+
+async def notify_overload(event: TelegramObject):
+    try:
+        if isinstance(event, Message):
+            await event.reply(CHAT_QUEUE_OVERLOAD_TEXT)
+        elif isinstance(event, CallbackQuery):
+            await event.answer(CHAT_QUEUE_OVERLOAD_TEXT, show_alert=True)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось уведомить о переполнении очереди: {e}")
+
+
+# Общая очередь для сообщений и нажатий кнопок: они меняют одно и то же FSM-состояние чата
+chat_queue = ChatQueueMiddleware()
@@ -0,0 +1,169 @@
+import hashlib
+import re
+
+from db.segmentation import EMAIL_SEGMENT_COLUMNS, EMAIL_SEGMENT_TRANSLATIONS
+
+# Синонимы заголовков популярных выгрузок (CRM, СПАРК, Контур и т.п.) для полей email-сегмента
+COLUMN_SYNONYMS = {
+    "name": [
+        "название", "наименование", "компания", "организация", "название организации", "наименование организации",
+        "краткое наименование", "полное наименование", "company", "company name", "organization",
+    ],
+    "region": ["регион", "область", "субъект рф", "регион регистрации", "region"],
+    "msp_registry": ["реестр мсп", "мсп", "категория мсп", "категория субъекта мсп", "sme registry"],
+    "director_name": [
+        "директор", "руководитель", "генеральный директор", "фио директора", "фио руководителя",
+        "имя руководителя", "director", "ceo",
+    ],
+    "director_position": ["должность", "должность руководителя", "position", "director position"],
+    "phone_number": ["телефон", "телефоны", "номер телефона", "контактный телефон", "phone", "phone number", "tel"],
+    "email": ["e-mail", "эл почта", "электронная почта", "почта", "адрес электронной почты", "mail", "e mail"],
+    "website": ["сайт", "веб сайт", "адрес сайта", "site", "web", "url"],
+    "primary_activity": [
+        "вид деятельности", "основной вид деятельности", "оквэд", "основной оквэд", "отрасль", "activity", "industry",
+    ],
+    "revenue": ["выручка", "доход", "оборот", "revenue"],
+    "employee_count": [
+        "численность", "численность сотрудников", "количество сотрудников", "среднесписочная численность",
+        "сотрудники", "employees", "staff",
+    ],
+}
+
+# Минимальная похожесть (1 - расстояние Левенштейна / длина) для нечёткого совпадения
+FUZZY_HEADER_SIMILARITY = 0.85
+FUZZY_TOKEN_SIMILARITY = 0.8
+# Слова короче этого сравниваются только точно («мсп», «тел», «url»)
+FUZZY_MIN_TOKEN_LENGTH = 4
+
+
+def normalize_header(header) -> str:
+    """
+    Нормализует заголовок колонки: нижний регистр, «ё» → «е», без знаков препинания и лишних пробелов.
+
+    :param header: Заголовок колонки.
+    :return: Нормализованный заголовок.
+    """
+    header = str(header).lower().replace("ё", "е")
+    return " ".join(re.sub(r"[^\w]+", " ", header).replace("_", " ").split())
+
+
+def get_header_signature(user_columns: list) -> str:
+    """
+    Возвращает сигнатуру набора заголовков: не зависит от порядка колонок, регистра и пунктуации.
+
+    :param user_columns: Заголовки загруженной таблицы.
+    :return: sha256 в hex.
+    """
+    headers = sorted({normalize_header(column) for column in user_columns})
+    return hashlib.sha256("\n".join(headers).encode("utf-8")).hexdigest()
+
+
+def levenshtein_distance(a: str, b: str) -> int:
+    """ Расстояние Левенштейна между строками. """
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        previous = current
+    return previous[-1]
+
+
+def similarity(a: str, b: str) -> float:
+    """ Похожесть строк от 0 до 1 на основе расстояния Левенштейна. """
+    if not a or not b:
+        return 0.0
+    return 1 - levenshtein_distance(a, b) / max(len(a), len(b))
+
+
+def _build_synonym_index() -> dict[str, str]:
+    index = {}
+    for field in EMAIL_SEGMENT_COLUMNS:
+        synonyms = [field, field.replace("_", " "), EMAIL_SEGMENT_TRANSLATIONS.get(field, "")]
+        synonyms += COLUMN_SYNONYMS.get(field, [])
+        for synonym in synonyms:
+            normalized = normalize_header(synonym)
+            if normalized:
+                index.setdefault(normalized, field)
+    return index
+
+
+# Нормализованный синоним → поле сегмента
+SYNONYM_INDEX = _build_synonym_index()
+
+
+def _tokens_match(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    if min(len(a), len(b)) < FUZZY_MIN_TOKEN_LENGTH:
+        return False
+    return similarity(a, b) >= FUZZY_TOKEN_SIMILARITY
+
+
+def match_header(header) -> str | None:
+    """
+    Локально сопоставляет заголовок с полем email-сегмента без обращения к модели.
+    Порядок: точное совпадение с синонимом → опечатка в синониме (Левенштейн) →
+    все слова синонима встречаются в заголовке («Выручка, тыс. руб.» → revenue).
+    Неоднозначные заголовки («Название региона») остаются нераспознанными.
+
+    :param header: Заголовок колонки.
+    :return: Поле сегмента или None.
+    """
+    normalized = normalize_header(header)
+    if not normalized:
+        return None
+
+    if normalized in SYNONYM_INDEX:
+        return SYNONYM_INDEX[normalized]
+
+    best_similarity, fuzzy_fields = 0.0, set()
+    for synonym, field in SYNONYM_INDEX.items():
+        score = similarity(normalized, synonym)
+        if score > best_similarity:
+            best_similarity, fuzzy_fields = score, {field}
+        elif score == best_similarity:
+            fuzzy_fields.add(field)
+    if best_similarity >= FUZZY_HEADER_SIMILARITY and len(fuzzy_fields) == 1:
+        return fuzzy_fields.pop()
+
+    tokens = normalized.split()
+    best_tokens, token_fields = 0, set()
+    for synonym, field in SYNONYM_INDEX.items():
+        synonym_tokens = synonym.split()
+        if not all(any(_tokens_match(s, t) for t in tokens) for s in synonym_tokens):
+            continue
+        if len(synonym_tokens) > best_tokens:
+            best_tokens, token_fields = len(synonym_tokens), {field}
+        elif len(synonym_tokens) == best_tokens:
+            token_fields.add(field)
+    if len(token_fields) == 1:
+        return token_fields.pop()
+
+    return None
+
+
+def match_columns(user_columns: list) -> tuple[dict, list]:
+    """
+    Локально сопоставляет колонки загруженной таблицы с полями email-сегмента.
+    Если на одно поле претендуют несколько колонок, решение остаётся за моделью.
+
+    :param user_columns: Заголовки загруженной таблицы.
+    :return: (распознанные колонки {заголовок: поле}, нераспознанные заголовки).
+    """
+    matches = {column: match_header(column) for column in user_columns}
+
+    claimed = {}
+    for column, field in matches.items():
+        if field:
+            claimed.setdefault(field, []).append(column)
+
+    resolved = {columns[0]: field for field, columns in claimed.items() if len(columns) == 1}
+    unresolved = [column for column in user_columns if column not in resolved]
+    return resolved, unresolved
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import re
+import threading
+
+from config import COMPANY_CONTEXT_MAX_TOKENS
+from logger import logger
+from promts.template_promt import COMPANY_CONTEXT_FIELDS, format_company_context
+from utils.llm_router import TASK_GENERATE, get_route
+from utils.metrics import COMPANY_CONTEXT_REQUESTS
+from utils.token_counter import count_tokens, truncate_tokens
+
+# Задачи, для которых сокращаются сведения о компании: класс задачи маршрутизатора (по его модели считаются
+# токены) и поля брифа по убыванию важности с лимитом токенов на поле. Лимиты не дают длинным FAQ и кейсам
+# вытеснить главное; оставшийся бюджет затем достаётся обрезанным полям в том же порядке
+CONTEXT_TASKS = {
+    "template": (TASK_GENERATE, (
+        ("company_name", 30),
+        ("business_sector", 60),
+        ("unique_selling_proposition", 250),
+        ("promoted_products_and_services", 300),
+        ("target_audience_b2b_b2c_niche_geography", 150),
+        ("customer_pain_points", 200),
+        ("competitor_differences", 200),
+        ("successful_case_studies", 250),
+        ("company_mission", 100),
+        ("company_values", 100),
+        ("common_customer_objections_and_responses", 200),
+        ("delivery_availability_geographical_coverage", 100),
+        ("frequently_asked_questions_with_answers", 200),
+        ("additional_information", 150),
+        ("resource_links", 80),
+        ("office_addresses_and_hours", 60),
+    )),
+}
+# Меньше стольких токенов поле не добавляется: обрывок текста модели не поможет
+MIN_FIELD_TOKENS = 20
+# Сколько сокращённых сведений хранится в памяти (компания × задача)
+COMPANY_CONTEXT_CACHE_SIZE = 512
+
+# Конец предложения или пункта: обрезанное поле заканчивается на нём, если так теряется не больше половины текста
+SENTENCE_END = re.compile(r"[.!?…;\n]")
+
+# Ключ — (компания, задача, хеш полей брифа): процесс, в котором бриф не сохраняли, не отдаст устаревшие
+# сведения — изменённый бриф даёт другой ключ
+_cache: dict[tuple[int, str, str], str] = {}
+# Номер версии брифа компании: сведения, собранные до сохранения брифа, в кэш не попадают
+_versions: dict[int, int] = {}
+_lock = threading.Lock()
+
+
+def normalize_field(value) -> str:
+    """ Значение поля брифа без лишних пробелов и пустых строк. """
+    lines = (" ".join(line.split()) for line in str(value).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def trim_field(text: str, max_tokens: int, model: str | None = None) -> str:
+    """
+    Обрезает поле брифа до max_tokens токенов по границе предложения.
+
+    :param text: Текст поля.
+    :param max_tokens: Лимит токенов.
+    :param model: Модель, по кодировке которой считаются токены.
+    :return: Текст поля (с « …» в конце, если он обрезан).
+    """
+    truncated = truncate_tokens(text, max_tokens - 1, model)
+    if truncated == text:
+        return text
+    ends = [match.end() for match in SENTENCE_END.finditer(truncated)]
+    if ends and ends[-1] >= len(truncated) // 2:
+        truncated = truncated[:ends[-1]]
+    elif " " in truncated:
+        # Иначе — по границе слова
+        truncated = truncated.rsplit(" ", 1)[0]
+    return f"{truncated.rstrip()} …"
+
+
+def get_brief_hash(company_details: dict, task: str) -> str:
+    """ Хеш полей брифа, из которых собираются сведения для задачи. """
+    fields = {field: str(company_details[field]) for field, _ in CONTEXT_TASKS[task][1] if company_details.get(field)}
+    return hashlib.sha256(json.dumps(fields, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+
+def compact_company_context(company_details: dict, task: str = "template",
+                            max_tokens: int = COMPANY_CONTEXT_MAX_TOKENS, model: str | None = None) -> str:
+    """
+    Сведения о компании для промта задачи в пределах бюджета токенов: поля берутся по важности для задачи
+    (CONTEXT_TASKS) и обрезаются до своих лимитов, оставшийся бюджет дополняет обрезанные поля.
+
+    :param company_details: Поля брифа компании (CompanyInfo).
+    :param task: Задача из CONTEXT_TASKS.
+    :param max_tokens: Бюджет токенов.
+    :param model: Модель, по кодировке которой считаются токены.
+    :return: Сведения о компании в формате format_company_context.
+    """
+    fields = CONTEXT_TASKS[task][1]
+    texts = {field: normalize_field(company_details[field]) for field, _ in fields if company_details.get(field)}
+    tokens = {field: count_tokens(text, model) for field, text in texts.items()}
+
+    limits, remaining = {}, max_tokens
+    for field, field_limit in fields:
+        if field not in texts:
+            continue
+        # Подпись поля и перенос строки тоже расходуют бюджет
+        overhead = count_tokens(f"- {COMPANY_CONTEXT_FIELDS[field]}: \n", model)
+        limit = min(field_limit, tokens[field], remaining - overhead)
+        if limit < min(MIN_FIELD_TOKENS, tokens[field]):
+            continue
+        limits[field] = limit
+        remaining -= limit + overhead
+
+    for field, _ in fields:
+        if field in limits and remaining > 0:
+            extra = min(tokens[field] - limits[field], remaining)
+            limits[field] += extra
+            remaining -= extra
+
+    return format_company_context({
+        field: texts[field] if limit >= tokens[field] else trim_field(texts[field], limit, model)
+        for field, limit in limits.items()
+    })
+
+
+def get_company_context(company_id: int, company_details: dict, task: str = "template") -> str:
+    """
+    Сокращённые сведения о компании для промта задачи. Сведения кэшируются для компании, задачи и содержимого
+    брифа: изменённый бриф (в том числе сохранённый другим процессом) собирается заново.
+
+    :param company_id: ID компании.
+    :param company_details: Поля брифа компании (CompanyInfo).
+    :param task: Задача из CONTEXT_TASKS.
+    :return: Сведения о компании для промта.
+    """
+    key = (company_id, task, get_brief_hash(company_details, task))
+    with _lock:
+        context = _cache.get(key)
+        version = _versions.get(company_id, 0)
+    if context is not None:
+        COMPANY_CONTEXT_REQUESTS.labels(task, "hit").inc()
+        return context
+    COMPANY_CONTEXT_REQUESTS.labels(task, "miss").inc()
+
+    model = get_route(CONTEXT_TASKS[task][0])[0][0]
+    context = compact_company_context(company_details, task, model=model)
+    logger.info(f"✂️ Сведения о компании ID {company_id} для {task}: "
+                f"{count_tokens(format_company_context(company_details), model)} → {count_tokens(context, model)} токенов")
+
+    with _lock:
+        if _versions.get(company_id, 0) == version:
+            # Сведения по прежней версии брифа больше не понадобятся
+            for stale in [stale for stale in _cache if stale[:2] == key[:2]]:
+                del _cache[stale]
+            if len(_cache) >= COMPANY_CONTEXT_CACHE_SIZE:
+                _cache.pop(next(iter(_cache)))
+            _cache[key] = context
+    return context
+
+
+def invalidate_company_context(company_id: int):
+    """ Сбрасывает сокращённые сведения компании (после изменения брифа). """
+    with _lock:
+        _versions[company_id] = _versions.get(company_id, 0) + 1
+        for key in [key for key in _cache if key[0] == company_id]:
+            del _cache[key]
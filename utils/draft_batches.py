@@ -0,0 +1,285 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+from config import LLM_BATCH_ENABLED, LLM_BATCH_HORIZON_DAYS, LLM_BATCH_MIN_LEADS, LLM_BATCH_POLL_INTERVAL
+from db.db import SessionLocal
+from db.db_draft import get_drafted_lead_ids, save_drafts
+from db.db_draft_batch import (
+    BATCH_CANCELLED, BATCH_COMPLETED, BATCH_EXPIRED, BATCH_FAILED, BATCH_INGESTED, BATCH_IN_PROGRESS, BATCH_SUBMITTED,
+    create_draft_batch, get_active_draft_batches, get_wave_active_batches, get_waves_for_batch, update_draft_batch,
+)
+from db.models import Company, Templates, Waves
+from handlers.draft_handlers.draft_handler import build_draft_prompt, estimate_lead_usage, get_wave_description
+from logger import logger
+from promts.output_schemas import DraftEmail
+from utils.batch_client import BATCH_ENDPOINT, get_batch_client
+from utils.draft_clusters import use_clustered_generation
+from utils.google_doc import append_drafts_to_sheet
+from utils.llm_router import TASK_GENERATE, get_route, supports_json_mode
+from utils.metrics import DRAFTS_GENERATED
+from utils.structured_output import JSON_SYSTEM_PROMPT, parse_structured
+from utils.usage import check_budget, record_usage, usage_context
+from utils.wave_shedulers import get_filtered_leads_for_wave
+
+# Запросы Batch API тарифицируются вдвое дешевле обычных
+BATCH_PRICE_FACTOR = 0.5
+# Статусы OpenAI Batch API, при которых результаты ещё не готовы
+PENDING_PROVIDER_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+
+
+def get_batch_custom_id(wave_id: int, lead_id: int) -> str:
+    return f"wave-{wave_id}-lead-{lead_id}"
+
+
+def parse_batch_custom_id(custom_id: str) -> tuple[int, int]:
+    _, wave_id, _, lead_id = custom_id.split("-")
+    return int(wave_id), int(lead_id)
+
+
+def build_batch_requests(template, leads, wave_id: int, description: str, model: str) -> list[dict]:
+    """
+    Собирает строки пакета: по запросу генерации письма на каждого лида волны.
+
+    :param template: Шаблон письма.
+    :param leads: DataFrame с лидами.
+    :param wave_id: ID волны.
+    :param description: Описание контент-плана.
+    :param model: Модель.
+    :return: Строки JSONL-пакета.
+    """
+    body = {"model": model}
+    if supports_json_mode(model):
+        body["response_format"] = {"type": "json_object"}
+
+    return [
+        {
+            "custom_id": get_batch_custom_id(wave_id, lead["id"]),
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                **body,
+                "messages": [
+                    {"role": "system", "content": JSON_SYSTEM_PROMPT},
+                    {"role": "user", "content": build_draft_prompt(template, lead, description)},
+                ],
+            },
+        }
+        for _, lead in leads.iterrows()
+    ]
+
+
+def parse_batch_results(rows: list[dict]) -> tuple[dict[int, DraftEmail], int, list[dict]]:
+    """
+    Разбирает строки результатов пакета.
+
+    :param rows: Строки файла результатов (и ошибок) Batch API.
+    :return: ({lead_id: письмо}, количество неудачных запросов, usage успешных ответов).
+    """
+    drafts, failed, usages = {}, 0, []
+    for row in rows:
+        response = row.get("response") or {}
+        if row.get("error") or response.get("status_code") != 200:
+            failed += 1
+            continue
+
+        body = response["body"]
+        if body.get("usage"):
+            usages.append(body["usage"])
+        try:
+            draft, _ = parse_structured(body["choices"][0]["message"]["content"] or "", DraftEmail)
+        except (ValueError, KeyError, IndexError):
+            failed += 1
+            continue
+        drafts[parse_batch_custom_id(row["custom_id"])[1]] = draft
+    return drafts, failed, usages
+
+
+def submit_wave_batch(db, wave, client):
+    """
+    Отправляет генерацию черновиков волны одним пакетным заданием.
+
+    :param db: Сессия базы данных.
+    :param wave: Волна.
+    :param client: Клиент пакетных заданий (utils.batch_client).
+    :return: Запись задания или None, если волна генерируется обычным способом в день отправки.
+    """
+    template = db.query(Templates).filter_by(wave_id=wave.wave_id).first()
+    leads = get_filtered_leads_for_wave(db, wave.wave_id)
+    if not leads.empty:
+        # Черновики, уже сгенерированные обычным способом, повторно не оплачиваются
+        leads = leads[~leads["id"].isin(list(get_drafted_lead_ids(db, wave.wave_id)))]
+    if template is None or len(leads) < LLM_BATCH_MIN_LEADS:
+        logger.debug(f"Волна ID {wave.wave_id}: {len(leads)} лидов, пакетная генерация не нужна.")
+        return None
+    if use_clustered_generation(len(leads)):
+        # Сегментная генерация и так делает по нескольку запросов на волну — пакет не нужен
+        logger.debug(f"Волна ID {wave.wave_id}: черновики генерируются по сегментам в день отправки.")
+        return None
+
+    model = get_route(TASK_GENERATE)[0][0]
+    description = get_wave_description(db, wave)
+    tokens_per_lead, cost_per_lead = estimate_lead_usage(db, wave, template, description, leads)
+    reason = check_budget(db, wave.company_id, tokens_per_lead * len(leads),
+                          cost_per_lead * BATCH_PRICE_FACTOR * len(leads))
+    if reason:
+        # Волна останется на день отправки: к тому времени бюджет может обновиться
+        logger.warning(f"⚠️ Волна ID {wave.wave_id} не отправлена пакетом: {reason}")
+        return None
+
+    requests = build_batch_requests(template, leads, wave.wave_id, description, model)
+    # Запись задания — до отправки: без неё следующий проход отправил бы волну ещё одним платным пакетом
+    batch = create_draft_batch(db, wave.wave_id, client.name, model, len(requests))
+    if batch is None:
+        return None
+    try:
+        provider_batch_id = client.submit(requests, metadata={"wave_id": str(wave.wave_id)})
+    except Exception as e:
+        update_draft_batch(db, batch.batch_job_id, status=BATCH_FAILED, error=f"Ошибка отправки: {e}")
+        raise
+    if not update_draft_batch(db, batch.batch_job_id, provider_batch_id=provider_batch_id, status=BATCH_SUBMITTED):
+        # Результаты пакета без записи не загрузить: отменяем его, волна сгенерируется в день отправки
+        client.cancel(provider_batch_id)
+        logger.error(f"❌ Пакет {provider_batch_id} волны ID {wave.wave_id} отменён: не удалось сохранить его ID.")
+        return None
+    logger.info(f"📦 Волна ID {wave.wave_id}: {len(requests)} запросов отправлено пакетом {provider_batch_id}.")
+    db.refresh(batch)
+    return batch
+
+
+def ingest_draft_batch(db, batch, client, state: dict) -> int:
+    """
+    Загружает результаты пакета в drafts и Google Таблицу компании.
+
+    :param db: Сессия базы данных.
+    :param batch: Запись задания.
+    :param client: Клиент пакетных заданий.
+    :param state: Состояние задания от client.retrieve.
+    :return: Количество сохранённых черновиков.
+    """
+    rows = []
+    for file_id in (state.get("output_file_id"), state.get("error_file_id")):
+        if file_id:
+            rows.extend(client.download(file_id))
+
+    generated, failed, usages = parse_batch_results(rows)
+    # Запросы, на которые провайдер не ответил (например, задание истекло), тоже считаются неудачными
+    failed += max(batch.request_count - len(rows), 0)
+    if batch.backend == "openai":
+        # Локальная замена выполняет запросы через create_chat_completion, и их стоимость уже учтена
+        for usage in usages:
+            record_usage(batch.model, "draft_batch", SimpleNamespace(**usage), price_factor=BATCH_PRICE_FACTOR)
+
+    # Email и название берутся из текущего сегмента: лиды, выбывшие из него после отправки пакета, пропускаются.
+    # Черновики, появившиеся за это время (их уже видел пользователь), не перезаписываются
+    leads = get_filtered_leads_for_wave(db, batch.wave_id)
+    drafted = get_drafted_lead_ids(db, batch.wave_id)
+    drafts = [
+        {
+            "wave_id": batch.wave_id,
+            "lead_id": int(lead["id"]),
+            "email": lead.get("email"),
+            "company_name": lead.get("name", "Клиент"),
+            "subject": generated[int(lead["id"])].subject,
+            "text": generated[int(lead["id"])].text,
+        }
+        for _, lead in leads.iterrows()
+        if int(lead["id"]) in generated and int(lead["id"]) not in drafted
+    ]
+
+    saved = 0
+    if drafts:
+        wave = db.query(Waves).filter_by(wave_id=batch.wave_id).first()
+        company = db.query(Company).filter_by(company_id=wave.company_id).first()
+        saved = save_drafts(db, wave.company_id, drafts)
+        if company and company.google_sheet_url and company.google_sheet_name:
+            append_drafts_to_sheet(company.google_sheet_url, company.google_sheet_name, drafts)
+
+    DRAFTS_GENERATED.labels("generated").inc(len(drafts))
+    DRAFTS_GENERATED.labels("failed").inc(failed)
+    update_draft_batch(db, batch.batch_job_id, status=BATCH_INGESTED, saved_count=saved, failed_count=failed)
+    logger.info(f"✅ Пакет {batch.provider_batch_id} (волна ID {batch.wave_id}): сохранено {saved} черновиков, "
+                f"без ответа {failed}.")
+    return saved
+
+
+def poll_draft_batch(db, batch, cancel_pending: bool = False) -> str:
+    """
+    Проверяет состояние пакетного задания и загружает готовые результаты.
+
+    :param db: Сессия базы данных.
+    :param batch: Запись задания.
+    :param cancel_pending: Отменить задание, если результаты ещё не готовы (наступил день отправки).
+    :return: Новый статус задания.
+    """
+    wave = db.query(Waves).filter_by(wave_id=batch.wave_id).first()
+    with usage_context(company_id=wave.company_id, campaign_id=wave.campaign_id, wave_id=wave.wave_id):
+        return _poll_draft_batch(db, batch, cancel_pending)
+
+
+def _poll_draft_batch(db, batch, cancel_pending: bool) -> str:
+    client = get_batch_client(batch.backend)
+    state = client.retrieve(batch.provider_batch_id)
+
+    if state["status"] in PENDING_PROVIDER_STATUSES:
+        if cancel_pending:
+            client.cancel(batch.provider_batch_id)
+            update_draft_batch(db, batch.batch_job_id, status=BATCH_CANCELLED, error="Не готово к дню отправки")
+            logger.warning(f"⚠️ Пакет {batch.provider_batch_id} не готов к дню отправки волны ID {batch.wave_id}, "
+                           f"отменён.")
+            return BATCH_CANCELLED
+        if batch.status != BATCH_IN_PROGRESS:
+            update_draft_batch(db, batch.batch_job_id, status=BATCH_IN_PROGRESS)
+        return BATCH_IN_PROGRESS
+
+    if state["status"] in (BATCH_COMPLETED, BATCH_EXPIRED):
+        ingest_draft_batch(db, batch, client, state)
+        return BATCH_INGESTED
+
+    status = BATCH_CANCELLED if state["status"] == BATCH_CANCELLED else BATCH_FAILED
+    update_draft_batch(db, batch.batch_job_id, status=status, error=f"Статус провайдера: {state['status']}")
+    logger.error(f"❌ Пакет {batch.provider_batch_id} волны ID {batch.wave_id} завершился со статусом "
+                 f"{state['status']}.")
+    return status
+
+
+def finalize_wave_batches(db, wave_id: int):
+    """
+    В день отправки: загружает готовые пакеты волны и отменяет неготовые, чтобы оставшиеся лиды
+    сгенерировались обычным способом.
+
+    :param db: Сессия базы данных.
+    :param wave_id: ID волны.
+    """
+    for batch in get_wave_active_batches(db, wave_id):
+        try:
+            poll_draft_batch(db, batch, cancel_pending=True)
+        except Exception as e:
+            logger.error(f"❌ Ошибка завершения пакета {batch.provider_batch_id}: {e}", exc_info=True)
+
+
+def run_draft_batches():
+    """ Один проход: опрос активных пакетов и отправка пакетов для волн в пределах LLM_BATCH_HORIZON_DAYS. """
+    with SessionLocal() as db:
+        for batch in get_active_draft_batches(db):
+            try:
+                poll_draft_batch(db, batch)
+            except Exception as e:
+                logger.error(f"❌ Ошибка опроса пакета {batch.provider_batch_id}: {e}", exc_info=True)
+
+        client = get_batch_client()
+        for wave in get_waves_for_batch(db, datetime.utcnow().date(), LLM_BATCH_HORIZON_DAYS):
+            try:
+                submit_wave_batch(db, wave, client)
+            except Exception as e:
+                logger.error(f"❌ Ошибка отправки пакета для волны ID {wave.wave_id}: {e}", exc_info=True)
+
+
+async def draft_batch_loop():
+    """ Периодически отправляет и опрашивает пакетные задания генерации черновиков. """
+    while LLM_BATCH_ENABLED:
+        try:
+            await asyncio.to_thread(run_draft_batches)
+        except Exception as e:
+            logger.error(f"❌ Ошибка пакетной генерации черновиков: {e}", exc_info=True)
+        await asyncio.sleep(LLM_BATCH_POLL_INTERVAL)
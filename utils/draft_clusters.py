@@ -0,0 +1,150 @@
+import re
+
+import pandas as pd
+
+from config import DRAFT_CLUSTER_MIN_LEADS, DRAFT_GENERATION_MODE
+
+# Размер компании по числу сотрудников (границы малого и среднего бизнеса): (верхняя граница, ключ, описание)
+SIZE_BUCKETS = (
+    (15, "micro", "микропредприятия (до 15 сотрудников)"),
+    (100, "small", "малый бизнес (до 100 сотрудников)"),
+    (250, "medium", "средний бизнес (до 250 сотрудников)"),
+    (float("inf"), "large", "крупные компании (более 250 сотрудников)"),
+)
+SIZE_LABELS = {key: label for _, key, label in SIZE_BUCKETS}
+
+# Профили сегментов от подробного к общему: лиды из слишком маленьких сегментов переходят на следующий уровень,
+# последний уровень — все оставшиеся лиды одним сегментом
+PROFILE_LEVELS = (
+    ("primary_activity", "region", "size"),
+    ("primary_activity", "size"),
+    ("primary_activity",),
+    (),
+)
+
+# Плейсхолдеры личных данных в вариантах письма: плейсхолдер -> колонка лида
+PERSONAL_FIELDS = {
+    "company_name": "name",
+    "director_name": "director_name",
+    "director_position": "director_position",
+    "region": "region",
+    "website": "website",
+}
+# Плейсхолдер вместе с запятой и пробелами перед ним: при пустом значении удаляется целиком
+PLACEHOLDER_PATTERN = re.compile(r"(,?[ \t]*)\[([a-z_]+)\]")
+
+# Сколько названий компаний сегмента показывается модели для примера
+CLUSTER_EXAMPLES = 3
+
+
+def use_clustered_generation(lead_count: int) -> bool:
+    """ Генерировать ли черновики волны по сегментам (DRAFT_GENERATION_MODE: per_lead, clustered, auto). """
+    if DRAFT_GENERATION_MODE == "clustered":
+        return True
+    return DRAFT_GENERATION_MODE == "auto" and lead_count >= DRAFT_CLUSTER_MIN_LEADS
+
+
+def get_lead_field(lead, name: str) -> str:
+    """ Значение поля лида строкой; пустые значения и NaN — пустая строка. """
+    value = lead.get(name)
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    return " ".join(str(value).split())
+
+
+def get_size_bucket(employee_count) -> str:
+    """ Ключ размера компании по числу сотрудников (пустая строка, если число не указано). """
+    try:
+        count = float(str(employee_count).replace(" ", "").replace(",", "."))
+    except (TypeError, ValueError):
+        return ""
+    if pd.isna(count):
+        return ""
+    return next(key for limit, key, _ in SIZE_BUCKETS if count <= limit)
+
+
+def cluster_leads(df: pd.DataFrame, min_size: int) -> list[tuple[dict, pd.DataFrame]]:
+    """
+    Группирует лидов по профилю: вид деятельности × регион × размер компании. Сегменты меньше min_size
+    укрупняются по PROFILE_LEVELS, поэтому число сегментов не превышает len(df) / min_size + 1.
+
+    :param df: DataFrame с лидами.
+    :param min_size: Минимальный размер сегмента.
+    :return: [(профиль {поле: значение}, лиды сегмента)].
+    """
+    if df.empty:
+        return []
+    leads = df.to_dict("records")
+    profiles = pd.DataFrame({
+        "primary_activity": [get_lead_field(lead, "primary_activity").casefold() for lead in leads],
+        "region": [get_lead_field(lead, "region").casefold() for lead in leads],
+        "size": [get_size_bucket(lead.get("employee_count")) for lead in leads],
+    }, index=df.index)
+
+    clusters, remaining = [], profiles
+    for level, fields in enumerate(PROFILE_LEVELS):
+        last_level = level == len(PROFILE_LEVELS) - 1
+        groups = remaining.groupby(list(fields), sort=False).groups if fields else {(): remaining.index}
+        small = []
+        for key, index in groups.items():
+            if len(index) < min_size and not last_level:
+                small.extend(index)
+                continue
+            values = key if isinstance(key, tuple) else (key,)
+            clusters.append((dict(zip(fields, values)), df.loc[index]))
+        if not small:
+            break
+        remaining = remaining.loc[small]
+    return clusters
+
+
+def describe_profile(profile: dict, leads: pd.DataFrame) -> dict:
+    """ Описание сегмента для промпта: вид деятельности, регион, размер и примеры компаний. """
+    names = (get_lead_field(lead, "name") for lead in leads.head(CLUSTER_EXAMPLES * 2).to_dict("records"))
+    examples = [name for name in names if name]
+    return {
+        "primary_activity": profile.get("primary_activity") or "разные",
+        "region": profile.get("region") or "разные",
+        "size": SIZE_LABELS.get(profile.get("size"), "разный"),
+        "examples": ", ".join(examples[:CLUSTER_EXAMPLES]) or "не указаны",
+    }
+
+
+def personalize(text: str, values: dict) -> str:
+    """
+    Подставляет данные лида в плейсхолдеры [company_name], [director_name] и т.п.
+
+    :param text: Текст варианта письма.
+    :param values: {плейсхолдер: значение}; пустые и неизвестные плейсхолдеры удаляются вместе с запятой перед ними.
+    :return: Персонализированный текст.
+    """
+    def replace(match):
+        value = values.get(match.group(2))
+        return f"{match.group(1)}{value}" if value else ""
+
+    return PLACEHOLDER_PATTERN.sub(replace, text)
+
+
+def personalize_drafts(leads: pd.DataFrame, variants: list, wave_id: int) -> list[dict]:
+    """
+    Черновики лидов сегмента из вариантов письма: вариант выбирается по ID лида (при повторной генерации
+    лид получает тот же вариант), личные данные подставляются локально.
+
+    :param leads: Лиды сегмента.
+    :param variants: Варианты письма (DraftEmail).
+    :param wave_id: ID волны.
+    :return: Черновики в формате save_drafts.
+    """
+    drafts = []
+    for lead in leads.to_dict("records"):
+        variant = variants[int(lead["id"]) % len(variants)]
+        values = {placeholder: get_lead_field(lead, column) for placeholder, column in PERSONAL_FIELDS.items()}
+        drafts.append({
+            "wave_id": wave_id,
+            "lead_id": lead["id"],
+            "email": lead.get("email"),
+            "company_name": lead.get("name", "Клиент"),
+            "subject": personalize(variant.subject, values),
+            "text": personalize(variant.text, values),
+        })
+    return drafts
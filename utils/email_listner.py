@@ -1,86 +1,464 @@
 import asyncio
-import email
-import logging
-from email.header import decode_header
-from imapclient import IMAPClient
-from sqlalchemy.orm import sessionmaker
-import httpx
+import re
+import ssl
+from email import policy
+from email.parser import BytesParser
 
-from config import IMAP_PORT, EMAIL_ACCOUNT, IMAP_SERVER, EMAIL_PASSWORD
-from db.db import engine  # Импортируем модель Wave из вашей базы данных  # Функция для отправки уведомлений
+from aioimaplib import aioimaplib
+from sqlalchemy.orm import Session
 
-from db.models import Waves
+from db.db import SessionLocal
+from db.db_draft import get_sent_message_ids
+from db.models import Campaigns, EmailConnections, Waves
+from logger import logger
 
-# 🔹 ID чата для уведомлений
-GENERAL_CHAT_ID = -1001234567890  # Замените на ID вашего Telegram-чата
+# Сервер разрывает IDLE примерно через 30 минут, поэтому переподписываемся чуть раньше (RFC 2177)
+IMAP_IDLE_TIMEOUT = 25 * 60
+# Таймаут отдельных IMAP-команд
+IMAP_COMMAND_TIMEOUT = 30
+# Интервал опроса для серверов без поддержки IDLE
+IMAP_POLL_INTERVAL = 60
+# Пауза перед переподключением (удваивается после каждой неудачи до максимума)
+IMAP_RECONNECT_DELAY = 5
+IMAP_RECONNECT_MAX_DELAY = 300
+# Как часто перечитывать из БД индекс тем волн и список почтовых ящиков
+REPLY_INDEX_REFRESH_SECONDS = 300
+# Поля подключения, при изменении которых слушатель ящика перезапускается
+# (uid_validity и last_seen_uid меняет сам слушатель)
+LISTENER_CONFIG_FIELDS = ("company_id", "chat_id", "login", "password", "imap_server", "imap_port")
+# За сколько дней отправленные письма попадают в индекс цепочек (ответы на более старые ищутся по теме)
+REPLY_INDEX_MESSAGE_DAYS = 90
 
-# Настраиваем логгер
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# Запрашиваем только нужные заголовки; BODY.PEEK не выставляет флаг \Seen
+REPLY_HEADER_FIELDS = "SUBJECT FROM MESSAGE-ID IN-REPLY-TO REFERENCES"
+FETCH_PARTS = f"(UID BODY.PEEK[HEADER.FIELDS ({REPLY_HEADER_FIELDS})])"
 
-# Создаем сессию SQLAlchemy
-SessionLocal = sessionmaker(bind=engine)
+FETCH_UID_RE = re.compile(rb"\bUID (\d+)")
+UIDVALIDITY_RE = re.compile(rb"\[UIDVALIDITY (\d+)\]")
+UIDNEXT_RE = re.compile(rb"\[UIDNEXT (\d+)\]")
+EXISTS_RE = re.compile(rb"^\d+ EXISTS$")
+MESSAGE_ID_RE = re.compile(r"<([^<>]+)>")
+# Префиксы ответов и пересылок, которые почтовые клиенты добавляют к теме
+SUBJECT_PREFIX_RE = re.compile(r"^\s*((re|fwd?|aw|ответ|отв|пересл)(\[\d+\])?\s*:\s*)+", re.IGNORECASE)
 
-async def check_new_emails():
+_header_parser = BytesParser(policy=policy.default)
+
+
+def normalize_subject(subject: str | None) -> str:
     """
-    Функция подключается к IMAP-серверу, проверяет новые входящие письма и обрабатывает их.
+    Приводит тему письма к виду для сравнения: без префиксов Re:/Fwd:/Ответ:, лишних пробелов и регистра.
+
+    :param subject: Тема письма.
+    :return: Нормализованная тема.
     """
-    try:
-        with IMAPClient(IMAP_SERVER, port=IMAP_PORT) as client:
-            client.login(EMAIL_ACCOUNT, EMAIL_PASSWORD)
-            client.select_folder("INBOX")  # Выбираем папку "Входящие"
+    if not subject:
+        return ""
+    subject = SUBJECT_PREFIX_RE.sub("", subject)
+    return " ".join(subject.split()).lower()
+
+
+def extract_message_ids(value: str | None) -> list[str]:
+    """
+    Извлекает Message-ID из заголовков Message-ID / In-Reply-To / References.
+
+    :param value: Значение заголовка.
+    :return: Список идентификаторов без угловых скобок.
+    """
+    if not value:
+        return []
+    ids = MESSAGE_ID_RE.findall(value)
+    if not ids and value.strip():
+        ids = [value.strip()]
+    return [message_id.strip().lower() for message_id in ids if message_id.strip()]
+
+
+class ReplyIndex:
+    """
+    Индекс для сопоставления входящих писем с волнами рассылки без запросов к БД на каждое письмо.
+    Письмо сопоставляется сначала по цепочке (In-Reply-To / References → Message-ID отправленного письма),
+    затем по нормализованной теме волны в рамках компании.
+    """
+
+    def __init__(self):
+        self._subjects: dict[tuple[int, str], dict] = {}
+        self._message_ids: dict[str, dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._subjects) + len(self._message_ids)
+
+    def add_wave(self, company_id: int, wave_id: int, campaign_id: int, thread_id: int | None, subject: str):
+        """ Добавляет тему волны в индекс. """
+        entry = {"wave_id": wave_id, "campaign_id": campaign_id, "thread_id": thread_id, "subject": subject}
+        self._subjects[(company_id, normalize_subject(subject))] = entry
+
+    def add_message_id(self, message_id: str, entry: dict):
+        """ Добавляет Message-ID отправленного письма, ответы на которое относятся к волне entry. """
+        for normalized in extract_message_ids(message_id):
+            self._message_ids[normalized] = entry
+
+    def match(self, company_id: int, headers: dict) -> dict | None:
+        """
+        Ищет волну, к которой относится входящее письмо.
+
+        :param company_id: ID компании-владельца почтового ящика.
+        :param headers: Заголовки письма (subject, in_reply_to, references).
+        :return: Запись индекса волны или None.
+        """
+        for message_id in headers.get("in_reply_to", []) + headers.get("references", []):
+            entry = self._message_ids.get(message_id)
+            if entry:
+                return entry
+        return self._subjects.get((company_id, normalize_subject(headers.get("subject"))))
+
+    def load(self, db: Session):
+        """ Перестраивает индекс по данным волн и отправленных писем из БД. """
+        rows = (
+            db.query(Waves.wave_id, Waves.company_id, Waves.campaign_id, Waves.subject, Campaigns.thread_id)
+            .join(Campaigns, Campaigns.campaign_id == Waves.campaign_id)
+            .all()
+        )
+        subjects = {}
+        for row in rows:
+            subjects[(row.company_id, normalize_subject(row.subject))] = {
+                "wave_id": row.wave_id,
+                "campaign_id": row.campaign_id,
+                "thread_id": row.thread_id,
+                "subject": row.subject,
+            }
+
+        message_ids = {}
+        for row in get_sent_message_ids(db, REPLY_INDEX_MESSAGE_DAYS):
+            entry = {
+                "wave_id": row.wave_id,
+                "campaign_id": row.campaign_id,
+                "thread_id": row.thread_id,
+                "subject": row.subject,
+            }
+            for normalized in extract_message_ids(row.message_id):
+                message_ids[normalized] = entry
+
+        self._subjects = subjects
+        self._message_ids = message_ids
+        logger.info(f"📇 Индекс ответов обновлён: {len(subjects)} тем, {len(message_ids)} отправленных писем.")
+
+
+def parse_fetch_response(lines: list) -> list[tuple[int, dict]]:
+    """
+    Разбирает ответ UID FETCH с заголовками писем.
+
+    :param lines: Строки ответа aioimaplib.
+    :return: Список (uid, заголовки), отсортированный по UID.
+    """
+    messages = []
+    current_uid = None
+    for line in lines:
+        if isinstance(line, bytearray):
+            if current_uid is not None:
+                messages.append((current_uid, parse_reply_headers(bytes(line))))
+                current_uid = None
+            continue
+        match = FETCH_UID_RE.search(line) if b"FETCH" in line else None
+        if match:
+            current_uid = int(match.group(1))
+    return sorted(messages, key=lambda item: item[0])
+
+
+def parse_reply_headers(raw_headers: bytes) -> dict:
+    """
+    Декодирует заголовки письма, нужные для сопоставления ответа с волной.
+
+    :param raw_headers: Блок заголовков письма.
+    :return: Словарь {"subject", "from", "message_id", "in_reply_to", "references"}.
+    """
+    message = _header_parser.parsebytes(raw_headers, headersonly=True)
+    message_ids = extract_message_ids(message.get("Message-ID"))
+    return {
+        "subject": str(message.get("Subject", "") or ""),
+        "from": str(message.get("From", "") or ""),
+        "message_id": message_ids[0] if message_ids else None,
+        "in_reply_to": extract_message_ids(message.get("In-Reply-To")),
+        "references": extract_message_ids(message.get("References")),
+    }
+
+
+def save_mailbox_position(connection_id: int, uid_validity: int, last_seen_uid: int):
+    """
+    Сохраняет позицию обработки почтового ящика, чтобы после перезапуска не терять и не дублировать письма.
+
+    :param connection_id: ID записи EmailConnections.
+    :param uid_validity: UIDVALIDITY папки INBOX.
+    :param last_seen_uid: UID последнего обработанного письма.
+    """
+    with SessionLocal() as db:
+        db.query(EmailConnections).filter_by(id=connection_id).update(
+            {"uid_validity": uid_validity, "last_seen_uid": last_seen_uid}
+        )
+        db.commit()
+
+
+class MailboxListener:
+    """
+    Слушатель одного почтового ящика: держит IMAP-соединение в режиме IDLE и при появлении новых писем
+    одним UID FETCH забирает только их заголовки.
+    """
+
+    def __init__(self, connection: dict, index: ReplyIndex, notify, save_position=save_mailbox_position,
+                 use_ssl: bool | None = None):
+        """
+        :param connection: Параметры ящика (поля EmailConnections).
+        :param index: Индекс тем волн.
+        :param notify: Корутина notify(connection, entry, headers), вызываемая для каждого найденного ответа.
+        :param save_position: Функция сохранения позиции (connection_id, uid_validity, last_seen_uid).
+        :param use_ssl: Использовать TLS (по умолчанию — для всех портов, кроме 143).
+        """
+        self.connection = connection
+        self.index = index
+        self.notify = notify
+        self.save_position = save_position
+        self.use_ssl = connection["imap_port"] != 143 if use_ssl is None else use_ssl
+        self.uid_validity = connection.get("uid_validity")
+        self.last_seen_uid = connection.get("last_seen_uid")
+        self._client = None
+        self._connection_lost = False
+
+    @property
+    def name(self) -> str:
+        return f"{self.connection['login']}@{self.connection['imap_server']}"
+
+    async def run(self):
+        """ Основной цикл: работает с ящиком и переподключается с нарастающей паузой при ошибках. """
+        delay = IMAP_RECONNECT_DELAY
+        while True:
+            try:
+                await self._session()
+                delay = IMAP_RECONNECT_DELAY
+            except asyncio.CancelledError:
+                await self._logout()
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка IMAP-слушателя {self.name}: {e}. Переподключение через {delay} с.")
+            await self._logout()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, IMAP_RECONNECT_MAX_DELAY)
+
+    async def _session(self):
+        self._connection_lost = False
+        self._client = aioimaplib.IMAP4(
+            host=self.connection["imap_server"],
+            port=self.connection["imap_port"],
+            timeout=IMAP_COMMAND_TIMEOUT,
+            conn_lost_cb=self._on_connection_lost,
+            ssl_context=ssl.create_default_context() if self.use_ssl else None,
+        )
+        await self._client.wait_hello_from_server()
+
+        response = await self._client.login(self.connection["login"], self.connection["password"])
+        if response.result != "OK":
+            raise ConnectionError(f"авторизация отклонена: {response.lines}")
+
+        response = await self._client.select("INBOX")
+        if response.result != "OK":
+            raise ConnectionError(f"не удалось открыть INBOX: {response.lines}")
+        self._sync_position(response.lines)
+
+        logger.info(f"📬 Подключён почтовый ящик {self.name}, последний UID: {self.last_seen_uid}")
+        await self.fetch_new_messages()
+
+        if not self._client.has_capability("IDLE"):
+            logger.warning(f"⚠️ Сервер {self.name} не поддерживает IDLE, используется опрос.")
+            while not self._connection_lost:
+                await asyncio.sleep(IMAP_POLL_INTERVAL)
+                await self.fetch_new_messages()
+            raise ConnectionError("соединение разорвано")
+
+        while True:
+            idle = await self._client.idle_start(timeout=IMAP_IDLE_TIMEOUT)
+            push = await self._client.wait_server_push(timeout=IMAP_IDLE_TIMEOUT + IMAP_COMMAND_TIMEOUT)
+            self._client.idle_done()
+            if self._connection_lost:
+                raise ConnectionError("соединение разорвано")
+            await asyncio.wait_for(idle, IMAP_COMMAND_TIMEOUT)
+
+            if push != aioimaplib.STOP_WAIT_SERVER_PUSH and any(EXISTS_RE.match(line) for line in push):
+                await self.fetch_new_messages()
+
+    async def fetch_new_messages(self) -> int:
+        """
+        Одним UID FETCH забирает заголовки всех писем, пришедших после последнего обработанного UID,
+        и уведомляет о найденных ответах.
+
+        :return: Количество обработанных писем.
+        """
+        first_uid = self.last_seen_uid + 1
+        response = await self._client.uid("fetch", f"{first_uid}:*", FETCH_PARTS)
+        if response.result != "OK":
+            raise ConnectionError(f"ошибка FETCH: {response.lines}")
+
+        # Диапазон n:* всегда возвращает последнее письмо ящика, даже если его UID меньше n
+        messages = [(uid, headers) for uid, headers in parse_fetch_response(response.lines) if uid >= first_uid]
+        for uid, headers in messages:
+            await self._handle_message(uid, headers)
+            self.last_seen_uid = uid
 
-            while True:
-                logger.info("🔍 Проверяем новые письма...")
-                messages = client.search(["UNSEEN"])  # Ищем непрочитанные письма
+        if messages:
+            self.save_position(self.connection["id"], self.uid_validity, self.last_seen_uid)
+            logger.info(f"📩 {self.name}: обработано новых писем: {len(messages)}")
+        return len(messages)
 
-                if messages:
-                    logger.info(f"📩 Найдено {len(messages)} новых писем")
+    async def _handle_message(self, uid: int, headers: dict):
+        entry = self.index.match(self.connection["company_id"], headers)
+        if not entry:
+            logger.debug(f"📧 {self.name}: письмо UID {uid} «{headers['subject']}» не относится к рассылкам.")
+            return
 
-                    for msgid in messages:
-                        raw_message = client.fetch(msgid, ["RFC822"])[msgid][b"RFC822"]
-                        email_message = email.message_from_bytes(raw_message)
+        logger.info(f"✅ {self.name}: ответ на волну ID {entry['wave_id']} от {headers['from']}")
+        try:
+            await self.notify(self.connection, entry, headers)
+        except Exception as e:
+            logger.error(f"❌ Не удалось отправить уведомление об ответе (UID {uid}): {e}", exc_info=True)
 
-                        subject, encoding = decode_header(email_message["Subject"])[0]
-                        if isinstance(subject, bytes):
-                            subject = subject.decode(encoding or "utf-8")
+    def _sync_position(self, select_lines: list):
+        """ Сверяет UIDVALIDITY и определяет, с какого UID продолжать обработку. """
+        uid_validity = _search_int(UIDVALIDITY_RE, select_lines)
+        uid_next = _search_int(UIDNEXT_RE, select_lines) or 1
 
-                        logger.info(f"📧 Входящее письмо с темой: {subject}")
+        if self.last_seen_uid is None or (self.uid_validity is not None and uid_validity != self.uid_validity):
+            if self.last_seen_uid is not None:
+                logger.warning(f"⚠️ {self.name}: изменился UIDVALIDITY, старые письма пропускаются.")
+            # Первое подключение: обрабатываем только письма, пришедшие с этого момента
+            self.last_seen_uid = uid_next - 1
+            self.uid_validity = uid_validity
+            self.save_position(self.connection["id"], self.uid_validity, self.last_seen_uid)
+        elif self.uid_validity is None:
+            self.uid_validity = uid_validity
+            self.save_position(self.connection["id"], self.uid_validity, self.last_seen_uid)
 
-                        # Проверяем, есть ли такая тема в таблице wave
-                        with SessionLocal() as db:
-                            wave = db.query(Waves).filter(Waves.subject == subject).first()
+    def _on_connection_lost(self, exc):
+        self._connection_lost = True
+        if self._client is not None:
+            self._client.protocol.idle_queue.put_nowait(aioimaplib.STOP_WAIT_SERVER_PUSH)
 
-                            if wave:
-                                logger.info(f"✅ Тема письма совпадает с волной ID {wave.wave_id}")
-                                await send_telegram_message(
-                                    GENERAL_CHAT_ID,
-                                    f"📩 Новое письмо по кампании **{wave.subject}**!"
-                                )
+    async def _logout(self):
+        if self._client is None:
+            return
+        try:
+            if not self._connection_lost:
+                if self._client.has_pending_idle():
+                    self._client.idle_done()
+                await asyncio.wait_for(self._client.logout(), IMAP_COMMAND_TIMEOUT)
+        except Exception:
+            pass
+        self._client = None
 
-                        # Помечаем письмо как прочитанное
-                        client.add_flags(msgid, ["\\Seen"])
 
-                # ⏳ Ожидаем 60 секунд перед следующей проверкой
-                await asyncio.sleep(60)
+def _search_int(pattern: re.Pattern, lines: list) -> int | None:
+    for line in lines:
+        if isinstance(line, bytes):
+            match = pattern.search(line)
+            if match:
+                return int(match.group(1))
+    return None
 
-    except Exception as e:
-        logger.error(f"❌ Ошибка при обработке почты: {e}", exc_info=True)
 
+def load_email_connections(db: Session) -> list[dict]:
+    """
+    Загружает параметры всех подключённых почтовых ящиков.
+
+    :param db: Сессия базы данных.
+    :return: Список словарей с полями EmailConnections.
+    """
+    return [
+        {
+            "id": connection.id,
+            "company_id": connection.company_id,
+            "chat_id": connection.chat_id,
+            "login": connection.login,
+            "password": connection.password,
+            "imap_server": connection.imap_server,
+            "imap_port": connection.imap_port,
+            "uid_validity": connection.uid_validity,
+            "last_seen_uid": connection.last_seen_uid,
+        }
+        for connection in db.query(EmailConnections).all()
+    ]
+
+
+def make_telegram_notifier(bot):
+    """
+    Создаёт функцию уведомления о новом ответе в тему кампании в Telegram.
+
+    :param bot: Объект бота.
+    :return: Корутина notify(connection, entry, headers).
+    """
+    async def notify(connection: dict, entry: dict, headers: dict):
+        await bot.send_message(
+            chat_id=connection["chat_id"],
+            message_thread_id=entry["thread_id"],
+            text=(
+                f"📩 Новый ответ по волне «{entry['subject']}»\n"
+                f"От: {headers['from']}\n"
+                f"Тема: {headers['subject']}"
+            ),
+        )
+
+    return notify
 
-async def send_telegram_message(chat_id, text):
-    async with httpx.AsyncClient() as client:
-        await client.post(TELEGRAM_API_URL, json={"chat_id": chat_id, "text": text, "parse_mode": "Markdown"})
 
+def sync_mailbox_listeners(listeners: dict[int, tuple[tuple, asyncio.Task]], connections: list[dict],
+                           index: ReplyIndex, notify, **listener_options):
+    """
+    Приводит запущенные слушатели в соответствие со списком ящиков: запускает новые и упавшие,
+    перезапускает ящики с изменёнными параметрами (логин, пароль, сервер...) и останавливает удалённые.
 
-async def main():
+    :param listeners: Запущенные слушатели: ID подключения → (параметры подключения, задача). Изменяется на месте.
+    :param connections: Актуальные подключения (load_email_connections).
+    :param index: Индекс тем волн.
+    :param notify: Корутина уведомления об ответе.
+    :param listener_options: Дополнительные параметры MailboxListener (save_position, use_ssl).
     """
-    Запуск основного цикла проверки почты.
+    actual_ids = {connection["id"] for connection in connections}
+    for connection_id in [connection_id for connection_id in listeners if connection_id not in actual_ids]:
+        _, task = listeners.pop(connection_id)
+        task.cancel()
+        logger.info(f"📧 Остановлен слушатель удалённого почтового ящика (подключение ID {connection_id})")
+
+    for connection in connections:
+        config = tuple(connection[field] for field in LISTENER_CONFIG_FIELDS)
+        running = listeners.get(connection["id"])
+        if running is not None and not running[1].done():
+            if running[0] == config:
+                continue
+            running[1].cancel()
+            logger.info(f"📧 Параметры почтового ящика (подключение ID {connection['id']}) изменились, перезапуск")
+
+        listener = MailboxListener(connection, index, notify, **listener_options)
+        listeners[connection["id"]] = (config, asyncio.create_task(listener.run()))
+        logger.info(f"📧 Запущен слушатель почтового ящика {listener.name}")
+
+
+async def start_reply_listener(bot):
     """
-    while True:
-        await check_new_emails()
-        await asyncio.sleep(10)  # Повторяем цикл каждые 10 секунд
+    Запускает слушатели ответов для всех почтовых ящиков из EmailConnections
+    и периодически обновляет индекс тем волн и список ящиков.
+
+    :param bot: Объект бота для уведомлений.
+    """
+    index = ReplyIndex()
+    notify = make_telegram_notifier(bot)
+    listeners: dict[int, tuple[tuple, asyncio.Task]] = {}
+
+    try:
+        while True:
+            try:
+                with SessionLocal() as db:
+                    index.load(db)
+                    connections = load_email_connections(db)
 
+                sync_mailbox_listeners(listeners, connections, index, notify)
+            except Exception as e:
+                logger.error(f"❌ Ошибка при обновлении слушателей почты: {e}", exc_info=True)
 
-if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+            await asyncio.sleep(REPLY_INDEX_REFRESH_SECONDS)
+    finally:
+        for _, task in listeners.values():
+            task.cancel()
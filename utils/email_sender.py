@@ -0,0 +1,328 @@
+import asyncio
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+
+import aiosmtplib
+
+from db.db import SessionLocal, engine
+from db.db_draft import (
+    claim_drafts_for_sending, lock_wave_sending, mark_draft_failed, mark_draft_sent, release_stuck_drafts,
+    get_wave_delivery_stats
+)
+from db.models import EmailConnections, Waves
+from logger import logger
+from utils.metrics import EMAILS_SENT
+
+# Сколько SMTP-соединений держать открытыми на один почтовый ящик отправителя
+SMTP_POOL_SIZE = 3
+# После скольких писем соединение переоткрывается (почтовые провайдеры ограничивают сессию)
+SMTP_MESSAGES_PER_CONNECTION = 100
+# Таймаут SMTP-команд
+SMTP_TIMEOUT = 60
+# Ограничения скорости отправки (писем в минуту) для защиты репутации отправителя
+SENDER_MESSAGES_PER_MINUTE = 60
+DOMAIN_MESSAGES_PER_MINUTE = 20
+# Повторные попытки при временных ошибках (4xx, обрыв соединения)
+SMTP_MAX_ATTEMPTS = 3
+SMTP_RETRY_DELAY = 30
+
+
+class RateLimiter:
+    """
+    Равномерно распределяет события во времени: не чаще per_minute в минуту.
+    Слот резервируется под блокировкой, а ожидание идёт без неё, поэтому ожидающие не мешают друг другу.
+    """
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class _PooledClient:
+    def __init__(self, client: aiosmtplib.SMTP):
+        self.client = client
+        self.sent = 0
+
+
+class SmtpConnectionPool:
+    """
+    Пул SMTP-соединений одного почтового ящика. Соединения переиспользуются между письмами и волнами,
+    разорванные и «выработавшие» лимит писем переоткрываются.
+    """
+
+    def __init__(self, connection: dict, size: int = SMTP_POOL_SIZE):
+        self.connection = connection
+        self.size = size
+        self._idle: deque[_PooledClient] = deque()
+        self._slots = asyncio.Semaphore(size)
+
+    @property
+    def sender(self) -> str:
+        return self.connection["login"]
+
+    async def _connect(self) -> _PooledClient:
+        port = self.connection["smtp_port"]
+        client = aiosmtplib.SMTP(
+            hostname=self.connection["smtp_server"],
+            port=port,
+            timeout=SMTP_TIMEOUT,
+            use_tls=port == 465,
+        )
+        await client.connect()
+        if client.supports_extension("auth"):
+            await client.login(self.connection["login"], self.connection["password"])
+        logger.debug(f"🔌 Открыто SMTP-соединение {self.sender}@{self.connection['smtp_server']}")
+        return _PooledClient(client)
+
+    @asynccontextmanager
+    async def acquire(self):
+        """ Выдаёт соединение из пула (или открывает новое) на время отправки одного письма. """
+        async with self._slots:
+            pooled = self._idle.pop() if self._idle else None
+            if pooled is None or not pooled.client.is_connected or pooled.sent >= SMTP_MESSAGES_PER_CONNECTION:
+                if pooled is not None:
+                    await _quit(pooled.client)
+                pooled = await self._connect()
+
+            try:
+                yield pooled.client
+            except Exception:
+                await _quit(pooled.client)
+                raise
+            pooled.sent += 1
+            self._idle.append(pooled)
+
+    async def close(self):
+        """ Закрывает все простаивающие соединения пула. """
+        while self._idle:
+            await _quit(self._idle.pop().client)
+
+
+async def _quit(client: aiosmtplib.SMTP):
+    try:
+        if client.is_connected:
+            await client.quit()
+    except Exception:
+        client.close()
+
+
+# Пулы и ограничители живут между волнами: соединения переиспользуются, лимиты действуют на все рассылки
+_pools: dict[int, SmtpConnectionPool] = {}
+_sender_limiters: dict[int, RateLimiter] = {}
+_domain_limiters: dict[tuple[int, str], RateLimiter] = {}
+# Волны, которые отправляет этот процесс (между процессами — lock_wave_sending)
+_active_waves: set[int] = set()
+
+
+def get_smtp_pool(connection: dict) -> SmtpConnectionPool:
+    """
+    Возвращает пул соединений для почтового ящика (создаётся при первом обращении).
+
+    :param connection: Параметры ящика (поля EmailConnections).
+    :return: SmtpConnectionPool.
+    """
+    pool = _pools.get(connection["id"])
+    if pool is None or pool.connection != connection:
+        pool = SmtpConnectionPool(connection)
+        _pools[connection["id"]] = pool
+    return pool
+
+
+async def close_smtp_pools():
+    """ Закрывает все SMTP-соединения (при остановке бота). """
+    for pool in list(_pools.values()):
+        await pool.close()
+    _pools.clear()
+
+
+def get_recipient_domain(email: str) -> str:
+    return email.rsplit("@", 1)[-1].strip().lower()
+
+
+def interleave_by_domain(drafts: list[dict]) -> list[dict]:
+    """
+    Перемешивает письма так, чтобы подряд шли разные домены получателей:
+    пока один домен ждёт своего лимита, воркеры отправляют письма на другие.
+
+    :param drafts: Черновики для отправки.
+    :return: Черновики в порядке отправки.
+    """
+    by_domain = defaultdict(deque)
+    for draft in drafts:
+        by_domain[get_recipient_domain(draft["email"])].append(draft)
+
+    queues = sorted(by_domain.values(), key=len, reverse=True)
+    ordered = []
+    while queues:
+        for queue in queues:
+            ordered.append(queue.popleft())
+        queues = [queue for queue in queues if queue]
+    return ordered
+
+
+def build_message(sender: str, draft: dict) -> EmailMessage:
+    """
+    Собирает письмо из черновика.
+
+    :param sender: Адрес отправителя.
+    :param draft: Черновик (email, subject, text).
+    :return: EmailMessage с уникальным Message-ID.
+    """
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = draft["email"]
+    message["Subject"] = draft["subject"]
+    message["Date"] = formatdate(localtime=True)
+    message["Message-ID"] = make_msgid(domain=get_recipient_domain(sender))
+    message.set_content(draft["text"])
+    return message
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """ Постоянная ошибка (5xx) — повторная отправка бессмысленна. """
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(500 <= recipient.code < 600 for recipient in error.recipients)
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and 500 <= code < 600
+
+
+class _WaveDelivery:
+    """ Отправка одной волны: очередь писем, воркеры по числу соединений, учёт состояния по каждому лиду. """
+
+    def __init__(self, db, wave: Waves, connections: list[dict], drafts: list[dict]):
+        self.db = db
+        self.wave = wave
+        self.pools = [get_smtp_pool(connection) for connection in connections]
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.stats = {"sent": 0, "failed": 0, "requeued": 0}
+        self.aborted = False
+
+        # Письма распределяются по отправителям по кругу
+        for number, draft in enumerate(interleave_by_domain(drafts)):
+            self.queue.put_nowait((draft, self.pools[number % len(self.pools)]))
+
+    async def run(self) -> dict:
+        workers = [asyncio.create_task(self._worker()) for _ in range(sum(pool.size for pool in self.pools))]
+        await asyncio.gather(*workers)
+        return self.stats
+
+    async def _worker(self):
+        while not self.aborted:
+            try:
+                draft, pool = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await self._deliver(draft, pool)
+
+    async def _deliver(self, draft: dict, pool: SmtpConnectionPool):
+        domain = get_recipient_domain(draft["email"])
+        domain_limiter = _domain_limiters.setdefault(
+            (self.wave.company_id, domain), RateLimiter(DOMAIN_MESSAGES_PER_MINUTE)
+        )
+        sender_limiter = _sender_limiters.setdefault(pool.connection["id"], RateLimiter(SENDER_MESSAGES_PER_MINUTE))
+
+        for attempt in range(1, SMTP_MAX_ATTEMPTS + 1):
+            if self.aborted:
+                return
+
+            await domain_limiter.wait()
+            await sender_limiter.wait()
+
+            message = build_message(pool.sender, draft)
+            try:
+                async with pool.acquire() as client:
+                    await client.send_message(message)
+            except aiosmtplib.SMTPAuthenticationError as e:
+                # Без авторизации ни одно письмо этого ящика не уйдёт: останавливаем волну,
+                # невзятые письма вернутся в очередь
+                logger.error(f"❌ Ошибка авторизации SMTP {pool.sender}: {e}. Отправка волны остановлена.")
+                self.aborted = True
+                EMAILS_SENT.labels("auth_error").inc()
+                return
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                if is_permanent_error(e) or attempt == SMTP_MAX_ATTEMPTS:
+                    logger.warning(f"⚠️ Письмо для {draft['email']} не отправлено ({attempt} попыток): {error}")
+                    mark_draft_failed(self.db, draft["draft_id"], error, attempts=attempt)
+                    self.stats["failed"] += 1
+                    EMAILS_SENT.labels("failed").inc()
+                    return
+                EMAILS_SENT.labels("retried").inc()
+                logger.info(f"🔁 Временная ошибка для {draft['email']}, повтор через {SMTP_RETRY_DELAY * attempt} с: {error}")
+                await asyncio.sleep(SMTP_RETRY_DELAY * attempt)
+                continue
+
+            mark_draft_sent(self.db, draft["draft_id"], message["Message-ID"], pool.sender, attempts=attempt)
+            self.stats["sent"] += 1
+            EMAILS_SENT.labels("sent").inc()
+            return
+
+
+async def send_wave(wave_id: int) -> dict:
+    """
+    Отправляет подтверждённые черновики волны через SMTP-ящики компании.
+
+    :param wave_id: ID волны.
+    :return: Статистика {"sent", "failed", "requeued"} текущего запуска и "statuses" — итог по всем черновикам волны.
+    """
+    if wave_id in _active_waves:
+        logger.warning(f"⚠️ Отправка волны ID {wave_id} уже выполняется.")
+        return {}
+
+    _active_waves.add(wave_id)
+    try:
+        with SessionLocal() as db:
+            wave = db.query(Waves).filter_by(wave_id=wave_id).first()
+            if not wave:
+                logger.error(f"❌ Волна с ID {wave_id} не найдена.")
+                return {}
+
+            connections = [
+                {
+                    "id": connection.id,
+                    "login": connection.login,
+                    "password": connection.password,
+                    "smtp_server": connection.smtp_server,
+                    "smtp_port": connection.smtp_port,
+                }
+                for connection in db.query(EmailConnections).filter_by(company_id=wave.company_id)
+                .order_by(EmailConnections.id).all()
+            ]
+            if not connections:
+                logger.error(f"❌ У компании ID {wave.company_id} нет подключённых почтовых ящиков.")
+                return {}
+
+            with lock_wave_sending(engine, wave_id) as acquired:
+                if not acquired:
+                    logger.warning(f"⚠️ Волну ID {wave_id} уже отправляет другой процесс.")
+                    return {}
+
+                # Под блокировкой письма в статусе "sending" не принадлежат живому запуску: они «зависли»
+                # после аварийной остановки и возвращаются в очередь
+                release_stuck_drafts(db, wave_id)
+                drafts = claim_drafts_for_sending(db, wave_id)
+                logger.info(f"📤 Волна ID {wave_id}: к отправке {len(drafts)} писем через {len(connections)} ящиков.")
+
+                delivery = _WaveDelivery(db, wave, connections, drafts)
+                try:
+                    await delivery.run()
+                finally:
+                    delivery.stats["requeued"] = release_stuck_drafts(db, wave_id)
+
+            stats = delivery.stats
+            stats["statuses"] = get_wave_delivery_stats(db, wave_id)
+            logger.info(f"✅ Отправка волны ID {wave_id} завершена: {stats}")
+            return stats
+    finally:
+        _active_waves.discard(wave_id)
@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import uuid
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable
+
+import pandas as pd
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.types import TelegramObject, Update
+
+from db.db import SessionLocal
+from db.db_bot_state import (
+    cleanup_processed_updates, get_fsm_frames, get_fsm_record, lock_fsm_key, register_update, save_fsm_data,
+    save_fsm_fields,
+)
+from logger import logger
+
+# Как часто чистить таблицу принятых update_id (секунды)
+PROCESSED_UPDATES_CLEANUP_INTERVAL = 3600
+# Ссылка на таблицу (DataFrame) в данных FSM: {FRAME_MARKER: frame_id}
+FRAME_MARKER = "__fsm_frame__"
+
+
+def _run_in_session(func, *args, **kwargs):
+    with SessionLocal() as db:
+        return func(db, *args, **kwargs)
+
+
+def get_frame_id(frame: pd.DataFrame) -> str:
+    """ ID таблицы в данных FSM — хеш содержимого: неизменённая таблица не сохраняется заново. """
+    try:
+        digest = hashlib.sha256(pd.util.hash_pandas_object(frame, index=True).values.tobytes())
+    except TypeError:
+        # Нехешируемые значения (списки в ячейках): таблица сохраняется при каждом изменении данных
+        return uuid.uuid4().hex
+    digest.update(repr(list(frame.columns)).encode())
+    return digest.hexdigest()
+
+
+def encode_fsm_value(value, frames: dict[str, pd.DataFrame]):
+    """
+    Приводит данные FSM к JSON: DataFrame заменяются ссылками и собираются в frames.
+
+    :param value: Значение из данных FSM.
+    :param frames: Найденные таблицы {frame_id: DataFrame} (дополняется).
+    :return: JSON-совместимое значение.
+    """
+    if isinstance(value, pd.DataFrame):
+        frame_id = get_frame_id(value)
+        frames[frame_id] = value
+        return {FRAME_MARKER: frame_id}
+    if isinstance(value, dict):
+        return {str(key): encode_fsm_value(item, frames) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [encode_fsm_value(item, frames) for item in value]
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        # Скаляры numpy
+        return value.item()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"Значение типа {type(value).__name__} нельзя сохранить в данных FSM")
+
+
+def collect_frame_ids(value) -> set[str]:
+    """ ID таблиц, на которые ссылаются данные FSM. """
+    if isinstance(value, dict):
+        if FRAME_MARKER in value:
+            return {value[FRAME_MARKER]}
+        return set().union(*(collect_frame_ids(item) for item in value.values()))
+    if isinstance(value, list):
+        return set().union(*(collect_frame_ids(item) for item in value))
+    return set()
+
+
+def decode_fsm_value(value, frames: dict[str, pd.DataFrame]):
+    """ Восстанавливает данные FSM: ссылки заменяются таблицами (None, если таблица не найдена). """
+    if isinstance(value, dict):
+        if FRAME_MARKER in value:
+            frame = frames.get(value[FRAME_MARKER])
+            if frame is None:
+                logger.warning(f"⚠️ Таблица {value[FRAME_MARKER]} из данных FSM не найдена.")
+            return frame
+        return {key: decode_fsm_value(item, frames) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_fsm_value(item, frames) for item in value]
+    return value
+
+
+def load_fsm_data(db, key: str) -> dict:
+    """ Данные FSM по ключу вместе с таблицами, на которые они ссылаются. """
+    _, data = get_fsm_record(db, key)
+    if not data:
+        return {}
+    frame_ids = collect_frame_ids(data)
+    return decode_fsm_value(data, get_fsm_frames(db, key, frame_ids) if frame_ids else {})
+
+
+def update_fsm_data(db, key: str, patch: dict) -> dict:
+    """
+    Дополняет данные FSM (как dict.update) одной транзакцией под блокировкой ключа: обновления одного чата
+    из разных процессов не затирают друг друга.
+
+    :param db: Сессия базы данных.
+    :param key: Ключ хранилища.
+    :param patch: Новые значения.
+    :return: Данные FSM после обновления.
+    """
+    lock_fsm_key(db, key)
+    _, current = get_fsm_record(db, key)
+    frames = {}
+    data = {**(current or {}), **encode_fsm_value(patch, frames)}
+    frame_ids = collect_frame_ids(data)
+    save_fsm_data(db, key, data or None, frames, frame_ids)
+    stored_ids = frame_ids - set(frames)
+    return decode_fsm_value(data, {**(get_fsm_frames(db, key, stored_ids) if stored_ids else {}), **frames})
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM-хранилище в PostgreSQL: состояние пользователей общее для всех процессов бота.
+    Данные хранятся в JSON; DataFrame из сценариев загрузки лежат в fsm_frames, а в данных остаются ссылки.
+    update_data читает и записывает данные под блокировкой ключа, поэтому апдейты одного чата, попавшие
+    в разные процессы, не теряют изменений друг друга. Запросы к БД выполняются в отдельном потоке,
+    чтобы не блокировать цикл событий.
+    """
+
+    def __init__(self, key_builder: KeyBuilder | None = None):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await asyncio.to_thread(_run_in_session, save_fsm_fields, self.key_builder.build(key), state=value)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await asyncio.to_thread(_run_in_session, get_fsm_record, self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        frames = {}
+        payload = encode_fsm_value(data, frames) if data else None
+        await asyncio.to_thread(_run_in_session, save_fsm_data, self.key_builder.build(key), payload, frames)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return await asyncio.to_thread(_run_in_session, load_fsm_data, self.key_builder.build(key))
+
+    async def update_data(self, key: StorageKey, data: dict[str, Any]) -> dict[str, Any]:
+        return await asyncio.to_thread(_run_in_session, update_fsm_data, self.key_builder.build(key), data)
+
+    async def close(self) -> None:
+        pass
+
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    """
+    Пропускает апдейты, которые уже были приняты (повторная доставка вебхука или другой процесс).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Update):
+            is_new = await asyncio.to_thread(_run_in_session, register_update, event.update_id)
+            if not is_new:
+                logger.info(f"🔁 Апдейт {event.update_id} уже обработан, повтор пропущен.")
+                return None
+        return await handler(event, data)
+
+
+async def cleanup_processed_updates_loop():
+    """ Периодически удаляет устаревшие update_id. """
+    while True:
+        try:
+            removed = await asyncio.to_thread(_run_in_session, cleanup_processed_updates)
+            if removed:
+                logger.info(f"🧹 Удалено {removed} устаревших update_id.")
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки processed_updates: {e}", exc_info=True)
+        await asyncio.sleep(PROCESSED_UPDATES_CLEANUP_INTERVAL)
@@ -1,5 +1,3 @@
-import gspread
-from google.oauth2.service_account import Credentials
 import re
 
 from config import CREDENTIALS_FILE, SCOPES, SHEET_NAME, SHEET_ID
@@ -8,7 +6,6 @@ import os
 from datetime import datetime
 
 import pandas as pd
-from openpyxl.workbook import Workbook
 from logger import logger
 
 
@@ -56,6 +53,9 @@ def create_excel_with_multiple_sheets(data: dict, file_name: str) -> str:
     file_path = os.path.join(os.getcwd(), "uploads", file_name)  # Путь для сохранения файла
     os.makedirs(os.path.dirname(file_path), exist_ok=True)  # Убедиться, что директория существует
 
+    # openpyxl и клиент Google Sheets импортируются при первом использовании, а не при старте бота
+    from openpyxl.workbook import Workbook
+
     try:
         # Создаем новую книгу
         wb = Workbook()
@@ -88,6 +88,9 @@ def connect_to_google_sheets(sheet_id: str, sheet_name: str):
         logger.error("❌ Ошибка: sheet_id или sheet_name не заданы.")
         raise ValueError("sheet_id и sheet_name должны быть указаны.")
 
+    import gspread
+    from google.oauth2.service_account import Credentials
+
     creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPES)
     client = gspread.authorize(creds)
     sheet = client.open_by_key(sheet_id).worksheet(sheet_name)
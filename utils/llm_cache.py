@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from datetime import timedelta
+
+from sqlalchemy.orm import sessionmaker
+
+from config import LLM_CACHE_ENABLED, LLM_CACHE_MAX_MB, LLM_CACHE_TTL_HOURS
+from db.db import engine
+from db.db_llm_cache import evict_llm_cache, get_cached_llm_response, save_llm_response
+from logger import logger
+from utils.metrics import LLM_CACHE_REQUESTS
+
+# Как часто вытеснять устаревшие и лишние записи кэша (секунды)
+LLM_CACHE_CLEANUP_INTERVAL = 3600
+
+# Отдельные сессии: кэш вызывается из хендлеров, у которых может быть открыта своя сессия SessionLocal
+_Session = sessionmaker(bind=engine)
+
+
+def get_llm_cache_key(model: str, messages: list[dict], params: dict) -> str:
+    """
+    Ключ кэша: sha256 от модели, сообщений и параметров запроса в каноническом JSON.
+
+    :param model: Модель.
+    :param messages: Сообщения чата.
+    :param params: Остальные параметры запроса (temperature, response_format и т.п.; таймаут не учитывается).
+    :return: Шестнадцатеричный sha256.
+    """
+    params = {key: value for key, value in params.items() if key != "timeout"}
+    payload = json.dumps({"model": model, "messages": messages, "params": params},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_cached_completion(operation: str, model: str, messages: list[dict], params: dict):
+    """
+    Ищет ответ модели в кэше.
+
+    :param operation: Операция (для метрик попаданий).
+    :param model: Модель.
+    :param messages: Сообщения чата.
+    :param params: Остальные параметры запроса.
+    :return: ChatCompletion, собранный из сохранённого ответа, или None.
+    """
+    if not LLM_CACHE_ENABLED:
+        return None
+
+    with _Session() as db:
+        content = get_cached_llm_response(db, get_llm_cache_key(model, messages, params))
+
+    LLM_CACHE_REQUESTS.labels(operation, "hit" if content is not None else "miss").inc()
+    if content is None:
+        return None
+
+    logger.debug("📦 Ответ модели для %s взят из кэша.", operation)
+    return _build_completion(model, content)
+
+
+def save_completion(operation: str, model: str, messages: list[dict], params: dict, response):
+    """
+    Сохраняет ответ модели в кэш (пустые ответы не кэшируются).
+
+    :param operation: Операция.
+    :param model: Модель.
+    :param messages: Сообщения чата.
+    :param params: Остальные параметры запроса.
+    :param response: Ответ OpenAI.
+    """
+    if not LLM_CACHE_ENABLED or not response.choices or not response.choices[0].message.content:
+        return
+
+    with _Session() as db:
+        save_llm_response(db, get_llm_cache_key(model, messages, params), model, operation,
+                          response.choices[0].message.content, timedelta(hours=LLM_CACHE_TTL_HOURS))
+
+
+def _build_completion(model: str, content: str):
+    from openai.types.chat import ChatCompletion
+
+    return ChatCompletion.model_validate({
+        "id": f"cached-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    })
+
+
+def _evict():
+    with _Session() as db:
+        return evict_llm_cache(db, int(LLM_CACHE_MAX_MB * 1024 * 1024))
+
+
+async def llm_cache_cleanup_loop():
+    """ Периодически удаляет просроченные ответы и вытесняет давно не использованные сверх LLM_CACHE_MAX_MB. """
+    while LLM_CACHE_ENABLED:
+        try:
+            removed = await asyncio.to_thread(_evict)
+            if removed:
+                logger.info(f"🧹 Из кэша LLM удалено {removed} записей.")
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки кэша LLM: {e}", exc_info=True)
+        await asyncio.sleep(LLM_CACHE_CLEANUP_INTERVAL)
@@ -0,0 +1,410 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from config import (
+    LLM_BREAKER_COOLDOWN, LLM_BREAKER_FAILURES, LLM_CONCURRENCY_INITIAL, LLM_CONCURRENCY_MAX, LLM_CONCURRENCY_MIN,
+    LLM_INTERACTIVE_WAIT, LLM_LATENCY_TOLERANCE,
+)
+from logger import logger
+from utils.metrics import (
+    LLM_BREAKER_REJECTIONS, LLM_BREAKER_STATE, LLM_CONCURRENCY_LIMIT, LLM_IN_FLIGHT, LLM_SLOT_WAIT,
+)
+
+# Приоритет запросов к модели: интерактивные (ответ пользователю) при перегрузке получают отказ сразу,
+# фоновые (генерация волн, пакеты) ждут своей очереди
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+
+# Состояния предохранителя и их значения в метрике llm_breaker_state
+BREAKER_CLOSED = "closed"
+BREAKER_HALF_OPEN = "half_open"
+BREAKER_OPEN = "open"
+BREAKER_STATE_VALUES = {BREAKER_CLOSED: 0, BREAKER_HALF_OPEN: 1, BREAKER_OPEN: 2}
+
+# Сглаживание базовой задержки модели (доля нового замера)
+LATENCY_BASELINE_ALPHA = 0.05
+# Не чаще одного снижения лимита за это время: пачка одновременных 429 — один сигнал перегрузки, а не десять
+DECREASE_INTERVAL = 1.0
+# Как часто фоновый запрос проверяет полуоткрытый предохранитель, пока идёт пробный запрос (секунды)
+BREAKER_PROBE_WAIT = 1.0
+
+_priority: ContextVar[str] = ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+# Потоки для синхронных вызовов модели из асинхронного кода (генерация волн): размер — верхняя граница лимита
+_executor = ThreadPoolExecutor(max_workers=LLM_CONCURRENCY_MAX, thread_name_prefix="llm")
+
+
+class LLMUnavailableError(Exception):
+    """ Модель перегружена или недоступна (предохранитель разомкнут), интерактивный запрос отклонён сразу. """
+
+
+@contextmanager
+def llm_priority(priority: str):
+    """ Задаёт приоритет запросов к модели внутри блока. """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def is_congestion_error(error: Exception) -> bool:
+    """ Ошибки, означающие перегрузку модели: таймаут, обрыв соединения, 429 и 5xx. """
+    import openai
+
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+async def run_llm_in_thread(func, *args, **kwargs):
+    """
+    Выполняет синхронный вызов модели в пуле потоков LLM с текущим контекстом (приоритет, учёт потребления).
+
+    :param func: Функция (например, request_structured).
+    :return: Результат функции.
+    """
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_executor, call)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после failure_threshold подряд ошибок перегрузки размыкается на cooldown секунд.
+    Затем в полуоткрытом состоянии пропускает один пробный запрос: успех замыкает предохранитель, ошибка
+    перегрузки — снова размыкает, остальные запросы ждут результата пробы.
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return BREAKER_CLOSED
+        return BREAKER_HALF_OPEN if self.retry_after() == 0 else BREAKER_OPEN
+
+    def retry_after(self) -> float:
+        """ Сколько секунд до полуоткрытого состояния (0 — запросы пропускаются). """
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - self.clock())
+
+    def is_available(self) -> bool:
+        """ Примет ли предохранитель запрос сейчас (без занятия пробы) — для выбора модели в маршрутизаторе. """
+        return self.opened_at is None or (self.retry_after() == 0 and not self.probing)
+
+    def enter(self) -> bool | None:
+        """
+        Пропускает запрос; в полуоткрытом состоянии — только один пробный до его результата.
+
+        :return: None — запрос не пропущен, True — пробный запрос, False — обычный.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if self.retry_after() > 0 or self.probing:
+                return None
+            self.probing = True
+            return True
+
+    def release_probe(self):
+        """ Пробный запрос завершился без ответа о перегрузке (отмена, ошибка запроса): пробу займёт следующий. """
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self) -> bool:
+        """ Учитывает ошибку перегрузки. :return: True, если предохранитель разомкнулся. """
+        with self._lock:
+            self.failures += 1
+            half_open = self.opened_at is not None and self.retry_after() == 0
+            if half_open or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = self.clock()
+                self.probing = False
+                return True
+            return False
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdaptiveLimiter:
+    """
+    Лимит одновременных запросов по AIMD: +1 за каждые limit успешных ответов с нормальной задержкой,
+    вдвое меньше при 429, таймауте или задержке выше tolerance × базовая. Базовая задержка своя у каждой
+    операции (классификация и генерация письма на одной модели различаются в разы) и учитывает все успешные
+    ответы, в том числе медленные. Интерактивные запросы обслуживаются раньше фоновых.
+    """
+
+    def __init__(self, initial: int = LLM_CONCURRENCY_INITIAL, minimum: int = LLM_CONCURRENCY_MIN,
+                 maximum: int = LLM_CONCURRENCY_MAX, tolerance: float = LLM_LATENCY_TOLERANCE, clock=time.monotonic):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.clock = clock
+        self.in_flight = 0
+        self.baselines: dict[str | None, float] = {}
+        self._interactive_waiting = 0
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+        # Ожидающие место асинхронные запросы: (цикл событий, future), будятся вместе с потоками
+        self._async_waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def _has_slot(self, priority: str) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        return priority == PRIORITY_INTERACTIVE or self._interactive_waiting == 0
+
+    def acquire(self, priority: str = PRIORITY_INTERACTIVE, timeout: float | None = None) -> bool:
+        """
+        Занимает место для запроса.
+
+        :param priority: Приоритет запроса.
+        :param timeout: Сколько ждать (None — без ограничения).
+        :return: True, если место получено.
+        """
+        with self._condition:
+            if priority == PRIORITY_INTERACTIVE:
+                self._interactive_waiting += 1
+            try:
+                if not self._condition.wait_for(lambda: self._has_slot(priority), timeout):
+                    return False
+                self.in_flight += 1
+                return True
+            finally:
+                if priority == PRIORITY_INTERACTIVE:
+                    self._interactive_waiting -= 1
+                    self._notify()
+
+    async def acquire_async(self, priority: str = PRIORITY_INTERACTIVE, timeout: float | None = None) -> bool:
+        """
+        Занимает место для запроса, ожидая в цикле событий (без потока). При отмене место не занимается.
+
+        :param priority: Приоритет запроса.
+        :param timeout: Сколько ждать (None — без ограничения).
+        :return: True, если место получено.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        with self._condition:
+            if priority == PRIORITY_INTERACTIVE:
+                self._interactive_waiting += 1
+        try:
+            while True:
+                with self._condition:
+                    if self._has_slot(priority):
+                        self.in_flight += 1
+                        return True
+                    waiter = (loop, loop.create_future())
+                    self._async_waiters.append(waiter)
+                try:
+                    remaining = None if deadline is None else deadline - loop.time()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    await asyncio.wait_for(waiter[1], remaining)
+                except asyncio.TimeoutError:
+                    return False
+                finally:
+                    with self._condition:
+                        if waiter in self._async_waiters:
+                            self._async_waiters.remove(waiter)
+        finally:
+            if priority == PRIORITY_INTERACTIVE:
+                with self._condition:
+                    self._interactive_waiting -= 1
+                    self._notify()
+
+    def _notify(self):
+        """ Будит ожидающих место (вызывается под self._condition). """
+        self._condition.notify_all()
+        for loop, future in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # Цикл событий уже закрыт
+                pass
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._notify()
+
+    def on_success(self, latency: float | None = None, operation: str | None = None):
+        """
+        Успешный ответ.
+
+        :param latency: Время запроса (None — не оценивать, например для потоковых ответов).
+        :param operation: Операция: задержка сравнивается с базовой задержкой этой операции.
+        """
+        with self._condition:
+            slow = False
+            if latency is not None:
+                baseline = self.baselines.get(operation)
+                slow = baseline is not None and latency > self.tolerance * baseline
+                # Медленные ответы тоже входят в базовую: иначе после долгой операции или устойчивого
+                # замедления модели базовая не догонит реальную задержку и лимит будет только снижаться
+                self.baselines[operation] = latency if baseline is None else (
+                    (1 - LATENCY_BASELINE_ALPHA) * baseline + LATENCY_BASELINE_ALPHA * latency
+                )
+            if slow:
+                self._decrease()
+                return
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._notify()
+
+    def on_congestion(self):
+        with self._condition:
+            self._decrease()
+
+    def _decrease(self):
+        now = self.clock()
+        if now - self._last_decrease < DECREASE_INTERVAL:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.minimum), self.limit / 2)
+
+
+class LLMGuard:
+    """ Лимит одновременных запросов и предохранитель одной модели; общий для всех мест вызова модели. """
+
+    def __init__(self, model: str, limiter: AdaptiveLimiter | None = None, breaker: CircuitBreaker | None = None):
+        self.model = model
+        self.limiter = limiter or AdaptiveLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self._update_metrics()
+
+    def _update_metrics(self):
+        LLM_CONCURRENCY_LIMIT.labels(self.model).set(int(self.limiter.limit))
+        LLM_IN_FLIGHT.labels(self.model).set(self.limiter.in_flight)
+        LLM_BREAKER_STATE.labels(self.model).set(BREAKER_STATE_VALUES[self.breaker.state])
+
+    def _reject(self, priority: str, reason: str):
+        LLM_BREAKER_REJECTIONS.labels(self.model, priority).inc()
+        raise LLMUnavailableError(f"Модель {self.model} недоступна: {reason}")
+
+    def _acquire(self, priority: str):
+        start = time.perf_counter()
+        timeout = LLM_INTERACTIVE_WAIT if priority == PRIORITY_INTERACTIVE else None
+        acquired = self.limiter.acquire(priority, timeout)
+        self._acquired(priority, acquired, timeout, time.perf_counter() - start)
+
+    async def _acquire_async(self, priority: str):
+        start = time.perf_counter()
+        timeout = LLM_INTERACTIVE_WAIT if priority == PRIORITY_INTERACTIVE else None
+        acquired = await self.limiter.acquire_async(priority, timeout)
+        self._acquired(priority, acquired, timeout, time.perf_counter() - start)
+
+    def _acquired(self, priority: str, acquired: bool, timeout: float | None, wait: float):
+        LLM_SLOT_WAIT.labels(priority).observe(wait)
+        if not acquired:
+            self._reject(priority, f"все {int(self.limiter.limit)} мест заняты дольше {timeout} с")
+        self._update_metrics()
+
+    def _enter(self, priority: str) -> bool | None:
+        """
+        Проверка предохранителя перед запросом (без ожидания).
+
+        :return: Как CircuitBreaker.enter: None — фоновому запросу ждать, True — пробный запрос.
+        :raises LLMUnavailableError: Предохранитель не пропускает интерактивный запрос.
+        """
+        probe = self.breaker.enter()
+        if probe is None and priority == PRIORITY_INTERACTIVE:
+            retry_after = self.breaker.retry_after()
+            self._reject(priority, f"предохранитель разомкнут ещё {retry_after:.0f} с" if retry_after
+                         else "предохранитель ждёт результата пробного запроса")
+        return probe
+
+    def _finish(self, error: BaseException | None, latency: float | None, operation: str | None, probe: bool):
+        self.limiter.release()
+        if error is None:
+            self.limiter.on_success(latency, operation)
+            self.breaker.record_success()
+        elif isinstance(error, Exception) and is_congestion_error(error):
+            self.limiter.on_congestion()
+            if self.breaker.record_failure():
+                logger.warning(f"🔌 Предохранитель модели {self.model} разомкнут на {self.breaker.cooldown} с.")
+        elif probe:
+            self.breaker.release_probe()
+        self._update_metrics()
+
+    @contextmanager
+    def slot(self, operation: str | None = None):
+        """
+        Место для синхронного запроса к модели (ждёт в потоке, поэтому фоновые вызовы — через run_llm_in_thread).
+
+        :param operation: Операция: задержка ответа сравнивается с обычной для неё.
+        """
+        priority = _priority.get()
+        while (probe := self._enter(priority)) is None:
+            time.sleep(self.breaker.retry_after() or BREAKER_PROBE_WAIT)
+
+        try:
+            self._acquire(priority)
+        except BaseException:
+            if probe:
+                self.breaker.release_probe()
+            raise
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            # Отмена и прерванный поток только освобождают место
+            self._finish(e, None, operation, probe)
+            raise
+        self._finish(None, time.perf_counter() - start, operation, probe)
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """ Место для асинхронного (потокового) запроса к модели; задержка потока в AIMD не учитывается. """
+        priority = _priority.get()
+        while (probe := self._enter(priority)) is None:
+            await asyncio.sleep(self.breaker.retry_after() or BREAKER_PROBE_WAIT)
+
+        try:
+            # Место ждётся в цикле событий: отменённый запрос не занимает ни места, ни потока
+            await self._acquire_async(priority)
+        except BaseException:
+            if probe:
+                self.breaker.release_probe()
+            raise
+        try:
+            yield
+        except BaseException as e:
+            self._finish(e, None, None, probe)
+            raise
+        self._finish(None, None, None, probe)
+
+
+_guards: dict[str, LLMGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def get_llm_guard(model: str) -> LLMGuard:
+    """ Возвращает общий для процесса ограничитель модели. """
+    with _guards_lock:
+        if model not in _guards:
+            _guards[model] = LLMGuard(model)
+        return _guards[model]
@@ -0,0 +1,176 @@
+import time
+
+from config import LLM_ROUTES, LLM_TIMEOUTS
+from logger import logger
+
+# Классы задач: каждый вызов модели объявляет свой класс и получает настроенную цепочку моделей
+TASK_CLASSIFY = "classify"
+TASK_EXTRACT = "extract"
+TASK_GENERATE = "generate"
+TASK_EDIT = "edit"
+
+# Модели по классам задач: первая — основная, остальные — запасные (при таймауте, 429, 5xx, недоступности).
+# Классификация и извлечение — на малой модели, генерация писем остаётся на большой.
+DEFAULT_ROUTES = {
+    TASK_CLASSIFY: ["gpt-4o-mini", "gpt-3.5-turbo"],
+    TASK_EXTRACT: ["gpt-4o-mini", "gpt-3.5-turbo"],
+    TASK_GENERATE: ["gpt-4", "gpt-4o"],
+    TASK_EDIT: ["gpt-4o", "gpt-4"],
+}
+# Таймаут одного запроса к модели по классам задач (секунды)
+DEFAULT_TIMEOUTS = {
+    TASK_CLASSIFY: 10.0,
+    TASK_EXTRACT: 15.0,
+    TASK_GENERATE: 60.0,
+    TASK_EDIT: 30.0,
+}
+# Модели с JSON-режимом (response_format={"type": "json_object"}); остальным формат задаётся только промптом
+JSON_MODE_MODEL_PREFIXES = ("gpt-4o", "gpt-4-turbo", "gpt-4.1", "gpt-3.5-turbo", "o1", "o3", "o4")
+
+
+def _parse_pairs(value: str) -> dict[str, str]:
+    pairs = {}
+    for item in value.split(","):
+        key, _, item_value = item.partition("=")
+        if key.strip() and item_value.strip():
+            pairs[key.strip().lower()] = item_value.strip()
+    return pairs
+
+
+def parse_routes(value: str) -> dict[str, list[str]]:
+    """
+    Разбирает переопределение маршрутов "задача=модель|запасная,задача=модель".
+
+    :param value: Строка из LLM_ROUTES.
+    :return: Словарь {задача: [модели]}.
+    """
+    routes = {}
+    for task, models in _parse_pairs(value).items():
+        chain = [model.strip() for model in models.split("|") if model.strip()]
+        if chain:
+            routes[task] = chain
+    return routes
+
+
+def parse_timeouts(value: str) -> dict[str, float]:
+    """
+    Разбирает переопределение таймаутов "задача=секунды,задача=секунды".
+
+    :param value: Строка из LLM_TIMEOUTS.
+    :return: Словарь {задача: таймаут}.
+    """
+    return {task: float(seconds) for task, seconds in _parse_pairs(value).items()}
+
+
+ROUTES = {**DEFAULT_ROUTES, **parse_routes(LLM_ROUTES)}
+TIMEOUTS = {**DEFAULT_TIMEOUTS, **parse_timeouts(LLM_TIMEOUTS)}
+
+
+def get_route(task: str) -> tuple[list[str], float]:
+    """
+    Возвращает цепочку моделей и таймаут для класса задачи.
+
+    :param task: Класс задачи (TASK_*).
+    :return: (модели в порядке использования, таймаут запроса в секундах).
+    """
+    if task not in ROUTES:
+        raise ValueError(f"Неизвестный класс задачи LLM: {task}")
+    return ROUTES[task], TIMEOUTS.get(task, DEFAULT_TIMEOUTS[TASK_GENERATE])
+
+
+def supports_json_mode(model: str) -> bool:
+    """ Поддерживает ли модель response_format={"type": "json_object"}. """
+    return model.startswith(JSON_MODE_MODEL_PREFIXES)
+
+
+def is_fallback_error(error: Exception) -> bool:
+    """ Ошибки, при которых есть смысл повторить запрос на запасной модели. """
+    import openai
+
+    from utils.llm_guard import LLMUnavailableError
+
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError,
+                          openai.NotFoundError, LLMUnavailableError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def get_available_models(models: list[str]) -> list[str]:
+    """
+    Убирает из цепочки модели с разомкнутым предохранителем, чтобы сразу обращаться к запасной.
+    Последняя модель остаётся всегда: при её недоступности интерактивный запрос получит отказ, фоновый — подождёт.
+    """
+    from utils.llm_guard import get_llm_guard
+
+    available = [model for model in models[:-1] if get_llm_guard(model).breaker.is_available()]
+    return available + models[-1:]
+
+
+def route_chat_completion(task: str, operation: str, messages: list[dict], cacheable: bool = False,
+                          json_mode: bool = False, **kwargs):
+    """
+    Отправляет запрос модели, настроенной для класса задачи, переходя на запасные модели при сбоях.
+
+    :param task: Класс задачи (classify, extract, generate, edit).
+    :param operation: Операция для метрик (extract_filters, draft и т.п.).
+    :param messages: Сообщения чата.
+    :param cacheable: Разрешить ответ из кэша LLM.
+    :param json_mode: Запросить JSON-объект у моделей, которые это поддерживают.
+    :return: Ответ OpenAI.
+    """
+    from classifier import create_chat_completion
+    from utils.metrics import LLM_ROUTE_COST, LLM_ROUTE_FALLBACKS, LLM_ROUTE_LATENCY, get_llm_cost
+
+    models, timeout = get_route(task)
+    models = get_available_models(models)
+    for index, model in enumerate(models):
+        params = dict(kwargs)
+        if json_mode and supports_json_mode(model):
+            params["response_format"] = {"type": "json_object"}
+        start = time.perf_counter()
+        try:
+            response = create_chat_completion(operation, model, messages, cacheable=cacheable, timeout=timeout, **params)
+        except Exception as e:
+            if index == len(models) - 1 or not is_fallback_error(e):
+                raise
+            LLM_ROUTE_FALLBACKS.labels(task, model, type(e).__name__).inc()
+            logger.warning(f"⚠️ Модель {model} ({task}/{operation}) недоступна: {type(e).__name__}. "
+                           f"Переход на {models[index + 1]}.")
+            continue
+        LLM_ROUTE_LATENCY.labels(task, model).observe(time.perf_counter() - start)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            LLM_ROUTE_COST.labels(task, model).inc(
+                get_llm_cost(model, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+            )
+        return response
+
+
+async def stream_route_chat_completion(task: str, operation: str, messages: list[dict], **kwargs):
+    """
+    Потоковый вариант route_chat_completion. На запасную модель переходит, только пока не получен
+    первый фрагмент ответа: начатый ответ пользователь уже видит, и подменять его нельзя.
+
+    :param task: Класс задачи (classify, extract, generate, edit).
+    :param operation: Операция для метрик.
+    :param messages: Сообщения чата.
+    :return: Асинхронный генератор фрагментов текста.
+    """
+    from classifier import stream_chat_completion
+    from utils.metrics import LLM_ROUTE_FALLBACKS
+
+    models, timeout = get_route(task)
+    models = get_available_models(models)
+    for index, model in enumerate(models):
+        started = False
+        try:
+            async for chunk in stream_chat_completion(operation, model, messages, timeout=timeout, **kwargs):
+                started = True
+                yield chunk
+            return
+        except Exception as e:
+            if started or index == len(models) - 1 or not is_fallback_error(e):
+                raise
+            LLM_ROUTE_FALLBACKS.labels(task, model, type(e).__name__).inc()
+            logger.warning(f"⚠️ Модель {model} ({task}/{operation}) недоступна: {type(e).__name__}. "
+                           f"Переход на {models[index + 1]}.")
@@ -0,0 +1,207 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from logger import logger
+
+# Бакеты задержек (секунды): от быстрых SQL-запросов до долгих вызовов LLM
+FAST_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+# Стоимость моделей OpenAI, USD за 1000 токенов (prompt, completion)
+LLM_PRICES_PER_1K = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+
+HANDLER_LATENCY = Histogram(
+    "bot_handler_seconds", "Время обработки апдейта хендлером", ["router", "handler", "state"], buckets=SLOW_BUCKETS
+)
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в хендлерах", ["router", "handler"])
+
+LLM_LATENCY = Histogram("llm_request_seconds", "Время запроса к LLM", ["model", "operation"], buckets=SLOW_BUCKETS)
+LLM_ERRORS = Counter("llm_request_errors_total", "Ошибки запросов к LLM", ["model", "operation"])
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "Время до первого фрагмента потокового ответа LLM", ["model", "operation"],
+    buckets=SLOW_BUCKETS
+)
+LLM_TOKENS = Counter("llm_tokens_total", "Токены LLM", ["model", "operation", "kind"])
+LLM_CACHE_REQUESTS = Counter("llm_cache_requests_total", "Обращения к кэшу ответов LLM", ["operation", "result"])
+COMPANY_CONTEXT_REQUESTS = Counter(
+    "company_context_requests_total", "Обращения к кэшу сокращённых сведений о компании", ["task", "result"]
+)
+LLM_COST = Counter("llm_cost_usd_total", "Оценка стоимости запросов к LLM, USD", ["model", "operation"])
+LLM_ROUTE_LATENCY = Histogram(
+    "llm_route_seconds", "Время запроса к LLM по классу задачи и модели маршрута", ["task", "model"],
+    buckets=SLOW_BUCKETS
+)
+LLM_ROUTE_COST = Counter("llm_route_cost_usd_total", "Стоимость запросов к LLM по маршрутам, USD", ["task", "model"])
+LLM_ROUTE_FALLBACKS = Counter(
+    "llm_route_fallbacks_total", "Переходы на запасную модель маршрута", ["task", "model", "error"]
+)
+LLM_STRUCTURED_OUTPUT = Counter(
+    "llm_structured_output_total", "Разбор структурированных ответов LLM: ok, repaired, retried, failed",
+    ["operation", "result"]
+)
+LLM_RETRIES_AVOIDED = Counter(
+    "llm_retries_avoided_total", "Повторные запросы к LLM, которых удалось избежать локальным исправлением JSON",
+    ["operation"]
+)
+LLM_CONCURRENCY_LIMIT = Gauge("llm_concurrency_limit", "Адаптивный лимит одновременных запросов к LLM", ["model"])
+LLM_IN_FLIGHT = Gauge("llm_in_flight_requests", "Выполняющиеся запросы к LLM", ["model"])
+LLM_BREAKER_STATE = Gauge(
+    "llm_breaker_state", "Состояние предохранителя LLM: 0 — замкнут, 1 — полуоткрыт, 2 — разомкнут", ["model"]
+)
+LLM_BREAKER_REJECTIONS = Counter(
+    "llm_breaker_rejections_total", "Запросы к LLM, отклонённые без обращения к модели", ["model", "priority"]
+)
+LLM_SLOT_WAIT = Histogram(
+    "llm_slot_wait_seconds", "Ожидание места для запроса к LLM", ["priority"], buckets=SLOW_BUCKETS
+)
+INTENT_CLASSIFICATIONS = Counter(
+    "intent_classifications_total", "Классификации сообщений: локальной моделью или через LLM", ["source"]
+)
+INTENT_AB_RESULTS = Counter(
+    "intent_ab_results_total", "Совпадение ответа локальной модели классификации с LLM", ["result"]
+)
+
+DB_QUERY_LATENCY = Histogram("db_query_seconds", "Время SQL-запросов", ["statement"], buckets=FAST_BUCKETS)
+
+DRAFTS_GENERATED = Counter("wave_drafts_generated_total", "Сгенерированные черновики", ["status"])
+DRAFT_BATCH_LATENCY = Histogram(
+    "wave_draft_batch_seconds", "Время генерации партии черновиков", buckets=SLOW_BUCKETS
+)
+EMAILS_SENT = Counter("wave_emails_total", "Письма волн по результату отправки", ["status"])
+
+CHAT_QUEUE_DEPTH = Gauge("chat_queue_depth", "Апдейты в очередях чатов (включая обрабатываемые)")
+CHAT_QUEUE_WAIT = Histogram("chat_queue_wait_seconds", "Ожидание апдейта в очереди чата", buckets=SLOW_BUCKETS)
+CHAT_QUEUE_DROPPED = Counter("chat_queue_dropped_total", "Апдейты, не попавшие в очередь чата", ["reason"])
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Замеряет время каждого хендлера с метками роутера, хендлера и группы FSM-состояния.
+    Роутеры создаются без имён, поэтому роутер определяется по модулю, где объявлен хендлер.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        handler_name = getattr(callback, "__name__", "unknown")
+        router_name = getattr(callback, "__module__", None) or "unknown"
+        # Только группа состояний: полное имя состояния даёт лишнюю кардинальность
+        state = (data.get("raw_state") or "none").split(":")[0]
+
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(router_name, handler_name).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(router_name, handler_name, state).observe(time.perf_counter() - start)
+
+
+def instrument_dispatcher(dp: Dispatcher):
+    """
+    Подключает замер хендлеров (сообщения и нажатия кнопок). Внутренние middleware диспетчера aiogram
+    применяет и к хендлерам вложенных роутеров, поэтому замер подключается только к корню — иначе хендлер
+    учитывался бы дважды.
+    """
+    middleware = HandlerMetricsMiddleware()
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
+
+
+def instrument_engine(engine: Engine):
+    """ Подключает замер времени SQL-запросов к движку SQLAlchemy. """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start"].pop()
+        DB_QUERY_LATENCY.labels(get_statement_type(statement)).observe(time.perf_counter() - started)
+
+
+def get_statement_type(statement: str) -> str:
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return verb if verb in {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"} else "OTHER"
+
+
+def get_llm_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    Оценивает стоимость запроса к модели.
+
+    :param model: Имя модели (версии вида gpt-4o-2024-08-06 сопоставляются с базовой моделью).
+    :param prompt_tokens: Токены запроса.
+    :param completion_tokens: Токены ответа.
+    :return: Стоимость в USD (0, если цена модели неизвестна).
+    """
+    prices = LLM_PRICES_PER_1K.get(model)
+    if prices is None:
+        base = max((name for name in LLM_PRICES_PER_1K if model.startswith(name)), key=len, default=None)
+        prices = LLM_PRICES_PER_1K.get(base, (0, 0))
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1000
+
+
+def record_llm_usage(model: str, operation: str, usage, price_factor: float = 1.0) -> float:
+    """
+    Учитывает токены и стоимость ответа модели.
+
+    :param model: Модель.
+    :param operation: Операция (classify, map_columns, draft и т.п.).
+    :param usage: Объект usage из ответа OpenAI (может отсутствовать).
+    :param price_factor: Множитель цены (скидка Batch API).
+    :return: Стоимость запроса в USD.
+    """
+    if usage is None:
+        return 0.0
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    LLM_TOKENS.labels(model, operation, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(model, operation, "completion").inc(completion_tokens)
+    cost = get_llm_cost(model, prompt_tokens, completion_tokens) * price_factor
+    LLM_COST.labels(model, operation).inc(cost)
+    return cost
+
+
+@contextmanager
+def observe_llm_call(model: str, operation: str):
+    """ Замеряет время запроса к модели и считает ошибки. """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        LLM_ERRORS.labels(model, operation).inc()
+        raise
+    finally:
+        LLM_LATENCY.labels(model, operation).observe(time.perf_counter() - start)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """
+    Поднимает HTTP-эндпоинт /metrics в формате Prometheus.
+
+    :param port: Порт (0 — метрики не публикуются).
+    :param host: Адрес (по умолчанию только локальный).
+    """
+    if not port:
+        return
+    start_http_server(port, addr=host)
+    logger.info(f"📈 Метрики доступны на http://{host}:{port}/metrics")
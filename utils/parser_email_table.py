@@ -1,17 +1,23 @@
 import pandas as pd
 import re
-import json
 import logging
-from classifier import client
-from db.db import engine
-from db.dynamic_table_manager import create_dynamic_email_table
+from utils.llm_router import TASK_EXTRACT
+from utils.structured_output import StructuredOutputError, request_structured
+from db.db import engine, SessionLocal
+from db.db_column_mapping import get_cached_column_mapping, save_column_mapping
+from db.dynamic_table_manager import create_dynamic_email_table, ensure_email_dedup_index
 from db.email_table_db import process_table_operations
 from db.segmentation import EMAIL_SEGMENT_COLUMNS
 from sqlalchemy import inspect
 from aiogram.fsm.context import FSMContext
 from promts.email_table_promt import generate_column_mapping_prompt
+from promts.output_schemas import ColumnMapping
+from logger import get_sampled_logger
+from utils.column_mapping import get_header_signature, match_columns, normalize_header
 
 logger = logging.getLogger(__name__)
+# Построчные события загрузки пишутся с выборкой, чтобы логирование не тормозило большие файлы
+row_logger = get_sampled_logger(__name__, every=100, per_second=5)
 
 
 def clean_dataframe(df: pd.DataFrame) -> pd.DataFrame:
@@ -23,44 +29,73 @@ def clean_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-async def map_columns(user_columns: list) -> dict:
+async def map_columns(user_columns: list, company_id: int | None = None) -> dict | None:
+    """
+    Сопоставляет колонки загруженной таблицы с полями email-сегмента.
+    Повторяющийся набор заголовков берётся из кэша, известные заголовки распознаются локально,
+    в модель уходят только нераспознанные колонки.
+
+    :param user_columns: Заголовки загруженной таблицы.
+    :param company_id: ID компании (для кэша маппингов компании).
+    :return: {заголовок: поле или None} или None, если ни одна колонка не сопоставлена.
+    """
+    signature = get_header_signature(user_columns)
+
+    with SessionLocal() as db:
+        cached = get_cached_column_mapping(db, company_id, signature)
+    if cached is not None:
+        mapping = {column: cached.get(normalize_header(column)) for column in user_columns}
+        logger.info("📦 Маппинг колонок взят из кэша: %s", mapping)
+        return mapping if any(mapping.values()) else None
+
+    mapping, unresolved = match_columns(user_columns)
+    logger.info("🔎 Локально сопоставлено %d из %d колонок, в модель: %s", len(mapping), len(user_columns), unresolved)
+
+    complete = True
+    if unresolved:
+        model_mapping = await map_columns_with_model(unresolved)
+        if model_mapping is None:
+            # Модель не ответила: работаем с тем, что распознано локально, но не кэшируем неполный маппинг
+            complete = False
+            model_mapping = {}
+        for column in unresolved:
+            field = model_mapping.get(column)
+            mapping[column] = field if field in EMAIL_SEGMENT_COLUMNS else None
+
+    mapping = {column: mapping.get(column) for column in user_columns}
+    logger.debug("🔄 Полученный маппинг: %s", mapping)
+
+    if not any(mapping.values()):
+        return None
+
+    if complete:
+        # Маппинг без участия модели годится для всех компаний, ответ модели кэшируется для компании
+        with SessionLocal() as db:
+            save_column_mapping(
+                db, company_id, signature,
+                {normalize_header(column): field for column, field in mapping.items()},
+                shared=not unresolved,
+            )
+
+    return mapping
+
+
+async def map_columns_with_model(user_columns: list) -> dict | None:
     """ Отправляет запрос на маппинг колонок через ИИ и логирует данные перед отправкой. """
     logger.debug("🔄 Отправка запроса для маппинга колонок...")
 
     prompt = generate_column_mapping_prompt(user_columns)
 
-    logger.debug(f"📤 Данные, отправляемые в модель: {json.dumps({'messages': [{'role': 'user', 'content': prompt}]}, indent=2, ensure_ascii=False)}")
-
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}]
-    )
-
-    logger.debug(f"📩 Полный ответ от OpenAI перед обработкой: {response}")
-
-    # Получаем сырое содержимое ответа
-    raw_response = response.choices[0].message.content.strip() if response.choices else ""
-
-    # Если ответ пустой — ошибка
-    if not raw_response:
-        logger.error("❌ Ошибка: пустой ответ от OpenAI API. Проверь параметры запроса.")
-        return {}
-
-    # Проверяем, есть ли Markdown-обёртка, и удаляем её только если она есть
-    if raw_response.startswith("```json") and raw_response.endswith("```"):
-        cleaned_response = re.sub(r"^```json\s*|\s*```$", "", raw_response).strip()
-    else:
-        cleaned_response = raw_response  # Оставляем без изменений, если обёртки нет
+    logger.debug("📤 Данные, отправляемые в модель: %s", prompt)
 
     try:
-        mapping = json.loads(cleaned_response)
-    except json.JSONDecodeError as e:
-        logger.error(f"❌ Ошибка декодирования JSON: {e}. Оригинальный ответ: {raw_response}")
-        return {}
+        mapping = request_structured(TASK_EXTRACT, "map_columns", prompt, ColumnMapping, cacheable=True)
+    except StructuredOutputError as e:
+        logger.error(f"❌ Ошибка разбора ответа модели для маппинга колонок: {e}")
+        return None
 
-    logger.debug(f"🔄 Полученный маппинг: {mapping}")
-
-    return mapping if mapping and any(mapping.values()) else None
+    logger.debug("📩 Ответ модели с маппингом колонок: %s", mapping.root)
+    return mapping.root
 
 
 def count_emails_in_cell(cell):
@@ -94,19 +129,21 @@ def clean_and_validate_emails(df: pd.DataFrame) -> tuple:
     multi_email_rows = []
     problematic_values = []
 
-    logger.debug(f"📩 Начинаем проверку email-колонки: {email_column}")
+    logger.debug("📩 Начинаем проверку email-колонки: %s", email_column)
 
     for index, value in df[email_column].items():
-        logger.debug(f"🔍 Обрабатываем строку {index + 1}: '{value}'")
+        # Несколько адресов в ячейке невозможны без нескольких «@» — остальные строки не разбираем
+        if value.count("@") < 2:
+            continue
 
         count, emails = count_emails_in_cell(value)
 
         if count > 1:
-            logger.info(f"📌 В строке {index + 1} найдено {count} email: {emails}")
+            row_logger.info("📌 В строке %d найдено %d email: %s", index + 1, count, emails)
             multi_email_rows.append(index + 1)  # +1, чтобы соответствовало Excel
             problematic_values.append(", ".join(emails))
 
-    logger.info(f"✅ Найдено {len(multi_email_rows)} строк с несколькими email.")
+    logger.info("✅ Найдено %d строк с несколькими email.", len(multi_email_rows))
 
     return df, email_column, len(multi_email_rows), multi_email_rows, problematic_values
 
@@ -122,7 +159,7 @@ async def save_cleaned_data(df: pd.DataFrame, segment_table_name: str, message,
         await message.reply("⚠️ Ошибка: не удалось определить имя файла.")
         return False
 
-    logger.debug(f"📌 Используется file_name: {file_name}")
+    logger.debug("📌 Используется file_name: %s", file_name)
 
     # **Добавляем file_name в DataFrame**
     df["file_name"] = file_name  # Добавляем колонку с названием файла
@@ -131,20 +168,20 @@ async def save_cleaned_data(df: pd.DataFrame, segment_table_name: str, message,
     REQUIRED_COLUMNS = EMAIL_SEGMENT_COLUMNS + ["file_name"]
     MANDATORY_COLUMNS = ["email", "file_name"]  # Обязательные колонки
 
-    logger.debug(f"📌 REQUIRED_COLUMNS: {REQUIRED_COLUMNS}")
-    logger.debug(f"📌 Фактические колонки в DataFrame перед фильтрацией: {df.columns.tolist()}")
+    logger.debug("📌 REQUIRED_COLUMNS: %s", REQUIRED_COLUMNS)
+    logger.debug("📌 Фактические колонки в DataFrame перед фильтрацией: %s", df.columns)
 
     # **Оставляем только нужные колонки**
     df = df[[col for col in df.columns if col in REQUIRED_COLUMNS]]
 
-    logger.debug(f"📌 Итоговые колонки после фильтрации: {df.columns.tolist()}")
+    logger.debug("📌 Итоговые колонки после фильтрации: %s", df.columns)
 
     # **Добавляем отсутствующие колонки из REQUIRED_COLUMNS и заполняем их None**
     for col in REQUIRED_COLUMNS:
         if col not in df.columns:
             df[col] = None  # Заполняем None, так как пользователь не загрузил эти данные
 
-    logger.debug(f"📌 Итоговые колонки после добавления недостающих: {df.columns.tolist()}")
+    logger.debug("📌 Итоговые колонки после добавления недостающих: %s", df.columns)
 
     # Проверяем, есть ли обязательные колонки
     missing_mandatory = [col for col in MANDATORY_COLUMNS if col not in df.columns]
@@ -153,18 +190,39 @@ async def save_cleaned_data(df: pd.DataFrame, segment_table_name: str, message,
         return False
 
     # Проверяем, существует ли таблица
+    existing_duplicates = 0
     if not inspect(engine).has_table(segment_table_name):
         create_dynamic_email_table(engine, segment_table_name)
         logger.info(f"✅ Таблица '{segment_table_name}' создана.")
+    else:
+        existing_duplicates = ensure_email_dedup_index(engine, segment_table_name)
 
     # Получаем chat_id
     chat_id = str(message.chat.id)
 
-    # Передаём `file_name` в `process_table_operations`
-    result = process_table_operations(df, file_name, chat_id, message, segment_table_name)
+    # Передаём `file_name` в `process_table_operations`; без уникального индекса (повторы в таблице или ошибка
+    # его создания) дописываются только новые email
+    mode = "upsert" if existing_duplicates == 0 else "insert_new"
+    result = process_table_operations(df, file_name, chat_id, message, segment_table_name, mode)
 
     if result:
-        await message.reply(f"✅ База email загружена. Доступно записей: {len(df)}.")
+        await message.reply(
+            f"✅ База email загружена.\n"
+            f"• Новых записей: {result['new']}\n"
+            f"• Обновлено существующих: {result['updated']}\n"
+            f"• Дубликатов в файле: {result['duplicates']}"
+        )
+        if existing_duplicates is None:
+            await message.reply(
+                f"⚠️ Не удалось проверить повторы email в ранее загруженной базе, поэтому существующие записи "
+                f"не обновлялись ({result['skipped']} строк файла пропущено)."
+            )
+        elif existing_duplicates:
+            await message.reply(
+                f"⚠️ В ранее загруженной базе {existing_duplicates} email записаны несколько раз, поэтому "
+                f"существующие записи не обновлялись ({result['skipped']} строк файла пропущено). "
+                f"Обратитесь к администратору, чтобы объединить повторы."
+            )
     else:
         await message.reply(f"❌ Ошибка при обработке данных из {file_name}.")
 
@@ -0,0 +1,287 @@
+import hashlib
+import json
+import logging
+import operator
+import re
+from abc import ABC, abstractmethod
+from functools import lru_cache
+
+import pandas as pd
+from sqlalchemy import and_, case, cast, column, func, or_, select, table, text, Numeric, true
+from sqlalchemy.sql.elements import ColumnElement
+
+from db.segmentation import EMAIL_SEGMENT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Пробельные символы (включая неразрывный пробел), которые вырезаются из чисел вида "1 000 000"
+NUMBER_WHITESPACE_PATTERN = "[\\s\u00a0]+"
+# Строка считается числом только в таком виде (после замены запятой на точку)
+NUMBER_PATTERN = "^-?[0-9]+(\\.[0-9]+)?$"
+
+NUMERIC_OPERATORS = {
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+class _Condition(ABC):
+    """
+    Условие по одной колонке. Каждое условие умеет выражать себя и в SQL, и в виде
+    векторизованной маски pandas — с одинаковой семантикой.
+    """
+
+    def __init__(self, column_name: str):
+        self.column_name = column_name
+
+    @abstractmethod
+    def to_sql(self) -> ColumnElement:
+        """ Условие в SQL. """
+
+    @abstractmethod
+    def to_mask(self, df: pd.DataFrame) -> pd.Series:
+        """ Условие как маска строк DataFrame. """
+
+
+class _PresenceCondition(_Condition):
+    """ Значение заполнено (True) или пустое (False). Пустым считается NULL и строка из пробелов. """
+
+    def __init__(self, column_name: str, present: bool):
+        super().__init__(column_name)
+        self.present = present
+
+    def to_sql(self) -> ColumnElement:
+        col = column(self.column_name)
+        if self.present:
+            return and_(col.isnot(None), func.btrim(col) != "")
+        return or_(col.is_(None), func.btrim(col) == "")
+
+    def to_mask(self, df: pd.DataFrame) -> pd.Series:
+        series = df[self.column_name]
+        filled = series.notna() & (series.fillna("").astype(str).str.strip(" ") != "")
+        return filled if self.present else ~filled
+
+
+class _ContainsCondition(_Condition):
+    """ Значение содержит хотя бы одну из подстрок (без учёта регистра). """
+
+    def __init__(self, column_name: str, values: list[str]):
+        super().__init__(column_name)
+        self.values = values
+
+    def to_sql(self) -> ColumnElement:
+        lowered = func.lower(column(self.column_name))
+        return or_(*[lowered.contains(value, autoescape=True) for value in self.values])
+
+    def to_mask(self, df: pd.DataFrame) -> pd.Series:
+        lowered = df[self.column_name].fillna("").astype(str).str.lower()
+        mask = pd.Series(False, index=df.index)
+        for value in self.values:
+            mask |= lowered.str.contains(value, regex=False)
+        return mask & df[self.column_name].notna()
+
+
+class _NumericCondition(_Condition):
+    """ Числовое сравнение. Нечисловые значения в колонке условию не удовлетворяют. """
+
+    def __init__(self, column_name: str, op: str, value: float):
+        super().__init__(column_name)
+        self.op = op
+        self.value = value
+
+    def to_sql(self) -> ColumnElement:
+        cleaned = func.replace(
+            func.regexp_replace(column(self.column_name), NUMBER_WHITESPACE_PATTERN, "", "g"), ",", "."
+        )
+        number = case((cleaned.op("~")(NUMBER_PATTERN), cast(cleaned, Numeric)), else_=None)
+        return NUMERIC_OPERATORS[self.op](number, self.value)
+
+    def to_mask(self, df: pd.DataFrame) -> pd.Series:
+        cleaned = (
+            df[self.column_name].fillna("").astype(str)
+            .str.replace(NUMBER_WHITESPACE_PATTERN, "", regex=True)
+            .str.replace(",", ".", regex=False)
+        )
+        number = pd.to_numeric(cleaned.where(cleaned.str.match(NUMBER_PATTERN)), errors="coerce")
+        return NUMERIC_OPERATORS[self.op](number, self.value).fillna(False).astype(bool)
+
+
+class CompiledSegmentFilter:
+    """
+    Скомпилированный набор фильтров сегментации.
+    Один и тот же объект применяется и в SQL (выборка из email-таблицы), и к DataFrame.
+    """
+
+    def __init__(self, filters: dict, conditions: list[_Condition]):
+        self.filters = filters
+        self.conditions = conditions
+        self.filter_hash = get_filters_hash(filters)
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.conditions
+
+    def where_clause(self) -> ColumnElement:
+        """ Возвращает SQL-условие WHERE для выборки сегмента. """
+        if not self.conditions:
+            return true()
+        return and_(*[condition.to_sql() for condition in self.conditions])
+
+    def select_query(self, table_name: str, columns: list | None = None, limit: int | None = None):
+        """
+        Формирует SELECT по email-таблице с условиями сегмента.
+
+        :param table_name: Имя email-таблицы.
+        :param columns: Список колонок (по умолчанию все).
+        :param limit: Ограничение количества строк.
+        :return: Объект SQLAlchemy Select.
+        """
+        selected = [column(name) for name in columns] if columns else [text("*")]
+        query = select(*selected).select_from(table(table_name)).where(self.where_clause())
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    def mask(self, df: pd.DataFrame) -> pd.Series:
+        """ Возвращает булеву маску строк DataFrame, попадающих в сегмент. """
+        result = pd.Series(True, index=df.index)
+        for condition in self.conditions:
+            if condition.column_name not in df.columns:
+                return pd.Series(False, index=df.index)
+            result &= condition.to_mask(df)
+        return result
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        """ Применяет фильтры к DataFrame. """
+        if df.empty or not self.conditions:
+            return df
+        return df[self.mask(df)]
+
+
+def get_filters_hash(filters: dict | None) -> str:
+    """
+    Возвращает стабильный хеш набора фильтров (не зависит от порядка ключей).
+
+    :param filters: Фильтры сегментации.
+    :return: Hex-строка SHA-1.
+    """
+    return hashlib.sha1(_canonical_json(filters).encode("utf-8")).hexdigest()
+
+
+def compile_filters(filters: dict | None) -> CompiledSegmentFilter:
+    """
+    Компилирует фильтры сегментации в исполняемый предикат. Результат кэшируется по хешу фильтров.
+
+    :param filters: Фильтры в формате extract_filters_from_text / Campaigns.filters.
+    :return: CompiledSegmentFilter.
+    """
+    return _compile_cached(_canonical_json(filters))
+
+
+def load_campaign_filters(raw_filters) -> dict:
+    """
+    Приводит Campaigns.filters к словарю (в БД фильтры могут храниться как JSON-объект или как строка).
+
+    :param raw_filters: Значение Campaigns.filters.
+    :return: Словарь фильтров (пустой, если фильтров нет или они повреждены).
+    """
+    if not raw_filters:
+        return {}
+    if isinstance(raw_filters, dict):
+        return raw_filters
+    if isinstance(raw_filters, str):
+        try:
+            decoded = json.loads(raw_filters)
+        except json.JSONDecodeError:
+            logger.error(f"❌ Ошибка декодирования JSON-фильтров: {raw_filters}")
+            return {}
+        return decoded if isinstance(decoded, dict) else {}
+    logger.warning(f"⚠️ Неожиданный формат фильтров кампании: {type(raw_filters)}")
+    return {}
+
+
+def read_segment(db, table_name: str, filters: dict | None, columns: list | None = None,
+                 limit: int | None = None) -> pd.DataFrame:
+    """
+    Загружает из email-таблицы только строки, попадающие в сегмент (фильтрация выполняется в PostgreSQL).
+
+    :param db: Сессия базы данных.
+    :param table_name: Имя email-таблицы.
+    :param filters: Фильтры сегментации.
+    :param columns: Список колонок (по умолчанию все).
+    :param limit: Ограничение количества строк.
+    :return: DataFrame с лидами сегмента.
+    """
+    compiled = compile_filters(filters)
+    return pd.read_sql(compiled.select_query(table_name, columns=columns, limit=limit), db.bind)
+
+
+def _canonical_json(filters: dict | None) -> str:
+    return json.dumps(filters or {}, sort_keys=True, ensure_ascii=False, default=str)
+
+
+@lru_cache(maxsize=256)
+def _compile_cached(canonical_filters: str) -> CompiledSegmentFilter:
+    filters = json.loads(canonical_filters)
+    conditions = []
+
+    for key, value in filters.items():
+        if key not in EMAIL_SEGMENT_COLUMNS:
+            logger.warning(f"⚠️ Фильтр по неизвестной колонке пропущен: {key}")
+            continue
+        conditions.extend(_build_conditions(key, value))
+
+    logger.debug(f"🧩 Скомпилированы фильтры {canonical_filters}: {len(conditions)} условий")
+    return CompiledSegmentFilter(filters, conditions)
+
+
+def _build_conditions(key: str, value) -> list[_Condition]:
+    """ Переводит значение фильтра в список условий (семантика общая для кампаний и волн). """
+    if isinstance(value, bool):
+        return [_PresenceCondition(key, value)]
+
+    if isinstance(value, (int, float)):
+        return [_NumericCondition(key, "=", value)]
+
+    if isinstance(value, str):
+        normalized = value.strip().lower()
+        if normalized in ("true", "false"):
+            return [_PresenceCondition(key, normalized == "true")]
+        return [_ContainsCondition(key, [normalized])] if normalized else []
+
+    if isinstance(value, list):
+        values = [str(item).strip().lower() for item in value if isinstance(item, (str, int, float))
+                  and not isinstance(item, bool) and str(item).strip()]
+        return [_ContainsCondition(key, values)] if values else []
+
+    if isinstance(value, dict):
+        conditions = []
+        for op, operand in value.items():
+            number = _to_number(operand)
+            if op in NUMERIC_OPERATORS and number is not None:
+                conditions.append(_NumericCondition(key, op, number))
+            else:
+                logger.warning(f"⚠️ Пропущен некорректный оператор фильтра: {key} → {op}: {operand}")
+        return conditions
+
+    logger.warning(f"⚠️ Пропущен неподходящий формат фильтра: {key} → {value}")
+    return []
+
+
+def _to_number(value) -> float | None:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        cleaned = re.sub(NUMBER_WHITESPACE_PATTERN, "", value).replace(",", ".")
+        try:
+            return float(cleaned)
+        except ValueError:
+            return None
+    return None
@@ -1,12 +1,30 @@
-import json
-
+from sqlalchemy import func, literal, select, table
 from sqlalchemy.sql import text
 import os
 from sqlalchemy.orm import Session
 import pandas as pd
 
-from db.segmentation import EMAIL_SEGMENT_COLUMNS
-from utils.utils import send_to_model, logger  # Функция отправки в модель
+from db.db import SessionLocal
+from db.db_segmentation import materialize_campaign_segment, read_campaign_segment
+from db.segmentation import EMAIL_SEGMENT_COLUMNS, EMAIL_SEGMENT_TRANSLATIONS
+from utils.segment_filters import compile_filters, read_segment
+from utils.llm_router import TASK_EXTRACT
+from utils.structured_output import StructuredOutputError, request_structured
+from utils.utils import logger
+from promts.output_schemas import SegmentFilters
+
+# До какого размера таблицы сегмент считается точным COUNT(*), а не по выборке
+SEGMENT_EXACT_COUNT_THRESHOLD = 50000
+# Сколько строк примерно читается из таблицы для оценки размера сегмента
+SEGMENT_SAMPLE_ROWS = 10000
+# Фиксированное зерно TABLESAMPLE: оценка не «прыгает» при повторных запросах с теми же фильтрами
+SEGMENT_SAMPLE_SEED = 42
+# Количество строк в превью сегмента
+SEGMENT_PREVIEW_LIMIT = 20
+# Колонки, которые показываются в текстовом превью
+SEGMENT_PREVIEW_COLUMNS = ["name", "region", "email"]
+# Чем показывается пустая ячейка в превью
+SEGMENT_PREVIEW_EMPTY = "—"
 
 
 def extract_filters_from_text(user_input: str) -> dict:
@@ -47,16 +65,10 @@ def extract_filters_from_text(user_input: str) -> dict:
        Ответ:
     """
 
-    response = send_to_model(prompt)  # Отправляем в GPT
-    logger.debug(f"📥 Ответ модели: {response}")
-
-    # Обрабатываем JSON-ответ
+    # Отправляем в GPT и проверяем ответ по схеме
     try:
-        model_data = json.loads(response)
-        filters = model_data.get("filters", {})
-
-        if not isinstance(filters, dict):
-            raise ValueError("Модель вернула некорректные данные (ожидался словарь).")
+        filters = request_structured(TASK_EXTRACT, "extract_filters", prompt, SegmentFilters, cacheable=True).filters
+        logger.debug(f"📥 Ответ модели: {filters}")
 
         # Валидация данных: отбираем только разрешённые фильтры
         validated_filters = {}
@@ -70,7 +82,7 @@ def extract_filters_from_text(user_input: str) -> dict:
         logger.info(f"✅ Итоговые фильтры: {validated_filters}")
         return validated_filters
 
-    except (json.JSONDecodeError, ValueError) as e:
+    except StructuredOutputError as e:
         logger.error(f"❌ Ошибка обработки JSON: {e}")
         return {}  # Возвращаем пустой словарь при ошибке
 
@@ -78,6 +90,8 @@ def extract_filters_from_text(user_input: str) -> dict:
 def apply_filters_to_email_table(db: Session, email_table_id: int, filters: dict) -> pd.DataFrame:
     """
     Применяет фильтры к email-таблице и возвращает отфильтрованный DataFrame.
+    Фильтрация выполняется в PostgreSQL общим движком фильтров (utils.segment_filters),
+    поэтому сегмент совпадает с тем, что получит волна при рассылке.
 
     :param db: Сессия базы данных.
     :param email_table_id: ID email-таблицы.
@@ -85,61 +99,11 @@ def apply_filters_to_email_table(db: Session, email_table_id: int, filters: dict
     :return: DataFrame с отфильтрованными email-лидами.
     """
     try:
-        # Определяем название email-таблицы
-        query_table = text("SELECT table_name FROM email_tables WHERE email_table_id = :email_table_id")
-        result = db.execute(query_table, {"email_table_id": email_table_id}).fetchone()
-
-        if not result:
-            logger.error(f"❌ Email-таблица с ID {email_table_id} не найдена.")
-            return pd.DataFrame()
-
-        table_name = result[0]
-        logger.info(f"📌 Используем email-таблицу: {table_name}")
-
-        # Загружаем данные
-        query_data = f"SELECT * FROM {table_name}"
-        df = pd.read_sql(query_data, db.bind)
-
-        if df.empty:
-            logger.warning(f"⚠️ Таблица {table_name} пуста.")
+        table_name = get_email_table_name(db, email_table_id)
+        if not table_name:
             return pd.DataFrame()
 
-        logger.debug(f"🔍 Загружено {len(df)} записей из таблицы {table_name}")
-        logger.debug(f"📋 Доступные колонки: {df.columns.tolist()}")
-
-        # Вывод уникальных значений для всех колонок, которые есть в фильтрах
-        for key in filters.keys():
-            if key in df.columns:
-                unique_values = df[key].dropna().unique()
-                logger.debug(f"📌 Уникальные значения в колонке '{key}': {unique_values}")
-
-        # Применяем фильтры
-        for key, value in filters.items():
-            if key in df.columns:
-                # Приводим текстовые данные к единому формату
-                if df[key].dtype == "object":
-                    df[key] = df[key].astype(str).str.strip().str.lower()
-
-                # 🔹 **Обрабатываем `true` и `false` как наличие/отсутствие значений**
-                if isinstance(value, str) and value.lower() == "true":
-                    df = df[df[key].notna() & (df[key] != "")]
-                elif isinstance(value, str) and value.lower() == "false":
-                    df = df[df[key].isna() | (df[key] == "")]
-                elif isinstance(value, dict):  # Фильтрация по операторам >, <
-                    for op, val in value.items():
-                        if op == ">":
-                            df = df[df[key] > val]
-                        elif op == "<":
-                            df = df[df[key] < val]
-                elif isinstance(value, list):  # Фильтр по списку значений
-                    normalized_values = [v.lower().strip() for v in value]
-                    df = df[df[key].str.contains("|".join(normalized_values), case=False, na=False)]
-                elif isinstance(value, str):  # Фильтрация по конкретному значению (ищем вхождение)
-                    normalized_value = value.strip().lower()
-                    df = df[df[key].str.contains(normalized_value, case=False, na=False)]
-
-                # Логируем результат фильтрации
-                logger.debug(f"📌 Фильтр `{key}` → {value}: осталось {len(df)} записей")
+        df = read_segment(db, table_name, filters)
 
         logger.info(f"✅ Итоговое количество записей после фильтрации: {len(df)}")
         return df
@@ -149,6 +113,155 @@ def apply_filters_to_email_table(db: Session, email_table_id: int, filters: dict
         return pd.DataFrame()
 
 
+def get_email_table_name(db: Session, email_table_id: int) -> str | None:
+    """
+    Возвращает имя динамической email-таблицы по её ID.
+
+    :param db: Сессия базы данных.
+    :param email_table_id: ID email-таблицы.
+    :return: Имя таблицы или None, если запись не найдена.
+    """
+    query_table = text("SELECT table_name FROM email_tables WHERE email_table_id = :email_table_id")
+    result = db.execute(query_table, {"email_table_id": email_table_id}).fetchone()
+
+    if not result:
+        logger.error(f"❌ Email-таблица с ID {email_table_id} не найдена.")
+        return None
+
+    logger.info(f"📌 Используем email-таблицу: {result[0]}")
+    return result[0]
+
+
+def estimate_table_rows(db: Session, table_name: str) -> int:
+    """
+    Оценивает количество строк в таблице по статистике PostgreSQL без её чтения.
+    Как и планировщик, плотность строк из pg_class масштабируется на текущий размер таблицы,
+    чтобы оценка не отставала от загрузок, прошедших после последнего ANALYZE.
+    Если таблица ещё ни разу не анализировалась, используется оценка планировщика из EXPLAIN.
+
+    :param db: Сессия базы данных.
+    :param table_name: Имя таблицы.
+    :return: Оценка количества строк.
+    """
+    stats = db.execute(
+        text(
+            "SELECT reltuples, relpages, pg_relation_size(oid) / current_setting('block_size')::int AS pages "
+            "FROM pg_class WHERE oid = to_regclass(:table_name)"
+        ),
+        {"table_name": table_name}
+    ).one_or_none()
+
+    if stats is not None and stats.reltuples >= 0 and stats.relpages > 0:
+        return int(stats.reltuples / stats.relpages * stats.pages)
+
+    plan = db.execute(text(f'EXPLAIN (FORMAT JSON) SELECT * FROM "{table_name}"')).scalar()
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def estimate_segment_size(db: Session, table_name: str, filters: dict) -> tuple[int, bool]:
+    """
+    Быстро оценивает размер сегмента. Небольшие таблицы считаются точно,
+    для больших считается доля подходящих строк в выборке TABLESAMPLE SYSTEM.
+
+    :param db: Сессия базы данных.
+    :param table_name: Имя email-таблицы.
+    :param filters: Фильтры сегментации.
+    :return: Кортеж (количество лидов, является ли количество точным).
+    """
+    compiled = compile_filters(filters)
+    total_rows = estimate_table_rows(db, table_name)
+
+    if total_rows > SEGMENT_EXACT_COUNT_THRESHOLD:
+        percent = min(100.0, SEGMENT_SAMPLE_ROWS * 100.0 / total_rows)
+        sample = table(table_name).tablesample(func.system(percent), seed=literal(SEGMENT_SAMPLE_SEED))
+        sampled, matched = db.execute(
+            select(func.count(), func.count().filter(compiled.where_clause())).select_from(sample)
+        ).one()
+
+        if sampled:
+            estimate = round(matched * total_rows / sampled)
+            logger.info(
+                f"📊 Оценка сегмента {table_name} по выборке: {matched}/{sampled} строк, ≈{estimate} из {total_rows}"
+            )
+            return estimate, False
+
+    exact = db.execute(
+        select(func.count()).select_from(table(table_name)).where(compiled.where_clause())
+    ).scalar()
+    logger.info(f"📊 Точный размер сегмента {table_name}: {exact}")
+    return exact, True
+
+
+def preview_segment(db: Session, email_table_id: int, filters: dict) -> dict | None:
+    """
+    Возвращает превью сегмента для быстрой обратной связи пользователю: первые строки и оценку размера.
+    Полную выборку не читает.
+
+    :param db: Сессия базы данных.
+    :param email_table_id: ID email-таблицы.
+    :param filters: Фильтры сегментации.
+    :return: Словарь {"table_name", "preview", "count", "exact"} или None, если таблица не найдена.
+    """
+    table_name = get_email_table_name(db, email_table_id)
+    if not table_name:
+        return None
+
+    preview = read_segment(db, table_name, filters, limit=SEGMENT_PREVIEW_LIMIT)
+
+    # Превью не заполнилось до лимита — значит, это уже весь сегмент
+    if len(preview) < SEGMENT_PREVIEW_LIMIT:
+        count, exact = len(preview), True
+    else:
+        count, exact = estimate_segment_size(db, table_name, filters)
+        count = max(count, len(preview))
+
+    return {"table_name": table_name, "preview": preview, "count": count, "exact": exact}
+
+
+def format_preview_value(value) -> str:
+    """ Значение ячейки превью сегмента; пустые значения и NaN — прочерк. """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return SEGMENT_PREVIEW_EMPTY
+    return str(value).strip() or SEGMENT_PREVIEW_EMPTY
+
+
+def format_segment_preview(preview: pd.DataFrame) -> str:
+    """
+    Форматирует превью сегмента в текст для сообщения Telegram.
+
+    :param preview: DataFrame с первыми строками сегмента.
+    :return: Текст превью.
+    """
+    columns = [col for col in SEGMENT_PREVIEW_COLUMNS if col in preview.columns]
+    lines = []
+    for number, row in enumerate(preview[columns].itertuples(index=False), start=1):
+        # Пустые ячейки остаются на своём месте, чтобы значения не съезжали относительно заголовка
+        values = [format_preview_value(value) for value in row]
+        lines.append(f"{number}. {' | '.join(values)}")
+
+    header = " | ".join(EMAIL_SEGMENT_TRANSLATIONS.get(col, col) for col in columns)
+    return f"{header}\n" + "\n".join(lines)
+
+
+def export_campaign_segment(company_id: int, campaign_id: int, table_name: str) -> tuple[str, int]:
+    """
+    Материализует сегмент кампании и выгружает его в Excel.
+    Выполняется в фоне (в отдельном потоке), поэтому открывает собственную сессию БД.
+
+    :param company_id: ID компании.
+    :param campaign_id: ID кампании.
+    :param table_name: Имя email-таблицы кампании.
+    :return: Кортеж (путь к Excel-файлу, точное количество лидов).
+    """
+    with SessionLocal() as db:
+        if materialize_campaign_segment(db, campaign_id) is None:
+            return "", 0
+
+        df = read_campaign_segment(db, campaign_id, table_name)
+
+    return generate_excel_from_df(df, company_id, campaign_id), len(df)
+
+
 def generate_excel_from_df(df: pd.DataFrame, company_id: int, campaign_id: int) -> str:
     """
     Генерирует Excel-файл с отфильтрованными email-лидами.
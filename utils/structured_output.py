@@ -0,0 +1,131 @@
+import ast
+import json
+import re
+from typing import Any, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+from logger import logger
+from utils.llm_router import get_route, route_chat_completion
+
+SchemaT = TypeVar("SchemaT", bound=BaseModel)
+
+# Сколько раз переспрашивать модель, если ответ не удалось разобрать даже после локального исправления
+STRUCTURED_MAX_RETRIES = 1
+
+FENCE_PATTERN = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "«": '"', "»": '"', "‘": "'", "’": "'"})
+
+# Системное сообщение для JSON-режима: OpenAI требует упоминания JSON в сообщениях при response_format=json_object
+JSON_SYSTEM_PROMPT = "Отвечай только JSON-объектом, без пояснений и Markdown."
+RETRY_PROMPT = (
+    "Предыдущий ответ не удалось разобрать как JSON нужного формата ({error}). "
+    "Верни только корректный JSON-объект, без пояснений и Markdown."
+)
+
+
+class StructuredOutputError(ValueError):
+    """ Ответ модели не соответствует схеме даже после исправления и повторного запроса. """
+
+
+def parse_json_tolerant(text: str) -> Any:
+    """
+    Разбирает JSON из ответа модели, исправляя типичные ошибки: Markdown-обёртку, текст вокруг объекта,
+    префикс «Ответ:», висячие запятые, «умные» кавычки, одинарные кавычки и True/False/None.
+
+    :param text: Текст ответа модели.
+    :return: Разобранное значение.
+    :raises ValueError: Если JSON не удалось восстановить.
+    """
+    text = (text or "").strip()
+    candidates = [text, FENCE_PATTERN.sub("", text).strip()]
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        candidates.append(text[start:end + 1])
+
+    for candidate in candidates:
+        for variant in (candidate, TRAILING_COMMA_PATTERN.sub(r"\1", candidate.translate(SMART_QUOTES))):
+            try:
+                return json.loads(variant)
+            except json.JSONDecodeError:
+                pass
+            try:
+                # Python-литерал: одинарные кавычки, True/False/None
+                return ast.literal_eval(variant)
+            except (ValueError, SyntaxError, MemoryError, RecursionError):
+                pass
+    raise ValueError("ответ не содержит корректного JSON")
+
+
+def parse_structured(content: str, schema: type[SchemaT]) -> tuple[SchemaT, bool]:
+    """
+    Разбирает ответ модели по схеме.
+
+    :param content: Текст ответа.
+    :param schema: pydantic-модель ответа.
+    :return: (объект схемы, понадобилось ли локальное исправление JSON).
+    :raises ValueError: Если ответ не удалось привести к схеме.
+    """
+    try:
+        return schema.model_validate_json(content), False
+    except ValidationError:
+        pass
+    try:
+        return schema.model_validate(parse_json_tolerant(content)), True
+    except ValidationError as e:
+        raise ValueError(f"ответ не соответствует схеме: {e.error_count()} ошибок") from e
+
+
+def request_structured(task: str, operation: str, prompt: str, schema: type[SchemaT],
+                       cacheable: bool = False) -> SchemaT:
+    """
+    Запрашивает у модели ответ по pydantic-схеме: JSON-режим там, где модель его поддерживает,
+    локальное исправление JSON и не больше STRUCTURED_MAX_RETRIES повторных запросов.
+
+    :param task: Класс задачи для маршрутизации модели (utils.llm_router).
+    :param operation: Операция для метрик.
+    :param prompt: Промпт.
+    :param schema: pydantic-модель ответа.
+    :param cacheable: Брать ответ из кэша LLM (кэшируются только ответы, прошедшие проверку схемы).
+    :return: Объект схемы.
+    :raises StructuredOutputError: Если корректный ответ так и не получен.
+    """
+    from utils.llm_cache import get_cached_completion, save_completion
+    from utils.metrics import LLM_RETRIES_AVOIDED, LLM_STRUCTURED_OUTPUT
+
+    messages = [{"role": "system", "content": JSON_SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+    cache_model, cache_params = get_route(task)[0][0], {"schema": schema.__name__}
+
+    if cacheable:
+        cached = get_cached_completion(operation, cache_model, messages, cache_params)
+        if cached is not None:
+            try:
+                return parse_structured(cached.choices[0].message.content, schema)[0]
+            except ValueError:
+                logger.warning(f"⚠️ Ответ из кэша для {operation} не соответствует схеме, запрашиваем модель.")
+
+    request_messages = messages
+    for attempt in range(STRUCTURED_MAX_RETRIES + 1):
+        response = route_chat_completion(task, operation, request_messages, json_mode=True)
+        content = response.choices[0].message.content if response.choices else ""
+        try:
+            result, repaired = parse_structured(content, schema)
+        except ValueError as e:
+            if attempt == STRUCTURED_MAX_RETRIES:
+                LLM_STRUCTURED_OUTPUT.labels(operation, "failed").inc()
+                raise StructuredOutputError(f"{operation}: {e}") from e
+            LLM_STRUCTURED_OUTPUT.labels(operation, "retried").inc()
+            logger.warning(f"⚠️ {operation}: {e}. Повторный запрос к модели.")
+            request_messages = request_messages + [{"role": "assistant", "content": content or ""},
+                                                   {"role": "user", "content": RETRY_PROMPT.format(error=e)}]
+            continue
+
+        LLM_STRUCTURED_OUTPUT.labels(operation, "repaired" if repaired else "ok").inc()
+        if repaired:
+            # Без локального исправления этот ответ стоил бы повторного запроса к модели
+            LLM_RETRIES_AVOIDED.labels(operation).inc()
+            logger.info("🩹 %s: JSON ответа исправлен локально, повторный запрос не понадобился.", operation)
+        if cacheable:
+            save_completion(operation, cache_model, messages, cache_params, response)
+        return result
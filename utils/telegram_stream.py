@@ -0,0 +1,99 @@
+import asyncio
+import time
+from typing import AsyncIterator
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+from config import TELEGRAM_STREAM_EDIT_INTERVAL
+from logger import logger
+
+# Максимальная длина текста сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Признак того, что текст ещё дописывается
+STREAM_CURSOR = " ▌"
+
+
+def fit_message(text: str) -> str:
+    """ Обрезает текст до лимита сообщения Telegram, оставляя конец — он меняется при потоковой генерации. """
+    if len(text) <= TELEGRAM_MESSAGE_LIMIT:
+        return text
+    return "…" + text[-(TELEGRAM_MESSAGE_LIMIT - 1):]
+
+
+async def edit_message_safely(message: Message, text: str) -> float:
+    """
+    Правит сообщение, не падая на ограничениях Telegram.
+
+    :param message: Сообщение бота.
+    :param text: Новый текст.
+    :return: Сколько секунд Telegram просит подождать до следующей правки (0, если ограничения нет).
+    """
+    try:
+        await message.edit_text(text)
+    except TelegramRetryAfter as e:
+        logger.warning(f"⚠️ Telegram ограничил правки сообщения, пауза {e.retry_after} с.")
+        return float(e.retry_after)
+    except TelegramBadRequest as e:
+        # Текст не изменился с прошлой правки — это не ошибка
+        if "message is not modified" not in str(e):
+            raise
+    return 0.0
+
+
+async def stream_to_message(message: Message, chunks: AsyncIterator[str], header: str = "",
+                            placeholder: str = "⏳ Генерирую...", error_text: str | None = None,
+                            interval: float = TELEGRAM_STREAM_EDIT_INTERVAL) -> tuple[str, Message]:
+    """
+    Показывает потоковый ответ модели в одном сообщении: отвечает заглушкой и правит её по мере
+    поступления текста — первый фрагмент сразу, дальше не чаще раза в interval секунд.
+
+    :param message: Сообщение пользователя, на которое отвечает бот.
+    :param chunks: Фрагменты текста (например, stream_route_chat_completion).
+    :param header: Заголовок перед текстом.
+    :param placeholder: Текст до первого фрагмента.
+    :param error_text: Текст, которым заменяется заглушка или недописанный ответ, если поток оборвался с ошибкой
+        (исключение после этого пробрасывается дальше).
+    :param interval: Минимальный интервал между правками (секунды).
+    :return: (полный текст ответа, сообщение бота для итоговой правки).
+    """
+    reply = await message.reply(header + placeholder)
+    text = ""
+    next_edit_at = 0.0
+
+    try:
+        async for chunk in chunks:
+            text += chunk
+            if time.monotonic() < next_edit_at:
+                continue
+            retry_after = await edit_message_safely(reply, fit_message(header + text + STREAM_CURSOR))
+            next_edit_at = time.monotonic() + max(interval, retry_after)
+    except Exception:
+        # Не оставляем пользователю «⏳ Генерирую...» или обрывок текста с курсором
+        if error_text is not None:
+            try:
+                await finish_stream_message(reply, error_text)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось заменить сообщение текстом ошибки: {e}")
+        raise
+
+    return text, reply
+
+
+async def finish_stream_message(reply: Message, text: str):
+    """
+    Итоговая правка сообщения после окончания потока. Текст длиннее лимита Telegram отправляется
+    отдельными сообщениями целиком, а не обрезается.
+
+    :param reply: Сообщение бота, которое правилось во время генерации.
+    :param text: Итоговый текст.
+    """
+    parts = [text[start:start + TELEGRAM_MESSAGE_LIMIT] for start in range(0, len(text), TELEGRAM_MESSAGE_LIMIT)]
+
+    # Итоговую правку нельзя пропустить: при ограничении ждём и повторяем
+    retry_after = await edit_message_safely(reply, parts[0])
+    if retry_after:
+        await asyncio.sleep(retry_after)
+        await edit_message_safely(reply, parts[0])
+    for part in parts[1:]:
+        await reply.answer(part)
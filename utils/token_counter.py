@@ -0,0 +1,60 @@
+from functools import lru_cache
+
+from logger import logger
+
+# Кодировка для моделей, которых tiktoken не знает (актуальные модели OpenAI)
+DEFAULT_ENCODING = "o200k_base"
+# Оценка без tiktoken: символов на токен для русского текста (с запасом)
+CHARS_PER_TOKEN = 3
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str | None):
+    """
+    Кодировка tiktoken для модели. tiktoken скачивает словарь при первом обращении (или берёт его
+    из TIKTOKEN_CACHE_DIR); без пакета или без сети токены оцениваются по числу символов.
+
+    :param model: Модель (None — кодировка по умолчанию).
+    :return: Кодировка или None, если tiktoken недоступен.
+    """
+    try:
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(DEFAULT_ENCODING)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        logger.warning(f"⚠️ tiktoken недоступен, токены оцениваются по длине текста: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str | None = None) -> int:
+    """ Число токенов текста для модели. """
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str | None = None) -> str:
+    """
+    Обрезает текст до max_tokens токенов.
+
+    :param text: Текст.
+    :param max_tokens: Сколько токенов оставить.
+    :param model: Модель.
+    :return: Начало текста не длиннее max_tokens токенов (сам текст, если он короче).
+    """
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    # Токен может оказаться половиной многобайтного символа — такой хвост отбрасывается
+    return encoding.decode(tokens[:max_tokens]).rstrip("�")
@@ -0,0 +1,230 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy.orm import sessionmaker
+
+from config import LLM_COMPANY_MONTHLY_BUDGET_USD, LLM_COMPANY_MONTHLY_TOKENS, LLM_USAGE_FLUSH_INTERVAL
+from db.db import engine
+from db.db_usage import (
+    USAGE_COUNTERS, add_llm_usage, get_average_completion_tokens, get_company_ids_by_chat, get_company_quota,
+    get_company_usage,
+)
+from logger import logger
+from utils.chat_queue import get_event_chat_id
+from utils.metrics import get_llm_cost, record_llm_usage
+from utils.token_counter import count_tokens
+
+# Оценка стоимости волны: длина письма без истории компании
+DEFAULT_DRAFT_COMPLETION_TOKENS = 400
+# Сколько лидов волны берётся для оценки длины промпта
+ESTIMATE_SAMPLE_LEADS = 20
+
+# Кому относится текущий запрос к модели: company_id, campaign_id, wave_id или chat_id (компания по чату
+# определяется при записи в БД, чтобы не искать её на каждый апдейт)
+_usage_context: ContextVar[dict] = ContextVar("llm_usage_context", default={})
+
+# Отдельные сессии: запись идёт из фонового цикла и потоков пакетной генерации
+_Session = sessionmaker(bind=engine)
+
+
+@contextmanager
+def usage_context(**ids):
+    """
+    Привязывает запросы к модели внутри блока к компании, кампании, волне или чату.
+
+    :param ids: company_id, campaign_id, wave_id, chat_id.
+    """
+    token = _usage_context.set({**_usage_context.get(), **{key: value for key, value in ids.items() if value}})
+    try:
+        yield
+    finally:
+        _usage_context.reset(token)
+
+
+def get_usage_context() -> dict:
+    return _usage_context.get()
+
+
+class UsageLedger:
+    """
+    Накопитель потребления LLM: запросы суммируются в памяти по (день, компания, кампания, волна, модель,
+    операция) и периодически прибавляются к агрегатам llm_usage одним запросом.
+    """
+
+    def __init__(self):
+        self._pending: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, operation: str, prompt_tokens: int, completion_tokens: int, cost: float):
+        context = get_usage_context()
+        key = (
+            datetime.utcnow().date(), context.get("company_id", 0), context.get("campaign_id", 0),
+            context.get("wave_id", 0), context.get("chat_id"), model, operation,
+        )
+        with self._lock:
+            totals = self._pending.setdefault(key, [0, 0, 0, 0.0])
+            for index, value in enumerate((1, prompt_tokens, completion_tokens, cost)):
+                totals[index] += value
+
+    def pending_usage(self, company_id: int) -> dict:
+        """ Ещё не записанное в БД потребление компании (запросы с привязкой только к чату не учитываются). """
+        result = dict.fromkeys(USAGE_COUNTERS, 0)
+        with self._lock:
+            for key, totals in self._pending.items():
+                if key[1] == company_id:
+                    for name, value in zip(USAGE_COUNTERS, totals):
+                        result[name] += value
+        return result
+
+    def flush(self) -> int:
+        """
+        Записывает накопленное в llm_usage. При ошибке записи накопленное возвращается в очередь.
+
+        :return: Количество записанных агрегатов.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        with _Session() as db:
+            chat_ids = [key[4] for key in pending if not key[1] and key[4]]
+            companies = get_company_ids_by_chat(db, chat_ids)
+
+            rows = {}
+            for (usage_date, company_id, campaign_id, wave_id, chat_id, model, operation), totals in pending.items():
+                row_key = (usage_date, company_id or companies.get(chat_id, 0), campaign_id, wave_id, model, operation)
+                row = rows.setdefault(row_key, dict.fromkeys(USAGE_COUNTERS, 0))
+                for name, value in zip(USAGE_COUNTERS, totals):
+                    row[name] += value
+
+            written = add_llm_usage(db, [
+                {"usage_date": key[0], "company_id": key[1], "campaign_id": key[2], "wave_id": key[3],
+                 "model": key[4], "operation": key[5], **counters}
+                for key, counters in rows.items()
+            ])
+
+        if not written:
+            with self._lock:
+                for key, totals in pending.items():
+                    current = self._pending.setdefault(key, [0, 0, 0, 0.0])
+                    for index, value in enumerate(totals):
+                        current[index] += value
+            return 0
+        return len(rows)
+
+
+ledger = UsageLedger()
+
+
+def record_usage(model: str, operation: str, usage, price_factor: float = 1.0) -> float:
+    """
+    Учитывает ответ модели в метриках и в учёте потребления текущей компании.
+
+    :param model: Модель.
+    :param operation: Операция.
+    :param usage: Объект usage из ответа OpenAI (может отсутствовать).
+    :param price_factor: Множитель цены (скидка Batch API).
+    :return: Стоимость запроса в USD.
+    """
+    cost = record_llm_usage(model, operation, usage, price_factor)
+    if usage is not None:
+        ledger.record(model, operation, getattr(usage, "prompt_tokens", 0) or 0,
+                      getattr(usage, "completion_tokens", 0) or 0, cost)
+    return cost
+
+
+def get_month_usage(db, company_id: int, today: date | None = None) -> dict:
+    """ Потребление компании с начала месяца, включая ещё не записанное в БД. """
+    today = today or datetime.utcnow().date()
+    usage = get_company_usage(db, company_id, today.replace(day=1))
+    for name, value in ledger.pending_usage(company_id).items():
+        usage[name] += value
+    return usage
+
+
+def get_company_limits(db, company_id: int) -> tuple[float, int]:
+    """
+    Возвращает месячные лимиты компании.
+
+    :return: (бюджет в USD, лимит токенов); 0 — без лимита.
+    """
+    quota = get_company_quota(db, company_id)
+    budget = quota.monthly_budget_usd if quota and quota.monthly_budget_usd is not None else LLM_COMPANY_MONTHLY_BUDGET_USD
+    tokens = quota.monthly_token_limit if quota and quota.monthly_token_limit is not None else LLM_COMPANY_MONTHLY_TOKENS
+    return budget, tokens
+
+
+def estimate_draft_usage(db, company_id: int, prompts: list[str], model: str, operation: str = "draft",
+                         variants: int = 1) -> tuple[int, float]:
+    """
+    Оценивает потребление на один запрос генерации по выборке промптов волны.
+
+    :param db: Сессия базы данных.
+    :param company_id: ID компании.
+    :param prompts: Промпты нескольких лидов (или сегментов) волны.
+    :param model: Модель генерации.
+    :param operation: Операция, по истории которой оценивается длина ответа.
+    :param variants: Писем в одном ответе (для оценки без истории).
+    :return: (токенов на запрос, USD на запрос).
+    """
+    if not prompts:
+        return 0, 0.0
+    prompt_tokens = sum(count_tokens(prompt, model) for prompt in prompts) / len(prompts)
+    completion_tokens = (get_average_completion_tokens(db, company_id, operation)
+                         or DEFAULT_DRAFT_COMPLETION_TOKENS * variants)
+    return int(prompt_tokens + completion_tokens), get_llm_cost(model, int(prompt_tokens), int(completion_tokens))
+
+
+def check_budget(db, company_id: int, tokens: int, cost: float) -> str | None:
+    """
+    Проверяет, укладывается ли предстоящая работа в месячные лимиты компании.
+
+    :param db: Сессия базы данных.
+    :param company_id: ID компании.
+    :param tokens: Оценка токенов предстоящей работы.
+    :param cost: Оценка стоимости предстоящей работы (USD).
+    :return: Причина отказа или None, если лимиты позволяют.
+    """
+    budget, token_limit = get_company_limits(db, company_id)
+    if not budget and not token_limit:
+        return None
+
+    used = get_month_usage(db, company_id)
+    if budget and used["cost_usd"] + cost > budget:
+        return (f"Бюджет LLM на месяц исчерпан: израсходовано ${used['cost_usd']:.2f} из ${budget:.2f}, "
+                f"требуется ещё около ${cost:.2f}")
+    if token_limit and used["prompt_tokens"] + used["completion_tokens"] + tokens > token_limit:
+        return (f"Лимит токенов на месяц исчерпан: израсходовано "
+                f"{used['prompt_tokens'] + used['completion_tokens']} из {token_limit}, требуется ещё около {tokens}")
+    return None
+
+
+class UsageContextMiddleware(BaseMiddleware):
+    """ Привязывает запросы к модели из хендлеров к чату (а через него — к компании). """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        chat_id = get_event_chat_id(event)
+        with usage_context(chat_id=str(chat_id) if chat_id is not None else None):
+            return await handler(event, data)
+
+
+async def usage_flush_loop():
+    """ Периодически записывает накопленное потребление LLM в БД. """
+    while True:
+        await asyncio.sleep(LLM_USAGE_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(ledger.flush)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи учёта LLM: {e}", exc_info=True)
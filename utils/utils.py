@@ -1,38 +1,42 @@
 import pandas as pd
-import pdfplumber
-from docx import Document
 import mimetypes
 from aiogram.types import File
 
 import logging
-from classifier import client  # Здесь используется клиент для работы с моделью
+from utils.llm_router import TASK_GENERATE, route_chat_completion  # Маршрутизация запросов к моделям
 
 logger = logging.getLogger(__name__)
 
 
-def send_to_model(prompt: str) -> dict:
+def send_to_model(prompt: str, operation: str = "generate", cacheable: bool = False,
+                  task: str = TASK_GENERATE) -> dict:
     """
     Отправляет запрос в модель OpenAI и возвращает результат.
 
     :param prompt: Текстовый запрос для модели.
+    :param operation: Операция для метрик LLM.
+    :param cacheable: Разрешить ответ из кэша LLM (детерминированные промпты извлечения, не генерация).
+    :param task: Класс задачи, по которому выбирается модель (см. utils.llm_router).
     :return: Результат работы модели в виде словаря.
     """
     try:
-        logger.debug(f"Отправляем запрос в модель с prompt: {prompt}")
+        logger.debug("Отправляем запрос в модель с prompt: %s", prompt)
 
         # Отправляем запрос
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}]
+        response = route_chat_completion(
+            task,
+            operation,
+            messages=[{"role": "user", "content": prompt}],
+            cacheable=cacheable
         )
 
         # Логируем полный ответ
-        logger.debug(f"Полный ответ от модели: {response}")
+        logger.debug("Полный ответ от модели: %s", response)
 
         # Проверяем и извлекаем текст ответа
         if response.choices and len(response.choices) > 0:
             result = response.choices[0].message.content.strip()
-            logger.debug(f"Извлеченный результат: {result}")
+            logger.debug("Извлеченный результат: %s", result)
             return result
         else:
             raise ValueError("Ответ модели не содержит 'choices' или они пусты.")
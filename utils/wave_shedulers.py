@@ -1,10 +1,12 @@
 import asyncio
-import json
 import pandas as pd
 import schedule
 from sqlalchemy.orm import Session
-from datetime import datetime
+from datetime import datetime, timedelta
 from db.db import SessionLocal
+from db.db_draft import get_drafted_lead_ids
+from db.db_usage import get_paused_waves
+from db.db_segmentation import materialize_campaign_segment, read_campaign_segment
 from db.models import Waves, EmailTable, Campaigns
 from handlers.draft_handlers.draft_handler import generate_drafts_for_wave
 from logger import logger
@@ -36,37 +38,18 @@ def get_filtered_leads_for_wave(db: Session, wave_id: int) -> pd.DataFrame:
             logger.warning(f"⚠️ Email-таблица с email_table_id={campaign.email_table_id} не найдена.")
             return pd.DataFrame()
 
-        filters = {}
-        if isinstance(campaign.filters, str):
-            try:
-                filters = json.loads(campaign.filters)
-            except json.JSONDecodeError:
-                logger.error(f"❌ Ошибка декодирования JSON-фильтров: {campaign.filters}")
+        # Сегмент материализуется при сохранении фильтров; для старых кампаний считаем его здесь один раз
+        if campaign.segment_refreshed_at is None:
+            logger.info(f"🔄 Сегмент кампании {campaign.campaign_id} ещё не материализован, рассчитываем.")
+            if materialize_campaign_segment(db, campaign.campaign_id) is None:
+                return pd.DataFrame()
 
-        logger.info(f"🔍 Загруженные фильтры: {filters}")
-
-        # Загружаем данные из таблицы
-        df = pd.read_sql(f"SELECT * FROM {email_table.table_name}", db.bind)
+        df = read_campaign_segment(db, campaign.campaign_id, email_table.table_name)
 
         if df.empty:
-            logger.warning(f"⚠️ Таблица {email_table.table_name} пуста.")
+            logger.warning(f"⚠️ Нет лидов в таблице {email_table.table_name}, подходящих под фильтры.")
             return pd.DataFrame()
 
-        # Применяем фильтры
-        for key, value in filters.items():
-            if key in df.columns:
-                if isinstance(value, list):
-                    df = df[df[key].isin(value)]
-                elif isinstance(value, str):
-                    values = [v.strip() for v in value.split(",")]
-                    df = df[df[key].isin(values)]
-                elif isinstance(value, dict):
-                    for op, val in value.items():
-                        if op == ">" and key in df.columns:
-                            df = df[df[key] > val]
-                        elif op == "<" and key in df.columns:
-                            df = df[df[key] < val]
-
         logger.info(f"✅ Найдено {len(df)} лидов после фильтрации.")
         return df
 
@@ -83,18 +66,30 @@ async def process_daily_waves():
     logger.info("🔄 Проверка запланированных волн на сегодня...")
 
     with SessionLocal() as db:
-        waves = get_today_waves(db)
+        # Волны, остановленные из-за бюджета LLM, проверяются каждый день, пока не появится бюджет
+        tomorrow = datetime.utcnow().date() + timedelta(days=1)
+        waves = list({wave.wave_id: wave for wave in get_today_waves(db) + get_paused_waves(db, tomorrow)}.values())
         if not waves:
             logger.info("📭 На сегодня нет запланированных волн.")
             return
 
         for wave in waves:
+            # Готовые пакеты загружаем, неготовые отменяем: их лиды сгенерируются ниже обычным способом
+            from utils.draft_batches import finalize_wave_batches
+            await asyncio.to_thread(finalize_wave_batches, db, wave.wave_id)
+
             df = get_filtered_leads_for_wave(db, wave.wave_id)
             if df.empty:
                 logger.warning(f"⚠️ Нет лидов для волны ID {wave.wave_id}")
                 continue
 
-            await generate_drafts_for_wave(db, df, wave)
+            # Лиды с черновиками из пакетной генерации повторно не генерируются
+            df = df[~df["id"].isin(list(get_drafted_lead_ids(db, wave.wave_id)))]
+            if df.empty:
+                logger.info(f"✅ Все черновики волны ID {wave.wave_id} уже сгенерированы пакетом.")
+                continue
+
+            await generate_drafts_for_wave(db, df, wave.wave_id)
 
 
 def schedule_job():
@@ -104,8 +99,16 @@ def schedule_job():
 
 
 async def scheduler_loop():
-    """ Асинхронный цикл для работы schedule. """
+    """
+    Асинхронный цикл для работы schedule. Волны проверяются и при запуске: после перезапуска процесса
+    ежедневная проверка (остановленные по бюджету волны, пакеты дня отправки) не пропускается, а уже
+    сгенерированные черновики повторно не создаются.
+    """
     schedule_job()
+    try:
+        await process_daily_waves()
+    except Exception as e:
+        logger.error(f"❌ Ошибка проверки волн при запуске: {e}", exc_info=True)
     while True:
         schedule.run_pending()
         await asyncio.sleep(60)  # Проверка раз в минуту